@@ -1,183 +1,71 @@
 import os
 import json
+import queue
 import base64
 import tempfile
 import traceback
+import zipfile
+import importlib
+import importlib.util
+import functools
+import gzip
+import hashlib
+import threading
+import collections
 import os
 import re
 from mimetypes import guess_type
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Optional
 from dotenv import load_dotenv
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import DocumentContentFormat
-from azure.core.credentials import AzureKeyCredential
-from openai import AzureOpenAI
-from pdf2image import convert_from_path
-from flask import Flask, request, render_template, flash, jsonify, send_file, redirect, url_for
+from flask import Flask, Request, Response, request, render_template, flash, jsonify, send_file, redirect, url_for
 from werkzeug.utils import secure_filename
-from azure.ai.inference import ChatCompletionsClient
-import boto3  # Added for Amazon Bedrock integration
-from botocore.exceptions import BotoCoreError, ClientError
 
 # Load environment variables from .env file
 load_dotenv()
 
-from typing import List, Optional, Dict, Union, Any
-from pydantic import BaseModel, Field
-from datetime import date, datetime
-
-
-class SellerInfo(BaseModel):
-    """Information about the seller/vendor"""
-    name: Optional[str] = Field(None, description="Legal name of the seller")
-    address: Optional[str] = Field(None, description="Complete address of the seller")
-    gstin: Optional[str] = Field(None, description="GST Identification Number of the seller")
-    pan: Optional[str] = Field(None, description="Permanent Account Number of the seller")
-    contact_details: Optional[str] = Field(None, description="Contact information including phone, email, etc.")
-
-
-class BuyerInfo(BaseModel):
-    """Information about the buyer/customer"""
-    name: Optional[str] = Field(None, description="Legal name of the buyer")
-    address: Optional[str] = Field(None, description="Complete address of the buyer")
-    gstin: Optional[str] = Field(None, description="GST Identification Number of the buyer")
-    pan: Optional[str] = Field(None, description="Permanent Account Number of the buyer")
-    contact_details: Optional[str] = Field(None, description="Contact information including phone, email, etc.")
-
-
-class LineItem(BaseModel):
-    """Details of a single line item in the invoice"""
-    description: Optional[str] = Field(None, description="Description of the product or service")
-    hsn_sac: Optional[str] = Field(None, description="HSN (Harmonized System of Nomenclature) or SAC (Services Accounting Code)")
-    quantity: Optional[float] = Field(None, description="Quantity of the item")
-    unit: Optional[str] = Field(None, description="Unit of measurement (e.g., PCS, KG, HRS)")
-    unit_price: Optional[float] = Field(None, description="Price per unit")
-    tax_percentage: Optional[float] = Field(None, description="Tax percentage applied to this item")
-    tax_amount: Optional[float] = Field(None, description="Tax amount for this item")
-    amount: Optional[float] = Field(None, description="Total amount for the line item (typically quantity × unit_price)")
-
-
-class TaxDetail(BaseModel):
-    """Details of a tax component"""
-    tax_type: Optional[str] = Field(None, description="Type of tax (e.g., CGST, SGST, IGST)")
-    rate: Optional[float] = Field(None, description="Tax rate as a percentage")
-    amount: Optional[float] = Field(None, description="Amount of tax")
-
-
-class BankDetails(BaseModel):
-    """Banking information for payment"""
-    bank_name: Optional[str] = Field(None, description="Name of the bank")
-    account_number: Optional[str] = Field(None, description="Bank account number")
-    ifsc_code: Optional[str] = Field(None, description="IFSC (Indian Financial System Code)")
-    branch: Optional[str] = Field(None, description="Bank branch location")
-
-
-class ShippingDetails(BaseModel):
-    """Information about shipping or delivery"""
-    shipped_to: Optional[str] = Field(None, description="Name of the recipient")
-    ship_to_address: Optional[str] = Field(None, description="Shipping address")
-    place_of_supply: Optional[str] = Field(None, description="State code or name for place of supply")
-    transporter: Optional[str] = Field(None, description="Name of the transporter")
-    vehicle_number: Optional[str] = Field(None, description="Vehicle registration number")
-    dispatch_date: Optional[str] = Field(None, description="Date of dispatch")
-
-
-class Invoice(BaseModel):
-    """Complete invoice data model"""
-    # Basic invoice information
-    invoice_number: Optional[str] = Field(None, description="Unique identifier for the invoice")
-    invoice_date: Optional[str] = Field(None, description="Date when the invoice was issued (DD/MM/YYYY format)")
-    due_date: Optional[str] = Field(None, description="Date by which payment is due (DD/MM/YYYY format)")
-    payment_terms: Optional[str] = Field(None, description="Terms of payment (e.g., '30 days', 'Net 15', 'Immediate')")
-    currency: Optional[str] = Field(None, description="Currency code or symbol (e.g., INR, USD, EUR)")
-    
-    # Parties information
-    seller: Optional[SellerInfo] = Field(None, description="Information about the seller/vendor")
-    buyer: Optional[BuyerInfo] = Field(None, description="Information about the buyer/customer")
-    
-    # Line items and financial information
-    items: List[LineItem] = Field(default_factory=list, description="Line items in the invoice")
-    subtotal: Optional[float] = Field(None, description="Total amount before taxes in the invoice currency")
-    tax_details: List[TaxDetail] = Field(default_factory=list, description="Breakdown of taxes applied")
-    total_tax_amount: Optional[float] = Field(None, description="Sum of all taxes in the invoice currency")
-    total_amount: Optional[float] = Field(None, description="Final invoice amount including taxes in the invoice currency")
-    amount_in_words: Optional[str] = Field(None, description="Total amount expressed in words including currency")
-    
-    # Reference information
-    po_number: Optional[str] = Field(None, description="Purchase Order number reference")
-    shipping_details: Optional[ShippingDetails] = Field(None, description="Information about shipping or delivery")
-    bank_details: Optional[BankDetails] = Field(None, description="Banking information for payment")
-    
-    # GST-specific information
-    irn: Optional[str] = Field(None, description="Invoice Reference Number for e-invoicing")
-    ack_number: Optional[str] = Field(None, description="Acknowledgement number for e-invoicing")
-    place_of_supply: Optional[str] = Field(None, description="State code or name for place of supply")
-    reverse_charge: Optional[bool] = Field(None, description="Whether reverse charge mechanism is applicable")
-    
-    # Additional information
-    notes: Optional[str] = Field(None, description="Additional notes or terms and conditions")
-
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "invoice_number": "2425MR1058",
-                "invoice_date": "17/12/2024",
-                "due_date": "31/01/2025",
-                "payment_terms": "45 Days",
-                "seller": {
-                    "name": "SAFEX FIRE SERVICES LTD.",
-                    "address": "Fact: PLOT NO.13,14,15,OPP.BIDCO, TAL:PALGHAR, DIST.PALGHAR, MAHARASHTRA - 401404",
-                    "gstin": "27AAECS7539M1ZP",
-                    "contact_details": "CONTACT NO.02525-251482,252686 E-Mail: palghar@safexfire.com"
-                },
-                "buyer": {
-                    "name": "TATA CONSULTANCY SERVICES LTD (MALAD)",
-                    "address": "1FL WING A, 2 & 3FL WING B,7FL WING A, 8FL WING A & B,TRIL IT4,INFINIY IT PARK",
-                    "gstin": "27AAACR4849R1ZL",
-                    "contact_details": "Tel No. : 022-63718493"
-                },
-                "items": [
-                    {
-                        "description": "ANNUAL MAINTANACE FOR FIRE EXT SERVICE MONTH - NOVEMBER 2024",
-                        "hsn_sac": "998719",
-                        "quantity": 433,
-                        "unit": "Nos",
-                        "rate": 16.00,
-                        "amount": 6928.00
-                    }
-                ],
-                "subtotal": 6928.00,
-                "tax_details": [
-                    {
-                        "tax_type": "CGST",
-                        "rate": 9,
-                        "amount": 623.52
-                    },
-                    {
-                        "tax_type": "SGST",
-                        "rate": 9,
-                        "amount": 623.52
-                    }
-                ],
-                "total_tax_amount": 1247.04,
-                "total_amount": 8175.00,
-                "amount_in_words": "Eight Thousand One Hundred Seventy Five Only",
-                "irn": "bd13c19a0060a19ed820359c025761eb778929c354829ba08e1ebd1e429b75"
-            }
-        }
+from datetime import datetime
+from models import Invoice, LineItemList
+from prompts import (GPT_SYSTEM_PROMPT, GPT_DI_IMAGE_SYSTEM_PROMPT, GPT_DI_TEXT_SYSTEM_PROMPT, PHI_SYSTEM_PROMPT,
+                     CLAUDE_IMAGE_SYSTEM_PROMPT, CLAUDE_DOCUMENT_SYSTEM_PROMPT, CLAUDE_TEXT_SYSTEM_PROMPT,
+                     GPT_LINE_ITEMS_SYSTEM_PROMPT,
+                     CLAUDE_LINE_ITEMS_SYSTEM_PROMPT, CLAUDE_FIELD_SYSTEM_PROMPT, EXTRACTION_VERSIONS,
+                     claude_system_blocks)
+from chunked_extraction import CHUNK_HEADER_INSTRUCTION, extract_chunked, find_line_item_table, should_chunk
+from validation import decide_action, validate_cached_results, validate_invoice
+from identifiers import check_identifiers
+from duplicates import DUPLICATE_POLICY, DuplicateIndex, document_hash, field_fingerprint
+from bedrock_data_automation import (BedrockDataAutomationError, get_client as get_bda_client, output_page_count,
+                                     standard_output_text)
+from textract_analysis import get_analyzer as get_textract_analyzer, render_document as render_textract_document
+from local_ocr import LOCAL_OCR_EXTRACTOR, LOCAL_OCR_LANG, get_local_ocr, layout_markdown, layout_tables, layout_words
+from text_layer import TEXT_LAYER_ENABLED, read_text_layer
+from provider_pool import azure_openai_pool, bedrock_claude_pool, pool_status
+from ingestion import (ArchiveTooLargeError, ContentHashIndex, ExtractionQueue, HashingSpool, file_sha256,
+                       iter_zip_spools, store_spool)
+from previews import THUMBNAIL_NAME, PreviewStore
+from progress import ProgressLog, new_job_id, stage, valid_job_id
+from export import TABLES as EXPORT_TABLES, format_timestamp, parse_timestamp, stream_table
+from result_store import AGGREGATE_MAX_ROWS, TABLES as STORE_TABLES, open_store
+from layouts import LayoutStore
+from usage import claude_usage, metered, openai_usage, record_usage, usage_summary
+from vendor_templates import (TEMPLATE_MIN_CONFIDENCE, VENDOR_TEMPLATES_ENABLED, VendorTemplates,
+                              document_intelligence_tables, textract_tables)
+from provenance import (REEXTRACT_MAX_FIELDS, document_intelligence_words, field_provenance, low_confidence_fields,
+                        reextract_fields, textract_words)
 
 
 def convert_pdf_to_image(pdf_path: str, output_dir: str) -> str:
     """Convert first page of PDF to image and save it in the output directory"""
     # Convert PDF to image (first page only)
-    images = convert_from_path(pdf_path, first_page=1, last_page=1)
-    if not images:
-        raise ValueError(f"Could not convert PDF to image: {pdf_path}")
-    
-    # Save the first page image
-    image_path = os.path.join(output_dir, "page_1.jpg")
-    images[0].save(image_path, "JPEG")
+    from pdf2image import convert_from_path
+    with stage("rasterize"):
+        images = convert_from_path(pdf_path, first_page=1, last_page=1)
+        if not images:
+            raise ValueError(f"Could not convert PDF to image: {pdf_path}")
+        
+        # Save the first page image
+        image_path = os.path.join(output_dir, "page_1.jpg")
+        images[0].save(image_path, "JPEG")
     return image_path
 
 def local_image_to_data_url(image_path: str) -> str:
@@ -190,6 +78,271 @@ def local_image_to_data_url(image_path: str) -> str:
     
     return f"data:{mime_type};base64,{base64_encoded_data}"
 
+def invoke_claude(system_prompt: str, message_content: list, region: str, model_id: str, max_tokens: int = 2048) -> str:
+    """Call Claude on Bedrock with the Messages API and return the text of the first content block"""
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": 0.0,
+        # The system prompt is a stable prefix, marked for Bedrock prompt caching once it is long enough
+        "system": claude_system_blocks(system_prompt),
+        "messages": [
+            {
+                "role": "user",
+                "content": message_content
+            }
+        ]
+    })
+
+    def call(endpoint):
+        response = endpoint.client.invoke_model(
+            modelId=endpoint.target,
+            body=body,
+            accept="application/json",
+            contentType="application/json"
+        )
+        return response["body"].read().decode(), None
+
+    # Routed to the healthiest configured region/profile (see provider_pool.py)
+    response_body = bedrock_claude_pool(region, model_id).call(call)
+    result_json = json.loads(response_body)
+    record_usage("bedrock_claude", model_id, **claude_usage(result_json.get("usage")))
+    # Extract content from the first message in the response (Messages API format)
+    return result_json.get("content", [])[0].get("text", "") if result_json.get("content") else ""
+
+@stage("repair")
+def postprocess_claude_invoice(structured_invoice):
+    """Fill in critical fields Claude commonly leaves out; modifies the dict in place"""
+    if not isinstance(structured_invoice, dict):
+        return structured_invoice
+    # Check seller information
+    if "seller" in structured_invoice and isinstance(structured_invoice["seller"], dict):
+        # If seller has address but no name, try to extract name from the first line of address
+        if not structured_invoice["seller"].get("name") and structured_invoice["seller"].get("address"):
+            # Try to extract company name from address or use a placeholder
+            address_lines = structured_invoice["seller"]["address"].split(",")[0].strip()
+            if "Regd.Off." in address_lines:
+                # Remove registration office prefix if present
+                address_lines = address_lines.replace("Regd.Off.", "").strip()
+            structured_invoice["seller"]["name"] = address_lines
+
+    # Ensure tax_details exists
+    if "tax_details" not in structured_invoice:
+        structured_invoice["tax_details"] = []
+
+    # If line_items have tax_percentage but no tax_amount, calculate it
+    if "line_items" in structured_invoice and isinstance(structured_invoice["line_items"], list):
+        for item in structured_invoice["line_items"]:
+            if isinstance(item, dict) and "tax_percentage" in item and "amount" in item and "tax_amount" not in item:
+                # Calculate tax amount based on percentage
+                item["tax_amount"] = round(item["amount"] * (item["tax_percentage"] / 100), 2)
+    return structured_invoice
+
+def extract_claude_chunked(layout_text: str, text_intro: str, image_block: Optional[dict], region: str, model_id: str) -> dict:
+    """Extract a long invoice with Claude in header and line-item chunks (see chunked_extraction.py)"""
+    def extract_header(header_text):
+        message_content = [{"type": "text", "text": f"{text_intro}\n\n{header_text}\n\n{CHUNK_HEADER_INSTRUCTION}"}]
+        if image_block:
+            message_content.append(image_block)
+        header = json.loads(invoke_claude(CLAUDE_DOCUMENT_SYSTEM_PROMPT, message_content, region, model_id))
+        return postprocess_claude_invoice(header)
+
+    def extract_items(table_text):
+        message_content = [{"type": "text", "text": table_text}]
+        items = json.loads(invoke_claude(CLAUDE_LINE_ITEMS_SYSTEM_PROMPT, message_content, region, model_id, max_tokens=4096))
+        return items.get("line_items", []) if isinstance(items, dict) else items
+
+    result = extract_chunked(layout_text, extract_header, extract_items, items_key="line_items")
+    return postprocess_claude_invoice(result)
+
+def extract_gpt_chunked(openai_pool, layout_text: str, image_data_url: Optional[str] = None) -> dict:
+    """Extract a long invoice with Azure OpenAI in header and line-item chunks (see chunked_extraction.py)"""
+    def extract_header(header_text):
+        text = f"Here is the extracted text from the invoice:\n\n{header_text}\n\n{CHUNK_HEADER_INSTRUCTION}"
+        if image_data_url:
+            messages = [
+                {"role": "system", "content": GPT_DI_IMAGE_SYSTEM_PROMPT},
+                {"role": "user", "content": [
+                    {"type": "text", "text": text},
+                    {"type": "image_url", "image_url": {"url": image_data_url}}
+                ]}
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": GPT_DI_TEXT_SYSTEM_PROMPT},
+                {"role": "user", "content": text}
+            ]
+        response = openai_pool.parse(messages=messages, response_format=Invoice)
+        return gpt_parsed(response).model_dump(exclude_none=True)
+
+    def extract_items(table_text):
+        response = openai_pool.parse(
+            messages=[
+                {"role": "system", "content": GPT_LINE_ITEMS_SYSTEM_PROMPT},
+                {"role": "user", "content": table_text}
+            ],
+            response_format=LineItemList,
+        )
+        return [item.model_dump(exclude_none=True) for item in gpt_parsed(response).items]
+
+    return extract_chunked(layout_text, extract_header, extract_items, items_key="items")
+
+def gpt_parsed(response):
+    """Structured output of an Azure OpenAI response; a refusal raises instead of yielding None"""
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise ValueError(f"Azure OpenAI returned no structured output: {message.refusal or 'empty response'}")
+    return message.parsed
+
+def parse_gpt_invoice(openai_pool, messages: list, layout_text: Optional[str] = None,
+                      image_data_url: Optional[str] = None) -> Invoice:
+    """Extract an Invoice with one Azure OpenAI call.
+
+    Output cut off at the token limit is extracted again in chunks when the
+    layout has a line-item table, as truncated Claude responses are.
+    """
+    from openai import LengthFinishReasonError
+    try:
+        response = openai_pool.parse(messages=messages, response_format=Invoice)
+    except LengthFinishReasonError:
+        if find_line_item_table(layout_text) is None:
+            raise
+        print("Structured output was truncated, retrying with chunked extraction")
+        return Invoice.model_validate(extract_gpt_chunked(openai_pool, layout_text, image_data_url))
+    return gpt_parsed(response)
+
+def add_field_provenance(file_path: str, result, words: list, source: str, reextract_with: Optional[tuple] = None,
+                         tables: Optional[list] = None):
+    """Record per-field OCR confidence and page boxes on a result dict (see provenance.py).
+
+    With ``reextract_with`` (a Claude region and model id), fields below the
+    confidence threshold are re-read from crops of the page first. With the
+    page ``tables``, the seller's vendor template learns from the result.
+    """
+    if not isinstance(result, dict) or 'error' in result or not words:
+        return result
+    provenance = field_provenance(result, words, source)
+    fields = low_confidence_fields(provenance)[:REEXTRACT_MAX_FIELDS]
+    if fields and reextract_with:
+        try:
+            with stage("reextract", fields=len(fields)):
+                changed = reextract_fields(
+                    result, provenance, fields, file_path,
+                    lambda content: invoke_claude(CLAUDE_FIELD_SYSTEM_PROMPT, content, *reextract_with, max_tokens=1024)
+                )
+            print(f"Re-read {len(fields)} low-confidence fields of {os.path.basename(file_path)}, {len(changed)} changed")
+        except Exception as e:
+            print(f"Error re-reading low-confidence fields: {e}")
+    result['provenance'] = provenance
+    if tables is not None and VENDOR_TEMPLATES_ENABLED:
+        try:
+            VENDOR_TEMPLATES.learn(result, provenance, words, tables)
+        except Exception as e:
+            print(f"Error learning vendor template: {e}")
+    return result
+
+def extract_with_template(words: list, tables: list, source: str) -> Optional[dict]:
+    """Read an invoice with its seller's vendor template; None when the LLM has to extract it"""
+    if not VENDOR_TEMPLATES_ENABLED or not words:
+        return None
+    with stage("template"):
+        found = VENDOR_TEMPLATES.extract(words, tables, source)
+    if found is None:
+        return None
+    data, provenance, confidence, gstin = found
+    if confidence < TEMPLATE_MIN_CONFIDENCE:
+        print(f"Vendor template of {gstin} is not confident enough ({confidence:.2f}), extracting with the LLM")
+        return None
+    print(f"Extracted with the vendor template of {gstin} (confidence {confidence:.2f})")
+    data['provenance'] = provenance
+    data['template'] = {'seller_gstin': gstin, 'confidence': round(confidence, 3)}
+    return data
+
+def extract_from_layout(input_file: str, processing_method: str, pages: list, source: str, extractor: str, openai_pool=None):
+    """Extract an invoice from local OCR or text-layer pages (see local_ocr.py) without page images.
+
+    A vendor template is tried first, then the ``extractor`` LLM ('claude' or
+    'gpt') reads the layout markdown. Returns the cached result, an error dict
+    when the LLM fails, or None when no template applies and ``extractor`` is 'none'.
+    """
+    words = layout_words(pages)
+    tables = layout_tables(pages)
+    layout_text = layout_markdown(pages)
+
+    templated = extract_with_template(words, tables, source)
+    if templated is not None:
+        save_to_cache(input_file, processing_method, templated)
+        return templated
+
+    text_intro = "Here is the extracted text from the invoice:"
+    reextract_with = None
+    try:
+        if extractor == "gpt":
+            # Same layout markdown as Document Intelligence, so the DI text-only extraction applies
+            if should_chunk(layout_text):
+                structured_invoice = serialize_model(Invoice.model_validate(extract_gpt_chunked(openai_pool, layout_text)))
+            else:
+                structured_invoice = serialize_model(parse_gpt_invoice(
+                    openai_pool,
+                    [
+                        {"role": "system", "content": GPT_DI_TEXT_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"{text_intro}\n\n{layout_text}\n\nPlease extract the information according to the model structure."}
+                    ],
+                    layout_text,
+                ))
+        elif extractor == "claude":
+            AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+            CLAUDE_MODEL_ID = os.getenv("BEDROCK_CLAUDE_MODEL_ID", "arn:aws:bedrock:us-east-1:302263040839:inference-profile/us.anthropic.claude-3-5-sonnet-20240620-v1:0")
+            reextract_with = (AWS_REGION, CLAUDE_MODEL_ID)
+            if should_chunk(layout_text):
+                structured_invoice = extract_claude_chunked(layout_text, text_intro, None, AWS_REGION, CLAUDE_MODEL_ID)
+            else:
+                message_content = [{"type": "text", "text": f"{text_intro}\n\n{layout_text}"}]
+                claude_content = invoke_claude(CLAUDE_TEXT_SYSTEM_PROMPT, message_content, AWS_REGION, CLAUDE_MODEL_ID)
+                structured_invoice = postprocess_claude_invoice(json.loads(claude_content))
+        else:
+            return None
+    except Exception as e:
+        print(f"Error extracting {source} output: {e}")
+        return {"error": str(e), "text": layout_text}
+
+    add_field_provenance(input_file, structured_invoice, words, source, reextract_with, tables)
+    save_to_cache(input_file, processing_method, structured_invoice)
+    return structured_invoice
+
+# Methods that call Azure OpenAI
+GPT_METHODS = ("gpt_only", "di_gpt_image", "di_gpt_no_image")
+
+# LLM that extracts a born-digital PDF's text layer for each method (see text_layer.py);
+# DI + Phi keeps its own path
+TEXT_LAYER_EXTRACTORS = {
+    "gpt_only": "gpt",
+    "di_gpt_image": "gpt",
+    "di_gpt_no_image": "gpt",
+    "bedrock_claude_sonnet": "claude",
+    "bedrock_data_automation": "claude",
+    "textract_claude": "claude",
+    "local_ocr": LOCAL_OCR_EXTRACTOR,
+}
+
+# Third-party SDKs each processing method imports on first use
+METHOD_SDKS = {
+    "gpt_only": ["pdf2image", "openai"],
+    "di_gpt_image": ["pdf2image", "openai", "azure.ai.documentintelligence"],
+    "di_gpt_no_image": ["pdf2image", "openai", "azure.ai.documentintelligence"],
+    "di_phi": ["pdf2image", "azure.ai.documentintelligence", "azure.ai.inference"],
+    "bedrock_claude_sonnet": ["pdf2image", "boto3"],
+    "bedrock_data_automation": ["pdf2image", "boto3"],
+    "textract_claude": ["pdf2image", "boto3"],
+    "local_ocr": ["pdf2image", "pytesseract"],
+}
+
+def preload_sdks(methods):
+    """Import the SDKs of the given methods now, e.g. in a pre-forking server master"""
+    for module in sorted({module for method in methods for module in METHOD_SDKS.get(method, [])}):
+        importlib.import_module(module)
+
+@metered()
 def analyze_and_parse_invoice(
     doc_intelligence_endpoint: str,
     doc_intelligence_key: str,
@@ -197,30 +350,61 @@ def analyze_and_parse_invoice(
     openai_key: str,
     deployment_name: str,
     input_file: str,
-    processing_method: str = "bedrock_claude_sonnet"
+    processing_method: str = "bedrock_claude_sonnet",
+    refresh: bool = False
 ):
+    """Extract an invoice, reusing its cached result unless ``refresh`` is set.
+
+    Refreshing (e.g. after a schema or prompt change) still reuses the stored
+    OCR/layout output of the document, so only the LLM stage runs again.
+    """
     # --- Amazon Bedrock Claude Sonnet integration variables ---
     # Set these in your .env or environment:
     # AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, BEDROCK_CLAUDE_MODEL_ID
     AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
     BEDROCK_CLAUDE_MODEL_ID = os.getenv("BEDROCK_CLAUDE_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
 
-    # Check if we have a cached result for this file and processing method
-    cached_result = get_cached_result(input_file, processing_method)
-    if cached_result:
-        return cached_result
-    # Initialize OpenAI client (needed for both methods)
-    openai_client = AzureOpenAI(
-        azure_endpoint=openai_endpoint,
-        api_key=openai_key,
-        api_version="2024-08-01-preview"
-    )
+    if not refresh:
+        # Check if we have a cached result for this file and processing method
+        cached_result = get_cached_result(input_file, processing_method)
+        if cached_result:
+            return cached_result
+
+        # Identical bytes reuse an earlier result before a paid extraction runs
+        duplicate_result = find_duplicate_before_extraction(input_file, processing_method)
+        if duplicate_result is not None:
+            return duplicate_result
+    # Azure OpenAI deployments to balance GPT calls over (see provider_pool.py); only
+    # the GPT methods need them, so the others never load the openai SDK
+    openai_pool = None
+    if processing_method in GPT_METHODS or (processing_method == "local_ocr" and LOCAL_OCR_EXTRACTOR == "gpt"):
+        openai_pool = azure_openai_pool(openai_endpoint, openai_key, deployment_name)
+
+    # Born-digital PDFs are read from their text layer, skipping rasterizing, OCR and image tokens
+    extractor = TEXT_LAYER_EXTRACTORS.get(processing_method)
+    if TEXT_LAYER_ENABLED and extractor and input_file.lower().endswith('.pdf'):
+        try:
+            with stage("text_layer"):
+                text_pages = read_text_layer(input_file)
+        except Exception as e:
+            print(f"Error reading the PDF text layer: {e}")
+            text_pages = None
+        if text_pages is not None:
+            print(f"Using the PDF text layer of {len(text_pages)} pages instead of {processing_method} OCR")
+            result = extract_from_layout(input_file, processing_method, text_pages, "text_layer", extractor, openai_pool)
+            if result is not None and not (isinstance(result, dict) and "error" in result):
+                return result
+            print("Text layer extraction did not succeed, continuing with the regular method")
+
+    if not refresh:
+        # Page hashes need a render, so born-digital PDFs read from their text layer skip them
+        index_page_hash(input_file)
     
     # Create a temporary directory that will persist through the function
     temp_dir = tempfile.mkdtemp()
     try:
-        # If input is PDF, convert to image first
-        if input_file.lower().endswith('.pdf'):
+        # GPT image methods send the first page as an image; the other methods rasterize (or not) themselves
+        if input_file.lower().endswith('.pdf') and processing_method in ["gpt_only", "di_gpt_image"]:
             image_path = convert_pdf_to_image(input_file, temp_dir)
         else:
             image_path = input_file
@@ -232,16 +416,12 @@ def analyze_and_parse_invoice(
             with open(image_path, "rb") as img_file:
                 # Convert the image to base64
                 base64_image = base64.b64encode(img_file.read()).decode("utf-8")
-        else: 
-            PROCESSING_METHODS = [
-                "di_gpt_image",  # Document Intelligence + GPT-4o with image
-                "di_gpt_no_image",  # Document Intelligence + GPT-4o without image
-                "di_phi",  # Document Intelligence + Microsoft Phi-3
-                "gpt_only",  # GPT-4o with image only
-                "bedrock_claude_sonnet",  # Amazon Bedrock Claude Sonnet
-                "bedrock_data_automation",  # Amazon Bedrock Data Automation
-                "textract_claude"  # Amazon Textract + Claude
-            ]
+        elif processing_method in ["di_gpt_image", "di_gpt_no_image", "di_phi"]:
+            # Provider SDKs are imported on first use of the methods that need them
+            from azure.ai.documentintelligence import DocumentIntelligenceClient
+            from azure.ai.documentintelligence.models import DocumentContentFormat
+            from azure.core.credentials import AzureKeyCredential
+
             # Initialize Document Intelligence client
             doc_client = DocumentIntelligenceClient(
                 endpoint=doc_intelligence_endpoint,
@@ -251,31 +431,14 @@ def analyze_and_parse_invoice(
             
             # Initialize the Phi client if needed
             if processing_method == 'di_phi':
+                from azure.ai.inference import ChatCompletionsClient
                 inference_client = ChatCompletionsClient(
                     endpoint=PHI_DI_ENDPOINT,
                     credential=AzureKeyCredential(PHI_DI_KEY),
                 )
 
-        # Prepare the system prompt for both methods
-        system_prompt = """You are an AI assistant specialized in extracting invoice data.
-Extract complete and accurate information from the invoice document.
-
-Extract the following information:
-- Basic invoice details (number, date, due date, payment terms)
-- Currency used in the invoice (e.g., INR, USD, EUR) - extract this from the document or from any 'amount in words' text
-- Seller and buyer information (name, address, GSTIN, contact details)
-- Line items with descriptions, quantities, unit prices, tax percentages, tax amounts, and total amounts
-- Tax details (CGST, SGST, IGST rates and amounts)
-- Total amounts, bank details, and any reference numbers
-
-For line items, make sure to:
-1. Extract unit_price (price per unit) correctly
-2. Include tax_percentage and tax_amount when available
-3. Ensure amount reflects the total for each line item
-
-Format your response with appropriate fields. Format monetary values as numbers without currency symbols, but be sure to extract and include the currency code/symbol in the 'currency' field.
-If the currency appears in 'amount in words' (e.g., 'INR Thirty-Four Thousand'), extract it for the currency field.
-Ensure all data is extracted accurately."""
+        # Prompts are built once in prompts.py so their prefixes stay cacheable
+        system_prompt = GPT_SYSTEM_PROMPT
         
         # For methods that need image data
         if processing_method in ["di_gpt_image", "gpt_only"]:
@@ -288,24 +451,51 @@ Ensure all data is extracted accurately."""
         
         # Read the document for Document Intelligence (for DI methods)
         if processing_method in ["di_gpt_image", "di_gpt_no_image", "di_phi"]:
-            with open(input_file, 'rb') as f:
-                document_data = f.read()
-            
-            # Get layout analysis with markdown
-            poller = doc_client.begin_analyze_document(
-                'prebuilt-layout',
-                document_data,
-                output_content_format=DocumentContentFormat.MARKDOWN
+            # The layout of a document is analysed once; re-extractions reuse the stored result
+            from azure.ai.documentintelligence.models import AnalyzeResult
+            digest = content_digest(input_file)
+            stored_layout = LAYOUTS.get(digest, "document_intelligence")
+            if stored_layout is not None:
+                doc_result = AnalyzeResult(stored_layout)
+            else:
+                with open(input_file, 'rb') as f:
+                    document_data = f.read()
+
+                # Get layout analysis with markdown
+                with stage("ocr", provider="document_intelligence"):
+                    poller = doc_client.begin_analyze_document(
+                        'prebuilt-layout',
+                        document_data,
+                        output_content_format=DocumentContentFormat.MARKDOWN
+                    )
+                    doc_result = poller.result()
+                record_usage("document_intelligence", "prebuilt-layout", pages=len(doc_result.pages or []))
+                LAYOUTS.put(digest, "document_intelligence", doc_result.as_dict())
+
+            templated = extract_with_template(document_intelligence_words(doc_result),
+                                              document_intelligence_tables(doc_result), "document_intelligence")
+            if templated is not None:
+                save_to_cache(input_file, processing_method, templated)
+                return templated
+        
+        # Long line-item tables are extracted in chunks so structured output is not truncated
+        if processing_method in ["di_gpt_image", "di_gpt_no_image"] and should_chunk(doc_result.content):
+            chunked_result = extract_gpt_chunked(
+                openai_pool, doc_result.content,
+                image_data_url if processing_method == "di_gpt_image" else None
             )
-            doc_result = poller.result()
+            add_field_provenance(input_file, chunked_result, document_intelligence_words(doc_result), "document_intelligence",
+                                 tables=document_intelligence_tables(doc_result))
+            save_to_cache(input_file, processing_method, chunked_result)
+            return Invoice.model_validate(chunked_result)
         
         # Process based on the selected method
         if processing_method == "gpt_only":
             # Call GPT-4o with just the image
             print("Sending image to GPT-4o for direct processing")
-            response = openai_client.beta.chat.completions.parse(
-                model=deployment_name,
-                messages=[
+            parsed_result = parse_gpt_invoice(
+                openai_pool,
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": [
                         {
@@ -320,17 +510,15 @@ Ensure all data is extracted accurately."""
                         }
                     ]}
                 ],
-                response_format=Invoice,
             )
         elif processing_method == "di_gpt_image":
             # Call GPT-4o with Document Intelligence results AND image
             print("Sending Document Intelligence results WITH image to GPT-4o")
-            # Modified prompt for DI+GPT method
-            di_system_prompt = system_prompt + "\n\nThe document has already been processed by Document Intelligence, and the extracted text is provided to you along with the original image."
+            di_system_prompt = GPT_DI_IMAGE_SYSTEM_PROMPT
             
-            response = openai_client.beta.chat.completions.parse(
-                model=deployment_name,
-                messages=[
+            parsed_result = parse_gpt_invoice(
+                openai_pool,
+                [
                     {"role": "system", "content": di_system_prompt},
                     {"role": "user", "content": [
                         {
@@ -345,40 +533,14 @@ Ensure all data is extracted accurately."""
                         }
                     ]}
                 ],
-                response_format=Invoice,
+                doc_result.content, image_data_url,
             )
         elif processing_method == 'di_phi':
             # Call DI+Phi with the document
             print("Sending document to DI+Phi")
-            # Prepare the system prompt and user content for Phi
-            system_prompt = "You are an AI assistant that extracts data from documents and returns them as structured JSON objects."
+            # Instructions and schema live in the system prompt so the prefix is identical across calls
+            system_prompt = PHI_SYSTEM_PROMPT
             user_content = []
-            user_text_prompt = f"""ou are an AI assistant specialized in extracting invoice data.
-Extract complete and accurate information from the invoice document.
-
-Extract the following information:
-- Basic invoice details (number, date, due date, payment terms)
-- Currency used in the invoice (e.g., INR, USD, EUR) - extract this from the document or from any 'amount in words' text
-- Seller and buyer information (name, address, GSTIN, contact details)
-- Line items with descriptions, quantities, unit prices, tax percentages, tax amounts, and total amounts
-- Tax details (CGST, SGST, IGST rates and amounts)
-- Total amounts, bank details, and any reference numbers
-
-For line items, make sure to:
-1. Extract unit_price (price per unit) correctly
-2. Include tax_percentage and tax_amount when available
-3. Ensure amount reflects the total for each line item
-
-Format your response with appropriate fields. Format monetary values as numbers without currency symbols, but be sure to extract and include the currency code/symbol in the 'currency' field.
-If the currency appears in 'amount in words' (e.g., 'INR Thirty-Four Thousand'), extract it for the currency field.
-Ensure all data is extracted accurately.
-- Strictly use the following JSON schema: {json.dumps(Invoice.model_json_schema())}
-- ONLY return the JSON object. DO NOT return as a JSON markdown code block. DO NOT include any other detail in your response."""
-
-            user_content.append({
-                "type": "text",
-                "text": user_text_prompt
-            })
 
             # Use the doc_result.content as the markdown text for DI+Phi
             user_content.append({
@@ -386,20 +548,22 @@ Ensure all data is extracted accurately.
                 "text": doc_result.content
             })
             
-            response = inference_client.complete(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
-                    },
-                    {
-                        "role": "user",
-                        "content": user_content
-                    }
-                ],
-                temperature=0.1,
-                top_p=0.1
-            )
+            with stage("llm", provider="phi"):
+                response = inference_client.complete(
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": system_prompt,
+                        },
+                        {
+                            "role": "user",
+                            "content": user_content
+                        }
+                    ],
+                    temperature=0.1,
+                    top_p=0.1
+                )
+            record_usage("phi", getattr(response, "model", None), **openai_usage(getattr(response, "usage", None)))
         elif processing_method == "bedrock_claude_sonnet":
             # Amazon Bedrock Claude Sonnet integration
             print("Processing with Amazon Bedrock Claude Sonnet...")
@@ -420,79 +584,7 @@ Ensure all data is extracted accurately.
                     img_b64 = base64.b64encode(img_bytes).decode("utf-8")
                     
                 # System message for Claude with schema
-                system_message = """You are an expert invoice parser. Extract all relevant invoice fields in structured JSON format from the invoice image. Respond ONLY with a JSON object matching the invoice schema, no extra text. 
-
-Follow this exact schema structure for your JSON response:
-
-{
-  "invoice_number": "string",
-  "invoice_date": "string (YYYY-MM-DD)",
-  "due_date": "string (YYYY-MM-DD)",
-  "payment_terms": "string",
-  "currency": "string",
-  "seller": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "buyer": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "line_items": [
-    {
-      "description": "string",
-      "hsn_sac": "string",
-      "quantity": number,
-      "unit": "string",
-      "unit_price": number,
-      "tax_percentage": number,
-      "tax_amount": number,
-      "amount": number
-    }
-  ],
-  "subtotal": number,
-  "tax_details": [
-    {
-      "tax_type": "string (e.g., CGST, SGST, IGST)",
-      "rate": number,
-      "amount": number
-    }
-  ],
-  "total_tax_amount": number,
-  "total_amount": number,
-  "amount_in_words": "string",
-  "po_number": "string",
-  "shipping_details": {
-    "shipped_to": "string",
-    "ship_to_address": "string",
-    "place_of_supply": "string",
-    "transporter": "string",
-    "vehicle_number": "string",
-    "dispatch_date": "string"
-  },
-  "bank_details": {
-    "bank_name": "string",
-    "account_number": "string",
-    "ifsc_code": "string",
-    "branch": "string"
-  },
-  "irn": "string",
-  "ack_number": "string",
-  "place_of_supply": "string",
-  "reverse_charge": boolean,
-  "notes": "string"
-}
-
-Important notes:
-1. All fields are optional. If a field is not found in the document, omit it from the JSON rather than including it with a null or empty value.
-2. Always include the tax_details array even if empty.
-3. CRITICAL: You MUST use the key 'line_items' (not 'items') for the array of invoice line items as shown in the schema. The UI expects this exact field name."""
+                system_message = CLAUDE_IMAGE_SYSTEM_PROMPT
                 
                 # Prepare multimodal message with the image
                 message_content = [
@@ -511,54 +603,12 @@ Important notes:
                 ]
                 
                 # Call Bedrock with the proper Messages API format
-                bedrock = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-                response = bedrock.invoke_model(
-                    modelId=CLAUDE_MODEL_ID,
-                    body=json.dumps({
-                        "anthropic_version": "bedrock-2023-05-31",
-                        "max_tokens": 2048,
-                        "temperature": 0.0,
-                        "system": system_message,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": message_content
-                            }
-                        ]
-                    }),
-                    accept="application/json",
-                    contentType="application/json"
-                )
-                response_body = response["body"].read().decode()
-                result_json = json.loads(response_body)
-                # Extract content from the first message in the response (Messages API format)
-                claude_content = result_json.get("content", [])[0].get("text", "") if result_json.get("content") else ""
+                claude_content = invoke_claude(system_message, message_content, AWS_REGION, CLAUDE_MODEL_ID)
                 try:
                     structured_invoice = json.loads(claude_content)
                     
-                    # Post-processing to ensure critical fields are complete
-                    if isinstance(structured_invoice, dict):
-                        # Check seller information
-                        if "seller" in structured_invoice and isinstance(structured_invoice["seller"], dict):
-                            # If seller has address but no name, try to extract name from the first line of address
-                            if not structured_invoice["seller"].get("name") and structured_invoice["seller"].get("address"):
-                                # Try to extract company name from address or use a placeholder
-                                address_lines = structured_invoice["seller"]["address"].split(",")[0].strip()
-                                if "Regd.Off." in address_lines:
-                                    # Remove registration office prefix if present
-                                    address_lines = address_lines.replace("Regd.Off.", "").strip()
-                                structured_invoice["seller"]["name"] = address_lines
-                        
-                        # Ensure tax_details exists
-                        if "tax_details" not in structured_invoice:
-                            structured_invoice["tax_details"] = []
-                            
-                        # If line_items have tax_percentage but no tax_amount, calculate it
-                        if "line_items" in structured_invoice and isinstance(structured_invoice["line_items"], list):
-                            for item in structured_invoice["line_items"]:
-                                if isinstance(item, dict) and "tax_percentage" in item and "amount" in item and "tax_amount" not in item:
-                                    # Calculate tax amount based on percentage
-                                    item["tax_amount"] = round(item["amount"] * (item["tax_percentage"] / 100), 2)
+                    # Fill in critical fields Claude commonly leaves out
+                    postprocess_claude_invoice(structured_invoice)
                                     
                     save_to_cache(input_file, processing_method, structured_invoice)
                     return structured_invoice
@@ -567,263 +617,98 @@ Important notes:
                     # If not valid JSON, return as string
                     save_to_cache(input_file, processing_method, {"error": str(e), "text": claude_content})
                     return {"error": str(e), "text": claude_content}
-            except (BotoCoreError, ClientError, Exception) as e:
+            except Exception as e:
                 print(f"Bedrock Claude Sonnet error: {e}")
                 return {"error": str(e)}
         elif processing_method == "bedrock_data_automation":
             # Amazon Bedrock Data Automation integration
             print("Processing with Amazon Bedrock Data Automation...")
-            # Required env vars: AWS_REGION, BDA_BUCKET_NAME, BDA_INPUT_PREFIX, BDA_OUTPUT_PREFIX, BDA_PROJECT_ID, BDA_BLUEPRINT_NAME
-            # Use environment variables or fallback to user-provided constants
+            # Required env vars: AWS_REGION, BDA_BUCKET_NAME, BDA_INPUT_PREFIX, BDA_OUTPUT_PREFIX, BDA_PROJECT_ID
+            from botocore.exceptions import BotoCoreError, ClientError
             AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-            BDA_BUCKET_NAME = os.getenv("BDA_BUCKET_NAME", "doc-ocr-poc")
-            BDA_INPUT_PREFIX = os.getenv("BDA_INPUT_PREFIX", "bedrock-data-auto-temp/input")
-            BDA_OUTPUT_PREFIX = os.getenv("BDA_OUTPUT_PREFIX", "bedrock-data-auto-temp/output")
-            BDA_PROJECT_ID = os.getenv("BDA_PROJECT_ID", "4790fd771828")
-            BDA_BLUEPRINT_NAME = os.getenv("BDA_BLUEPRINT_NAME", "default-blueprint")
-            DATA_AUTOMATION_PROFILE_ARN = os.getenv("DATA_AUTOMATION_PROFILE_ARN", "arn:aws:bedrock:us-east-1:302263040839:data-automation-project/4790fd771828")
             CLAUDE_MODEL_ID = os.getenv("BEDROCK_CLAUDE_MODEL_ID", "arn:aws:bedrock:us-east-1:302263040839:inference-profile/us.anthropic.claude-3-5-sonnet-20240620-v1:0")
-            bda = boto3.client('bedrock-data-automation-runtime', region_name=AWS_REGION)
-            s3 = boto3.client('s3', region_name=AWS_REGION)
-            sts = boto3.client('sts')
-            
-            def get_aws_account_id():
-                return sts.get_caller_identity().get('Account')
-            def upload_to_s3(local_path, bucket, key):
-                s3.upload_file(local_path, bucket, key)
-            def get_json_object_from_s3_uri(s3_uri):
-                s3_uri_split = s3_uri.split('/')
-                bucket = s3_uri_split[2]
-                key = '/'.join(s3_uri_split[3:])
-                object_content = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
-                return json.loads(object_content)
-            aws_account_id = get_aws_account_id()
-            file_name = os.path.basename(input_file)
-            input_key = f"{BDA_INPUT_PREFIX}/{file_name}"
-            output_prefix = BDA_OUTPUT_PREFIX
-            upload_to_s3(input_file, BDA_BUCKET_NAME, input_key)
-            input_s3_uri = f"s3://{BDA_BUCKET_NAME}/{input_key}"
-            output_s3_uri = f"s3://{BDA_BUCKET_NAME}/{output_prefix}"
-            data_automation_arn = f"arn:aws:bedrock:{AWS_REGION}:{aws_account_id}:data-automation-project/{BDA_PROJECT_ID}"
-            params = {
-                'inputConfiguration': {
-                    's3Uri': input_s3_uri
-                },
-                'outputConfiguration': {
-                    's3Uri': output_s3_uri
-                },
-                'dataAutomationConfiguration': {
-                    'dataAutomationProjectArn': data_automation_arn
-                },
-                'dataAutomationProfileArn': f"arn:aws:bedrock:{AWS_REGION}:{aws_account_id}:data-automation-profile/us.data-automation-v1"
-            }
-            response = bda.invoke_data_automation_async(**params)
-            invocation_arn = response['invocationArn']
-            # Poll for completion
-            import time
-            while True:
-                status_response = bda.get_data_automation_status(invocationArn=invocation_arn)
-                status = status_response['status']
-                if status not in ['Created', 'InProgress']:
-                    break
-                time.sleep(2)
-            if status_response['status'] == 'Success':
-                job_metadata_s3_uri = status_response['outputConfiguration']['s3Uri']
-                job_metadata = get_json_object_from_s3_uri(job_metadata_s3_uri)
-                # Extract standard output (first segment/page)
+            # BDA runs once per document; re-extractions reuse its stored outputs
+            digest = content_digest(input_file)
+            bda_outputs = LAYOUTS.get(digest, "bedrock_data_automation")
+            if bda_outputs is None:
                 try:
-                    segment = job_metadata['output_metadata'][0]
-                    segment_metadata = segment['segment_metadata'][0]
-                    standard_output_path = segment_metadata['standard_output_path']
-                    standard_output_result = get_json_object_from_s3_uri(standard_output_path)
-                    # Send the BDA output to Claude Sonnet for structured extraction
-                    try:
-                        # Extract markdown content if present (else fallback to full output)
-                        bda_text = None
-                        if isinstance(standard_output_result, dict):
-                            # Try to extract all markdown representations
-                            if 'output' in standard_output_result and isinstance(standard_output_result['output'], list):
-                                markdowns = []
-                                for item in standard_output_result['output']:
-                                    rep = item.get('representation', {})
-                                    if isinstance(rep, dict) and 'markdown' in rep:
-                                        markdowns.append(rep['markdown'])
-                                if markdowns:
-                                    bda_text = '\n'.join(markdowns)
-                            # Fallback: string representation
-                            if not bda_text:
-                                bda_text = json.dumps(standard_output_result)
-                        else:
-                            bda_text = str(standard_output_result)
-
-                        # System message and user message for Claude 3.5 Sonnet
-                        system_message = """You are an expert invoice parser. Extract all relevant invoice fields in structured JSON format from the document content and the invoice image. Respond ONLY with a JSON object matching the invoice schema, no extra text. 
-
-Follow this exact schema structure for your JSON response:
-
-{
-  "invoice_number": "string",
-  "invoice_date": "string (YYYY-MM-DD)",
-  "due_date": "string (YYYY-MM-DD)",
-  "payment_terms": "string",
-  "currency": "string",
-  "seller": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "buyer": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "line_items": [
-    {
-      "description": "string",
-      "hsn_sac": "string",
-      "quantity": number,
-      "unit": "string",
-      "unit_price": number,
-      "tax_percentage": number,
-      "tax_amount": number,
-      "amount": number
-    }
-  ],
-  "subtotal": number,
-  "tax_details": [
-    {
-      "tax_type": "string (e.g., CGST, SGST, IGST)",
-      "rate": number,
-      "amount": number
-    }
-  ],
-  "total_tax_amount": number,
-  "total_amount": number,
-  "amount_in_words": "string",
-  "po_number": "string",
-  "shipping_details": {
-    "shipped_to": "string",
-    "ship_to_address": "string",
-    "place_of_supply": "string",
-    "transporter": "string",
-    "vehicle_number": "string",
-    "dispatch_date": "string"
-  },
-  "bank_details": {
-    "bank_name": "string",
-    "account_number": "string",
-    "ifsc_code": "string",
-    "branch": "string"
-  },
-  "irn": "string",
-  "ack_number": "string",
-  "place_of_supply": "string",
-  "reverse_charge": boolean,
-  "notes": "string"
-}
+                    with stage("ocr", provider="bedrock_data_automation"):
+                        bda_outputs = get_bda_client(AWS_REGION).process(input_file)
+                except BedrockDataAutomationError as e:
+                    print(f"BDA failed: {e.status_response or e}")
+                    return {"error": e.status_response or str(e)}
+                except (BotoCoreError, ClientError) as e:
+                    print(f"BDA error: {e}")
+                    return {"error": str(e)}
+                record_usage("bedrock_data_automation", "standard_output", pages=output_page_count(bda_outputs))
+                LAYOUTS.put(digest, "bedrock_data_automation", bda_outputs)
+            # Raw BDA output is kept as the result if the Claude step fails
+            standard_output_result = bda_outputs[0] if len(bda_outputs) == 1 else {"segments": bda_outputs}
+            # Send the BDA output of all segments to Claude Sonnet for structured extraction
+            try:
+                bda_text = standard_output_text(bda_outputs)
 
-Important notes:
-1. All fields are optional. If a field is not found in the document, omit it from the JSON rather than including it with a null or empty value.
-2. Always include the tax_details array even if empty.
-3. CRITICAL: You MUST use the key 'line_items' (not 'items') for the array of invoice line items as shown in the schema. The UI expects this exact field name."""
+                # System message and user message for Claude 3.5 Sonnet
+                system_message = CLAUDE_DOCUMENT_SYSTEM_PROMPT
+                
+                # Convert PDF to image if needed
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    if input_file.lower().endswith(".pdf"):
+                        image_path = convert_pdf_to_image(input_file, temp_dir)
+                    else:
+                        image_path = input_file
                         
-                        # Convert PDF to image if needed
-                        with tempfile.TemporaryDirectory() as temp_dir:
-                            if input_file.lower().endswith(".pdf"):
-                                image_path = convert_pdf_to_image(input_file, temp_dir)
-                            else:
-                                image_path = input_file
-                                
-                            # Read image as base64
-                            with open(image_path, "rb") as img_file:
-                                base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+                    # Read image as base64
+                    with open(image_path, "rb") as img_file:
+                        base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+                
+                    # Prepare multimodal message with both text and image
+                    message_content = [
+                        {
+                            "type": "text",
+                            "text": "Here is the extracted text from the invoice:" + "\n\n" + bda_text
+                        },
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/jpeg",
+                                "data": base64_image
+                            }
+                        }
+                    ]
+                    
+                    # Long line-item tables are extracted in chunks so the response is not truncated
+                    if should_chunk(bda_text):
+                        structured_invoice = extract_claude_chunked(
+                            bda_text, "Here is the extracted text from the invoice:",
+                            message_content[1], AWS_REGION, CLAUDE_MODEL_ID
+                        )
+                        save_to_cache(input_file, processing_method, structured_invoice)
+                        return structured_invoice
+                    
+                    claude_content = invoke_claude(system_message, message_content, AWS_REGION, CLAUDE_MODEL_ID)
+                    try:
+                        structured_invoice = json.loads(claude_content)
                         
-                            # Prepare multimodal message with both text and image
-                            message_content = [
-                                {
-                                    "type": "text",
-                                    "text": "Here is the extracted text from the invoice:" + "\n\n" + bda_text
-                                },
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": base64_image
-                                    }
-                                }
-                            ]
-                            
-                            bedrock_client = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-                            
-                            # Use the Messages API format for Claude 3.5 Sonnet with multimodal content
-                            response = bedrock_client.invoke_model(
-                                modelId=CLAUDE_MODEL_ID,
-                                body=json.dumps({
-                                    "anthropic_version": "bedrock-2023-05-31",
-                                    "max_tokens": 2048,
-                                    "temperature": 0.0,
-                                    "system": system_message,
-                                    "messages": [
-                                        {
-                                            "role": "user",
-                                            "content": message_content
-                                        }
-                                    ]
-                                }),
-                                accept="application/json",
-                                contentType="application/json"
+                        # Fill in critical fields Claude commonly leaves out
+                        postprocess_claude_invoice(structured_invoice)
+                    except Exception:
+                        structured_invoice = claude_content
+                        # A truncated response on a table-heavy document is retried in chunks
+                        if find_line_item_table(bda_text) is not None:
+                            print("Claude response could not be parsed, retrying with chunked extraction")
+                            structured_invoice = extract_claude_chunked(
+                                bda_text, "Here is the extracted text from the invoice:",
+                                message_content[1], AWS_REGION, CLAUDE_MODEL_ID
                             )
-                        
-                        response_body = response["body"].read().decode()
-                        result_json = json.loads(response_body)
-                        # Extract content from the first message in the response
-                        claude_content = result_json.get("content", [])[0].get("text", "") if result_json.get("content") else ""
-                        try:
-                            structured_invoice = json.loads(claude_content)
-                            
-                            # Post-processing to ensure critical fields are complete
-                            if isinstance(structured_invoice, dict):
-                                # Check seller information
-                                if "seller" in structured_invoice and isinstance(structured_invoice["seller"], dict):
-                                    # If seller has address but no name, try to extract name from the first line of address
-                                    if not structured_invoice["seller"].get("name") and structured_invoice["seller"].get("address"):
-                                        # Try to extract company name from address or use a placeholder
-                                        address_lines = structured_invoice["seller"]["address"].split(",")[0].strip()
-                                        if "Regd.Off." in address_lines:
-                                            # Remove registration office prefix if present
-                                            address_lines = address_lines.replace("Regd.Off.", "").strip()
-                                        structured_invoice["seller"]["name"] = address_lines
-                                
-                                # Ensure tax_details exists
-                                if "tax_details" not in structured_invoice:
-                                    structured_invoice["tax_details"] = []
-                                    
-                                # If line_items have tax_percentage but no tax_amount, calculate it
-                                if "line_items" in structured_invoice and isinstance(structured_invoice["line_items"], list):
-                                    for item in structured_invoice["line_items"]:
-                                        if isinstance(item, dict) and "tax_percentage" in item and "amount" in item and "tax_amount" not in item:
-                                            # Calculate tax amount based on percentage
-                                            item["tax_amount"] = round(item["amount"] * (item["tax_percentage"] / 100), 2)
-                        except Exception:
-                            structured_invoice = claude_content
 
-                        save_to_cache(input_file, processing_method, structured_invoice)
-                        return structured_invoice
-                    except Exception as e:
-                        print(f"Error sending BDA output to Claude Sonnet: {e}")
-                        save_to_cache(input_file, processing_method, standard_output_result)
-                        return standard_output_result
-                except Exception as e:
-                    print(f"BDA result extraction error: {e}")
-                    return {"error": str(e)}
-            else:
-                print(f"BDA failed: {status_response}")
-                return {"error": status_response}
+                save_to_cache(input_file, processing_method, structured_invoice)
+                return structured_invoice
+            except Exception as e:
+                print(f"Error sending BDA output to Claude Sonnet: {e}")
+                save_to_cache(input_file, processing_method, standard_output_result)
+                return standard_output_result
         elif processing_method == "textract_claude":
             # Amazon Textract + Claude integration
             print("Processing with Amazon Textract + Claude...")
@@ -832,123 +717,41 @@ Important notes:
             AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
             CLAUDE_MODEL_ID = os.getenv("BEDROCK_CLAUDE_MODEL_ID", "arn:aws:bedrock:us-east-1:302263040839:inference-profile/us.anthropic.claude-3-5-sonnet-20240620-v1:0")
             
+            # Extract text from every page with Amazon Textract (tables rendered as markdown)
+            print("Extracting text with Amazon Textract...")
+            ocr_words = []
+            ocr_tables = []
+            try:
+                with stage("ocr", provider="textract"):
+                    analyzer = get_textract_analyzer(AWS_REGION, TEXTRACT_CACHE_DIR)
+                    ocr_pages = analyzer.analyze(input_file, content_digest(input_file))
+                    extracted_text = render_textract_document(ocr_pages)
+                    ocr_words = textract_words(ocr_pages)
+                    ocr_tables = textract_tables(ocr_pages)
+            except Exception as e:
+                print(f"Textract error: {str(e)}")
+                # Fallback text if Textract fails
+                extracted_text = "Textract processing failed. Using only image analysis."
+
+            # Invoices of sellers with a learned layout are read from the OCR output without Claude
+            templated = extract_with_template(ocr_words, ocr_tables, "textract")
+            if templated is not None:
+                save_to_cache(input_file, processing_method, templated)
+                return templated
+
             # Convert PDF to image if needed, to ensure both image and text processing
             with tempfile.TemporaryDirectory() as temp_dir:
                 if input_file.lower().endswith(".pdf"):
                     image_path = convert_pdf_to_image(input_file, temp_dir)
                 else:
                     image_path = input_file
-                    
-                # Initialize Textract client
-                textract = boto3.client('textract', region_name=AWS_REGION)
-                
-                # Extract text using Textract
-                print("Extracting text with Amazon Textract...")
-                
-                # We've already converted any PDF to image above, so we can just use the image_path directly
-                # Textract synchronous API only supports image formats (JPG, PNG, etc.)
-                try:
-                    # Read the image file
-                    with open(image_path, 'rb') as document:
-                        file_bytes = document.read()
-                        
-                    # Process with Textract
-                    response = textract.detect_document_text(
-                        Document={
-                            'Bytes': file_bytes
-                        }
-                    )
-                except Exception as e:
-                    print(f"Textract error: {str(e)}")
-                    # Fallback text if Textract fails
-                    response = {'Blocks': []}
-                    extracted_text = "Textract processing failed. Using only image analysis."
-                
-                # Parse Textract response
-                extracted_text = ""
-                if 'Blocks' in response:
-                    for block in response['Blocks']:
-                        if block['BlockType'] == 'LINE':
-                            extracted_text += block['Text'] + "\n"
-                
+
                 # Read image as base64 for Claude
                 with open(image_path, "rb") as img_file:
                     base64_image = base64.b64encode(img_file.read()).decode("utf-8")
                 
                 # System message for Claude
-                system_message = """You are an expert invoice parser. Extract all relevant invoice fields in structured JSON format from the document content and the invoice image. Respond ONLY with a JSON object matching the invoice schema, no extra text. 
-
-Follow this exact schema structure for your JSON response:
-
-{
-  "invoice_number": "string",
-  "invoice_date": "string (YYYY-MM-DD)",
-  "due_date": "string (YYYY-MM-DD)",
-  "payment_terms": "string",
-  "currency": "string",
-  "seller": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "buyer": {
-    "name": "string",
-    "address": "string",
-    "gstin": "string",
-    "pan": "string",
-    "contact_details": "string"
-  },
-  "line_items": [
-    {
-      "description": "string",
-      "hsn_sac": "string",
-      "quantity": number,
-      "unit": "string",
-      "unit_price": number,
-      "tax_percentage": number,
-      "tax_amount": number,
-      "amount": number
-    }
-  ],
-  "subtotal": number,
-  "tax_details": [
-    {
-      "tax_type": "string (e.g., CGST, SGST, IGST)",
-      "rate": number,
-      "amount": number
-    }
-  ],
-  "total_tax_amount": number,
-  "total_amount": number,
-  "amount_in_words": "string",
-  "po_number": "string",
-  "shipping_details": {
-    "shipped_to": "string",
-    "ship_to_address": "string",
-    "place_of_supply": "string",
-    "transporter": "string",
-    "vehicle_number": "string",
-    "dispatch_date": "string"
-  },
-  "bank_details": {
-    "bank_name": "string",
-    "account_number": "string",
-    "ifsc_code": "string",
-    "branch": "string"
-  },
-  "irn": "string",
-  "ack_number": "string",
-  "place_of_supply": "string",
-  "reverse_charge": boolean,
-  "notes": "string"
-}
-
-Important notes:
-1. All fields are optional. If a field is not found in the document, omit it from the JSON rather than including it with a null or empty value.
-2. Always include the tax_details array even if empty.
-3. CRITICAL: You MUST use the key 'line_items' (not 'items') for the array of invoice line items as shown in the schema. The UI expects this exact field name."""
+                system_message = CLAUDE_DOCUMENT_SYSTEM_PROMPT
                 
                 # Prepare multimodal message with both Textract text and image
                 message_content = [
@@ -967,145 +770,140 @@ Important notes:
                 ]
                 
                 try:
+                    # Long line-item tables are extracted in chunks so the response is not truncated
+                    if should_chunk(extracted_text):
+                        structured_invoice = extract_claude_chunked(
+                            extracted_text, "Here is the extracted text from the invoice using Amazon Textract:",
+                            message_content[1], AWS_REGION, CLAUDE_MODEL_ID
+                        )
+                        add_field_provenance(input_file, structured_invoice, ocr_words, "textract",
+                                             (AWS_REGION, CLAUDE_MODEL_ID), ocr_tables)
+                        save_to_cache(input_file, processing_method, structured_invoice)
+                        return structured_invoice
+                    
                     # Call Claude with Textract data and image
                     print("Sending Textract output and image to Claude...")
-                    bedrock_client = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-                    
-                    # Use the Messages API format for Claude 3.5 Sonnet with multimodal content
-                    response = bedrock_client.invoke_model(
-                        modelId=CLAUDE_MODEL_ID,
-                        body=json.dumps({
-                            "anthropic_version": "bedrock-2023-05-31",
-                            "max_tokens": 2048,
-                            "temperature": 0.0,
-                            "system": system_message,
-                            "messages": [
-                                {
-                                    "role": "user",
-                                    "content": message_content
-                                }
-                            ]
-                        }),
-                        accept="application/json",
-                        contentType="application/json"
-                    )
-                    
-                    response_body = response["body"].read().decode()
-                    result_json = json.loads(response_body)
-                    # Extract content from the first message in the response
-                    claude_content = result_json.get("content", [])[0].get("text", "") if result_json.get("content") else ""
+                    claude_content = invoke_claude(system_message, message_content, AWS_REGION, CLAUDE_MODEL_ID)
                     
                     try:
                         structured_invoice = json.loads(claude_content)
                         
-                        # Post-processing to ensure critical fields are complete
-                        if isinstance(structured_invoice, dict):
-                            # Check seller information
-                            if "seller" in structured_invoice and isinstance(structured_invoice["seller"], dict):
-                                # If seller has address but no name, try to extract name from the first line of address
-                                if not structured_invoice["seller"].get("name") and structured_invoice["seller"].get("address"):
-                                    # Try to extract company name from address or use a placeholder
-                                    address_lines = structured_invoice["seller"]["address"].split(",")[0].strip()
-                                    if "Regd.Off." in address_lines:
-                                        # Remove registration office prefix if present
-                                        address_lines = address_lines.replace("Regd.Off.", "").strip()
-                                    structured_invoice["seller"]["name"] = address_lines
-                            
-                            # Ensure tax_details exists
-                            if "tax_details" not in structured_invoice:
-                                structured_invoice["tax_details"] = []
-                                
-                            # If line_items have tax_percentage but no tax_amount, calculate it
-                            if "line_items" in structured_invoice and isinstance(structured_invoice["line_items"], list):
-                                for item in structured_invoice["line_items"]:
-                                    if isinstance(item, dict) and "tax_percentage" in item and "amount" in item and "tax_amount" not in item:
-                                        # Calculate tax amount based on percentage
-                                        item["tax_amount"] = round(item["amount"] * (item["tax_percentage"] / 100), 2)
+                        # Fill in critical fields Claude commonly leaves out
+                        postprocess_claude_invoice(structured_invoice)
+                        # Fields read from low-confidence OCR words are checked again on a crop of the page
+                        add_field_provenance(input_file, structured_invoice, ocr_words, "textract",
+                                             (AWS_REGION, CLAUDE_MODEL_ID), ocr_tables)
                                         
                         save_to_cache(input_file, processing_method, structured_invoice)
                         return structured_invoice
                     except Exception as e:
                         print(f"Error parsing Claude response: {e}")
+                        # A truncated response on a table-heavy document is retried in chunks
+                        if find_line_item_table(extracted_text) is not None:
+                            print("Retrying with chunked extraction")
+                            structured_invoice = extract_claude_chunked(
+                                extracted_text, "Here is the extracted text from the invoice using Amazon Textract:",
+                                message_content[1], AWS_REGION, CLAUDE_MODEL_ID
+                            )
+                            add_field_provenance(input_file, structured_invoice, ocr_words, "textract",
+                                                 (AWS_REGION, CLAUDE_MODEL_ID), ocr_tables)
+                            save_to_cache(input_file, processing_method, structured_invoice)
+                            return structured_invoice
                         save_to_cache(input_file, processing_method, {"error": str(e), "text": extracted_text})
                         return {"error": str(e), "text": extracted_text}
                 except Exception as e:
                     print(f"Error processing with Textract+Claude: {e}")
                     return {"error": str(e)}
+        elif processing_method == "local_ocr":
+            # Tesseract on this machine; no cloud call unless an LLM has to extract the fields
+            print(f"Processing with local OCR (Tesseract), extractor: {LOCAL_OCR_EXTRACTOR}")
+            digest = content_digest(input_file)
+            ocr_pages = LAYOUTS.get(digest, "local_ocr")
+            if ocr_pages is None:
+                with stage("ocr", provider="tesseract"):
+                    ocr_pages = get_local_ocr().analyze(input_file)
+                record_usage("tesseract", LOCAL_OCR_LANG, pages=len(ocr_pages))
+                LAYOUTS.put(digest, "local_ocr", ocr_pages)
+            result = extract_from_layout(input_file, processing_method, ocr_pages, "local_ocr",
+                                         LOCAL_OCR_EXTRACTOR, openai_pool)
+            if result is None:
+                # Offline: only invoices of sellers with a vendor template can be extracted
+                return {"error": "No vendor template applies to this invoice and LOCAL_OCR_EXTRACTOR is 'none'",
+                        "text": layout_markdown(ocr_pages)}
+            return result
         elif processing_method == "di_gpt_no_image":
             # Call GPT-4o with Document Intelligence results WITHOUT image
             print("Sending Document Intelligence results WITHOUT image to GPT-4o")
-            # Modified prompt for DI+GPT without image method
-            di_system_prompt = system_prompt + "\n\nThe document has already been processed by Document Intelligence, and the extracted text is provided to you."
+            di_system_prompt = GPT_DI_TEXT_SYSTEM_PROMPT
             
-            response = openai_client.beta.chat.completions.parse(
-                model=deployment_name,
-                messages=[
+            parsed_result = parse_gpt_invoice(
+                openai_pool,
+                [
                     {"role": "system", "content": di_system_prompt},
                     {"role": "user", "content": f"Here is the extracted text from the invoice:\n\n{doc_result.content}\n\nPlease extract the information according to the model structure."}
                 ],
-                response_format=Invoice,
+                doc_result.content,
             )
         
         # Parse the response based on which method was used
         if processing_method == 'di_phi':
             # The complete method returns a different structure than the OpenAI client
             phi_response_text = response.choices[0].message.content
-            try:
-                # The Phi model may return invalid JSON with commas in numeric values
-                # Clean up the response first
-                import re
-                # This regex finds numeric values with commas (e.g., 169,050.28) not inside quotes
-                cleaned_text = re.sub(r'(?<!\"): (\d+),(\d+\.\d+)', r': \1\2', phi_response_text)
-                # Also clean up any other instances of invalid JSON with commas in numbers
-                cleaned_text = re.sub(r'(?<!\"): (\d+),(\d+),(\d+\.\d+)', r': \1\2\3', cleaned_text)
+            # Phi often returns JSON with thousands separators in numbers
+            with stage("repair"):
+                try:
+                    # The Phi model may return invalid JSON with commas in numeric values
+                    # Clean up the response first
+                    import re
+                    # This regex finds numeric values with commas (e.g., 169,050.28) not inside quotes
+                    cleaned_text = re.sub(r'(?<!\"): (\d+),(\d+\.\d+)', r': \1\2', phi_response_text)
+                    # Also clean up any other instances of invalid JSON with commas in numbers
+                    cleaned_text = re.sub(r'(?<!\"): (\d+),(\d+),(\d+\.\d+)', r': \1\2\3', cleaned_text)
                 
-                print(f"Cleaned response for parsing")
+                    print(f"Cleaned response for parsing")
                 
-                # Parse the cleaned response into a Python dict first
-                parsed_dict = json.loads(cleaned_text)
+                    # Parse the cleaned response into a Python dict first
+                    parsed_dict = json.loads(cleaned_text)
                 
-                # Fix boolean fields that might contain strings like 'Not provided'
-                if 'reverse_charge' in parsed_dict and parsed_dict['reverse_charge'] in ['Not provided', 'not provided', None, '']:
-                    parsed_dict['reverse_charge'] = None
+                    # Fix boolean fields that might contain strings like 'Not provided'
+                    if 'reverse_charge' in parsed_dict and parsed_dict['reverse_charge'] in ['Not provided', 'not provided', None, '']:
+                        parsed_dict['reverse_charge'] = None
                 
-                # Fix field name mismatches in seller/buyer info
-                if 'seller_info' in parsed_dict and 'seller' not in parsed_dict:
-                    parsed_dict['seller'] = parsed_dict.pop('seller_info')
+                    # Fix field name mismatches in seller/buyer info
+                    if 'seller_info' in parsed_dict and 'seller' not in parsed_dict:
+                        parsed_dict['seller'] = parsed_dict.pop('seller_info')
                 
-                if 'buyer_info' in parsed_dict and 'buyer' not in parsed_dict:
-                    parsed_dict['buyer'] = parsed_dict.pop('buyer_info')
+                    if 'buyer_info' in parsed_dict and 'buyer' not in parsed_dict:
+                        parsed_dict['buyer'] = parsed_dict.pop('buyer_info')
                 
-                # Now validate with the model
-                parsed_result = Invoice.model_validate(parsed_dict)
-                print(f"Successfully parsed PHI response: {type(parsed_result)}")
-            except Exception as e:
-                print(f"Error parsing PHI response: {e}")
-                print(f"PHI response: {phi_response_text}")
-                # Try a more aggressive cleaning - replace all commas between digits
-                try:
-                    # This regex removes all commas that appear between digits
-                    aggressive_clean = re.sub(r'(\d),(\d)', r'\1\2', phi_response_text)
-                    aggressive_dict = json.loads(aggressive_clean)
+                    # Now validate with the model
+                    parsed_result = Invoice.model_validate(parsed_dict)
+                    print(f"Successfully parsed PHI response: {type(parsed_result)}")
+                except Exception as e:
+                    print(f"Error parsing PHI response: {e}")
+                    print(f"PHI response: {phi_response_text}")
+                    # Try a more aggressive cleaning - replace all commas between digits
+                    try:
+                        # This regex removes all commas that appear between digits
+                        aggressive_clean = re.sub(r'(\d),(\d)', r'\1\2', phi_response_text)
+                        aggressive_dict = json.loads(aggressive_clean)
                     
-                    # Fix boolean fields that might contain strings like 'Not provided'
-                    if 'reverse_charge' in aggressive_dict and aggressive_dict['reverse_charge'] in ['Not provided', 'not provided', None, '']:
-                        aggressive_dict['reverse_charge'] = None
+                        # Fix boolean fields that might contain strings like 'Not provided'
+                        if 'reverse_charge' in aggressive_dict and aggressive_dict['reverse_charge'] in ['Not provided', 'not provided', None, '']:
+                            aggressive_dict['reverse_charge'] = None
                     
-                    # Fix field name mismatches in seller/buyer info
-                    if 'seller_info' in aggressive_dict and 'seller' not in aggressive_dict:
-                        aggressive_dict['seller'] = aggressive_dict.pop('seller_info')
+                        # Fix field name mismatches in seller/buyer info
+                        if 'seller_info' in aggressive_dict and 'seller' not in aggressive_dict:
+                            aggressive_dict['seller'] = aggressive_dict.pop('seller_info')
                     
-                    if 'buyer_info' in aggressive_dict and 'buyer' not in aggressive_dict:
-                        aggressive_dict['buyer'] = aggressive_dict.pop('buyer_info')
+                        if 'buyer_info' in aggressive_dict and 'buyer' not in aggressive_dict:
+                            aggressive_dict['buyer'] = aggressive_dict.pop('buyer_info')
                     
-                    parsed_result = Invoice.model_validate(aggressive_dict)
-                    print(f"Successfully parsed PHI response with aggressive cleaning")
-                except Exception as e2:
-                    print(f"Even aggressive cleaning failed: {e2}")
-                    raise
-        else:
-            # For OpenAI methods, the parsed response is already available
-            parsed_result = response.choices[0].message.parsed
+                        parsed_result = Invoice.model_validate(aggressive_dict)
+                        print(f"Successfully parsed PHI response with aggressive cleaning")
+                    except Exception as e2:
+                        print(f"Even aggressive cleaning failed: {e2}")
+                        raise
         
         # Print debug information about the result
         print(f"Result type: {type(parsed_result)}")
@@ -1113,8 +911,15 @@ Important notes:
         print(f"Result has dict(): {hasattr(parsed_result, 'dict')}")
         print(f"Result model_dump(): {parsed_result.model_dump()}")
         
+        # Document Intelligence word confidences are recorded per field with the result
+        cached_result = parsed_result
+        if processing_method in ["di_gpt_image", "di_gpt_no_image", "di_phi"]:
+            cached_result = add_field_provenance(input_file, serialize_model(parsed_result),
+                                                 document_intelligence_words(doc_result), "document_intelligence",
+                                                 tables=document_intelligence_tables(doc_result))
+
         # Save result to cache for future use
-        save_to_cache(input_file, processing_method, parsed_result)
+        save_to_cache(input_file, processing_method, cached_result)
         
         return parsed_result
     finally:
@@ -1153,18 +958,41 @@ def process_invoice_directory(doc_intelligence_endpoint: str,
                 deployment_name,
                 input_path
             )
+            data = serialize_model(result)
+            
+            # Invoices whose arithmetic does not add up are re-extracted with the retry method
+            report = validate_invoice(data)
+            action = decide_action(report)
+            attempt = 0
+            while action == "retry":
+                attempt += 1
+                print(f"Validation failed for {filename}, retrying with {VALIDATION_RETRY_METHOD}")
+                retry_result = analyze_and_parse_invoice(
+                    doc_intelligence_endpoint,
+                    doc_intelligence_key,
+                    openai_endpoint,
+                    openai_key,
+                    deployment_name,
+                    input_path,
+                    processing_method=VALIDATION_RETRY_METHOD
+                )
+                retry_data = serialize_model(retry_result)
+                retry_report = validate_invoice(retry_data)
+                if len(retry_report['issues']) < len(report['issues']):
+                    data, report = retry_data, retry_report
+                action = decide_action(report, attempt)
             
             # Save individual result
-            print(f"Result: {result.model_dump()}")
             output_filename = f"{os.path.splitext(filename)[0]}_parsed.json"
             output_path = os.path.join(output_dir, output_filename)
             with open(output_path, 'w') as f:
-                json.dump(result.model_dump(), f, indent=2)
+                json.dump(data, f, indent=2)
             
             results.append({
                 'filename': filename,
-                'status': 'success',
-                'data': result.model_dump()
+                'status': 'success' if action == 'accept' else 'needs_review',
+                'validation': report,
+                'data': data
             })
             
         except Exception as e:
@@ -1179,6 +1007,7 @@ def process_invoice_directory(doc_intelligence_endpoint: str,
     summary = {
         'total_processed': len(invoice_files),
         'successful': len([r for r in results if r['status'] == 'success']),
+        'needs_review': len([r for r in results if r['status'] == 'needs_review']),
         'failed': len([r for r in results if r['status'] == 'error']),
         'results': results
     }
@@ -1201,19 +1030,45 @@ DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME", "gpt-4o")
 PHI_DI_ENDPOINT = os.getenv("PHI_DI_ENDPOINT")
 PHI_DI_KEY = os.getenv("PHI_DI_KEY")
 
+# Method used to re-extract invoices that fail arithmetic validation
+VALIDATION_RETRY_METHOD = os.getenv("VALIDATION_RETRY_METHOD", "textract_claude")
+
 # Add processing method options
 PROCESSING_METHODS = [
     "bedrock_claude_sonnet",  # Amazon Bedrock Claude Sonnet
     "bedrock_data_automation",  # Amazon Bedrock Data Automation
-    "textract_claude"  # Amazon Textract + Claude
+    "textract_claude",  # Amazon Textract + Claude
+    "local_ocr"  # Tesseract on this machine + vendor templates or an LLM
 ]
 
+# Method used for documents submitted through the bulk upload endpoint
+BULK_PROCESSING_METHOD = os.getenv("BULK_PROCESSING_METHOD", "bedrock_claude_sonnet")
+# Request size limit for bulk uploads (single uploads keep MAX_CONTENT_LENGTH)
+BULK_MAX_CONTENT_LENGTH = int(os.getenv("BULK_MAX_CONTENT_LENGTH", str(2 * 1024 * 1024 * 1024)))
+
+class UploadRequest(Request):
+    """Request that spools uploaded files into the upload folder, hashing them as they stream in"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = HashingSpool(app.config['UPLOAD_FOLDER'])
+        self.__dict__.setdefault('spools', []).append(spool)
+        return spool
+
 # Flask application configuration
 app = Flask(__name__, static_folder='static')
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.request_class = UploadRequest
+# Set SECRET_KEY when running several workers so flashed messages survive across them
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or os.urandom(24)
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 
+@app.teardown_request
+def discard_unused_spools(exc=None):
+    """Remove spooled upload parts that a view did not store"""
+    for spool in request.__dict__.get('spools', []):
+        if not spool.done:
+            spool.discard()
+
 # Add custom filter to extract filename from path
 @app.template_filter('basename')
 def basename_filter(path):
@@ -1238,110 +1093,188 @@ def urlencode_filter(s):
 def tojson_filter(obj, indent=None):
     if obj is None:
         return json.dumps(None, indent=indent)
+    # Rendered results carry the JSON text produced at cache-write time
+    if isinstance(obj, (RenderedResult, ResultView)):
+        return obj.json_text
     try:
         serialized = serialize_model(obj) if hasattr(obj, 'dict') or hasattr(obj, 'model_dump') else obj
         return json.dumps(serialized, indent=indent, default=str)
     except Exception as e:
         return json.dumps({'error': str(e)}, indent=indent)
 
-# Helper class to emulate a Pydantic model but as a dotted dict
-class DotDict:
-    def __init__(self, data):
-        self.__dict__.update(data)
-        
+# Claude results name the line items 'line_items', the other methods 'items'; a
+# result stores one of the two and templates may read it under either name
+_KEY_ALIASES = {'line_items': 'items', 'items': 'line_items'}
+
+# Lightweight read-only accessor over the plain result dict for templates.
+# Nested dicts and lists are wrapped lazily on access, so rendering a result
+# never rebuilds the whole object graph.
+class ResultView:
+    __slots__ = ('_data', '_json_text')
+
+    def __init__(self, data, json_text=None):
+        self._data = data if isinstance(data, dict) else {}
+        self._json_text = json_text
+
+    def _key(self, key):
+        if key not in self._data and _KEY_ALIASES.get(key) in self._data:
+            return _KEY_ALIASES[key]
+        return key
+
     def __getattr__(self, name):
-        return self.__dict__.get(name)
-    
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _wrap_value(self._data.get(self._key(name)))
+
+    def __getitem__(self, key):
+        return _wrap_value(self._data.get(self._key(key)))
+
+    @property
+    def json_text(self):
+        if self._json_text is None:
+            self._json_text = json.dumps(self._data, indent=2, default=str)
+        return self._json_text
+
     def keys(self):
-        return self.__dict__.keys()
-    
+        return self._data.keys()
+
     def get(self, key, default=None):
-        return self.__dict__.get(key, default)
-    
+        return _wrap_value(self._data.get(self._key(key), default))
+
     # Add special methods to make Jinja2 template interactions better
     def __iter__(self):
-        return iter(self.__dict__)
-    
+        return iter(self._data)
+
     def __contains__(self, key):
-        return key in self.__dict__
-        
+        return self._key(key) in self._data
+
     def __bool__(self):
-        return bool(self.__dict__)
-        
-# Helper function to convert Pydantic models to DotDict or dict for JSON serialization
+        return bool(self._data)
+
+    def __repr__(self):
+        return f"ResultView({self._data!r})"
+
+class _ListView:
+    """Sequence wrapper that wraps dict elements only when they are accessed"""
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __getitem__(self, index):
+        return _wrap_value(self._items[index])
+
+    def __iter__(self):
+        return (_wrap_value(item) for item in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return f"_ListView({self._items!r})"
+
+def _wrap_value(value):
+    if isinstance(value, dict):
+        return ResultView(value)
+    if isinstance(value, list):
+        return _ListView(value)
+    return value
+
+class RenderedResult:
+    """A cached result in render-ready form: the plain dict plus the exact JSON
+    text that was written to the cache file, so it is never re-serialized."""
+    __slots__ = ('data', 'json_bytes')
+
+    def __init__(self, data, json_bytes):
+        self.data = data
+        self.json_bytes = json_bytes
+
+    @classmethod
+    def from_bytes(cls, json_bytes):
+        data = json.loads(json_bytes)
+        if not isinstance(data, dict):
+            data = {'text': data}
+        return cls(data, json_bytes)
+
+    @property
+    def json_text(self):
+        return self.json_bytes.decode('utf-8')
+
+    def view(self, overrides=None):
+        """Return a template accessor, optionally with top-level fields overridden"""
+        if not overrides:
+            return ResultView(self.data, self.json_text)
+        # The stored JSON no longer matches, so the view serializes itself when asked
+        return ResultView(dict(self.data, **overrides))
+
+# Helper function to convert a result into a plain, render-ready dict in a single pass
 def serialize_model(obj):
     # Handle None case explicitly
     if obj is None:
         return None
-    
-    # Lists - process each item
-    if isinstance(obj, list):
-        return [serialize_model(item) for item in obj]
-    
-    # Dictionaries - process each value
-    if isinstance(obj, dict):
-        return {k: serialize_model(v) for k, v in obj.items()}
-    
-    # Handle Pydantic models
-    data = None
+
     if hasattr(obj, 'model_dump') and callable(obj.model_dump):
-        try:
-            data = obj.model_dump()
-        except Exception:
-            # If model_dump fails, try the next method
-            pass
-    
-    if data is None and hasattr(obj, 'dict') and callable(obj.dict):
-        try:
-            data = obj.dict()
-        except Exception:
-            # If dict fails, use __dict__ as fallback
-            pass
-    
-    # If it's not a Pydantic model or dict/list extraction failed
-    if data is None:
-        # Try to get __dict__ if available, otherwise return the object as is
-        if hasattr(obj, '__dict__'):
-            data = obj.__dict__
-        else:
-            return obj
-    
-    # Process dictionary data
-    if isinstance(data, dict):
-        # Handle special keys to avoid conflict with dict methods
-        if 'items' in data:
-            data['line_items'] = data['items']
-        
-        # Ensure tax_amount is available as a field for backwards compatibility
-        if 'total_tax_amount' in data and 'tax_amount' not in data:
-            data['tax_amount'] = data['total_tax_amount']
-        
-        # For JSON serialization, we can return a regular dict
-        return {k: serialize_model(v) for k, v in data.items()}
-    
+        # mode='json' yields JSON-compatible primitives all the way down
+        data = obj.model_dump(mode='json', exclude_none=True)
+    elif isinstance(obj, dict):
+        # Shallow copy: the keys added here and by save_to_cache stay out of the caller's dict
+        data = dict(obj)
+    elif isinstance(obj, list):
+        return [serialize_model(item) for item in obj]
+    else:
+        return {'text': str(obj)}
+
+    # Ensure tax_amount is available as a field for backwards compatibility
+    if 'total_tax_amount' in data and 'tax_amount' not in data:
+        data['tax_amount'] = data['total_tax_amount']
+
     return data
 
-# Convert dictionary to DotDict for attribute access
-def to_dot_dict(data):
-    if data is None:
+def infer_tax_details(data):
+    """Build an IGST tax detail from other fields when the extraction has none"""
+    if data.get('tax_details'):
         return None
-    
-    if isinstance(data, list):
-        return [to_dot_dict(item) for item in data]
-    
-    if not isinstance(data, dict):
-        return data
-    
-    dot_dict = DotDict(data)
-    
-    # Convert nested dictionaries
-    for key, value in data.items():
-        if isinstance(value, dict):
-            dot_dict.__dict__[key] = to_dot_dict(value)
-        elif isinstance(value, list):
-            dot_dict.__dict__[key] = [to_dot_dict(item) if isinstance(item, (dict, list)) else item for item in value]
-    
-    return dot_dict
+
+    # If IGST is mentioned in the amount in words or we have a tax amount but no tax details
+    has_igst_reference = False
+    if data.get('amount_in_words') and 'IGST' in data['amount_in_words']:
+        has_igst_reference = True
+    elif data.get('tax_amount'):
+        has_igst_reference = True
+
+    # Check for IGST elsewhere in the invoice data
+    if not has_igst_reference:
+        for key in ['notes', 'payment_terms']:
+            if data.get(key) and 'IGST' in str(data.get(key)):
+                has_igst_reference = True
+                break
+
+    if not has_igst_reference:
+        return []
+
+    tax_rate = None
+    # Try to find percentages in various fields
+    percentage_sources = [data[key] for key in ('amount_in_words', 'notes', 'payment_terms')
+                          if isinstance(data.get(key), str) and data.get(key)]
+    for source in percentage_sources:
+        # Try both IGST specific percentage and any percentage
+        igst_match = re.search(r'IGST\s*\(?(\d+(\.\d+)?)\%?\)?', source)
+        if igst_match:
+            tax_rate = float(igst_match.group(1))
+            break
+
+        # If no IGST specific percentage, look for any percentage
+        percentage_match = re.search(r'(\d+(\.\d+)?)\s*\%', source)
+        if percentage_match:
+            tax_rate = float(percentage_match.group(1))
+            break
+
+    tax_amount = data.get('tax_amount') or data.get('total_tax_amount')
+
+    # Create a tax detail if we have either rate or amount
+    if tax_rate or tax_amount:
+        return [{'tax_type': 'IGST', 'rate': tax_rate, 'amount': tax_amount}]
+    return []
 
 # Create necessary directories if they don't exist
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -1352,6 +1285,25 @@ CACHE_DIR = os.path.join(app.config['UPLOAD_FOLDER'], 'cache')
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
+# Textract blocks per document page, keyed by content hash (see textract_analysis.py)
+TEXTRACT_CACHE_DIR = os.path.join(CACHE_DIR, 'textract')
+
+# BDA and Document Intelligence output per document, reused when results are re-extracted (see layouts.py)
+LAYOUTS = LayoutStore(os.path.join(CACHE_DIR, 'layout'))
+
+# Layouts of recurring sellers, learned from validated extractions (see vendor_templates.py)
+VENDOR_TEMPLATES = VendorTemplates(os.path.join(app.config['UPLOAD_FOLDER'], 'vendor_templates'))
+
+# Page hashes and field fingerprints of processed documents (kept outside the cache
+# directory so clearing the cache does not forget documents already seen)
+DUPLICATE_INDEX = DuplicateIndex(os.path.join(app.config['UPLOAD_FOLDER'], 'duplicates.jsonl'))
+
+# SHA-256 of every uploaded document, used to drop exact re-uploads before they are stored
+CONTENT_HASH_INDEX = ContentHashIndex(os.path.join(app.config['UPLOAD_FOLDER'], 'content_hashes.jsonl'))
+
+# Parquet tables of every extracted invoice for analytics (see result_store.py)
+RESULT_STORE = open_store(os.getenv('RESULT_STORE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'store')))
+
 # Cache functions for storing and retrieving processed results
 def get_cache_key(file_path, processing_method):
     """Generate a unique cache key based on file path and processing method"""
@@ -1369,6 +1321,7 @@ def clear_cache(file_path=None):
             cache_file = os.path.join(CACHE_DIR, f"{cache_key}.json")
             if os.path.exists(cache_file):
                 os.remove(cache_file)
+                _rendered_results.pop(cache_key, None)
                 print(f"Cleared cache for {os.path.basename(file_path)} with {method}")
     else:
         # Clear all cache files
@@ -1376,8 +1329,82 @@ def clear_cache(file_path=None):
             for cache_file in os.listdir(CACHE_DIR):
                 if cache_file.endswith('.json'):
                     os.remove(os.path.join(CACHE_DIR, cache_file))
+            _rendered_results.clear()
             print("Cleared all cache files")
 
+def document_id(file_path):
+    """Identifier for a document in the indexes kept alongside the cache"""
+    import hashlib
+    return hashlib.md5(file_path.encode()).hexdigest()
+
+def find_duplicate_before_extraction(file_path, processing_method):
+    """Result of an earlier document with identical content, to reuse instead of extracting.
+
+    Only with DUPLICATE_POLICY 'reuse', and only when that document has a result
+    of the current schema and prompts cached for this method. Looks up the content
+    digest, so nothing is rendered; documents whose pages only look alike are
+    extracted and flagged (see index_page_hash).
+    """
+    if DUPLICATE_POLICY != "reuse":
+        return None
+    try:
+        digest = content_digest(file_path)
+        original = CONTENT_HASH_INDEX.get(digest)
+        if original is None or original == file_path or content_digest(original) != digest:
+            return None
+    except OSError as e:
+        print(f"Error hashing {os.path.basename(file_path)} for duplicate detection: {e}")
+        return None
+    rendered = get_rendered_result(original, processing_method)
+    # Results of an older schema or prompt would be stamped as current when copied
+    if rendered is None or not is_current_result(rendered.data):
+        return None
+    print(f"{os.path.basename(file_path)} has the same content as {os.path.basename(original)}, reusing its result")
+    result = dict(rendered.data, duplicate_of=original)
+    save_to_cache(file_path, processing_method, result)
+    return result
+
+def index_page_hash(file_path):
+    """Hash the first page into the duplicate index and report near-duplicates.
+
+    Renders the page, so it runs only for documents that are rasterized anyway;
+    find_duplicates_after_extraction flags the matches on the result.
+    """
+    doc_id = document_id(file_path)
+    try:
+        file_mtime = os.path.getmtime(file_path)
+        entry = DUPLICATE_INDEX.get(doc_id)
+        if entry and entry.get("phash") and entry.get("mtime") == file_mtime:
+            phash = int(entry["phash"], 16)
+        else:
+            phash = document_hash(file_path)
+            if phash is None:
+                return
+            DUPLICATE_INDEX.add(doc_id, file_path, phash=phash, mtime=file_mtime)
+    except Exception as e:
+        print(f"Error hashing {os.path.basename(file_path)} for duplicate detection: {e}")
+        return
+    matches = DUPLICATE_INDEX.find_similar(phash, exclude=doc_id)
+    if matches:
+        print(f"{os.path.basename(file_path)} looks like a duplicate of {os.path.basename(matches[0]['path'])} (distance {matches[0]['distance']})")
+
+def find_duplicates_after_extraction(file_path, data):
+    """Look up documents with the same page hash or the same extracted key fields"""
+    doc_id = document_id(file_path)
+    duplicates = {"image": [], "fields": []}
+    entry = DUPLICATE_INDEX.get(doc_id)
+    if entry and entry.get("phash"):
+        duplicates["image"] = [match["path"] for match in DUPLICATE_INDEX.find_similar(int(entry["phash"], 16), exclude=doc_id)]
+    fingerprint = field_fingerprint(data)
+    if fingerprint:
+        duplicates["fields"] = [match["path"] for match in DUPLICATE_INDEX.find_by_fingerprint(fingerprint, exclude=doc_id)]
+        DUPLICATE_INDEX.add(doc_id, file_path, fingerprint=fingerprint)
+    return duplicates
+
+def is_current_result(data):
+    """Whether a cached result was extracted with the current schema and prompts"""
+    return isinstance(data, dict) and data.get('versions') == EXTRACTION_VERSIONS
+
 def get_cached_result(file_path, processing_method):
     """Get cached result if it exists"""
     cache_key = get_cache_key(file_path, processing_method)
@@ -1393,59 +1420,255 @@ def get_cached_result(file_path, processing_method):
             if file_mtime > cache_mtime:
                 return None
                 
-            with open(cache_file, 'r') as f:
-                cached_data = json.load(f)
+            rendered = get_rendered_result(file_path, processing_method)
+            if rendered is None:
+                return None
             print(f"Using cached result for {os.path.basename(file_path)} with {processing_method}")
-            return Invoice.model_validate(cached_data)
+            return Invoice.model_validate(rendered.data)
         except Exception as e:
             print(f"Error loading cache: {e}")
             return None
     return None
 
 def save_to_cache(file_path, processing_method, result):
-    """Save processed result to cache"""
+    """Save processed result to cache in render-ready form"""
     cache_key = get_cache_key(file_path, processing_method)
     cache_file = os.path.join(CACHE_DIR, f"{cache_key}.json")
     
     try:
-        with open(cache_file, 'w') as f:
-            # Support both Pydantic models and dicts for caching
-            if hasattr(result, 'model_dump'):
-                json.dump(result.model_dump(exclude_none=True), f, indent=2)
-            elif isinstance(result, dict):
-                json.dump(result, f, indent=2)
+        data = serialize_model(result)
+        if isinstance(data, dict):
+            # The schema and prompts the result was extracted with (see migrate.py)
+            data['versions'] = dict(EXTRACTION_VERSIONS)
+            # Tokens, pages and cost of the provider calls behind this result (see usage.py);
+            # results saved outside an extraction, such as reused duplicates, cost nothing
+            usage = usage_summary()
+            if usage is not None:
+                data['usage'] = usage
             else:
-                json.dump(str(result), f, indent=2)
+                data.pop('usage', None)
+        # Arithmetic checks travel with the result so retries and reviews can use them
+        if isinstance(data, dict) and 'error' not in data:
+            with stage("validate"):
+                data['validation'] = validate_invoice(data)
+                data['identifiers'] = check_identifiers(data)
+                data['duplicates'] = find_duplicates_after_extraction(file_path, data)
+        # Serialize exactly once; the same bytes are stored and served
+        with stage("cache_write"):
+            json_bytes = json.dumps(data, indent=2, default=str).encode('utf-8')
+            with open(cache_file, 'wb') as f:
+                f.write(json_bytes)
+        cache_mtime = os.path.getmtime(cache_file)
+        _rendered_results[cache_key] = (cache_mtime, RenderedResult(data, json_bytes))
         print(f"Saved result to cache for {os.path.basename(file_path)} with {processing_method}")
     except Exception as e:
         print(f"Error saving to cache: {e}")
-        
-def create_thumbnail(file_path):
-    """Create a thumbnail for PDF files"""
+        return
+
+    # Failed extractions are stored too, for their usage; they add no invoice rows
+    if RESULT_STORE is not None and isinstance(data, dict):
+        try:
+            with stage("store_append"):
+                RESULT_STORE.add(data, content_digest(file_path), os.path.basename(file_path),
+                                 processing_method, format_timestamp(cache_mtime))
+        except Exception as e:
+            print(f"Error adding result to the columnar store: {e}")
+
+# In-process copies of cached results, keyed by cache key and validated by cache file mtime
+_rendered_results = {}
+
+def get_rendered_result(file_path, processing_method):
+    """Get the render-ready cached result, or None if the file has no valid cache entry"""
+    cache_key = get_cache_key(file_path, processing_method)
+    cache_file = os.path.join(CACHE_DIR, f"{cache_key}.json")
     try:
-        # Create thumbnails directory if it doesn't exist
-        thumbnails_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails')
-        if not os.path.exists(thumbnails_dir):
-            os.makedirs(thumbnails_dir)
-            
-        # Generate thumbnail name
-        filename = os.path.basename(file_path)
-        thumbnail_path = os.path.join(thumbnails_dir, f"{os.path.splitext(filename)[0]}_thumbnail.jpg")
-        
-        # Only create thumbnail if it doesn't exist
-        if not os.path.exists(thumbnail_path):
-            # Convert first page of PDF to image
-            images = convert_from_path(file_path, first_page=1, last_page=1, dpi=72)
-            if images:
-                # Save the first page as thumbnail
-                images[0].save(thumbnail_path, 'JPEG')
-                print(f"Created thumbnail for {filename}")
-                
-        return thumbnail_path
-    except Exception as e:
-        print(f"Error creating thumbnail: {e}")
+        cache_mtime = os.path.getmtime(cache_file)
+        if os.path.getmtime(file_path) > cache_mtime:
+            return None
+    except OSError:
         return None
 
+    entry = _rendered_results.get(cache_key)
+    if entry and entry[0] == cache_mtime:
+        return entry[1]
+
+    try:
+        with open(cache_file, 'rb') as f:
+            rendered = RenderedResult.from_bytes(f.read())
+    except Exception as e:
+        print(f"Error loading cache: {e}")
+        return None
+    _rendered_results[cache_key] = (cache_mtime, rendered)
+    return rendered
+
+def analyze_to_rendered_result(file_path, processing_method):
+    """Run (or reuse) the extraction and return its render-ready cached form"""
+    rendered = get_rendered_result(file_path, processing_method)
+    if rendered is not None:
+        return rendered
+
+    result = analyze_and_parse_invoice(
+        doc_intelligence_endpoint=DOC_INTELLIGENCE_ENDPOINT,
+        doc_intelligence_key=DOC_INTELLIGENCE_KEY,
+        openai_endpoint=OPENAI_ENDPOINT,
+        openai_key=OPENAI_KEY,
+        deployment_name=DEPLOYMENT_NAME,
+        input_file=file_path,
+        processing_method=processing_method
+    )
+    rendered = get_rendered_result(file_path, processing_method)
+    if rendered is None:
+        # Results that were not cached (e.g. provider errors) are rendered directly
+        data = serialize_model(result)
+        rendered = RenderedResult(data, json.dumps(data, indent=2, default=str).encode('utf-8'))
+    return rendered
+
+# Stage events of running extractions and timings of finished ones (see progress.py)
+PROGRESS = ProgressLog(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+
+def iter_cached_results(since=None, methods=None):
+    """Cached results of stored documents, oldest first, in the form export.py flattens.
+
+    ``since`` (ISO text) skips results written at or before that time. Results are
+    read one at a time, so exports of any size run in bounded memory.
+    """
+    since = format_timestamp(parse_timestamp(since)) if since else None
+    entries = []
+    for digest, path in CONTENT_HASH_INDEX.entries():
+        for method in methods or list(METHOD_SDKS):
+            cache_file = os.path.join(CACHE_DIR, f"{get_cache_key(path, method)}.json")
+            try:
+                cache_mtime = os.path.getmtime(cache_file)
+                if os.path.getmtime(path) > cache_mtime:
+                    continue  # stale: the document changed after extraction
+            except OSError:
+                continue
+            extracted_at = format_timestamp(cache_mtime)
+            if since is None or extracted_at > since:
+                entries.append((extracted_at, digest, path, method, cache_file))
+    entries.sort()
+    for extracted_at, digest, path, method, cache_file in entries:
+        try:
+            with open(cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading cached result {cache_file}: {e}")
+            continue
+        yield {'data': data, 'document_sha256': digest, 'file': os.path.basename(path),
+               'processing_method': method, 'extracted_at': extracted_at}
+
+def stale_results(methods=None):
+    """(path, processing_method, versions) of cached results extracted with another schema or prompt version"""
+    for digest, path in CONTENT_HASH_INDEX.entries():
+        for method in methods or list(METHOD_SDKS):
+            cache_file = os.path.join(CACHE_DIR, f"{get_cache_key(path, method)}.json")
+            try:
+                if os.path.getmtime(path) > os.path.getmtime(cache_file):
+                    continue  # stale anyway: the next request extracts it again
+                with open(cache_file, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not is_current_result(data):
+                yield path, method, data.get('versions') if isinstance(data, dict) else None
+
+def reextract(file_path, processing_method):
+    """Re-run the extraction of a stored document on its stored OCR/layout output"""
+    with PROGRESS.job(new_job_id(), file_path, processing_method):
+        result = analyze_and_parse_invoice(
+            doc_intelligence_endpoint=DOC_INTELLIGENCE_ENDPOINT,
+            doc_intelligence_key=DOC_INTELLIGENCE_KEY,
+            openai_endpoint=OPENAI_ENDPOINT,
+            openai_key=OPENAI_KEY,
+            deployment_name=DEPLOYMENT_NAME,
+            input_file=file_path,
+            processing_method=processing_method,
+            refresh=True
+        )
+    # A failed run can leave the old result cached, so its errors come from the fresh result
+    data = serialize_model(result)
+    if not isinstance(data, dict) or 'error' in data:
+        return RenderedResult.from_bytes(json.dumps(data, indent=2, default=str).encode('utf-8'))
+    # The cached copy carries the versions it was saved with (see is_current_result)
+    return get_rendered_result(file_path, processing_method)
+
+def extract_in_background(file_path, processing_method):
+    """Queue handler: extract a stored upload and cache the result"""
+    with PROGRESS.job(new_job_id(), file_path, processing_method):
+        analyze_to_rendered_result(file_path, processing_method)
+    print(f"Background extraction finished for {os.path.basename(file_path)} with {processing_method}")
+
+# Documents accepted by the bulk upload endpoint wait here for extraction
+EXTRACTION_QUEUE = ExtractionQueue(extract_in_background)
+# Seconds a client turned away by a full extraction queue is asked to wait
+EXTRACTION_RETRY_AFTER = int(os.getenv("EXTRACTION_RETRY_AFTER", "30"))
+
+def queue_full_response(response):
+    """Turn a response into a 503 with Retry-After: requests never wait for room in the queue"""
+    response.status_code = 503
+    response.headers['Retry-After'] = str(EXTRACTION_RETRY_AFTER)
+    return response
+
+# Thumbnails and page previews, keyed by content hash (see previews.py)
+PREVIEWS = PreviewStore(os.path.join(app.config['UPLOAD_FOLDER'], 'previews'))
+
+@functools.lru_cache(maxsize=4096)
+def _file_digest(file_path, mtime_ns, size):
+    return file_sha256(file_path)
+
+def content_digest(file_path):
+    """SHA-256 of a document, hashed once per version of the file (its mtime and size).
+
+    Only ingestion records digests in CONTENT_HASH_INDEX; this never does.
+    """
+    stat = os.stat(file_path)
+    return _file_digest(file_path, stat.st_mtime_ns, stat.st_size)
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff')
+
+def stored_document(file_path):
+    """``file_path`` if it names a stored document, else None.
+
+    Routes take document paths from the request, so only uploads (files at the
+    top of the upload folder) and documents recorded at ingestion, such as inbox
+    files, are read, never any other file on the server.
+    """
+    if not file_path or not os.path.isfile(file_path):
+        return None
+    upload_folder = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    if (os.path.dirname(os.path.realpath(file_path)) == upload_folder
+            and file_path.lower().endswith(DOCUMENT_EXTENSIONS)):
+        return file_path
+    return file_path if CONTENT_HASH_INDEX.digest_of(file_path) is not None else None
+
+def schedule_previews(file_path, digest=None):
+    """Render a document's thumbnail and page previews in the background"""
+    try:
+        PREVIEWS.schedule(file_path, digest or content_digest(file_path))
+    except Exception as e:
+        print(f"Error scheduling previews for {os.path.basename(file_path)}: {e}")
+
+@app.template_global()
+def page_previews(file_path):
+    """URLs of a document's rendered pages, or None while they are not ready"""
+    digest = CONTENT_HASH_INDEX.digest_of(file_path)
+    manifest = PREVIEWS.manifest(digest) if digest else None
+    if manifest is None:
+        if os.path.exists(file_path):
+            schedule_previews(file_path, digest)
+        return None
+    return [url_for('preview_file', digest=digest, name=name) for name in manifest['files']]
+
+def send_cached_file(file_path, etag, max_age, immutable=False, **kwargs):
+    """send_file with a strong ETag and Cache-Control; answers conditional and range requests"""
+    response = send_file(file_path, etag=etag, conditional=True, max_age=max_age, **kwargs)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        # Paths can be overwritten by a new upload, so check back before reusing
+        response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/')
@@ -1509,7 +1732,15 @@ def upload_file():
     if file and file.filename.lower().endswith('.pdf'):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        if isinstance(file.stream, HashingSpool):
+            # The upload is already on disk and hashed; move it into place
+            file.stream.commit(filepath)
+            CONTENT_HASH_INDEX.claim(file.stream.hexdigest(), filepath)
+            schedule_previews(filepath, file.stream.hexdigest())
+        else:
+            file.save(filepath)
+            CONTENT_HASH_INDEX.claim(file_sha256(filepath), filepath)
+            schedule_previews(filepath)
         
         # Update the uploaded files list with the new file
         uploaded_files = [{
@@ -1525,6 +1756,69 @@ def upload_file():
         flash('Invalid file type. Please upload a PDF file.')
         return render_template('index.html', uploaded_file_path=None, uploaded_files=uploaded_files)
 
+@app.route('/upload/bulk', methods=['POST'])
+def bulk_upload():
+    """Store many PDFs (or ZIP archives of PDFs) and queue the new ones for extraction.
+
+    Each file is streamed to disk and hashed in one pass; files whose content was
+    uploaded before are reported as duplicates and not stored again.
+    """
+    request.max_content_length = BULK_MAX_CONTENT_LENGTH
+    processing_method = request.form.get('processing_method', BULK_PROCESSING_METHOD)
+    if processing_method not in PROCESSING_METHODS:
+        return jsonify({'error': f'Unknown processing method: {processing_method}'}), 400
+
+    files = request.files.getlist('files') or request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    summary = {'queued': [], 'duplicates': [], 'rejected': [], 'processing_method': processing_method}
+
+    def store(name, spool):
+        filename = secure_filename(name)
+        if not filename.lower().endswith('.pdf'):
+            spool.discard()
+            summary['rejected'].append({'file': name, 'reason': 'not a PDF'})
+            return
+        path, duplicate_of = store_spool(spool, filename, upload_folder, CONTENT_HASH_INDEX)
+        if duplicate_of:
+            summary['duplicates'].append({'file': name, 'duplicate_of': duplicate_of})
+            return
+        try:
+            EXTRACTION_QUEUE.submit(path, processing_method, block=False)
+        except queue.Full:
+            # Removed again, so the same file is stored and queued when it is sent again
+            os.remove(path)
+            summary['rejected'].append({'file': name, 'reason': 'extraction queue full'})
+            return
+        schedule_previews(path, spool.hexdigest())
+        summary['queued'].append({'file': name, 'path': path, 'sha256': spool.hexdigest(), 'size': spool.size})
+
+    for file in files:
+        spool = file.stream
+        if not file.filename or not isinstance(spool, HashingSpool):
+            continue
+        if file.filename.lower().endswith('.zip'):
+            try:
+                spool.flush()
+                for member_name, member_spool in iter_zip_spools(spool.name, upload_folder):
+                    store(member_name, member_spool)
+            except zipfile.BadZipFile:
+                summary['rejected'].append({'file': file.filename, 'reason': 'invalid ZIP archive'})
+            except ArchiveTooLargeError as e:
+                summary['rejected'].append({'file': file.filename, 'reason': f'ZIP archive too large: {e}'})
+            finally:
+                spool.discard()
+        else:
+            store(file.filename, spool)
+
+    summary['pending'] = EXTRACTION_QUEUE.pending()
+    if any(entry['reason'] == 'extraction queue full' for entry in summary['rejected']):
+        # What was queued is listed; the rest can be sent again later
+        return queue_full_response(jsonify(summary))
+    return jsonify(summary), 202 if summary['queued'] else 200
+
 @app.route('/analyze', methods=['POST'])
 def analyze_file():
     """Step 2: Process the already uploaded file"""
@@ -1550,7 +1844,7 @@ def analyze_file():
     # Sort files by date (newest first)
     uploaded_files.sort(key=lambda x: x['date'], reverse=True)
     
-    if not file_path or not os.path.exists(file_path):
+    if not stored_document(file_path):
         flash('File not found. Please upload a file first.')
         return render_template('index.html', uploaded_file_path=None, uploaded_files=uploaded_files)
     
@@ -1561,100 +1855,27 @@ def analyze_file():
     if not processing_method:
         flash('Please select a processing method before running analysis.')
         return render_template('index.html', uploaded_file_path=file_path, uploaded_files=uploaded_files)
+    # The page opens /progress/<job_id> before submitting, to follow the stages as they run
+    job_id = request.form.get('job_id')
+    if not valid_job_id(job_id):
+        job_id = new_job_id()
     try:
-        result = analyze_and_parse_invoice(
-            doc_intelligence_endpoint=DOC_INTELLIGENCE_ENDPOINT,
-            doc_intelligence_key=DOC_INTELLIGENCE_KEY,
-            openai_endpoint=OPENAI_ENDPOINT,
-            openai_key=OPENAI_KEY,
-            deployment_name=DEPLOYMENT_NAME,
-            input_file=file_path,
-            processing_method=processing_method
-        )
-        # Create a serialized version for JSON display
-        json_result = serialize_model(result)
-        
-        # Create a DotDict version for template attribute access
-        result_dict = to_dot_dict(json_result)
+        with PROGRESS.job(job_id, file_path, processing_method):
+            rendered = analyze_to_rendered_result(file_path, processing_method)
         
         # Add tax details if not present but we can detect them from other fields
-        import re
-        if not result_dict.tax_details or len(result_dict.tax_details) == 0:
-            # If IGST is mentioned in the amount in words or we have a tax amount but no tax details
-            has_igst_reference = False
-            if result_dict.amount_in_words and 'IGST' in result_dict.amount_in_words:
-                has_igst_reference = True
-            elif result_dict.tax_amount and not result_dict.tax_details:
-                has_igst_reference = True
-                
-            # Check for IGST elsewhere in the invoice data
-            if not has_igst_reference:
-                # Search in other text fields
-                for key in ['notes', 'payment_terms']:
-                    if hasattr(result_dict, key) and result_dict.get(key) and 'IGST' in str(result_dict.get(key)):
-                        has_igst_reference = True
-                        break
-                        
-            if has_igst_reference:
-                tax_rate = None
-                tax_amount = None
-                
-                # Try to extract tax rate from the template output
-                # Try to find percentages in various fields
-                percentage_sources = []
-                if hasattr(result_dict, 'amount_in_words') and result_dict.amount_in_words:
-                    percentage_sources.append(result_dict.amount_in_words)
-                if hasattr(result_dict, 'notes') and result_dict.notes:
-                    percentage_sources.append(result_dict.notes)
-                if hasattr(result_dict, 'payment_terms') and result_dict.payment_terms:
-                    percentage_sources.append(result_dict.payment_terms)
-                    
-                for source in percentage_sources:
-                    # Try both IGST specific percentage and any percentage
-                    igst_match = re.search(r'IGST\s*\(?(\d+(\.\d+)?)\%?\)?', source)
-                    if igst_match:
-                        tax_rate = float(igst_match.group(1))
-                        break
-                    
-                    # If no IGST specific percentage, look for any percentage
-                    percentage_match = re.search(r'(\d+(\.\d+)?)\s*\%', source)
-                    if percentage_match:
-                        tax_rate = float(percentage_match.group(1))
-                        break
-                
-                # If we have a tax amount but no tax details
-                if hasattr(result_dict, 'tax_amount') and result_dict.tax_amount:
-                    tax_amount = result_dict.tax_amount
-                elif hasattr(result_dict, 'total_tax_amount') and result_dict.total_tax_amount:
-                    tax_amount = result_dict.total_tax_amount
-                
-                # Create a tax detail object if we have either rate or amount
-                if tax_rate or tax_amount:
-                    result_dict.tax_details = [DotDict({
-                        'tax_type': 'IGST',
-                        'rate': tax_rate,
-                        'amount': tax_amount
-                    })]
-        
-        # Do not include any model definitions in the template context
-        # Only pass the actual data needed for rendering
-        # Ensure tax_details is always a list even if it's None
-        if result_dict is not None:
-            # Convert to regular dict if it's a DotDict
-            if isinstance(result_dict, DotDict):
-                # If it's a DotDict, check and set tax_details in __dict__
-                if result_dict.get('tax_details') is None:
-                    result_dict.__dict__['tax_details'] = []
-            elif isinstance(result_dict, dict) and result_dict.get('tax_details') is None:
-                # Regular dictionary case
-                result_dict['tax_details'] = []
+        overrides = None
+        inferred_tax_details = infer_tax_details(rendered.data)
+        if inferred_tax_details is not None:
+            overrides = {'tax_details': inferred_tax_details}
+        result_dict = rendered.view(overrides)
         
-        print(f"Parsed result: {result_dict}")
+        print(f"Rendered result for {os.path.basename(file_path)} with {processing_method}")
         # Calculate processing time in seconds
         processing_time = time.time() - start_time
         return render_template('index.html', 
                             result=result_dict,
-                            json_result=json_result, 
+                            json_result=rendered, 
                             uploaded_file_path=file_path, 
                             debug_mode=False, 
                             uploaded_files=uploaded_files, 
@@ -1682,7 +1903,7 @@ def analyze_file():
 def view_document():
     """View a document without analyzing it"""
     file_path = request.args.get('file_path')
-    if not file_path or not os.path.exists(file_path):
+    if not stored_document(file_path):
         flash('File not found')
         return redirect('/')
     
@@ -1715,12 +1936,12 @@ def view_document():
 def preview_document():
     """Return the contents of a file for preview"""
     file_path = request.args.get('file_path')
-    if not file_path or not os.path.exists(file_path):
+    if not stored_document(file_path):
         return 'File not found', 404
     
     # For PDF files, serve the file directly
     if file_path.lower().endswith('.pdf'):
-        return send_file(file_path, mimetype='application/pdf')
+        return send_cached_file(file_path, content_digest(file_path), 0, mimetype='application/pdf')
     
     return 'Preview not available for this file type', 400
 
@@ -1728,7 +1949,7 @@ def preview_document():
 def download_document():
     """Download a file"""
     file_path = request.args.get('file_path')
-    if not file_path or not os.path.exists(file_path):
+    if not stored_document(file_path):
         return 'File not found', 404
     
     filename = os.path.basename(file_path)
@@ -1742,16 +1963,39 @@ def view_invoice(filename):
         filename = filename[8:] # Remove 'uploads/' prefix
     
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if not os.path.exists(file_path):
+    if not stored_document(file_path):
         return 'File not found', 404
     
-    return send_file(file_path, mimetype='application/pdf')
+    return send_cached_file(file_path, content_digest(file_path), 0, mimetype='application/pdf')
+
+@app.route('/thumbnail')
+def thumbnail():
+    """First-page thumbnail of a document, rendered now if the background render has not run"""
+    file_path = request.args.get('file_path')
+    if not stored_document(file_path):
+        return 'File not found', 404
+    digest = content_digest(file_path)
+    try:
+        PREVIEWS.ensure(file_path, digest)
+    except Exception as e:
+        print(f"Error rendering thumbnail for {os.path.basename(file_path)}: {e}")
+        return 'Thumbnail not available', 404
+    # The ETag names the content, so a re-upload under the same name gets a new thumbnail
+    return send_cached_file(PREVIEWS.path(digest, THUMBNAIL_NAME), f"{digest}-thumb", 300, mimetype='image/webp')
+
+@app.route('/previews/<digest>/<name>')
+def preview_file(digest, name):
+    """A rendered preview; its URL names the content, so it never changes"""
+    path = PREVIEWS.path(digest, name)
+    if path is None or not name.endswith('.webp') or not os.path.exists(path):
+        return 'Preview not found', 404
+    return send_cached_file(path, f"{digest}-{name}", 365 * 24 * 3600, immutable=True, mimetype='image/webp')
 
 @app.route('/compare/<path:file_path>', methods=['GET'])
 def compare_methods(file_path):
     """Compare results across all processing methods for a single file"""
     
-    if not os.path.isfile(file_path):
+    if not stored_document(file_path):
         flash('File not found!')
         return redirect(url_for('index'))
     
@@ -1761,24 +2005,14 @@ def compare_methods(file_path):
     try:
         # Process with all methods
         for method in PROCESSING_METHODS:
-            # analyze_and_parse_invoice already uses caching internally
-            result = analyze_and_parse_invoice(
-                doc_intelligence_endpoint=DOC_INTELLIGENCE_ENDPOINT,
-                doc_intelligence_key=DOC_INTELLIGENCE_KEY,
-                openai_endpoint=OPENAI_ENDPOINT,
-                openai_key=OPENAI_KEY,
-                deployment_name=DEPLOYMENT_NAME,
-                input_file=file_path,
-                processing_method=method
-            )
-            # Create serialized version for JSON display
-            json_result = serialize_model(result)
+            # Cached results are served straight from their render-ready form
+            rendered = analyze_to_rendered_result(file_path, method)
             
-            # Create DotDict version for template attribute access
-            results[method] = to_dot_dict(json_result)
+            # Lightweight accessor for template attribute access
+            results[method] = rendered.view()
             
-            # Store the JSON result separately
-            json_results[method] = json_result
+            # The JSON text is reused as-is by the tojson filter
+            json_results[method] = rendered
         
         # Get just the filename for display
         filename = os.path.basename(file_path)
@@ -1797,6 +2031,367 @@ def compare_methods(file_path):
         flash(f'Error processing file: {str(e)}')
         return redirect(url_for('index'))
 
+@app.route('/result.json')
+def result_json():
+    """Serve the cached JSON for a file and processing method without re-serializing it"""
+    file_path = request.args.get('file_path')
+    processing_method = request.args.get('processing_method')
+    if not file_path or not processing_method:
+        return 'file_path and processing_method are required', 400
+    
+    rendered = get_rendered_result(file_path, processing_method)
+    if rendered is None:
+        return 'Result not found', 404
+    
+    return Response(rendered.json_bytes, mimetype='application/json')
+
+@app.route('/validation')
+def validation_report():
+    """Validate the arithmetic of every cached result in one batch"""
+    reports = validate_cached_results(CACHE_DIR)
+    return jsonify({
+        'total': len(reports),
+        'invalid': len([r for r in reports.values() if not r['valid']]),
+        'results': reports
+    })
+
+@app.route('/progress/<job_id>')
+def progress_stream(job_id):
+    """Server-Sent Events stream of an extraction job's stages, ending when the job does"""
+    if not valid_job_id(job_id):
+        return 'Invalid job id', 400
+
+    def events():
+        for event in PROGRESS.follow(job_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/timings')
+def job_timings():
+    """Stage timings of recently finished extraction jobs"""
+    limit = request.args.get('limit', default=100, type=int)
+    return jsonify(PROGRESS.timings(limit))
+
+@app.route('/providers')
+def provider_status():
+    """Latency, quota and health of the Azure OpenAI and Bedrock endpoints in use"""
+    return jsonify(pool_status())
+
+# --- JSON API (v1) -----------------------------------------------------------
+# Machine-to-machine routes for ERP integration: no templates or upload listings,
+# cached results are sent as their stored bytes, GETs answer If-None-Match with
+# 304, and larger bodies are compressed with brotli (when installed) or gzip.
+
+API_PREFIX = '/api/v1'
+API_PROCESSING_METHOD = os.getenv('API_PROCESSING_METHOD', 'bedrock_claude_sonnet')
+API_BATCH_MAX = int(os.getenv('API_BATCH_MAX', '1000'))
+# Bodies smaller than this are sent uncompressed
+API_COMPRESS_MIN_SIZE = int(os.getenv('API_COMPRESS_MIN_SIZE', '1024'))
+# Compressed result bodies kept in memory for repeat requests
+API_COMPRESS_CACHE_BYTES = int(os.getenv('API_COMPRESS_CACHE_BYTES', str(32 * 1024 * 1024)))
+# brotli is optional; without it responses are gzipped
+_BROTLI = importlib.util.find_spec('brotli') is not None
+
+# Invoice fields returned by, and searchable through, /api/v1/search
+SEARCH_FIELDS = ('invoice_number', 'invoice_date', 'seller_name', 'seller_gstin', 'buyer_name',
+                 'buyer_gstin', 'total_amount', 'currency')
+
+def api_error(message, status, **fields):
+    return jsonify({'error': message, **fields}), status
+
+def api_result_url(digest, processing_method=None):
+    return url_for('api_result', digest=digest, processing_method=processing_method)
+
+def api_envelope(fields, rendered=None):
+    """JSON object of ``fields``, plus the cached result bytes as "result" without re-serializing them"""
+    head = json.dumps(fields, default=str).encode('utf-8')
+    if rendered is None:
+        return head
+    return head[:-1] + (b', ' if fields else b'') + b'"result": ' + rendered.json_bytes + b'}'
+
+def invoice_summary(data):
+    """The SEARCH_FIELDS of an extracted invoice"""
+    seller = data.get('seller') if isinstance(data.get('seller'), dict) else {}
+    buyer = data.get('buyer') if isinstance(data.get('buyer'), dict) else {}
+    return {
+        'invoice_number': data.get('invoice_number'),
+        'invoice_date': data.get('invoice_date'),
+        'seller_name': seller.get('name'),
+        'seller_gstin': seller.get('gstin'),
+        'buyer_name': buyer.get('name'),
+        'buyer_gstin': buyer.get('gstin'),
+        'total_amount': data.get('total_amount'),
+        'currency': data.get('currency'),
+    }
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+# Compressed result bodies by (ETag, encoding), least recently used first, up to API_COMPRESS_CACHE_BYTES
+_compressed = collections.OrderedDict()
+_compressed_bytes = 0
+_compressed_lock = threading.Lock()
+
+def compressed_body(body, encoding, etag=None):
+    """``body`` compressed with ``encoding``; repeat requests for one result version reuse the bytes"""
+    global _compressed_bytes
+    if etag is None:
+        return _compress(body, encoding)
+    key = (etag, encoding)
+    with _compressed_lock:
+        if key in _compressed:
+            _compressed.move_to_end(key)
+            return _compressed[key]
+    data = _compress(body, encoding)
+    if len(data) > API_COMPRESS_CACHE_BYTES:
+        return data
+    with _compressed_lock:
+        if key not in _compressed:
+            _compressed[key] = data
+            _compressed_bytes += len(data)
+            while _compressed_bytes > API_COMPRESS_CACHE_BYTES:
+                _compressed_bytes -= len(_compressed.popitem(last=False)[1])
+    return data
+
+def response_encoding(response):
+    """The Content-Encoding to compress an API response with, or None to send it as is"""
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return None
+    if response.calculate_content_length() is None or response.calculate_content_length() < API_COMPRESS_MIN_SIZE:
+        return None
+    accepted = request.accept_encodings
+    if accepted['br'] and _BROTLI:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+@app.after_request
+def finish_api_response(response):
+    """Conditional GET and compression for the JSON API.
+
+    Each encoding of a body gets its own ETag (the identity ETag plus ``-gzip`` or
+    ``-br``), so caches never mix the representations up.
+    """
+    if not request.path.startswith(API_PREFIX + '/') or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = response_encoding(response)
+    # Result routes set an ETag naming the cached result version, which also keys its compressed bytes
+    versioned = response.get_etag()[0]
+    if request.method == 'GET' and response.status_code == 200:
+        if not versioned:
+            response.add_etag()
+        if encoding:
+            etag, weak = response.get_etag()
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        response.make_conditional(request)
+    if encoding is None or response.status_code != 200:
+        return response
+    response.set_data(compressed_body(response.get_data(), encoding, versioned))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route(f'{API_PREFIX}/documents', methods=['POST'])
+def api_submit_document():
+    """Store a PDF and extract it, in the request or (with ``wait=false``) on the extraction queue"""
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return api_error('No file uploaded', 400)
+    processing_method = request.form.get('processing_method', API_PROCESSING_METHOD)
+    if processing_method not in PROCESSING_METHODS:
+        return api_error(f'Unknown processing method: {processing_method}', 400)
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith('.pdf') or not isinstance(file.stream, HashingSpool):
+        return api_error('Only PDF documents are accepted', 415)
+
+    spool = file.stream
+    path, duplicate_of = store_spool(spool, filename, app.config['UPLOAD_FOLDER'], CONTENT_HASH_INDEX)
+    path = path or duplicate_of
+    digest = spool.hexdigest()
+    schedule_previews(path, digest)
+    fields = {'sha256': digest, 'file': os.path.basename(path), 'duplicate': duplicate_of is not None,
+              'processing_method': processing_method, 'result_url': api_result_url(digest, processing_method)}
+
+    rendered = get_rendered_result(path, processing_method)
+    if rendered is None and request.form.get('wait', 'true').lower() in ('0', 'false', 'no'):
+        try:
+            EXTRACTION_QUEUE.submit(path, processing_method, block=False)
+        except queue.Full:
+            # The document is stored; sending it again queues it
+            return queue_full_response(jsonify({'error': 'The extraction queue is full', **fields}))
+        fields['status'] = 'queued'
+        response = Response(api_envelope(fields), status=202, mimetype='application/json')
+        response.headers['Location'] = fields['result_url']
+        return response
+    if rendered is None:
+        job_id = request.form.get('job_id')
+        fields['job_id'] = job_id if valid_job_id(job_id) else new_job_id()
+        with PROGRESS.job(fields['job_id'], path, processing_method):
+            rendered = analyze_to_rendered_result(path, processing_method)
+    fields['status'] = 'done'
+    return Response(api_envelope(fields, rendered), mimetype='application/json')
+
+@app.route(f'{API_PREFIX}/results/<digest>')
+def api_result(digest):
+    """Cached result of a document by content hash: one method's, or every method's by name"""
+    digest = digest.lower()
+    path = CONTENT_HASH_INDEX.get(digest)
+    if path is None:
+        return api_error('Unknown document', 404, sha256=digest)
+    processing_method = request.args.get('processing_method')
+    if processing_method and processing_method not in PROCESSING_METHODS:
+        return api_error(f'Unknown processing method: {processing_method}', 400)
+
+    results = {}
+    versions = []
+    for method in [processing_method] if processing_method else PROCESSING_METHODS:
+        rendered = get_rendered_result(path, method)
+        if rendered is not None:
+            cache_file = os.path.join(CACHE_DIR, f"{get_cache_key(path, method)}.json")
+            try:
+                versions.append(f"{method}={os.stat(cache_file).st_mtime_ns}")
+            except FileNotFoundError:
+                continue  # cleared since it was read
+            results[method] = rendered
+    if not results:
+        return api_error('No result for this document yet', 404, sha256=digest, processing_method=processing_method)
+
+    if processing_method:
+        body = results[processing_method].json_bytes
+    else:
+        body = b'{' + b', '.join(json.dumps(method).encode('utf-8') + b': ' + rendered.json_bytes
+                                 for method, rendered in results.items()) + b'}'
+    response = Response(body, mimetype='application/json')
+    # Cache file versions identify the content, so the body never needs hashing
+    response.set_etag(hashlib.sha1(f"{digest}:{','.join(versions)}".encode('utf-8')).hexdigest())
+    return response
+
+@app.route(f'{API_PREFIX}/batches', methods=['POST'])
+def api_batch():
+    """Queue extraction of previously submitted documents, named by content hash"""
+    body = request.get_json(silent=True) or {}
+    digests = body.get('documents')
+    if not isinstance(digests, list) or not all(isinstance(d, str) for d in digests):
+        return api_error('"documents" must be a list of SHA-256 hashes', 400)
+    if len(digests) > API_BATCH_MAX:
+        return api_error(f'At most {API_BATCH_MAX} documents per batch', 413)
+    processing_method = body.get('processing_method', API_PROCESSING_METHOD)
+    if processing_method not in PROCESSING_METHODS:
+        return api_error(f'Unknown processing method: {processing_method}', 400)
+
+    documents = []
+    for digest in dict.fromkeys(d.lower() for d in digests):
+        path = CONTENT_HASH_INDEX.get(digest)
+        if path is None:
+            documents.append({'sha256': digest, 'status': 'unknown'})
+            continue
+        status = 'done'
+        if get_rendered_result(path, processing_method) is None:
+            try:
+                EXTRACTION_QUEUE.submit(path, processing_method, block=False)
+                status = 'queued'
+            except queue.Full:
+                status = 'queue_full'
+        documents.append({'sha256': digest, 'status': status,
+                          'result_url': api_result_url(digest, processing_method)})
+    queued = sum(1 for document in documents if document['status'] == 'queued')
+    response = jsonify({'processing_method': processing_method, 'queued': queued,
+                        'pending': EXTRACTION_QUEUE.pending(), 'documents': documents})
+    if any(document['status'] == 'queue_full' for document in documents):
+        return queue_full_response(response)
+    return response, 202 if queued else 200
+
+@app.route(f'{API_PREFIX}/export/<table>.<fmt>')
+def api_export(table, fmt):
+    """Stream one flattened table (invoices, line_items, tax_details) as CSV or JSONL"""
+    if table not in EXPORT_TABLES or fmt not in ('csv', 'jsonl'):
+        return api_error('Use /export/<invoices|line_items|tax_details>.<csv|jsonl>; '
+                         'Parquet is written by export.py', 404)
+    since = request.args.get('since')
+    try:
+        results = iter_cached_results(since=since, methods=request.args.getlist('processing_method') or None)
+        # Generators start lazily; pull the first chunk so a bad "since" fails here
+        chunks = stream_table(results, table, fmt)
+        first = next(chunks)
+    except ValueError as e:
+        return api_error(f'Invalid since: {e}', 400)
+
+    def body():
+        yield first
+        yield from chunks
+
+    response = Response(body(), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{fmt}'
+    return response
+
+@app.route(f'{API_PREFIX}/aggregate')
+def api_aggregate():
+    """Group-by over the columnar store, e.g. ?group_by=seller_gstin,invoice_month&metrics=sum:amount,count"""
+    if RESULT_STORE is None:
+        return api_error('The columnar store needs pyarrow and duckdb installed', 503)
+    table = request.args.get('table', 'line_items')
+    group_by = [column for column in request.args.get('group_by', 'seller_gstin,invoice_month').split(',') if column]
+    metrics = []
+    for metric in request.args.get('metrics', 'sum:amount,count').split(','):
+        function, _, column = metric.partition(':')
+        metrics.append((function.strip(), column.strip() or None))
+    reserved = {'table', 'group_by', 'metrics', 'processing_method', 'month_from', 'month_to', 'limit'}
+    # Any other argument naming a column of the table filters on it
+    filters = {name: value for name, value in request.args.items()
+               if name not in reserved and name in {column for column, _, _ in STORE_TABLES.get(table, [])}}
+    limit = min(max(request.args.get('limit', default=1000, type=int), 1), AGGREGATE_MAX_ROWS)
+    try:
+        result = RESULT_STORE.aggregate(table, group_by, metrics, filters,
+                                        processing_method=request.args.get('processing_method'),
+                                        month_from=request.args.get('month_from'),
+                                        month_to=request.args.get('month_to'), limit=limit)
+    except ValueError as e:
+        return api_error(str(e), 400)
+    except ImportError:
+        return api_error('Aggregate queries need duckdb installed', 503)
+    except OSError as e:
+        return api_error(str(e), 503)
+    return jsonify({'table': table, 'group_by': group_by, 'filters': filters, **result})
+
+@app.route(f'{API_PREFIX}/search')
+def api_search():
+    """Extracted invoices whose fields contain ``q`` (in ``field`` only, if given)"""
+    query = request.args.get('q', '').strip().lower()
+    field = request.args.get('field')
+    if field and field not in SEARCH_FIELDS:
+        return api_error(f'field must be one of {", ".join(SEARCH_FIELDS)}', 400)
+    processing_method = request.args.get('processing_method')
+    if processing_method and processing_method not in PROCESSING_METHODS:
+        return api_error(f'Unknown processing method: {processing_method}', 400)
+    limit = min(max(request.args.get('limit', default=50, type=int), 1), 500)
+
+    if RESULT_STORE is None:
+        return api_error('Search needs the columnar store (pyarrow and duckdb installed)', 503)
+    try:
+        found = RESULT_STORE.search(query, SEARCH_FIELDS, field, processing_method, limit)
+    except ImportError:
+        return api_error('Search needs duckdb installed', 503)
+    except OSError as e:
+        return api_error(str(e), 503)
+    hits = []
+    for digest, file, method, *values in found['rows']:
+        # Documents removed since they were extracted have no result to link to
+        if CONTENT_HASH_INDEX.get(digest) is None:
+            continue
+        hits.append({'sha256': digest, 'file': file, 'processing_method': method,
+                     **dict(zip(SEARCH_FIELDS, values)), 'result_url': api_result_url(digest, method)})
+    return jsonify({'query': query, 'field': field, 'count': len(hits), 'results': hits})
+
 @app.route('/clear-cache', methods=['POST'])
 def clear_cache_route():
     """Clear all cached results"""
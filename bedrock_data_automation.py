@@ -1,100 +1,196 @@
+"""Amazon Bedrock Data Automation (BDA) client.
+
+One client handles the whole BDA flow: upload the document to S3, invoke the
+project asynchronously, poll the invocation, then read the job metadata and the
+standard output of every segment. Uploads use S3 multipart transfers, segment
+outputs are fetched in parallel, and ``submit`` runs invocations on a shared
+thread pool so many documents can be in flight at once.
+
+The S3, STS and BDA runtime clients can be passed in, which lets the S3 side run
+against a local stand-in such as moto and the BDA side against a botocore Stubber.
+"""
 import os
 import json
 import time
-import boto3
-
-AWS_REGION = os.getenv('AWS_REGION', '<REGION>')
-BUCKET_NAME = os.getenv('AWS_BUCKET_NAME', '<BUCKET>')
-INPUT_PATH = os.getenv('AWS_INPUT_PATH', 'BDA/Input')
-OUTPUT_PATH = os.getenv('AWS_OUTPUT_PATH', 'BDA/Output')
-PROJECT_ID = os.getenv('AWS_PROJECT_ID', '<PROJECT_ID>')
-BLUEPRINT_NAME = os.getenv('AWS_BLUEPRINT_NAME', 'US-Driver-License-demo')
-
-BLUEPRINT_FIELDS = [
-    'NAME_DETAILS/FIRST_NAME',
-    'NAME_DETAILS/MIDDLE_NAME',
-    'NAME_DETAILS/LAST_NAME',
-    'DATE_OF_BIRTH',
-    'DATE_OF_ISSUE',
-    'EXPIRATION_DATE'
-]
-
-def process_with_bedrock_data_automation(local_file_path):
-    """
-    Uploads the file to S3, invokes Bedrock Data Automation, waits for completion, and parses the result.
-    Returns a dict suitable for Invoice.model_validate().
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from progress import note
+
+BDA_BUCKET_NAME = os.getenv("BDA_BUCKET_NAME", "doc-ocr-poc")
+BDA_INPUT_PREFIX = os.getenv("BDA_INPUT_PREFIX", "bedrock-data-auto-temp/input")
+BDA_OUTPUT_PREFIX = os.getenv("BDA_OUTPUT_PREFIX", "bedrock-data-auto-temp/output")
+BDA_PROJECT_ID = os.getenv("BDA_PROJECT_ID", "4790fd771828")
+# Concurrent invocations per client; S3 reads and multipart parts share the same pool size
+BDA_MAX_WORKERS = int(os.getenv("BDA_MAX_WORKERS", "8"))
+BDA_POLL_INTERVAL = float(os.getenv("BDA_POLL_INTERVAL", "2"))
+BDA_TIMEOUT = float(os.getenv("BDA_TIMEOUT", "900"))
+
+# Files above this size are uploaded in parallel parts of this size
+_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class BedrockDataAutomationError(RuntimeError):
+    """A BDA invocation that did not finish with status Success"""
+
+    def __init__(self, message, status_response=None):
+        super().__init__(message)
+        self.status_response = status_response
+
+
+def split_s3_uri(s3_uri):
+    """Return (bucket, key) for an s3:// URI"""
+    parts = s3_uri.split('/')
+    return parts[2], '/'.join(parts[3:])
+
+
+def standard_output_text(outputs):
+    """Join the markdown representations of all segment outputs, in segment order.
+
+    Falls back to the JSON text of the outputs when none carry markdown.
     """
-    s3 = boto3.client('s3', region_name=AWS_REGION)
-    bda = boto3.client('bedrock-data-automation-runtime', region_name=AWS_REGION)
-    sts = boto3.client('sts')
-    
-    aws_account_id = sts.get_caller_identity().get('Account')
-    file_name = os.path.basename(local_file_path)
-    input_s3_uri = f"s3://{BUCKET_NAME}/{INPUT_PATH}/{file_name}"
-    output_s3_uri = f"s3://{BUCKET_NAME}/{OUTPUT_PATH}"
-    data_automation_arn = f"arn:aws:bedrock:{AWS_REGION}:{aws_account_id}:data-automation-project/{PROJECT_ID}"
-
-    # Upload file to S3
-    s3.upload_file(local_file_path, BUCKET_NAME, f"{INPUT_PATH}/{file_name}")
-
-    params = {
-        'inputConfiguration': {
-            's3Uri': input_s3_uri
-        },
-        'outputConfiguration': {
-            's3Uri': output_s3_uri
-        },
-        'dataAutomationConfiguration': {
-            'dataAutomationProjectArn': data_automation_arn
-        },
-        'dataAutomationProfileArn': f"arn:aws:bedrock:{AWS_REGION}:{aws_account_id}:data-automation-profile/us.data-automation-v1"
-    }
-    response = bda.invoke_data_automation_async(**params)
-    invocation_arn = response['invocationArn']
-
-    # Wait for completion
-    while True:
-        status_response = bda.get_data_automation_status(invocationArn=invocation_arn)
-        status = status_response['status']
-        if status not in ['Created', 'InProgress']:
-            break
-        time.sleep(2)
-
-    if status_response['status'] != 'Success':
-        raise RuntimeError(f"Bedrock Data Automation failed: {status_response['status']}")
-
-    # Retrieve result metadata from S3
-    job_metadata_s3_uri = status_response['outputConfiguration']['s3Uri']
-    bucket = job_metadata_s3_uri.split('/')[2]
-    key = '/'.join(job_metadata_s3_uri.split('/')[3:])
-    object_content = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
-    job_metadata = json.loads(object_content)
-
-    # Parse the first segment and standard output (customize as needed)
-    segment = job_metadata['output_metadata'][0]
-    segment_metadata = segment['segment_metadata'][0]
-    standard_output_path = segment_metadata['standard_output_path']
-    std_bucket = standard_output_path.split('/')[2]
-    std_key = '/'.join(standard_output_path.split('/')[3:])
-    std_content = s3.get_object(Bucket=std_bucket, Key=std_key)['Body'].read()
-    standard_output_result = json.loads(std_content)
-
-    # Map to Invoice fields (customize mapping as needed)
-    invoice_dict = {
-        'invoice_number': standard_output_result.get('document_id'),
-        'invoice_date': standard_output_result.get('date'),
-        'seller': {
-            'name': standard_output_result.get('issuer_name'),
-            'address': standard_output_result.get('issuer_address'),
-            'gstin': standard_output_result.get('issuer_gstin'),
-            'contact_details': standard_output_result.get('issuer_contact'),
-        },
-        'buyer': {
-            'name': standard_output_result.get('buyer_name'),
-            'address': standard_output_result.get('buyer_address'),
-            'gstin': standard_output_result.get('buyer_gstin'),
-            'contact_details': standard_output_result.get('buyer_contact'),
-        },
-        # Add more mappings as needed
-    }
-    return invoice_dict
+    markdowns = []
+    for output in outputs:
+        if isinstance(output, dict) and isinstance(output.get('output'), list):
+            for item in output['output']:
+                representation = item.get('representation', {}) if isinstance(item, dict) else {}
+                if isinstance(representation, dict) and 'markdown' in representation:
+                    markdowns.append(representation['markdown'])
+    if markdowns:
+        return '\n'.join(markdowns)
+    return json.dumps(outputs[0] if len(outputs) == 1 else outputs)
+
+
+def output_page_count(outputs):
+    """Pages BDA processed, from the metadata of each segment's standard output"""
+    pages = 0
+    for output in outputs:
+        metadata = output.get('metadata', {}) if isinstance(output, dict) else {}
+        pages += metadata.get('number_of_pages') or 1
+    return pages
+
+
+class BedrockDataAutomationClient:
+    """Upload, invoke, poll and collect BDA results; safe to share between threads"""
+
+    def __init__(self, region, bucket=BDA_BUCKET_NAME, input_prefix=BDA_INPUT_PREFIX,
+                 output_prefix=BDA_OUTPUT_PREFIX, project_id=BDA_PROJECT_ID,
+                 max_workers=BDA_MAX_WORKERS, poll_interval=BDA_POLL_INTERVAL, timeout=BDA_TIMEOUT,
+                 s3_client=None, bda_client=None, sts_client=None):
+        self.region = region
+        self.bucket = bucket
+        self.input_prefix = input_prefix
+        self.output_prefix = output_prefix
+        self.project_id = project_id
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # boto3 is imported here so loading this module stays cheap
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+        config = Config(max_pool_connections=max_workers * 2)
+        self.s3 = s3_client or boto3.client('s3', region_name=region, config=config)
+        self.bda = bda_client or boto3.client('bedrock-data-automation-runtime', region_name=region, config=config)
+        self._sts = sts_client
+        self._account_id = None
+        self._transfer_config = TransferConfig(multipart_threshold=_MULTIPART_CHUNK_SIZE,
+                                               multipart_chunksize=_MULTIPART_CHUNK_SIZE,
+                                               max_concurrency=max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bda")
+        # Segment reads get their own pool so they never wait behind the invocations using it
+        self._fetch_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bda-fetch")
+        self._lock = threading.Lock()
+
+    @property
+    def account_id(self):
+        with self._lock:
+            if self._account_id is None:
+                import boto3
+                sts = self._sts or boto3.client('sts', region_name=self.region)
+                self._account_id = sts.get_caller_identity()['Account']
+            return self._account_id
+
+    def upload(self, local_path):
+        """Upload a document (multipart above 8 MB) and return its S3 URI"""
+        # A per-invocation prefix keeps concurrent uploads of same-named files apart
+        key = f"{self.input_prefix}/{uuid.uuid4().hex}/{os.path.basename(local_path)}"
+        self.s3.upload_file(local_path, self.bucket, key, Config=self._transfer_config)
+        return f"s3://{self.bucket}/{key}"
+
+    def invoke(self, input_s3_uri):
+        """Start an asynchronous invocation and return its ARN"""
+        account_id = self.account_id
+        response = self.bda.invoke_data_automation_async(
+            inputConfiguration={'s3Uri': input_s3_uri},
+            outputConfiguration={'s3Uri': f"s3://{self.bucket}/{self.output_prefix}"},
+            dataAutomationConfiguration={
+                'dataAutomationProjectArn': f"arn:aws:bedrock:{self.region}:{account_id}:data-automation-project/{self.project_id}"
+            },
+            dataAutomationProfileArn=f"arn:aws:bedrock:{self.region}:{account_id}:data-automation-profile/us.data-automation-v1",
+        )
+        return response['invocationArn']
+
+    def wait(self, invocation_arn):
+        """Poll until the invocation finishes; return the final status response"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            status_response = self.bda.get_data_automation_status(invocationArn=invocation_arn)
+            if status_response['status'] not in ('Created', 'InProgress'):
+                break
+            note(f"BDA invocation {status_response['status']}")
+            if time.monotonic() > deadline:
+                raise BedrockDataAutomationError(f"BDA invocation timed out after {self.timeout}s", status_response)
+            time.sleep(self.poll_interval)
+        if status_response['status'] != 'Success':
+            raise BedrockDataAutomationError(f"Bedrock Data Automation failed: {status_response['status']}", status_response)
+        return status_response
+
+    def get_json(self, s3_uri):
+        bucket, key = split_s3_uri(s3_uri)
+        return json.loads(self.s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+    def fetch_outputs(self, job_metadata_s3_uri):
+        """Read the job metadata, then the standard output of every segment in parallel"""
+        job_metadata = self.get_json(job_metadata_s3_uri)
+        paths = [segment_metadata['standard_output_path']
+                 for asset in job_metadata.get('output_metadata', [])
+                 for segment_metadata in asset.get('segment_metadata', [])
+                 if segment_metadata.get('standard_output_path')]
+        if not paths:
+            raise BedrockDataAutomationError("BDA job produced no standard output")
+        # map() keeps segment order
+        return list(self._fetch_executor.map(self.get_json, paths))
+
+    def process(self, local_path):
+        """Run one document through BDA and return the list of segment standard outputs"""
+        invocation_arn = self.invoke(self.upload(local_path))
+        status_response = self.wait(invocation_arn)
+        return self.fetch_outputs(status_response['outputConfiguration']['s3Uri'])
+
+    def submit(self, local_path):
+        """Run ``process`` on the client's pool; returns a Future"""
+        return self._executor.submit(self.process, local_path)
+
+    def process_many(self, local_paths):
+        """Process documents concurrently; returns {path: outputs or the exception raised}"""
+        futures = {path: self.submit(path) for path in local_paths}
+        results = {}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                results[path] = e
+        return results
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(region):
+    """Shared client per region, so connection and thread pools are reused across requests"""
+    with _clients_lock:
+        if region not in _clients:
+            _clients[region] = BedrockDataAutomationClient(region)
+        return _clients[region]
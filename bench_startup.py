@@ -0,0 +1,98 @@
+"""Cold-start benchmark for the app, based on ``python -X importtime``.
+
+Imports ``app`` in fresh interpreters and reports the median import time, the
+slowest top-level imports, and what each processing method adds the first time
+its SDKs load::
+
+    python bench_startup.py                 # this tree
+    python bench_startup.py --compare HEAD~1 # this tree and a git revision side by side
+"""
+import os
+import sys
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+METHODS = ["gpt_only", "di_gpt_image", "di_phi", "bedrock_claude_sonnet", "textract_claude"]
+
+
+def importtime(code, cwd):
+    """Run ``code`` with -X importtime; return {module: (self_us, cumulative_us, depth)}"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+                            capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"))
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def measure(cwd, runs):
+    """Median cumulative import time of app (ms), and the slowest modules it imports directly"""
+    samples = []
+    modules = {}
+    for _ in range(runs):
+        modules = importtime("import app", cwd)
+        samples.append(modules["app"][1] / 1000)
+    direct = sorted(((name, cumulative / 1000) for name, (_, cumulative, depth) in modules.items() if depth == 1),
+                    key=lambda item: item[1], reverse=True)
+    return statistics.median(samples), direct
+
+
+def method_costs(cwd):
+    """Extra import time (ms) of each method's SDKs after the app is loaded"""
+    costs = {}
+    for method in METHODS:
+        try:
+            with_sdks = importtime(f"import app; app.preload_sdks([{method!r}])", cwd)
+        except RuntimeError:
+            costs[method] = None  # tree without preload_sdks: everything loads with the app
+            continue
+        app_modules = set(importtime("import app", cwd))
+        costs[method] = sum(cumulative for name, (_, cumulative, depth) in with_sdks.items()
+                            if depth == 1 and name not in app_modules) / 1000
+    return costs
+
+
+def report(label, cwd, runs, top):
+    median, direct = measure(cwd, runs)
+    print(f"\n== {label}: import app {median:.0f} ms (median of {runs})")
+    for name, ms in direct[:top]:
+        print(f"   {ms:8.1f} ms  {name}")
+    print("   first use of a method adds:")
+    for method, ms in method_costs(cwd).items():
+        print(f"   {method:>24}  " + ("(already loaded)" if ms is None else f"{ms:.0f} ms"))
+    return median
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app cold start with python -X importtime")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest direct imports to list")
+    parser.add_argument("--compare", metavar="REV", help="Also measure a git revision (e.g. a commit before a change)")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    current = report("working tree", here, args.runs, args.top)
+    if args.compare:
+        worktree = tempfile.mkdtemp(prefix="bench-startup-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.compare], cwd=here,
+                       check=True, capture_output=True)
+        try:
+            before = report(args.compare, worktree, args.runs, args.top)
+            print(f"\nCold start: {before:.0f} ms -> {current:.0f} ms ({before - current:+.0f} ms saved)")
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=here, capture_output=True)
+            shutil.rmtree(worktree, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
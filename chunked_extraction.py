@@ -0,0 +1,171 @@
+"""Chunked extraction for invoices whose line-item tables are too long for one LLM response.
+
+The layout text (Document Intelligence markdown, or Textract text rendered with
+tables) is split into a header chunk and a series of table-row chunks. The header
+fields and each row chunk are extracted in parallel, then merged in chunk order so
+the result is deterministic, and the merged line items are reconciled against the
+extracted subtotal.
+"""
+import os
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Rows of the line-item table sent per extraction call
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", "40"))
+# Documents whose largest table has at least this many rows are extracted in chunks
+CHUNK_ROW_THRESHOLD = int(os.getenv("CHUNK_ROW_THRESHOLD", "60"))
+# Parallel extraction calls per document
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
+# Allowed absolute difference between the summed line items and the subtotal
+RECONCILIATION_TOLERANCE = float(os.getenv("RECONCILIATION_TOLERANCE", "1.0"))
+
+# Table rows kept in the header chunk so the model still sees the column layout
+_HEADER_SAMPLE_ROWS = 2
+
+_HTML_TABLE = re.compile(r'<table>.*?</table>', re.S | re.I)
+_HTML_ROW = re.compile(r'<tr>.*?</tr>', re.S | re.I)
+_MARKDOWN_SEPARATOR = re.compile(r'^\|?\s*:?-{3,}')
+
+CHUNK_HEADER_INSTRUCTION = ("The line items of this invoice are extracted separately. "
+                            "Extract every other field and return an empty list for the line items.")
+
+
+class TableLayout:
+    """The largest table found in a layout text, split into header and body rows"""
+
+    def __init__(self, start, end, header_rows, body_rows, kind):
+        self.start = start
+        self.end = end
+        self.header_rows = header_rows
+        self.body_rows = body_rows
+        self.kind = kind
+
+    def render(self, rows):
+        """Render the table header followed by the given body rows"""
+        if self.kind == "html":
+            return "<table>" + "".join(self.header_rows + rows) + "</table>"
+        return "\n".join(self.header_rows + rows)
+
+
+def _html_tables(text):
+    for match in _HTML_TABLE.finditer(text):
+        rows = _HTML_ROW.findall(match.group(0))
+        if not rows:
+            continue
+        # Leading rows that only contain <th> cells are the column headings
+        header_count = 0
+        while header_count < len(rows) - 1 and '<td' not in rows[header_count].lower():
+            header_count += 1
+        header_count = header_count or 1
+        yield TableLayout(match.start(), match.end(), rows[:header_count], rows[header_count:], "html")
+
+
+def _markdown_tables(text):
+    lines = text.split("\n")
+    offset = 0
+    block = []
+    block_start = 0
+    for line in lines + [""]:
+        if line.lstrip().startswith("|"):
+            if not block:
+                block_start = offset
+            block.append(line)
+        elif block:
+            header_count = 2 if len(block) > 1 and _MARKDOWN_SEPARATOR.match(block[1].strip()) else 1
+            end = block_start + len("\n".join(block))
+            yield TableLayout(block_start, end, block[:header_count], block[header_count:], "markdown")
+            block = []
+        offset += len(line) + 1
+
+
+def find_line_item_table(layout_text):
+    """Return the table with the most body rows, which is taken to be the line-item table"""
+    if not layout_text:
+        return None
+    tables = list(_html_tables(layout_text)) + list(_markdown_tables(layout_text))
+    if not tables:
+        return None
+    return max(tables, key=lambda table: len(table.body_rows))
+
+
+def should_chunk(layout_text):
+    """Whether the layout has a line-item table long enough to need chunked extraction"""
+    if os.getenv("CHUNKED_EXTRACTION", "auto").lower() == "off":
+        return False
+    table = find_line_item_table(layout_text)
+    if table is None:
+        return False
+    if os.getenv("CHUNKED_EXTRACTION", "auto").lower() == "always":
+        return len(table.body_rows) > CHUNK_ROWS
+    return len(table.body_rows) >= CHUNK_ROW_THRESHOLD
+
+
+def split_layout(layout_text, chunk_rows=CHUNK_ROWS):
+    """Split layout text into a header chunk and rendered table-row chunks.
+
+    The header chunk is the full text with the line-item table cut down to its
+    column headings and a couple of sample rows. Each row chunk repeats the column
+    headings so it can be read on its own.
+    """
+    table = find_line_item_table(layout_text)
+    if table is None:
+        return layout_text, []
+
+    omitted = len(table.body_rows) - _HEADER_SAMPLE_ROWS
+    sample = table.render(table.body_rows[:_HEADER_SAMPLE_ROWS])
+    if omitted > 0:
+        sample += f"\n[{omitted} more line item rows omitted]"
+    header_text = layout_text[:table.start] + sample + layout_text[table.end:]
+
+    row_chunks = [table.render(table.body_rows[i:i + chunk_rows])
+                  for i in range(0, len(table.body_rows), chunk_rows)]
+    return header_text, row_chunks
+
+
+def reconcile_line_items(line_items, subtotal, tolerance=RECONCILIATION_TOLERANCE):
+    """Compare the summed line item amounts with the subtotal"""
+    line_items_total = round(sum(item.get("amount") or 0 for item in line_items if isinstance(item, dict)), 2)
+    reconciliation = {
+        "line_items_count": len(line_items),
+        "line_items_total": line_items_total,
+        "subtotal": subtotal,
+        "delta": None,
+        "reconciled": None,
+    }
+    if isinstance(subtotal, (int, float)):
+        delta = round(line_items_total - subtotal, 2)
+        reconciliation["delta"] = delta
+        reconciliation["reconciled"] = abs(delta) <= tolerance
+    return reconciliation
+
+
+def extract_chunked(layout_text, extract_header, extract_items, items_key="line_items",
+                    chunk_rows=CHUNK_ROWS, workers=CHUNK_WORKERS):
+    """Extract an invoice in chunks and merge the results.
+
+    ``extract_header(text)`` returns the invoice fields as a dict and
+    ``extract_items(table_text)`` returns the list of line item dicts for one row
+    chunk. All calls run in parallel; line items are merged in row order.
+    """
+    header_text, row_chunks = split_layout(layout_text, chunk_rows)
+    print(f"Chunked extraction: header + {len(row_chunks)} line item chunks")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Each call runs in a copy of the caller's context, so progress stages reach its job
+        header_future = executor.submit(contextvars.copy_context().run, extract_header, header_text)
+        item_futures = [executor.submit(contextvars.copy_context().run, extract_items, chunk) for chunk in row_chunks]
+        # Results are collected in submission order, which keeps the merge deterministic
+        item_chunks = [future.result() for future in item_futures]
+        invoice = header_future.result() or {}
+
+    line_items = [item for chunk in item_chunks for item in (chunk or [])]
+    invoice[items_key] = line_items
+    invoice.pop("items" if items_key == "line_items" else "line_items", None)
+
+    reconciliation = reconcile_line_items(line_items, invoice.get("subtotal"))
+    reconciliation["chunks"] = len(row_chunks)
+    if reconciliation["reconciled"] is False:
+        print(f"Line items do not reconcile with subtotal: delta {reconciliation['delta']}")
+    invoice["reconciliation"] = reconciliation
+    return invoice
@@ -0,0 +1,171 @@
+"""Near-duplicate invoice detection.
+
+Processed documents get up to two keys:
+
+* a 64-bit difference hash (dHash) of its rendered first page, which stays
+  within a few bits for the same page scanned twice or photographed (only for
+  documents that are rendered for OCR anyway, not born-digital PDFs read from
+  their text layer), and
+* a fingerprint of (seller GSTIN, invoice number, total amount) taken from the
+  extracted fields.
+
+Image hashes are stored in a multi-index: the hash is split into bands and a
+hash within ``DUPLICATE_MAX_DISTANCE`` bits of a query must match it exactly in
+at least one band (pigeonhole), so a lookup only compares against the documents
+sharing a band instead of scanning the whole index.
+
+A page hash only says two pages look alike: invoices printed from one vendor's
+template, and blank or near-blank pages (whose hashes are almost all zeros or
+ones, and are not matched at all), hash alike too. Near-duplicates are therefore
+only flagged; a result is reused only for identical file content.
+
+The index is a journal of per-document updates shared between processes (see
+journal.py).
+"""
+import os
+import re
+import hashlib
+
+from journal import Journal
+
+# Largest Hamming distance between page hashes that still counts as a duplicate
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "3"))
+# 'flag' records suspected duplicates and still extracts; 'reuse' returns the earlier
+# result instead when the file content is identical, and flags other matches
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", "flag")
+
+_HASH_BITS = 64
+# Page hashes with fewer set (or unset) bits come from near-uniform pages and match too much
+_MIN_HASH_BITS = 8
+
+
+def image_hash(image):
+    """64-bit difference hash of a PIL image, as an int"""
+    from PIL import Image
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def informative(phash):
+    """Whether a page hash has enough structure to be compared with others"""
+    ones = bin(phash).count("1")
+    return _MIN_HASH_BITS <= ones <= _HASH_BITS - _MIN_HASH_BITS
+
+
+def document_hash(file_path):
+    """dHash of the first page of a PDF or an image file"""
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+        images = convert_from_path(file_path, first_page=1, last_page=1, dpi=36)
+        if not images:
+            return None
+        return image_hash(images[0])
+    from PIL import Image
+    with Image.open(file_path) as image:
+        return image_hash(image)
+
+
+def field_fingerprint(result):
+    """Fingerprint of seller GSTIN, invoice number and total, or None if any is missing"""
+    if not isinstance(result, dict):
+        return None
+    seller = result.get("seller") if isinstance(result.get("seller"), dict) else {}
+    gstin = re.sub(r"\s", "", str(seller.get("gstin") or "")).upper()
+    number = re.sub(r"[\s/-]", "", str(result.get("invoice_number") or "")).upper()
+    total = result.get("total_amount")
+    if not gstin or not number or not isinstance(total, (int, float)):
+        return None
+    return hashlib.sha1(f"{gstin}|{number}|{total:.2f}".encode("utf-8")).hexdigest()
+
+
+class DuplicateIndex:
+    """Persistent index of page hashes and field fingerprints, keyed by document id"""
+
+    def __init__(self, index_path, max_distance=DUPLICATE_MAX_DISTANCE):
+        self.index_path = index_path
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = _HASH_BITS // self.bands
+        self._documents = {}
+        self._band_tables = [dict() for _ in range(self.bands)]
+        self._fingerprints = {}
+        self._journal = Journal(index_path, self._apply, self._snapshot)
+        self._lock = self._journal.mutex
+
+    def _apply(self, record):
+        """Merge one journal record ({"id", and the fields that changed}) into the entry"""
+        record = dict(record)
+        doc_id = record.pop("id")
+        self._insert(doc_id, dict(self._documents.get(doc_id, {}), **record))
+
+    def _snapshot(self):
+        return [dict(entry, id=doc_id) for doc_id, entry in self._documents.items()]
+
+    def _band_keys(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (band * self.band_bits)) & mask for band in range(self.bands)]
+
+    def _insert(self, doc_id, entry):
+        previous = self._documents.get(doc_id)
+        if previous:
+            self._remove(doc_id, previous)
+        self._documents[doc_id] = entry
+        if entry.get("phash") is not None and informative(int(entry["phash"], 16)):
+            for table, key in zip(self._band_tables, self._band_keys(int(entry["phash"], 16))):
+                table.setdefault(key, set()).add(doc_id)
+        if entry.get("fingerprint"):
+            self._fingerprints.setdefault(entry["fingerprint"], set()).add(doc_id)
+
+    def _remove(self, doc_id, entry):
+        if entry.get("phash") is not None and informative(int(entry["phash"], 16)):
+            for table, key in zip(self._band_tables, self._band_keys(int(entry["phash"], 16))):
+                table.get(key, set()).discard(doc_id)
+        if entry.get("fingerprint"):
+            self._fingerprints.get(entry["fingerprint"], set()).discard(doc_id)
+
+    def get(self, doc_id):
+        """The stored entry for a document, or None"""
+        with self._lock:
+            self._journal.refresh()
+            entry = self._documents.get(doc_id)
+            return dict(entry) if entry else None
+
+    def add(self, doc_id, path, phash=None, fingerprint=None, mtime=None):
+        """Record (or update) a document's page hash and/or field fingerprint"""
+        record = {"id": doc_id, "path": path}
+        if phash is not None:
+            record["phash"] = f"{phash:016x}"
+            record["mtime"] = mtime
+        if fingerprint is not None:
+            record["fingerprint"] = fingerprint
+        self._journal.append(record)
+
+    def find_similar(self, phash, exclude=None):
+        """Documents whose page hash is within the distance limit, closest first; none for uninformative hashes"""
+        if not informative(phash):
+            return []
+        with self._lock:
+            self._journal.refresh()
+            candidates = set()
+            for table, key in zip(self._band_tables, self._band_keys(phash)):
+                candidates |= table.get(key, set())
+            matches = []
+            for doc_id in candidates - {exclude}:
+                distance = bin(int(self._documents[doc_id]["phash"], 16) ^ phash).count("1")
+                if distance <= self.max_distance:
+                    matches.append({"id": doc_id, "path": self._documents[doc_id]["path"], "distance": distance})
+        return sorted(matches, key=lambda match: match["distance"])
+
+    def find_by_fingerprint(self, fingerprint, exclude=None):
+        """Documents whose extracted seller GSTIN, invoice number and total are identical"""
+        with self._lock:
+            self._journal.refresh()
+            return [{"id": doc_id, "path": self._documents[doc_id]["path"]}
+                    for doc_id in sorted(self._fingerprints.get(fingerprint, set()) - {exclude})]
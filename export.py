@@ -0,0 +1,329 @@
+"""Bulk export of extracted invoices as flat tables in CSV, JSONL or Parquet.
+
+Every cached result is flattened into three tables, with columns derived from
+the models in ``models.py``:
+
+* ``invoices``: one row per document and processing method, with nested models
+  such as ``seller`` flattened to ``seller_name``, ``seller_gstin``, ...;
+* ``line_items``: one row per ``LineItem``;
+* ``tax_details``: one row per ``TaxDetail``.
+
+Rows are keyed by ``document_sha256`` and ``processing_method``. Results are read
+one at a time and written in chunks of ``EXPORT_CHUNK_ROWS`` rows, so memory
+stays bounded no matter how many documents are exported. Parquet needs
+``pyarrow``; CSV and JSONL need nothing extra.
+
+Incremental exports write a new file per table under ``<out>/<table>/`` and keep
+a watermark (the newest result exported) in ``<out>/export_state.json``, so
+``--incremental`` only picks up results extracted since the previous run::
+
+    python export.py exports/ --format parquet --incremental
+    python export.py exports/ --format csv --since 2025-01-01T00:00:00
+"""
+import os
+import io
+import csv
+import sys
+import json
+import typing
+import argparse
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+
+from models import Invoice, LineItem, TaxDetail
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+STATE_NAME = "export_state.json"
+
+# Columns that identify the document a row came from: (name, type, path)
+KEY_COLUMNS = [("document_sha256", str, None), ("file", str, None), ("processing_method", str, None),
+               ("extracted_at", str, None)]
+CHILD_KEY_COLUMNS = KEY_COLUMNS + [("invoice_number", str, None), ("line_number", int, None)]
+
+
+def _unwrap(annotation):
+    """The type inside Optional[...]"""
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return args[0] if len(args) == 1 else str
+    return annotation
+
+
+def _model_columns(model, path=()):
+    """(column, type, path) of a model's scalar fields, flattening nested models"""
+    columns = []
+    for name, field in model.model_fields.items():
+        annotation = _unwrap(field.annotation)
+        if typing.get_origin(annotation) is list:
+            continue  # lists become tables of their own
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            columns.extend(_model_columns(annotation, path + (name,)))
+        else:
+            kind = annotation if annotation in (str, float, int, bool) else str
+            columns.append(("_".join(path + (name,)), kind, path + (name,)))
+    return columns
+
+
+TABLES = {
+    "invoices": KEY_COLUMNS + _model_columns(Invoice),
+    "line_items": CHILD_KEY_COLUMNS + _model_columns(LineItem),
+    "tax_details": CHILD_KEY_COLUMNS + _model_columns(TaxDetail),
+}
+
+
+def _coerce(value, kind):
+    if value is None or value == "":
+        return None
+    try:
+        if kind is float:
+            return float(value.replace(",", "")) if isinstance(value, str) else float(value)
+        if kind is int:
+            return int(value)
+        if kind is bool:
+            return value if isinstance(value, bool) else str(value).strip().lower() in ("true", "yes", "y", "1")
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value if isinstance(value, str) else str(value)
+
+
+def _flatten(data, table, keys):
+    row = {}
+    for column, kind, path in TABLES[table]:
+        if path is None:
+            row[column] = keys.get(column)
+            continue
+        value = data
+        for part in path:
+            value = value.get(part) if isinstance(value, dict) else None
+        row[column] = _coerce(value, kind)
+    return row
+
+
+def flatten_result(data, document_sha256, file, processing_method, extracted_at):
+    """Yield (table, row) for one extracted invoice"""
+    if not isinstance(data, dict) or "error" in data:
+        return
+    keys = {"document_sha256": document_sha256, "file": file, "processing_method": processing_method,
+            "extracted_at": extracted_at}
+    yield "invoices", _flatten(data, "invoices", keys)
+    keys["invoice_number"] = _coerce(data.get("invoice_number"), str)
+    # Claude results name the line items "line_items", the other methods "items"
+    items = data.get("items") or data.get("line_items") or []
+    for number, item in enumerate(items if isinstance(items, list) else [], 1):
+        if isinstance(item, dict):
+            yield "line_items", _flatten(item, "line_items", dict(keys, line_number=number))
+    taxes = data.get("tax_details") or []
+    for number, tax in enumerate(taxes if isinstance(taxes, list) else [], 1):
+        if isinstance(tax, dict):
+            yield "tax_details", _flatten(tax, "tax_details", dict(keys, line_number=number))
+
+
+class CsvTableWriter:
+    def __init__(self, stream, columns):
+        self.writer = csv.DictWriter(stream, fieldnames=[name for name, _, _ in columns])
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonlTableWriter:
+    def __init__(self, stream, columns):
+        self.stream = stream
+
+    def write(self, rows):
+        self.stream.write("".join(json.dumps(row) + "\n" for row in rows))
+
+    def close(self):
+        pass
+
+
+_ARROW_TYPES = {str: "string", float: "float64", int: "int64", bool: "bool_"}
+
+
+def arrow_schema(columns):
+    """pyarrow schema of a table's (name, type, path) columns"""
+    import pyarrow as pa
+    return pa.schema([(name, getattr(pa, _ARROW_TYPES[kind])()) for name, kind, _ in columns])
+
+
+class ParquetTableWriter:
+    """Writes each chunk as a Parquet row group"""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+        self.pa = pa
+        self.schema = arrow_schema(columns)
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class TableExport:
+    """Buffers rows per table and hands them to the format's writers a chunk at a time"""
+
+    def __init__(self, directory, fmt, run_id, chunk_rows=EXPORT_CHUNK_ROWS):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.directory = directory
+        self.fmt = fmt
+        self.run_id = run_id
+        self.chunk_rows = chunk_rows
+        self.paths = {}
+        self.counts = {table: 0 for table in TABLES}
+        self._buffers = {table: [] for table in TABLES}
+        self._writers = {}
+        self._streams = []
+
+    def _writer(self, table):
+        if table not in self._writers:
+            os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+            path = os.path.join(self.directory, table, f"{self.run_id}.{self.fmt}")
+            self.paths[table] = path
+            if self.fmt == "parquet":
+                self._writers[table] = ParquetTableWriter(path, TABLES[table])
+            else:
+                stream = open(path, "w", newline="", encoding="utf-8")
+                self._streams.append(stream)
+                writer_class = CsvTableWriter if self.fmt == "csv" else JsonlTableWriter
+                self._writers[table] = writer_class(stream, TABLES[table])
+        return self._writers[table]
+
+    def add(self, table, row):
+        buffer = self._buffers[table]
+        buffer.append(row)
+        self.counts[table] += 1
+        if len(buffer) >= self.chunk_rows:
+            self._flush(table)
+
+    def _flush(self, table):
+        if self._buffers[table]:
+            self._writer(table).write(self._buffers[table])
+            self._buffers[table] = []
+
+    def close(self):
+        for table in TABLES:
+            self._flush(table)
+        for writer in self._writers.values():
+            writer.close()
+        for stream in self._streams:
+            stream.close()
+
+
+def stream_table(results, table, fmt):
+    """Yield one table of ``results`` as CSV or JSONL text, a chunk at a time (for HTTP responses)"""
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("Only csv and jsonl can be streamed")
+    buffer = io.StringIO()
+    writer = (CsvTableWriter if fmt == "csv" else JsonlTableWriter)(buffer, TABLES[table])
+    rows = []
+    for result in results:
+        rows.extend(row for row_table, row in flatten_result(**result) if row_table == table)
+        if len(rows) >= EXPORT_CHUNK_ROWS:
+            writer.write(rows)
+            rows = []
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    writer.write(rows)
+    yield buffer.getvalue()
+
+
+def format_timestamp(timestamp):
+    """UTC ISO text of a POSIX timestamp; one fixed width, so the strings sort by time"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def parse_timestamp(text):
+    """POSIX timestamp of ISO text; naive times are taken as UTC"""
+    moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _load_state(directory):
+    path = os.path.join(directory, STATE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_state(directory, state):
+    path = os.path.join(directory, STATE_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def export_results(results, directory, fmt="parquet", chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write ``results`` (dicts as yielded by the app's ``iter_cached_results``) to per-table files.
+
+    Returns a summary with the files written, row counts and the newest
+    ``extracted_at`` exported, which is stored as the directory's watermark.
+    """
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    export = TableExport(directory, fmt, run_id, chunk_rows)
+    watermark = None
+    documents = 0
+    try:
+        for result in results:
+            documents += 1
+            watermark = max(watermark or result["extracted_at"], result["extracted_at"])
+            for table, row in flatten_result(**result):
+                export.add(table, row)
+    finally:
+        export.close()
+
+    state = _load_state(directory)
+    if watermark:
+        state["watermark"] = max(state.get("watermark", watermark), watermark)
+    state.setdefault("runs", []).append({"run_id": run_id, "format": fmt, "documents": documents,
+                                         "rows": export.counts, "watermark": watermark})
+    _save_state(directory, state)
+    return {"run_id": run_id, "documents": documents, "rows": export.counts, "files": export.paths,
+            "watermark": state.get("watermark")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export extracted invoices as CSV, JSONL or Parquet tables")
+    parser.add_argument("out", help="Directory the tables are written under")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--since", help="Only results extracted after this ISO timestamp")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only results extracted after the watermark of the previous export to OUT")
+    parser.add_argument("--method", action="append", help="Limit to these processing methods")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if args.incremental:
+        since = _load_state(args.out).get("watermark", since)
+    os.makedirs(args.out, exist_ok=True)
+
+    # The app owns the result cache and the content hash index
+    from app import iter_cached_results
+    summary = export_results(iter_cached_results(since=since, methods=args.method), args.out,
+                             args.format, args.chunk_rows)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Azure Functions entry points (Python v2 programming model).
+
+* ``invoice_blob_added`` fires for each document written to the input container
+  and enqueues it, so the extraction itself scales out on the queue.
+* ``extract_invoices`` takes queue messages naming one blob or a batch of blobs,
+  extracts them in parallel with ``analyze_and_parse_invoice`` and writes each
+  result as JSON to the results container.
+
+Messages look like ``{"blob": "invoices-in/a.pdf"}`` or
+``{"blobs": ["invoices-in/a.pdf", "invoices-in/b.pdf"], "processing_method": "textract_claude"}``.
+The Functions host delivers queue messages in batches (``host.json``), and the
+app module, its provider pools and the blob client stay loaded between
+invocations, so warm instances reuse their connections.
+
+Run locally with Azure Functions Core Tools and Azurite: copy
+``local.settings.json.sample`` to ``local.settings.json``, start ``azurite``,
+then ``func start``.
+"""
+import os
+import re
+import json
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import azure.functions as func
+
+# Functions file systems are read-only apart from temp storage
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(os.getenv("TMPDIR", "/tmp"), "uploads"))
+
+from app import CONTENT_HASH_INDEX, PROCESSING_METHODS, analyze_to_rendered_result, file_sha256
+
+INPUT_CONTAINER = os.getenv("INVOICE_INPUT_CONTAINER", "invoices-in")
+RESULTS_CONTAINER = os.getenv("INVOICE_RESULTS_CONTAINER", "invoice-results")
+QUEUE_NAME = os.getenv("INVOICE_QUEUE_NAME", "invoice-extraction")
+FUNCTION_PROCESSING_METHOD = os.getenv("FUNCTION_PROCESSING_METHOD", "textract_claude")
+# Documents of one batch message extracted at the same time
+FUNCTION_BATCH_WORKERS = int(os.getenv("FUNCTION_BATCH_WORKERS", "4"))
+
+app = func.FunctionApp()
+
+_blob_service = None
+
+
+def blob_service():
+    """Blob client shared by all invocations on this instance"""
+    global _blob_service
+    if _blob_service is None:
+        from azure.storage.blob import BlobServiceClient
+        _blob_service = BlobServiceClient.from_connection_string(os.environ["AzureWebJobsStorage"])
+    return _blob_service
+
+
+def _split_blob_path(blob_path):
+    container, _, name = blob_path.partition("/")
+    return (container, name) if name else (INPUT_CONTAINER, container)
+
+
+def download_blob(container, name):
+    """Local copy of the current version of a blob, downloaded only once per version.
+
+    The path includes the blob's ETag, so a redelivered message hits the result
+    cache while a blob overwritten under the same name is downloaded and
+    extracted again. Bytes land in a temp file that is renamed into place when
+    complete, so an interrupted download is never mistaken for the document.
+    """
+    from azure.core import MatchConditions
+    blob_client = blob_service().get_blob_client(container, name)
+    etag = blob_client.get_blob_properties().etag
+    version = re.sub(r"[^0-9A-Za-z]", "", etag)
+    local_path = os.path.join(os.environ["UPLOAD_FOLDER"], "functions", container, version, name)
+    if os.path.exists(local_path):
+        return local_path
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(local_path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # Fails rather than mixing versions if the blob changes mid-download
+            blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified).readinto(f)
+        os.replace(tmp_path, local_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    CONTENT_HASH_INDEX.claim(file_sha256(local_path), local_path)
+    return local_path
+
+
+def extract_blob(blob_path, processing_method):
+    """Download one blob, extract it and store the result; returns the result blob name"""
+    container, name = _split_blob_path(blob_path)
+    local_path = download_blob(container, name)
+
+    rendered = analyze_to_rendered_result(local_path, processing_method)
+    result_name = f"{name}.{processing_method}.json"
+    blob_service().get_blob_client(RESULTS_CONTAINER, result_name).upload_blob(
+        rendered.json_text.encode("utf-8"), overwrite=True)
+    if isinstance(rendered.data, dict) and rendered.data.get("error"):
+        logging.warning("Extraction of %s returned an error: %s", blob_path, rendered.data["error"])
+    return result_name
+
+
+@app.blob_trigger(arg_name="blob", path=f"{INPUT_CONTAINER}/{{name}}", connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="message", queue_name=QUEUE_NAME, connection="AzureWebJobsStorage")
+def invoice_blob_added(blob: func.InputStream, message: func.Out[str]):
+    """Queue every document uploaded to the input container for extraction"""
+    logging.info("Queueing %s (%s bytes)", blob.name, blob.length)
+    message.set(json.dumps({"blob": blob.name}))
+
+
+@app.queue_trigger(arg_name="msg", queue_name=QUEUE_NAME, connection="AzureWebJobsStorage")
+def extract_invoices(msg: func.QueueMessage):
+    """Extract the blob(s) named in a queue message and write the results"""
+    body = msg.get_json()
+    blobs = body.get("blobs") or [body["blob"]]
+    processing_method = body.get("processing_method", FUNCTION_PROCESSING_METHOD)
+    if processing_method not in PROCESSING_METHODS:
+        raise ValueError(f"Unknown processing method: {processing_method}")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FUNCTION_BATCH_WORKERS, len(blobs)))) as executor:
+        futures = {blob: executor.submit(extract_blob, blob, processing_method) for blob in blobs}
+    failed = []
+    for blob, future in futures.items():
+        try:
+            logging.info("Extracted %s -> %s/%s", blob, RESULTS_CONTAINER, future.result())
+        except Exception:
+            logging.exception("Extraction of %s failed", blob)
+            failed.append(blob)
+    if failed:
+        # Raising returns the message to the queue; blobs that succeeded are served from the cache on retry
+        raise RuntimeError(f"{len(failed)} of {len(blobs)} documents failed: {', '.join(failed)}")
@@ -0,0 +1,80 @@
+"""Gunicorn settings for running the app in production.
+
+    gunicorn app:app
+
+Extractions are network-bound (OCR and LLM calls), so each worker process runs
+several threads. Every setting can be overridden from the environment.
+
+The content-hash, duplicate and inbox indexes are shared between processes
+through journals (see journal.py), so ``WEB_CONCURRENCY`` can be raised. It
+defaults to one process, and threads carry the concurrency.
+"""
+import os
+import sys
+import time
+import signal
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Import the app (and its SDKs, models and prompts) once in the master, so
+# workers fork with them loaded and the pages of shared code stay shared
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# A multi-page document through Textract or BDA plus Claude can take minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+# On SIGTERM workers stop accepting requests and get this long to finish in-flight ones
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "120"))
+keepalive = 5
+
+# Recycle workers now and then so memory held by PDF rendering is returned
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "500"))
+max_requests_jitter = 50
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """Import provider SDKs in the master so forked workers share them.
+
+    The app imports SDKs lazily; PRELOAD_METHODS (comma separated) limits the
+    preload to the methods a deployment uses, and defaults to all of them.
+    """
+    app_module = sys.modules.get("app")
+    if app_module is None:
+        return
+    methods = [m.strip() for m in os.getenv("PRELOAD_METHODS", "").split(",") if m.strip()]
+    app_module.preload_sdks(methods or list(app_module.METHOD_SDKS))
+
+
+def post_worker_init(worker):
+    """Note when the worker is told to stop, so worker_exit knows what is left of graceful_timeout"""
+    def handle_exit(sig, frame, handle_exit=worker.handle_exit):
+        worker.exit_requested_at = time.monotonic()
+        handle_exit(sig, frame)
+    signal.signal(signal.SIGTERM, handle_exit)
+
+
+def worker_exit(server, worker):
+    """Let background extractions queued by bulk uploads finish before the worker exits.
+
+    In-flight requests have already used part of ``graceful_timeout`` since the
+    SIGTERM; the master kills the worker when it runs out, so the queue only
+    gets the rest.
+    """
+    app_module = sys.modules.get("app")
+    if app_module is None:
+        return
+    extraction_queue = app_module.EXTRACTION_QUEUE
+    requested_at = getattr(worker, "exit_requested_at", None)
+    elapsed = time.monotonic() - requested_at if requested_at is not None else 0.0
+    # A second is kept back so the warning below is logged before the kill
+    remaining = max(0.0, graceful_timeout - elapsed - 1)
+    pending = extraction_queue.pending()
+    if pending:
+        server.log.info("Worker %s draining %d queued extractions for up to %.0fs", worker.pid, pending, remaining)
+    if not extraction_queue.drain(timeout=remaining):
+        server.log.warning("Worker %s exited with %d extractions still queued", worker.pid, extraction_queue.pending())
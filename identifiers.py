@@ -0,0 +1,310 @@
+"""Local validation of Indian tax and bank identifiers, plus master-data lookups.
+
+GSTIN checksums, PAN structure, the PAN embedded in a GSTIN, state codes versus
+place of supply and IFSC structure are all checked without any network call.
+Known vendors (by GSTIN) and bank branches (by IFSC) are looked up in sorted,
+fixed-width index files that are memory-mapped, so a lookup is a binary search
+over the page cache rather than a CSV scan. Identifiers that fail a check get
+near-miss suggestions: single-character corrections that pass the checksum or
+exist in the master data.
+"""
+import os
+import re
+import csv
+import json
+import mmap
+import struct
+import tempfile
+import threading
+
+VENDOR_MASTER_CSV = os.getenv("VENDOR_MASTER_CSV", os.path.join("data", "vendors.csv"))
+IFSC_MASTER_CSV = os.getenv("IFSC_MASTER_CSV", os.path.join("data", "ifsc.csv"))
+
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_ALPHABET_INDEX = {char: index for index, char in enumerate(_ALPHABET)}
+
+GSTIN_PATTERN = re.compile(r'^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z][1-9A-Z]Z[0-9A-Z]$')
+PAN_PATTERN = re.compile(r'^[A-Z]{3}[PCHFATBLJG][A-Z][0-9]{4}[A-Z]$')
+IFSC_PATTERN = re.compile(r'^[A-Z]{4}0[A-Z0-9]{6}$')
+
+# Characters OCR and LLMs most often confuse, tried first when suggesting corrections
+_CONFUSABLE = {
+    "0": "OQD", "O": "0Q", "Q": "O0", "D": "0",
+    "1": "IL", "I": "1L", "L": "1I",
+    "2": "Z", "Z": "2",
+    "5": "S", "S": "5",
+    "8": "B", "B": "8",
+    "6": "G", "G": "6",
+}
+
+GST_STATE_CODES = {
+    "01": "Jammu and Kashmir", "02": "Himachal Pradesh", "03": "Punjab", "04": "Chandigarh",
+    "05": "Uttarakhand", "06": "Haryana", "07": "Delhi", "08": "Rajasthan", "09": "Uttar Pradesh",
+    "10": "Bihar", "11": "Sikkim", "12": "Arunachal Pradesh", "13": "Nagaland", "14": "Manipur",
+    "15": "Mizoram", "16": "Tripura", "17": "Meghalaya", "18": "Assam", "19": "West Bengal",
+    "20": "Jharkhand", "21": "Odisha", "22": "Chhattisgarh", "23": "Madhya Pradesh", "24": "Gujarat",
+    "26": "Dadra and Nagar Haveli and Daman and Diu", "27": "Maharashtra", "29": "Karnataka",
+    "30": "Goa", "31": "Lakshadweep", "32": "Kerala", "33": "Tamil Nadu", "34": "Puducherry",
+    "35": "Andaman and Nicobar Islands", "36": "Telangana", "37": "Andhra Pradesh", "38": "Ladakh",
+    "97": "Other Territory",
+}
+_STATE_NAMES = {name.lower(): code for code, name in GST_STATE_CODES.items()}
+
+
+def _normalize(value):
+    return re.sub(r'[\s-]', '', value).upper() if isinstance(value, str) else None
+
+
+def gstin_check_digit(first14):
+    """Compute the GSTIN check character for the first 14 characters"""
+    total = 0
+    for position, char in enumerate(first14):
+        product = _ALPHABET_INDEX[char] * (2 if position % 2 else 1)
+        total += product // 36 + product % 36
+    return _ALPHABET[(36 - total % 36) % 36]
+
+
+def is_valid_gstin(gstin):
+    gstin = _normalize(gstin)
+    return bool(gstin and GSTIN_PATTERN.match(gstin) and gstin_check_digit(gstin[:14]) == gstin[14]
+                and gstin[:2] in GST_STATE_CODES)
+
+
+def is_valid_pan(pan):
+    pan = _normalize(pan)
+    return bool(pan and PAN_PATTERN.match(pan))
+
+
+def is_valid_ifsc(ifsc):
+    ifsc = _normalize(ifsc)
+    return bool(ifsc and IFSC_PATTERN.match(ifsc))
+
+
+def state_code_for_place(place_of_supply):
+    """Return the GST state code named by a place of supply such as '27', '27-Maharashtra' or 'Maharashtra'"""
+    if not isinstance(place_of_supply, str):
+        return None
+    match = re.match(r'\s*(\d{2})\b', place_of_supply)
+    if match:
+        return match.group(1)
+    name = re.sub(r'\(.*?\)', '', place_of_supply).strip().lower()
+    return _STATE_NAMES.get(name)
+
+
+def _single_edits(value, confusable_only=False):
+    """Single-character substitutions, most likely OCR confusions first"""
+    for position, char in enumerate(value):
+        for replacement in _CONFUSABLE.get(char, ""):
+            yield value[:position] + replacement + value[position + 1:]
+    if confusable_only:
+        return
+    for position, char in enumerate(value):
+        for replacement in _ALPHABET:
+            if replacement != char and replacement not in _CONFUSABLE.get(char, ""):
+                yield value[:position] + replacement + value[position + 1:]
+
+
+def suggest_gstins(gstin, index=None, limit=5):
+    """Suggest corrections for a GSTIN that is one character away from a valid or known one"""
+    gstin = _normalize(gstin)
+    if not gstin or len(gstin) != 15:
+        return []
+    suggestions = []
+    # Without master data only likely confusions are offered; any edit could pass the checksum
+    for candidate in _single_edits(gstin, confusable_only=index is None):
+        known = index is not None and index.get(candidate) is not None
+        if known or (index is None and is_valid_gstin(candidate)):
+            suggestions.append(candidate)
+            if len(suggestions) >= limit:
+                break
+    return suggestions
+
+
+class MasterDataIndex:
+    """Read-only, memory-mapped index of CSV rows keyed by a fixed-width code.
+
+    The index file holds a small header, then fixed-size records sorted by key
+    (key bytes + payload offset + payload length), then the JSON payloads. Looking
+    up a key is a binary search over the mapped records.
+    """
+    MAGIC = b"IDX1"
+    _HEADER = struct.Struct("<4sII")
+    _POINTER = struct.Struct("<II")
+
+    def __init__(self, index_path):
+        self._file = open(index_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.key_width = self._HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"Not a master data index: {index_path}")
+        self._record_size = self.key_width + self._POINTER.size
+
+    @classmethod
+    def build(cls, csv_path, index_path, key_field, key_width):
+        """Write an index for the rows of a CSV file, keyed by ``key_field``"""
+        rows = {}
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                key = _normalize(row.get(key_field))
+                if key and len(key) == key_width and key.isascii():
+                    rows[key] = json.dumps(row, separators=(",", ":")).encode("utf-8")
+
+        keys = sorted(rows)
+        records_start = cls._HEADER.size
+        payload_offset = records_start + len(keys) * (key_width + cls._POINTER.size)
+        # A temporary file of its own, so processes rebuilding at the same time never share one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or ".",
+                                        prefix=os.path.basename(index_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(cls._HEADER.pack(cls.MAGIC, len(keys), key_width))
+                offset = payload_offset
+                for key in keys:
+                    f.write(key.encode("ascii") + cls._POINTER.pack(offset, len(rows[key])))
+                    offset += len(rows[key])
+                for key in keys:
+                    f.write(rows[key])
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def for_csv(cls, csv_path, key_field, key_width):
+        """Open the index next to a CSV file, rebuilding it when the CSV is newer"""
+        if not os.path.exists(csv_path):
+            return None
+        index_path = os.path.splitext(csv_path)[0] + ".idx"
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(csv_path):
+            cls.build(csv_path, index_path, key_field, key_width)
+        return cls(index_path)
+
+    def _key_at(self, position):
+        start = self._HEADER.size + position * self._record_size
+        return self._map[start:start + self.key_width]
+
+    def get(self, key):
+        """Return the CSV row stored for a key, or None"""
+        key = _normalize(key)
+        if not key or len(key) != self.key_width:
+            return None
+        target = key.encode("ascii", "replace")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key_at(low) == target:
+            start = self._HEADER.size + low * self._record_size + self.key_width
+            offset, length = self._POINTER.unpack_from(self._map, start)
+            return json.loads(self._map[offset:offset + length])
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# name -> (CSV path, CSV mtime, index or None)
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index(name, csv_path, key_field, key_width):
+    """The index of a master data CSV, reopened (and rebuilt) once the CSV changes"""
+    try:
+        mtime = os.path.getmtime(csv_path)
+    except OSError:
+        mtime = None
+    with _indexes_lock:
+        entry = _indexes.get(name)
+        if entry is None or entry[:2] != (csv_path, mtime):
+            # A replaced index is left to the garbage collector; other threads may still be reading its map
+            try:
+                index = MasterDataIndex.for_csv(csv_path, key_field, key_width)
+            except Exception as e:
+                print(f"Error loading {name} master data from {csv_path}: {e}")
+                index = None
+            entry = _indexes[name] = (csv_path, mtime, index)
+    return entry[2]
+
+
+def vendor_index():
+    return _index("vendor", VENDOR_MASTER_CSV, "gstin", 15)
+
+
+def ifsc_index():
+    return _index("ifsc", IFSC_MASTER_CSV, "ifsc", 11)
+
+
+def _check_party(result, party_key, issues, lookups, vendors):
+    party = result.get(party_key)
+    if not isinstance(party, dict):
+        return None
+    gstin = _normalize(party.get("gstin"))
+    pan = _normalize(party.get("pan"))
+
+    if gstin:
+        if not is_valid_gstin(gstin):
+            issues.append({"field": f"{party_key}.gstin", "value": gstin, "problem": "invalid GSTIN",
+                           "suggestions": suggest_gstins(gstin, vendors)})
+        elif vendors is not None:
+            vendor = vendors.get(gstin)
+            lookups[f"{party_key}.gstin"] = vendor
+            if vendor is None:
+                suggestions = suggest_gstins(gstin, vendors)
+                if suggestions:
+                    issues.append({"field": f"{party_key}.gstin", "value": gstin, "problem": "unknown GSTIN",
+                                   "suggestions": suggestions})
+    if pan:
+        if not is_valid_pan(pan):
+            issues.append({"field": f"{party_key}.pan", "value": pan, "problem": "invalid PAN", "suggestions": []})
+        if gstin and len(gstin) == 15 and gstin[2:12] != pan:
+            issues.append({"field": f"{party_key}.pan", "value": pan, "problem": "PAN does not match GSTIN",
+                           "suggestions": [gstin[2:12]] if is_valid_gstin(gstin) else []})
+    return gstin
+
+
+def check_identifiers(result):
+    """Check the GSTIN, PAN and IFSC values of a result dict.
+
+    Returns ``valid``, a list of ``issues`` (each with near-miss ``suggestions``)
+    and the master data rows found for the identifiers in ``lookups``.
+    """
+    issues = []
+    lookups = {}
+    if not isinstance(result, dict):
+        return {"valid": True, "issues": issues, "lookups": lookups}
+
+    vendors = vendor_index()
+    _check_party(result, "seller", issues, lookups, vendors)
+    buyer_gstin = _check_party(result, "buyer", issues, lookups, vendors)
+
+    # Place of supply should be the state the buyer is registered in
+    shipping = result.get("shipping_details") if isinstance(result.get("shipping_details"), dict) else {}
+    place_of_supply = result.get("place_of_supply") or shipping.get("place_of_supply")
+    place_code = state_code_for_place(place_of_supply)
+    if place_code and buyer_gstin and is_valid_gstin(buyer_gstin) and buyer_gstin[:2] != place_code:
+        issues.append({"field": "place_of_supply", "value": place_of_supply,
+                       "problem": f"state code {place_code} differs from buyer GSTIN state {buyer_gstin[:2]}",
+                       "suggestions": [f"{buyer_gstin[:2]}-{GST_STATE_CODES[buyer_gstin[:2]]}"]})
+
+    bank = result.get("bank_details")
+    ifsc = _normalize(bank.get("ifsc_code")) if isinstance(bank, dict) else None
+    if ifsc:
+        branches = ifsc_index()
+        if not is_valid_ifsc(ifsc):
+            suggestions = [candidate for candidate in _single_edits(ifsc, confusable_only=branches is None)
+                           if is_valid_ifsc(candidate) and (branches is None or branches.get(candidate) is not None)][:5]
+            issues.append({"field": "bank_details.ifsc_code", "value": ifsc, "problem": "invalid IFSC",
+                           "suggestions": suggestions})
+        elif branches is not None:
+            branch = branches.get(ifsc)
+            lookups["bank_details.ifsc_code"] = branch
+            if branch is None:
+                issues.append({"field": "bank_details.ifsc_code", "value": ifsc, "problem": "unknown IFSC",
+                               "suggestions": [c for c in _single_edits(ifsc) if branches.get(c) is not None][:5]})
+
+    return {"valid": not issues, "issues": issues, "lookups": lookups}
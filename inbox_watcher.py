@@ -0,0 +1,256 @@
+"""Watched-folder ingestion daemon.
+
+Watches one or more inbox directories and extracts every invoice dropped into
+them, without re-listing and reprocessing the whole folder on each run:
+
+* new and modified files are noticed through inotify (``inotify_simple``) when it
+  is installed, otherwise by a periodic ``os.scandir`` poll;
+* a file is only picked up once its size and mtime have been unchanged for
+  ``INBOX_DEBOUNCE_SECONDS``, so half-copied files are never extracted;
+* ready files go through the shared content-hash index (exact re-drops are
+  skipped) and into a bounded extraction queue, so a large drop applies
+  backpressure instead of piling up in memory;
+* every file's size, mtime, hash and status is appended to a state journal
+  (see journal.py), so a restart skips finished files and re-queues only those
+  that were in flight, and on SIGTERM the queue gets ``INBOX_DRAIN_TIMEOUT``
+  seconds to finish before the daemon exits.
+
+Usage::
+
+    python inbox_watcher.py /srv/invoices/inbox [/srv/invoices/other ...] [--method textract_claude]
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import argparse
+import threading
+
+from ingestion import EXTRACTION_WORKERS, EXTRACTION_QUEUE_SIZE, ExtractionQueue, file_sha256
+from journal import Journal
+
+# Seconds a file's size and mtime must stay unchanged before it is processed
+INBOX_DEBOUNCE_SECONDS = float(os.getenv("INBOX_DEBOUNCE_SECONDS", "5"))
+# Seconds between directory scans when inotify is unavailable
+INBOX_POLL_INTERVAL = float(os.getenv("INBOX_POLL_INTERVAL", "10"))
+INBOX_STATE_FILE = os.getenv("INBOX_STATE_FILE", os.path.join("uploads", "inbox_state.jsonl"))
+INBOX_PROCESSING_METHOD = os.getenv("INBOX_PROCESSING_METHOD", "bedrock_claude_sonnet")
+# On SIGTERM intake stops and queued extractions get this long to finish; keep it
+# below the service manager's stop timeout (90s by default under systemd)
+INBOX_DRAIN_TIMEOUT = float(os.getenv("INBOX_DRAIN_TIMEOUT", "60"))
+
+INBOX_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff')
+
+# Seconds a submit waits for room in the queue before checking for shutdown again
+_SUBMIT_WAIT = 1.0
+
+
+class InboxState:
+    """Persisted per-file progress: size, mtime, sha256 and status (queued, done, duplicate, error)"""
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._files = {}
+        self._journal = Journal(state_path, self._apply, self._snapshot)
+        self._lock = self._journal.mutex
+
+    def _apply(self, record):
+        record = dict(record)
+        self._files.setdefault(record.pop("path"), {}).update(record)
+
+    def _snapshot(self):
+        return [dict(entry, path=path) for path, entry in self._files.items()]
+
+    def is_current(self, path, size, mtime):
+        """Whether this exact version of the file has already been taken in"""
+        with self._lock:
+            entry = self._files.get(path)
+        return bool(entry) and entry["size"] == size and entry["mtime"] == mtime
+
+    def update(self, path, **fields):
+        self._journal.append(dict(fields, path=path))
+
+    def in_flight(self):
+        """Files queued before the last shutdown that never finished"""
+        with self._lock:
+            return [path for path, entry in self._files.items() if entry.get("status") == "queued"]
+
+
+def _inotify():
+    """An inotify watcher, or None when inotify_simple is missing or unsupported"""
+    try:
+        from inotify_simple import INotify
+        return INotify()
+    except (ImportError, OSError) as e:
+        print(f"inotify unavailable ({e}); polling inbox directories instead")
+        return None
+
+
+class InboxWatcher:
+    """Watch inbox directories and feed settled new files into an extraction queue"""
+
+    def __init__(self, directories, extraction_queue, state, hash_index, processing_method,
+                 debounce=INBOX_DEBOUNCE_SECONDS, poll_interval=INBOX_POLL_INTERVAL):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.queue = extraction_queue
+        self.state = state
+        self.hash_index = hash_index
+        self.processing_method = processing_method
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._pending = {}  # path -> (size, mtime, time the pair was first seen)
+        self._stop = threading.Event()
+        self._inotify = None
+        self._watch_dirs = {}
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def _candidate(self, path):
+        if path.lower().endswith(INBOX_EXTENSIONS) and path not in self._pending:
+            self._pending[path] = None
+
+    def _scan(self):
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        if not self.state.is_current(entry.path, stat.st_size, stat.st_mtime):
+                            self._candidate(entry.path)
+            except FileNotFoundError:
+                print(f"Inbox directory not found: {directory}")
+
+    def _read_events(self, timeout):
+        from inotify_simple import flags
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            directory = self._watch_dirs.get(event.wd)
+            if directory and event.name and not event.mask & flags.ISDIR:
+                self._candidate(os.path.join(directory, event.name))
+
+    def _settle(self):
+        """Submit pending files whose size and mtime have stopped changing"""
+        now = time.monotonic()
+        for path in list(self._pending):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            seen = self._pending[path]
+            if seen is None or seen[:2] != (stat.st_size, stat.st_mtime):
+                self._pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - seen[2] >= self.debounce:
+                del self._pending[path]
+                self._ingest(path, stat.st_size, stat.st_mtime)
+
+    def _ingest(self, path, size, mtime):
+        if self.state.is_current(path, size, mtime):
+            return
+        digest = file_sha256(path)
+        duplicate_of = self.hash_index.claim(digest, path)
+        if duplicate_of:
+            print(f"Skipping {os.path.basename(path)}: same content as {duplicate_of}")
+            self.state.update(path, size=size, mtime=mtime, sha256=digest, status="duplicate", duplicate_of=duplicate_of)
+            return
+        self.state.update(path, size=size, mtime=mtime, sha256=digest, status="queued")
+        self._submit(path)
+
+    def _submit(self, path):
+        """Queue a file, waiting while the queue is full, which throttles scanning to the extraction rate.
+
+        The wait ends on shutdown; the file is still marked queued and is resumed on restart.
+        """
+        while not self._stop.is_set():
+            try:
+                self.queue.submit(path, self.processing_method, timeout=_SUBMIT_WAIT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        """Watch until stopped (SIGINT/SIGTERM); queued files left unfinished resume on restart"""
+        for path in self.state.in_flight():
+            if os.path.exists(path):
+                print(f"Resuming {os.path.basename(path)}")
+                if not self._submit(path):
+                    return
+
+        self._inotify = _inotify()
+        if self._inotify is not None:
+            from inotify_simple import flags
+            for directory in self.directories:
+                wd = self._inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY)
+                self._watch_dirs[wd] = directory
+
+        # One scan catches files that arrived while the daemon was down; with
+        # inotify, later changes come from events only
+        self._scan()
+        last_scan = time.monotonic()
+        print(f"Watching {', '.join(self.directories)}")
+        while not self._stop.is_set():
+            tick = min(self.debounce, self.poll_interval) / 2 or 0.5
+            if self._inotify is not None:
+                self._read_events(tick)
+            else:
+                self._stop.wait(tick)
+                if time.monotonic() - last_scan >= self.poll_interval:
+                    self._scan()
+                    last_scan = time.monotonic()
+            self._settle()
+        print("Inbox watcher stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract invoices dropped into inbox directories")
+    parser.add_argument("directories", nargs="+", help="Directories to watch")
+    parser.add_argument("--method", default=INBOX_PROCESSING_METHOD, help="Processing method to extract with")
+    parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS, help="Parallel extractions")
+    parser.add_argument("--state-file", default=INBOX_STATE_FILE, help="Where progress is persisted")
+    parser.add_argument("--drain-timeout", type=float, default=INBOX_DRAIN_TIMEOUT,
+                        help="Seconds queued extractions get to finish on shutdown")
+    args = parser.parse_args(argv)
+
+    # Imported here so --help works without provider configuration
+    from app import CONTENT_HASH_INDEX, PROCESSING_METHODS, analyze_to_rendered_result
+    if args.method not in PROCESSING_METHODS:
+        parser.error(f"unknown processing method {args.method}; choose from {', '.join(PROCESSING_METHODS)}")
+
+    state = InboxState(args.state_file)
+
+    def extract(path, processing_method):
+        try:
+            rendered = analyze_to_rendered_result(path, processing_method)
+            data = rendered.data if isinstance(rendered.data, dict) else {}
+            if data.get("error"):
+                state.update(path, status="error", error=str(data["error"]))
+            else:
+                state.update(path, status="done")
+            print(f"Processed {os.path.basename(path)}")
+        except Exception as e:
+            state.update(path, status="error", error=str(e))
+            raise
+
+    extraction_queue = ExtractionQueue(extract, workers=args.workers, maxsize=EXTRACTION_QUEUE_SIZE)
+    watcher = InboxWatcher(args.directories, extraction_queue, state, CONTENT_HASH_INDEX, args.method)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    watcher.run()
+
+    # Intake has stopped; a second signal ends the drain at once
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    pending = extraction_queue.pending()
+    if pending:
+        print(f"Draining {pending} queued extractions for up to {args.drain_timeout:.0f}s")
+    if not extraction_queue.drain(timeout=args.drain_timeout):
+        print(f"Exiting with {extraction_queue.pending()} extractions still queued; they resume on restart")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
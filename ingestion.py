@@ -0,0 +1,280 @@
+"""Streaming ingestion of uploaded documents.
+
+Uploaded files are spooled straight to disk in the upload folder while their
+SHA-256 is computed in the same pass, so memory use stays flat regardless of
+upload size. The content hash is checked against an index of documents already
+ingested; duplicates are dropped before anything is renamed into place, and new
+documents are handed to a bounded extraction queue.
+"""
+import os
+import time
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+import zipfile
+
+from journal import Journal
+
+# Bytes read per chunk when copying ZIP members to disk
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# Largest ZIP member, and most bytes all members of one archive may expand to
+ZIP_MAX_MEMBER_BYTES = int(os.getenv("ZIP_MAX_MEMBER_BYTES", str(64 * 1024 * 1024)))
+ZIP_MAX_TOTAL_BYTES = int(os.getenv("ZIP_MAX_TOTAL_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Background extraction threads, and the queue length at which submitters block
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", "100"))
+
+ALLOWED_EXTENSIONS = (".pdf",)
+
+
+class ArchiveTooLargeError(ValueError):
+    """A ZIP archive expands beyond the member or total size limit"""
+
+
+class HashingSpool:
+    """Writable temp file in the target directory that hashes bytes as they are written.
+
+    Werkzeug's multipart parser writes each uploaded file part into the stream
+    returned by ``Request._get_file_stream``; returning one of these makes the
+    parse, the disk write and the hash a single pass.
+    """
+
+    def __init__(self, directory):
+        fd, self.name = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.done = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # read/seek/flush/... are served by the underlying file
+        return getattr(self._file, name)
+
+    def commit(self, path):
+        """Move the spooled bytes to their final path"""
+        self._file.close()
+        os.replace(self.name, path)
+        self.done = True
+
+    def discard(self):
+        """Delete the spooled bytes"""
+        self._file.close()
+        if os.path.exists(self.name):
+            os.remove(self.name)
+        self.done = True
+
+
+def spool_stream(source, directory, chunk_size=SPOOL_CHUNK_SIZE, max_bytes=None):
+    """Copy a readable stream into a HashingSpool chunk by chunk, failing past ``max_bytes``"""
+    spool = HashingSpool(directory)
+    try:
+        if max_bytes is None:
+            shutil.copyfileobj(source, spool, chunk_size)
+        else:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                if spool.size + len(chunk) > max_bytes:
+                    raise ArchiveTooLargeError(f"expands to more than {max_bytes} bytes")
+                spool.write(chunk)
+        spool.flush()
+    except Exception:
+        spool.discard()
+        raise
+    return spool
+
+
+def iter_zip_spools(zip_path, directory, max_member_bytes=ZIP_MAX_MEMBER_BYTES, max_total_bytes=ZIP_MAX_TOTAL_BYTES):
+    """Yield (member name, HashingSpool) for each allowed file in a ZIP archive.
+
+    Raises ArchiveTooLargeError at the first member over ``max_member_bytes``, or
+    that takes the archive over ``max_total_bytes``. Declared sizes are checked
+    before a member is read, and the bytes written are counted while it is, so
+    a forged header stops at the limit too.
+    """
+    total = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir() or not member.filename.lower().endswith(ALLOWED_EXTENSIONS):
+                continue
+            limit = min(max_member_bytes, max_total_bytes - total)
+            if member.file_size > limit:
+                raise ArchiveTooLargeError(f"{member.filename} expands to more than {limit} bytes")
+            with archive.open(member) as source:
+                try:
+                    spool = spool_stream(source, directory, max_bytes=limit)
+                except ArchiveTooLargeError as e:
+                    raise ArchiveTooLargeError(f"{member.filename} {e}") from None
+            total += spool.size
+            yield os.path.basename(member.filename), spool
+
+
+def file_sha256(path, chunk_size=SPOOL_CHUNK_SIZE):
+    """SHA-256 of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentHashIndex:
+    """Persistent map of content SHA-256 to the path the document was stored at.
+
+    Shared by every worker process and the inbox daemon through a journal of
+    ``{"digest", "path"}`` records (see journal.py).
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._paths = {}
+        self._digests = {}
+        self._journal = Journal(index_path, self._apply, self._snapshot)
+        self._lock = self._journal.mutex
+
+    def _apply(self, record):
+        digest, path = record["digest"], record["path"]
+        previous = self._digests.get(path)
+        self._digests[path] = digest
+        if previous and previous != digest and self._paths.get(previous) == path:
+            # The path was overwritten with new content
+            del self._paths[previous]
+        self._paths[digest] = path
+
+    def _snapshot(self):
+        # Documents deleted since they were recorded are left out
+        return [{"digest": digest, "path": path} for digest, path in self._paths.items() if os.path.exists(path)]
+
+    def get(self, digest):
+        """Path of the stored document with this hash, if it still exists"""
+        with self._lock:
+            self._journal.refresh()
+            path = self._paths.get(digest)
+        return path if path and os.path.exists(path) else None
+
+    def entries(self):
+        """(digest, path) of every recorded document that still exists"""
+        with self._lock:
+            self._journal.refresh()
+            items = list(self._paths.items())
+        return [(digest, path) for digest, path in items if os.path.exists(path)]
+
+    def digest_of(self, path):
+        """Content hash last recorded for a path, or None"""
+        with self._lock:
+            self._journal.refresh()
+            return self._digests.get(path)
+
+    def claim(self, digest, path):
+        """Record ``path`` for ``digest`` unless a live document already has it.
+
+        Returns the existing path for a duplicate, or None when the claim succeeded.
+        Check and insert happen under the journal lock, so two concurrent uploads
+        of the same bytes cannot both be accepted, even in different processes.
+        """
+        with self._journal.locked():
+            existing = self._paths.get(digest)
+            if existing and existing != path and os.path.exists(existing):
+                if os.path.exists(path):
+                    # Remember what an already stored copy contains
+                    self._digests[path] = digest
+                return existing
+            if self._paths.get(digest) != path or self._digests.get(path) != digest:
+                self._journal.append({"digest": digest, "path": path})
+            return None
+
+
+def store_spool(spool, filename, directory, hash_index):
+    """Commit a spool under a safe, unused name, or discard it if its content is known.
+
+    Returns ``(path, duplicate_of)``; exactly one of the two is set.
+    """
+    digest = spool.hexdigest()
+    existing = hash_index.get(digest)
+    if existing:
+        spool.discard()
+        return None, existing
+
+    path = os.path.join(directory, filename)
+    if os.path.exists(path):
+        # Same name, different content: keep both
+        stem, extension = os.path.splitext(filename)
+        path = os.path.join(directory, f"{stem}_{digest[:8]}{extension}")
+    existing = hash_index.claim(digest, path)
+    if existing:
+        spool.discard()
+        return None, existing
+    spool.commit(path)
+    return path, None
+
+
+class ExtractionQueue:
+    """Bounded queue of (file path, processing method) drained by background threads"""
+
+    def __init__(self, handler, workers=EXTRACTION_WORKERS, maxsize=EXTRACTION_QUEUE_SIZE):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"extraction-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            file_path, processing_method = self._queue.get()
+            try:
+                self.handler(file_path, processing_method)
+            except Exception as e:
+                print(f"Background extraction failed for {os.path.basename(file_path)}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, file_path, processing_method, block=True, timeout=None):
+        """Enqueue a document; blocks while the queue is full unless ``block`` is False.
+
+        Raises ``queue.Full`` when the queue is still full without blocking or
+        after ``timeout`` seconds; request handlers pass ``block=False``.
+        """
+        if self._closed:
+            raise RuntimeError("Extraction queue is shutting down")
+        self._start()
+        self._queue.put((file_path, processing_method), block=block, timeout=timeout)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        """Wait until every queued document has been processed"""
+        self._queue.join()
+
+    def drain(self, timeout=None):
+        """Stop accepting documents and wait for queued ones to finish.
+
+        Returns True when everything finished, False if ``timeout`` ran out first.
+        """
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
@@ -0,0 +1,171 @@
+"""Append-only JSON-lines journals behind the indexes shared between processes.
+
+Gunicorn workers, their background extraction threads and the inbox daemon all
+update the same indexes (content hashes, duplicates, inbox progress). Each keeps
+its index in memory and records every change as one JSON line appended to its
+journal under an exclusive ``flock``. Before reading, a process replays the lines
+the others appended since it last looked, the way progress streams tail job
+logs. No writer can drop another's entries, and an update costs one appended
+line however large the index is.
+
+Superseded lines pile up, so once a journal passes ``JOURNAL_COMPACT_BYTES`` it
+is rewritten, still under the lock, to one line per live entry and swapped in
+with ``os.replace``. The rewritten file starts with a ``{"journal": <generation>}``
+line; readers that find another generation replay the file from the start, and
+the live set applies on top of what they hold without changing it.
+
+``fcntl`` is POSIX only; elsewhere the journal is safe within one process.
+"""
+import os
+import json
+import uuid
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Journals larger than this are compacted, and again each time they double past their live size
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+
+
+class Journal:
+    """A JSON-lines file folded into its owner's state by ``apply(record)``.
+
+    ``mutex`` guards that state: owners read it while holding the mutex, after
+    ``refresh()``, and change it only through ``append``. ``snapshot()`` returns
+    records that rebuild the state; without it the journal is never compacted.
+    Applying a snapshot record to a state that already has it must change nothing.
+    """
+
+    def __init__(self, path, apply, snapshot=None, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.mutex = threading.RLock()
+        self._apply = apply
+        self._snapshot = snapshot
+        self.compact_bytes = compact_bytes
+        self._compact_at = compact_bytes
+        self._inode = None
+        self._generation = None
+        self._offset = 0
+        self._held = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    @staticmethod
+    def _generation_of(record):
+        """The generation named by the first line of a compacted journal, or None for any other record"""
+        return record["journal"] if isinstance(record, dict) and list(record) == ["journal"] else None
+
+    def _replay(self, f):
+        self._inode = os.fstat(f.fileno()).st_ino
+        f.seek(0)
+        try:
+            generation = self._generation_of(json.loads(f.readline()))
+        except ValueError:
+            generation = None
+        if generation != self._generation:
+            # Compacted by another process since it was last read
+            self._generation, self._offset = generation, 0
+        f.seek(self._offset)
+        data = f.read()
+        # A line still being written has no newline yet and is read next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if self._generation_of(record) is None:
+                    self._apply(record)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Skipping unreadable line of {self.path}: {e}")
+        self._offset += end
+
+    def refresh(self):
+        """Apply the lines appended since the last refresh, by any process"""
+        with self.mutex:
+            try:
+                stat = os.stat(self.path)
+                if stat.st_ino == self._inode and stat.st_size == self._offset:
+                    return
+                with open(self.path, "rb") as f:
+                    self._replay(f)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def locked(self):
+        """Hold the journal against every thread and process, with all lines applied.
+
+        Check-and-insert operations run inside, so two processes cannot both
+        insert the same key. Re-entrant within a thread.
+        """
+        with self.mutex:
+            if self._held is not None:
+                yield
+                return
+            with self._open_locked() as f:
+                self._held = f
+                try:
+                    self._replay(f)
+                    yield
+                    if self._snapshot is not None and self._offset >= self._compact_at:
+                        self._compact()
+                finally:
+                    # Closing the file releases the flock
+                    self._held = None
+
+    def _open_locked(self):
+        """The journal file, opened for appending and flocked"""
+        while True:
+            f = open(self.path, "ab+")
+            if fcntl is None:
+                return f
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            # Compacted while this process waited for the lock: lock the new file instead
+            f.close()
+
+    def _compact(self):
+        """Rewrite the journal as the records of the live state, under the held lock"""
+        generation = uuid.uuid4().hex
+        lines = [{"journal": generation}] + list(self._snapshot())
+        data = "".join(json.dumps(record) + "\n" for record in lines).encode("utf-8")
+        self._compact_at = max(self.compact_bytes, 2 * len(data))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                        prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                inode = os.fstat(f.fileno()).st_ino
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # Nothing in the new file needs applying here
+        self._inode, self._generation, self._offset = inode, generation, len(data)
+
+    def append(self, record):
+        """Apply ``record`` and append it to the journal"""
+        with self.locked():
+            f = self._held
+            line = json.dumps(record) + "\n"
+            if os.fstat(f.fileno()).st_size != self._offset:
+                # Ends a line a crashed writer left unfinished, which replays skip
+                line = "\n" + line
+            f.write(line.encode("utf-8"))
+            f.flush()
+            self._offset = f.tell()
+            self._apply(record)
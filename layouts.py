@@ -0,0 +1,43 @@
+"""Provider OCR/layout output of each document, kept so extraction can re-run without it.
+
+The output of an OCR or layout provider depends only on the document's bytes,
+never on the ``Invoice`` schema or the prompts. Storing it by content hash
+lets a schema or prompt change re-run just the LLM stage on the stored output:
+
+    <directory>/<sha256>_<provider>.json
+
+Textract keeps its own per-page block cache (see textract_analysis.py); this
+store holds the Bedrock Data Automation outputs and Document Intelligence
+AnalyzeResults. Clearing the result cache leaves it alone.
+"""
+import os
+import json
+
+
+class LayoutStore:
+    """JSON layout output per document content and provider"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, provider):
+        return os.path.join(self.directory, f"{digest}_{provider}.json")
+
+    def get(self, digest, provider):
+        """Stored output, or None"""
+        path = self.path(digest, provider)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading stored layout {os.path.basename(path)}: {e}")
+            return None
+
+    def put(self, digest, provider, output):
+        path = self.path(digest, provider)
+        with open(path + ".tmp", "w") as f:
+            json.dump(output, f, default=str)
+        os.replace(path + ".tmp", path)
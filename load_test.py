@@ -0,0 +1,105 @@
+"""Measure how request throughput scales with the number of gunicorn workers.
+
+Starts ``gunicorn app:app`` once per worker count, sends requests to one path
+from a pool of client threads for a fixed time, and prints requests per second
+and latency percentiles for each run::
+
+    python load_test.py --workers 1 2 4 8 --path / --concurrency 32 --duration 20
+
+Point ``--path`` at an endpoint that exercises what you want to measure, e.g.
+``/result.json?file_path=uploads/x.pdf&processing_method=textract_claude`` for
+cached results. ``--url`` load-tests an already running server instead.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def run_load(url, concurrency, duration):
+    """Hit ``url`` from ``concurrency`` threads for ``duration`` seconds"""
+    deadline = time.monotonic() + duration
+
+    def client():
+        latencies, errors = [], 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                with urllib.request.urlopen(url, timeout=300) as response:
+                    response.read()
+                latencies.append(time.monotonic() - started)
+            except Exception:
+                errors += 1
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: client(), range(concurrency)))
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    errors = sum(client_errors for _, client_errors in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float("nan")
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+    }
+
+
+def print_row(label, stats):
+    print(f"{label:>8} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>9.1f} "
+          f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=int(os.getenv("GUNICORN_THREADS", "8")))
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--url", help="Load-test this running server instead of starting gunicorn")
+    args = parser.parse_args(argv)
+
+    print(f"{'workers':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    if args.url:
+        print_row("-", run_load(args.url, args.concurrency, args.duration))
+        return 0
+
+    url = f"http://127.0.0.1:{args.port}{args.path}"
+    for worker_count in args.workers:
+        env = dict(os.environ, WEB_CONCURRENCY=str(worker_count), GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_BIND=f"127.0.0.1:{args.port}")
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:app", "--access-logfile", "/dev/null"],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_until_up(url):
+                print(f"{worker_count:>8} server did not start")
+                continue
+            print_row(str(worker_count), run_load(url, args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""Local OCR with Tesseract for the local_ocr method.
+
+Pages are rasterized and read by Tesseract (through pytesseract) in a pool of
+worker processes, one page per task, so a long document uses every core and no
+page image crosses a process boundary. Each page comes back as plain JSON::
+
+    {"width": 2480, "height": 3508, "words": [{"text", "confidence", "bbox"}, ...]}
+
+with confidences from 0 to 1 and boxes as fractions of the page, the word format
+of provenance.py. From the words this module renders:
+
+* ``layout_markdown``: the document as Document Intelligence style markdown
+  (lines in reading order, tables as markdown, ``<!-- PageBreak -->`` between
+  pages), which the LLM extractors and chunked extraction take as is;
+* ``layout_tables``: the tables in the cell format of vendor_templates.py.
+
+Tesseract often reads the columns of a table as separate blocks, so words are
+regrouped into lines by their position, and runs of lines that split into
+columns at wide horizontal gaps are read as a table. Needs the ``tesseract``
+binary on the PATH.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+LOCAL_OCR_WORKERS = int(os.getenv("LOCAL_OCR_WORKERS", str(os.cpu_count() or 2)))
+LOCAL_OCR_DPI = int(os.getenv("LOCAL_OCR_DPI", "300"))
+LOCAL_OCR_LANG = os.getenv("LOCAL_OCR_LANG", "eng")
+# LLM that extracts invoices no vendor template applies to: claude, gpt or none (fully offline)
+LOCAL_OCR_EXTRACTOR = os.getenv("LOCAL_OCR_EXTRACTOR", "claude").lower()
+
+# Horizontal gap (page fraction) between two columns of a table row
+_COLUMN_GAP = 0.025
+# Least columns and rows (heading included) read as a table
+_MIN_COLUMNS = 3
+_MIN_ROWS = 3
+# Vertical gap, in line heights, that ends a table
+_ROW_GAP = 2.5
+PAGE_BREAK = "\n<!-- PageBreak -->\n"
+
+
+def _box(left, top, width, height):
+    return [round(left, 4), round(top, 4), round(width, 4), round(height, 4)]
+
+
+def ocr_page(file_path, page, dpi=LOCAL_OCR_DPI, lang=LOCAL_OCR_LANG):
+    """Read one page of a PDF or image with Tesseract; runs in a worker process"""
+    import pytesseract
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+        image = convert_from_path(file_path, dpi=dpi, first_page=page, last_page=page)[0]
+    else:
+        from PIL import Image
+        image = Image.open(file_path)
+        if page > 1:
+            image.seek(page - 1)
+        image.load()
+    try:
+        data = pytesseract.image_to_data(image.convert("RGB"), lang=lang, output_type=pytesseract.Output.DICT)
+        width, height = image.width, image.height
+    finally:
+        image.close()
+
+    words = []
+    for index, text in enumerate(data["text"]):
+        # Level 5 entries are words; the others are the blocks, paragraphs and lines around them
+        if data["level"][index] != 5 or not text.strip():
+            continue
+        words.append({"text": text.strip(), "confidence": max(0.0, float(data["conf"][index])) / 100,
+                      "bbox": _box(data["left"][index] / width, data["top"][index] / height,
+                                   data["width"][index] / width, data["height"][index] / height)})
+    return {"width": width, "height": height, "words": words}
+
+
+def _page_count(file_path):
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(file_path)["Pages"])
+    from PIL import Image
+    with Image.open(file_path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+class LocalOCR:
+    """Tesseract OCR of whole documents over a shared pool of worker processes"""
+
+    def __init__(self, workers=LOCAL_OCR_WORKERS, dpi=LOCAL_OCR_DPI, lang=LOCAL_OCR_LANG):
+        self.workers = max(1, workers)
+        self.dpi = dpi
+        self.lang = lang
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: the app process runs threads that a fork would copy mid-flight
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def analyze(self, file_path):
+        """Return the OCR of every page of a PDF or image, in page order"""
+        page_count = _page_count(file_path)
+        if page_count == 1:
+            # A single page is not worth a round trip through the pool
+            return [ocr_page(file_path, 1, self.dpi, self.lang)]
+        pool = self._pool()
+        futures = [pool.submit(ocr_page, file_path, page, self.dpi, self.lang) for page in range(1, page_count + 1)]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def _lines(page):
+    """Words of a page grouped into lines by position, top to bottom and left to right"""
+    lines = []
+    for word in sorted(page["words"], key=lambda word: word["bbox"][1] + word["bbox"][3] / 2):
+        centre = word["bbox"][1] + word["bbox"][3] / 2
+        if lines and lines[-1][0] <= centre <= lines[-1][1]:
+            lines[-1][2].append(word)
+        else:
+            lines.append([word["bbox"][1], word["bbox"][1] + word["bbox"][3], [word]])
+    return [sorted(words, key=lambda word: word["bbox"][0]) for _, _, words in lines]
+
+
+def layout_words(pages):
+    """Words of OCR or text-layer pages in the format of provenance.py, in reading order"""
+    return [{"text": word["text"], "confidence": word["confidence"], "page": number, "bbox": word["bbox"]}
+            for number, page in enumerate(pages, 1) for line in _lines(page) for word in line]
+
+
+def _segments(words):
+    """Split a line's words into cells at wide horizontal gaps"""
+    segments = []
+    for word in words:
+        if segments and word["bbox"][0] - (segments[-1][-1]["bbox"][0] + segments[-1][-1]["bbox"][2]) <= _COLUMN_GAP:
+            segments[-1].append(word)
+        else:
+            segments.append([word])
+    return segments
+
+
+def _cell(words):
+    left = min(word["bbox"][0] for word in words)
+    top = min(word["bbox"][1] for word in words)
+    right = max(word["bbox"][0] + word["bbox"][2] for word in words)
+    bottom = max(word["bbox"][1] + word["bbox"][3] for word in words)
+    return {"text": " ".join(word["text"] for word in words), "bbox": _box(left, top, right - left, bottom - top)}
+
+
+def _column(cell, heading):
+    """Index of the heading cell a body cell sits under: most overlap, else nearest centre"""
+    left, right = cell["bbox"][0], cell["bbox"][0] + cell["bbox"][2]
+
+    def score(index):
+        head = heading[index]["bbox"]
+        overlap = min(right, head[0] + head[2]) - max(left, head[0])
+        return overlap, -abs((left + right) / 2 - (head[0] + head[2] / 2))
+
+    return max(range(len(heading)), key=score)
+
+
+def page_layout(page):
+    """Lines and tables of one page in reading order, as ("line", text) and ("table", rows) items"""
+    items = []
+    run = []
+
+    def flush():
+        if len(run) >= _MIN_ROWS:
+            heading = run[0]
+            rows = [heading]
+            for segments in run[1:]:
+                row = [None] * len(heading)
+                for cell in segments:
+                    index = _column(cell, heading)
+                    # Cells that fall under one heading are one cell split at a wide gap
+                    row[index] = cell if row[index] is None else _cell([row[index], cell])
+                rows.append(row)
+            items.append(("table", rows))
+        else:
+            items.extend(("line", " ".join(cell["text"] for cell in segments)) for segments in run)
+        run.clear()
+
+    for words in _lines(page):
+        cells = [_cell(segment) for segment in _segments(words)]
+        if run:
+            last = run[-1][0]["bbox"]
+            if cells[0]["bbox"][1] - (last[1] + last[3]) > _ROW_GAP * last[3]:
+                flush()
+        # A row keeps the table going with at least two of its cells; a heading needs more
+        if len(cells) >= (2 if run else _MIN_COLUMNS):
+            run.append(cells)
+            continue
+        flush()
+        items.append(("line", " ".join(cell["text"] for cell in cells)))
+    flush()
+    return items
+
+
+def _table_markdown(rows):
+    def text(cell):
+        return (cell or {}).get("text", "").replace("|", "/")
+
+    lines = ["| " + " | ".join(text(cell) for cell in rows[0]) + " |", "|" + " --- |" * len(rows[0])]
+    lines.extend("| " + " | ".join(text(cell) for cell in row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def layout_markdown(pages):
+    """Text of the whole document as Document Intelligence style markdown"""
+    rendered = []
+    for page in pages:
+        parts = [text if kind == "line" else _table_markdown(text) for kind, text in page_layout(page)]
+        rendered.append("\n".join(part for part in parts if part))
+    return PAGE_BREAK.join(rendered)
+
+
+def layout_tables(pages):
+    """Tables of OCR or text-layer pages as rows of {"text", "bbox"} cells (see vendor_templates.py)"""
+    return [{"page": number, "rows": rows} for number, page in enumerate(pages, 1)
+            for kind, rows in page_layout(page) if kind == "table"]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_local_ocr():
+    """Shared engine, so every request uses the same worker processes"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = LocalOCR()
+        return _engine
@@ -0,0 +1,158 @@
+"""Re-extract cached results after the Invoice schema or a prompt changes.
+
+Every cached result records the ``SCHEMA_VERSION`` and ``PROMPT_VERSION`` it was
+extracted with (see prompts.py). This tool finds the results whose versions
+differ from the current ones and re-runs their extraction with the cached result
+bypassed. OCR/layout output is reused (Textract's page cache and layouts.py),
+so only the LLM stage runs again.
+
+Documents run ``--workers`` at a time, behind the same provider pools as the
+app. Each outcome is appended to ``<UPLOAD_FOLDER>/migrations/<schema>-<prompt>.jsonl``.
+Interrupting and re-running the tool resumes where it stopped: finished
+documents are current and no longer selected, and documents that failed are
+skipped unless ``--retry-failed`` is given.
+
+Usage::
+
+    python migrate.py --dry-run
+    python migrate.py --workers 4 [--method textract_claude] [--limit 100] [--retry-failed]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MIGRATION_WORKERS = int(os.getenv("MIGRATION_WORKERS", "4"))
+
+
+class MigrationLog:
+    """Outcome of every document of one migration, appended as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def failed(self):
+        """(file path, processing method) pairs whose last outcome was a failure"""
+        outcomes = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        outcomes[(entry["file"], entry["processing_method"])] = entry["status"]
+        return {key for key, status in outcomes.items() if status == "error"}
+
+    def record(self, **entry):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(dict(entry, at=time.time())) + "\n")
+
+
+def migrate(pending, reextract, log, workers=MIGRATION_WORKERS, is_current=None):
+    """Re-extract ``pending`` (path, method) pairs, at most ``workers`` at a time; returns outcome counts.
+
+    ``is_current(data)``, if given, must hold for a re-extracted result to count as migrated.
+    """
+    counts = Counter()
+    pending = iter(pending)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        running = {}
+
+        def fill():
+            # Submitting lazily means an interrupt leaves the rest of the backlog untouched
+            while len(running) < max(1, workers):
+                job = next(pending, None)
+                if job is None:
+                    return
+                running[executor.submit(run, *job)] = job
+
+        def run(path, method):
+            started = time.monotonic()
+            rendered = reextract(path, method)
+            if rendered is None:
+                raise RuntimeError("no result was cached")
+            if isinstance(rendered.data, dict) and "error" in rendered.data:
+                raise RuntimeError(str(rendered.data["error"]))
+            if is_current is not None and not is_current(rendered.data):
+                raise RuntimeError("the cached result is still from an older schema or prompt version")
+            return time.monotonic() - started
+
+        def record(future):
+            path, method = running.pop(future)
+            try:
+                seconds = future.result()
+                log.record(file=path, processing_method=method, status="ok", seconds=round(seconds, 3))
+                counts["ok"] += 1
+                print(f"Re-extracted {os.path.basename(path)} with {method} in {seconds:.1f}s")
+            except Exception as e:
+                log.record(file=path, processing_method=method, status="error", error=str(e))
+                counts["error"] += 1
+                print(f"Re-extraction of {os.path.basename(path)} with {method} failed: {e}")
+
+        try:
+            fill()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future)
+                fill()
+        except KeyboardInterrupt:
+            # Running extractions finish and are logged; the rest resume on the next run
+            for future in list(running):
+                if future.cancel():
+                    del running[future]
+            print(f"Interrupted, finishing {len(running)} running extractions")
+            wait(running)
+            for future in list(running):
+                record(future)
+            raise
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-extract results cached with an older schema or prompt version")
+    parser.add_argument("--method", action="append", help="Limit to these processing methods")
+    parser.add_argument("--workers", type=int, default=MIGRATION_WORKERS, help="Documents re-extracted at a time")
+    parser.add_argument("--limit", type=int, help="Re-extract at most this many results")
+    parser.add_argument("--retry-failed", action="store_true", help="Also retry results that failed in earlier runs")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the stale results")
+    args = parser.parse_args(argv)
+
+    # The app owns the result cache, the layout stores and the provider clients
+    from app import EXTRACTION_VERSIONS, app, is_current_result, reextract, stale_results
+    log = MigrationLog(os.path.join(app.config["UPLOAD_FOLDER"], "migrations",
+                                    f"{EXTRACTION_VERSIONS['schema']}-{EXTRACTION_VERSIONS['prompt']}.jsonl"))
+    skip = set() if args.retry_failed else log.failed()
+
+    stale = []
+    by_version = Counter()
+    for path, method, versions in stale_results(args.method):
+        if (path, method) in skip:
+            continue
+        by_version[(method, json.dumps(versions, sort_keys=True))] += 1
+        stale.append((path, method))
+    if args.limit is not None:
+        stale = stale[:args.limit]
+
+    print(f"Current versions: {json.dumps(EXTRACTION_VERSIONS)}")
+    for (method, versions), count in sorted(by_version.items()):
+        print(f"  {count} {method} results extracted with {versions}")
+    if skip:
+        print(f"  {len(skip)} results that failed before are skipped (--retry-failed to retry them)")
+    if args.dry_run or not stale:
+        print(f"{len(stale)} results to re-extract")
+        return 0
+
+    counts = migrate(stale, reextract, log, args.workers, is_current_result)
+    print(f"Re-extracted {counts['ok']} results, {counts['error']} failed; log: {log.path}")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Pydantic models describing the structured invoice data we extract."""
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+
+class SellerInfo(BaseModel):
+    """Information about the seller/vendor"""
+    name: Optional[str] = Field(None, description="Legal name of the seller")
+    address: Optional[str] = Field(None, description="Complete address of the seller")
+    gstin: Optional[str] = Field(None, description="GST Identification Number of the seller")
+    pan: Optional[str] = Field(None, description="Permanent Account Number of the seller")
+    contact_details: Optional[str] = Field(None, description="Contact information including phone, email, etc.")
+
+
+class BuyerInfo(BaseModel):
+    """Information about the buyer/customer"""
+    name: Optional[str] = Field(None, description="Legal name of the buyer")
+    address: Optional[str] = Field(None, description="Complete address of the buyer")
+    gstin: Optional[str] = Field(None, description="GST Identification Number of the buyer")
+    pan: Optional[str] = Field(None, description="Permanent Account Number of the buyer")
+    contact_details: Optional[str] = Field(None, description="Contact information including phone, email, etc.")
+
+
+class LineItem(BaseModel):
+    """Details of a single line item in the invoice"""
+    description: Optional[str] = Field(None, description="Description of the product or service")
+    hsn_sac: Optional[str] = Field(None, description="HSN (Harmonized System of Nomenclature) or SAC (Services Accounting Code)")
+    quantity: Optional[float] = Field(None, description="Quantity of the item")
+    unit: Optional[str] = Field(None, description="Unit of measurement (e.g., PCS, KG, HRS)")
+    unit_price: Optional[float] = Field(None, description="Price per unit")
+    tax_percentage: Optional[float] = Field(None, description="Tax percentage applied to this item")
+    tax_amount: Optional[float] = Field(None, description="Tax amount for this item")
+    amount: Optional[float] = Field(None, description="Total amount for the line item (typically quantity × unit_price)")
+
+
+class TaxDetail(BaseModel):
+    """Details of a tax component"""
+    tax_type: Optional[str] = Field(None, description="Type of tax (e.g., CGST, SGST, IGST)")
+    rate: Optional[float] = Field(None, description="Tax rate as a percentage")
+    amount: Optional[float] = Field(None, description="Amount of tax")
+
+
+class BankDetails(BaseModel):
+    """Banking information for payment"""
+    bank_name: Optional[str] = Field(None, description="Name of the bank")
+    account_number: Optional[str] = Field(None, description="Bank account number")
+    ifsc_code: Optional[str] = Field(None, description="IFSC (Indian Financial System Code)")
+    branch: Optional[str] = Field(None, description="Bank branch location")
+
+
+class ShippingDetails(BaseModel):
+    """Information about shipping or delivery"""
+    shipped_to: Optional[str] = Field(None, description="Name of the recipient")
+    ship_to_address: Optional[str] = Field(None, description="Shipping address")
+    place_of_supply: Optional[str] = Field(None, description="State code or name for place of supply")
+    transporter: Optional[str] = Field(None, description="Name of the transporter")
+    vehicle_number: Optional[str] = Field(None, description="Vehicle registration number")
+    dispatch_date: Optional[str] = Field(None, description="Date of dispatch")
+
+
+class Invoice(BaseModel):
+    """Complete invoice data model"""
+    # Basic invoice information
+    invoice_number: Optional[str] = Field(None, description="Unique identifier for the invoice")
+    invoice_date: Optional[str] = Field(None, description="Date when the invoice was issued (DD/MM/YYYY format)")
+    due_date: Optional[str] = Field(None, description="Date by which payment is due (DD/MM/YYYY format)")
+    payment_terms: Optional[str] = Field(None, description="Terms of payment (e.g., '30 days', 'Net 15', 'Immediate')")
+    currency: Optional[str] = Field(None, description="Currency code or symbol (e.g., INR, USD, EUR)")
+    
+    # Parties information
+    seller: Optional[SellerInfo] = Field(None, description="Information about the seller/vendor")
+    buyer: Optional[BuyerInfo] = Field(None, description="Information about the buyer/customer")
+    
+    # Line items and financial information
+    items: List[LineItem] = Field(default_factory=list, description="Line items in the invoice")
+    subtotal: Optional[float] = Field(None, description="Total amount before taxes in the invoice currency")
+    tax_details: List[TaxDetail] = Field(default_factory=list, description="Breakdown of taxes applied")
+    total_tax_amount: Optional[float] = Field(None, description="Sum of all taxes in the invoice currency")
+    total_amount: Optional[float] = Field(None, description="Final invoice amount including taxes in the invoice currency")
+    amount_in_words: Optional[str] = Field(None, description="Total amount expressed in words including currency")
+    
+    # Reference information
+    po_number: Optional[str] = Field(None, description="Purchase Order number reference")
+    shipping_details: Optional[ShippingDetails] = Field(None, description="Information about shipping or delivery")
+    bank_details: Optional[BankDetails] = Field(None, description="Banking information for payment")
+    
+    # GST-specific information
+    irn: Optional[str] = Field(None, description="Invoice Reference Number for e-invoicing")
+    ack_number: Optional[str] = Field(None, description="Acknowledgement number for e-invoicing")
+    place_of_supply: Optional[str] = Field(None, description="State code or name for place of supply")
+    reverse_charge: Optional[bool] = Field(None, description="Whether reverse charge mechanism is applicable")
+    
+    # Additional information
+    notes: Optional[str] = Field(None, description="Additional notes or terms and conditions")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "invoice_number": "2425MR1058",
+                "invoice_date": "17/12/2024",
+                "due_date": "31/01/2025",
+                "payment_terms": "45 Days",
+                "seller": {
+                    "name": "SAFEX FIRE SERVICES LTD.",
+                    "address": "Fact: PLOT NO.13,14,15,OPP.BIDCO, TAL:PALGHAR, DIST.PALGHAR, MAHARASHTRA - 401404",
+                    "gstin": "27AAECS7539M1ZP",
+                    "contact_details": "CONTACT NO.02525-251482,252686 E-Mail: palghar@safexfire.com"
+                },
+                "buyer": {
+                    "name": "TATA CONSULTANCY SERVICES LTD (MALAD)",
+                    "address": "1FL WING A, 2 & 3FL WING B,7FL WING A, 8FL WING A & B,TRIL IT4,INFINIY IT PARK",
+                    "gstin": "27AAACR4849R1ZL",
+                    "contact_details": "Tel No. : 022-63718493"
+                },
+                "items": [
+                    {
+                        "description": "ANNUAL MAINTANACE FOR FIRE EXT SERVICE MONTH - NOVEMBER 2024",
+                        "hsn_sac": "998719",
+                        "quantity": 433,
+                        "unit": "Nos",
+                        "rate": 16.00,
+                        "amount": 6928.00
+                    }
+                ],
+                "subtotal": 6928.00,
+                "tax_details": [
+                    {
+                        "tax_type": "CGST",
+                        "rate": 9,
+                        "amount": 623.52
+                    },
+                    {
+                        "tax_type": "SGST",
+                        "rate": 9,
+                        "amount": 623.52
+                    }
+                ],
+                "total_tax_amount": 1247.04,
+                "total_amount": 8175.00,
+                "amount_in_words": "Eight Thousand One Hundred Seventy Five Only",
+                "irn": "bd13c19a0060a19ed820359c025761eb778929c354829ba08e1ebd1e429b75"
+            }
+        }
+
+
+class LineItemList(BaseModel):
+    """Line items extracted from one chunk of a long line-item table"""
+    items: List[LineItem] = Field(default_factory=list, description="Line items in the order they appear in the table")
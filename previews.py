@@ -0,0 +1,124 @@
+"""Thumbnails and per-page WebP previews, rendered once per document content.
+
+Previews live in ``<directory>/<sha256>/``: ``thumb.webp``, ``page-<n>.webp`` and
+a ``manifest.json`` written last, so a directory with a manifest is complete.
+Because the directory is named after the content hash, a file never changes once
+written and can be served with a strong ETag and a year-long immutable
+``Cache-Control``; re-uploads of the same bytes reuse the existing previews.
+
+``schedule`` renders on a small background pool (uploads call it), and
+``ensure`` renders on the calling thread if nothing has been rendered yet,
+waiting on a render already in progress instead of starting a second one.
+"""
+import os
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREVIEW_DPI = int(os.getenv("PREVIEW_DPI", "100"))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "200"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+
+MANIFEST_NAME = "manifest.json"
+THUMBNAIL_NAME = "thumb.webp"
+
+
+def page_name(page):
+    return f"page-{page}.webp"
+
+
+class PreviewStore:
+    """Render and locate the previews of documents by content hash"""
+
+    def __init__(self, directory, dpi=PREVIEW_DPI, thumbnail_width=THUMBNAIL_WIDTH,
+                 quality=PREVIEW_QUALITY, workers=PREVIEW_WORKERS):
+        self.directory = directory
+        self.dpi = dpi
+        self.thumbnail_width = thumbnail_width
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="previews")
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest, name):
+        """Absolute path of one preview file; None for names outside the digest's directory"""
+        if not digest.isalnum() or os.path.basename(name) != name:
+            return None
+        return os.path.join(self.directory, digest, name)
+
+    def manifest(self, digest):
+        """Manifest of a completely rendered document, or None"""
+        path = self.path(digest, MANIFEST_NAME)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def schedule(self, file_path, digest):
+        """Render previews in the background unless they exist or are being rendered; returns a Future or None"""
+        if self.manifest(digest) is not None:
+            return None
+        with self._lock:
+            future = self._in_flight.get(digest)
+            if future is None:
+                future = self._executor.submit(self._render, file_path, digest)
+                self._in_flight[digest] = future
+                future.add_done_callback(lambda _: self._forget(digest))
+        return future
+
+    def ensure(self, file_path, digest):
+        """Manifest of the document's previews, rendering them now if needed"""
+        manifest = self.manifest(digest)
+        if manifest is not None:
+            return manifest
+        future = self.schedule(file_path, digest)
+        return future.result() if future is not None else self.manifest(digest)
+
+    def _forget(self, digest):
+        with self._lock:
+            self._in_flight.pop(digest, None)
+
+    def _save(self, image, path, width=None):
+        if width and image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)))
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGB")
+        image.save(path + ".tmp", "WEBP", quality=self.quality, method=4)
+        os.replace(path + ".tmp", path)
+
+    def _pages(self, file_path):
+        """Yield page images one at a time so long documents are never all in memory"""
+        if file_path.lower().endswith(".pdf"):
+            from pdf2image import convert_from_path, pdfinfo_from_path
+            page_count = int(pdfinfo_from_path(file_path)["Pages"])
+            for page in range(1, page_count + 1):
+                yield convert_from_path(file_path, dpi=self.dpi, first_page=page, last_page=page)[0]
+        else:
+            from PIL import Image
+            with Image.open(file_path) as image:
+                image.load()
+                yield image
+
+    def _render(self, file_path, digest):
+        directory = os.path.join(self.directory, digest)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            pages = 0
+            for pages, image in enumerate(self._pages(file_path), 1):
+                if pages == 1:
+                    self._save(image, os.path.join(directory, THUMBNAIL_NAME), width=self.thumbnail_width)
+                self._save(image, os.path.join(directory, page_name(pages)))
+                image.close()
+            manifest = {"pages": pages, "dpi": self.dpi, "thumbnail": THUMBNAIL_NAME,
+                        "files": [page_name(page) for page in range(1, pages + 1)]}
+            with open(os.path.join(directory, MANIFEST_NAME + ".tmp"), "w") as f:
+                json.dump(manifest, f)
+            os.replace(os.path.join(directory, MANIFEST_NAME + ".tmp"), os.path.join(directory, MANIFEST_NAME))
+            print(f"Rendered {pages} preview pages for {os.path.basename(file_path)}")
+            return manifest
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
@@ -0,0 +1,211 @@
+"""Stage-by-stage progress events of extraction jobs.
+
+An extraction runs inside ``ProgressLog.job(...)``; code anywhere beneath it marks
+its work with ``stage(name)`` (a context manager or decorator) and may add
+``note(...)`` events, e.g. for each poll of a long-running provider job. Outside a
+job both are no-ops.
+
+Events are appended to ``<directory>/<job_id>.jsonl`` as they happen, so a
+Server-Sent Events stream in any worker process can follow a job by tailing that
+file. When a job ends, its per-stage timings are appended to
+``<directory>/timings.jsonl`` for later latency analysis.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Pipeline stages in the order they normally run
+STAGES = ("text_layer", "rasterize", "ocr", "template", "llm", "repair", "reextract", "validate", "cache_write", "store_append")
+
+PROGRESS_POLL_INTERVAL = float(os.getenv("PROGRESS_POLL_INTERVAL", "0.25"))
+# How long a stream waits for its job to start, and for it to finish
+PROGRESS_START_TIMEOUT = float(os.getenv("PROGRESS_START_TIMEOUT", "60"))
+PROGRESS_STREAM_TIMEOUT = float(os.getenv("PROGRESS_STREAM_TIMEOUT", "1800"))
+# Event logs of finished jobs are removed after this long
+PROGRESS_RETENTION_HOURS = float(os.getenv("PROGRESS_RETENTION_HOURS", "24"))
+
+TIMINGS_NAME = "timings.jsonl"
+_HEARTBEAT_SECONDS = 15
+_JOB_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_current_job = contextvars.ContextVar("progress_job", default=None)
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def valid_job_id(job_id):
+    return bool(job_id and _JOB_ID.match(job_id))
+
+
+class Job:
+    """One extraction: writes its events and accumulates stage timings"""
+
+    def __init__(self, events_path, job_id, file_path, processing_method):
+        self.events_path = events_path
+        self.job_id = job_id
+        self.file_path = file_path
+        self.processing_method = processing_method
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.stage_seconds = {}
+        self.stage_counts = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def emit(self, event, **fields):
+        record = {"event": event, "job_id": self.job_id, "elapsed": round(self.elapsed(), 3), **fields}
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.events_path, "a") as f:
+                f.write(line)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_counts[name] = self.stage_counts.get(name, 0) + 1
+
+    def summary(self, status):
+        with self._lock:
+            stages = {name: {"seconds": round(seconds, 3), "count": self.stage_counts[name]}
+                      for name, seconds in self.stage_seconds.items()}
+        return {"job_id": self.job_id, "file": os.path.basename(self.file_path),
+                "processing_method": self.processing_method, "started_at": self.started_at,
+                "seconds": round(self.elapsed(), 3), "status": status, "stages": stages}
+
+
+def current_job():
+    return _current_job.get()
+
+
+@contextmanager
+def stage(name, **details):
+    """Time a pipeline stage of the current job and publish its start and end"""
+    job = _current_job.get()
+    if job is None:
+        yield
+        return
+    started = time.monotonic()
+    job.emit("stage_start", stage=name, **details)
+    try:
+        yield
+    except BaseException as e:
+        seconds = time.monotonic() - started
+        job.record(name, seconds)
+        job.emit("stage_end", stage=name, seconds=round(seconds, 3), error=str(e) or type(e).__name__, **details)
+        raise
+    seconds = time.monotonic() - started
+    job.record(name, seconds)
+    job.emit("stage_end", stage=name, seconds=round(seconds, 3), **details)
+
+
+def note(message, **fields):
+    """Publish an informational event (e.g. a provider poll) on the current job"""
+    job = _current_job.get()
+    if job is not None:
+        job.emit("note", message=message, **fields)
+
+
+class ProgressLog:
+    """Directory of job event logs plus the timings of every finished job"""
+
+    def __init__(self, directory, retention_hours=PROGRESS_RETENTION_HOURS):
+        self.directory = directory
+        self.retention_seconds = retention_hours * 3600
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def events_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.jsonl")
+
+    @contextmanager
+    def job(self, job_id, file_path, processing_method):
+        """Run the body as job ``job_id``; stages started beneath it are attributed to it"""
+        self._prune()
+        job = Job(self.events_path(job_id), job_id, file_path, processing_method)
+        token = _current_job.set(job)
+        job.emit("job_start", file=os.path.basename(file_path), processing_method=processing_method)
+        status = "error"
+        try:
+            yield job
+            status = "ok"
+        except Exception as e:
+            # Not "error": EventSource fires its own error event on connection failures
+            job.emit("job_error", message=str(e))
+            raise
+        finally:
+            _current_job.reset(token)
+            summary = job.summary(status)
+            with self._lock:
+                with open(os.path.join(self.directory, TIMINGS_NAME), "a") as f:
+                    f.write(json.dumps(summary) + "\n")
+            job.emit("job_end", status=status, seconds=summary["seconds"], stages=summary["stages"])
+
+    def follow(self, job_id, start_timeout=PROGRESS_START_TIMEOUT, timeout=PROGRESS_STREAM_TIMEOUT,
+               poll_interval=PROGRESS_POLL_INTERVAL):
+        """Yield a job's events as they are written, ending after ``job_end``.
+
+        Yields None every few seconds while nothing happens, so callers can keep
+        idle connections alive.
+        """
+        path = self.events_path(job_id)
+        started = time.monotonic()
+        last_yield = started
+        while not os.path.exists(path):
+            if time.monotonic() - started > start_timeout:
+                return
+            time.sleep(poll_interval)
+
+        with open(path, "r") as f:
+            buffer = ""
+            while time.monotonic() - started < timeout:
+                chunk = f.readline()
+                if not chunk:
+                    if time.monotonic() - last_yield > _HEARTBEAT_SECONDS:
+                        last_yield = time.monotonic()
+                        yield None
+                    time.sleep(poll_interval)
+                    continue
+                buffer += chunk
+                if not buffer.endswith("\n"):
+                    continue  # the writer is mid-line
+                event = json.loads(buffer)
+                buffer = ""
+                last_yield = time.monotonic()
+                yield event
+                if event.get("event") == "job_end":
+                    return
+
+    def timings(self, limit=None):
+        """Summaries of finished jobs, oldest first"""
+        path = os.path.join(self.directory, TIMINGS_NAME)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            summaries = [json.loads(line) for line in f if line.strip()]
+        return summaries[-limit:] if limit else summaries
+
+    def _prune(self):
+        """Remove old event logs, at most once an hour"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < 3600:
+                return
+            self._last_prune = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != TIMINGS_NAME and name.endswith(".jsonl"):
+                try:
+                    if now - os.path.getmtime(path) > self.retention_seconds:
+                        os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,234 @@
+"""System prompts and compact schema text for the LLM extraction methods.
+
+Everything here is built once at import time from the ``Invoice`` model so that
+every request sends byte-identical prompt prefixes. Identical prefixes are what
+Bedrock prompt caching (``cache_control``) and Azure OpenAI automatic prefix
+caching key on, so keep per-request content out of the system prompts.
+
+Both only cache a prefix of at least 1024 tokens (measure with ``estimated_tokens``):
+
+- Azure OpenAI puts the ``response_format`` JSON schema of ``Invoice`` (about
+  2,500 tokens) ahead of the system prompt, so the schema and the shared
+  ``EXTRACTION_INSTRUCTIONS`` are cached without anything being marked.
+- The Claude invoice prompts start with ``CLAUDE_INVOICE_PREFIX``: the rules, the
+  compact schema and a worked example, padded past the threshold by the example.
+  ``claude_system_blocks`` sends that prefix as its own ``cache_control`` block so
+  the image, document and text prompts all read the same cache entry.
+
+The line-item and field re-extraction prompts are short and sent uncached. The
+``cache_read_tokens`` and ``cache_write_tokens`` in a result's usage (see
+usage.py) show whether a call hit the cache.
+"""
+import os
+import json
+import hashlib
+import typing
+from pydantic import BaseModel
+
+from models import Invoice, LineItem
+
+# Bump when the wording of any prompt below changes
+PROMPT_VERSION = "3"
+
+# Changes whenever a field is added, removed or retyped on the Invoice model
+SCHEMA_VERSION = hashlib.sha256(
+    json.dumps(Invoice.model_json_schema(), sort_keys=True).encode('utf-8')
+).hexdigest()[:12]
+
+# Stamped on every cached result; results with other versions are re-extracted by migrate.py
+EXTRACTION_VERSIONS = {"schema": SCHEMA_VERSION, "prompt": PROMPT_VERSION}
+
+# Bedrock prompt caching can be switched off for models/regions that reject cache_control
+BEDROCK_PROMPT_CACHING = os.getenv("BEDROCK_PROMPT_CACHING", "true").lower() in ("1", "true", "yes")
+# Shortest prompt Bedrock caches, in tokens (1024 for Claude Sonnet, 2048 for Haiku)
+BEDROCK_CACHE_MIN_TOKENS = int(os.getenv("BEDROCK_CACHE_MIN_TOKENS", "1024"))
+
+_TYPE_NAMES = {str: "string", float: "number", int: "number", bool: "boolean"}
+
+
+def _compact_type(annotation, renames):
+    """Render a field annotation in the compact schema notation"""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return _compact_type(args[0], renames) if len(args) == 1 else "|".join(_compact_type(a, renames) for a in args)
+    if origin in (list, typing.List):
+        return f"[{_compact_type(typing.get_args(annotation)[0], renames)}]"
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return compact_schema(annotation, renames)
+    return _TYPE_NAMES.get(annotation, "string")
+
+
+def compact_schema(model, renames=None):
+    """Return a one-line, key: type description of a pydantic model.
+
+    This is a fraction of the size of ``model_json_schema()`` but carries the same
+    field names and types, which is all the extractors need.
+    """
+    renames = renames or {}
+    parts = []
+    for name, field in model.model_fields.items():
+        parts.append(f"{renames.get(name, name)}: {_compact_type(field.annotation, renames)}")
+    return "{" + ", ".join(parts) + "}"
+
+
+# Claude output is keyed 'line_items' (the UI reads that name), the Invoice model uses 'items'
+INVOICE_SCHEMA = compact_schema(Invoice)
+CLAUDE_INVOICE_SCHEMA = compact_schema(Invoice, renames={"items": "line_items"})
+
+EXTRACTION_INSTRUCTIONS = """You are an AI assistant specialized in extracting invoice data.
+Extract complete and accurate information from the invoice document.
+
+Extract the following information:
+- Basic invoice details (number, date, due date, payment terms)
+- Currency used in the invoice (e.g., INR, USD, EUR) - extract this from the document or from any 'amount in words' text
+- Seller and buyer information (name, address, GSTIN, contact details)
+- Line items with descriptions, quantities, unit prices, tax percentages, tax amounts, and total amounts
+- Tax details (CGST, SGST, IGST rates and amounts)
+- Total amounts, bank details, and any reference numbers
+
+For line items, make sure to:
+1. Extract unit_price (price per unit) correctly
+2. Include tax_percentage and tax_amount when available
+3. Ensure amount reflects the total for each line item
+
+Format your response with appropriate fields. Format monetary values as numbers without currency symbols, but be sure to extract and include the currency code/symbol in the 'currency' field.
+If the currency appears in 'amount in words' (e.g., 'INR Thirty-Four Thousand'), extract it for the currency field.
+Ensure all data is extracted accurately."""
+
+# Azure OpenAI structured output methods (the schema travels as response_format)
+GPT_SYSTEM_PROMPT = EXTRACTION_INSTRUCTIONS
+GPT_DI_IMAGE_SYSTEM_PROMPT = GPT_SYSTEM_PROMPT + "\n\nThe document has already been processed by Document Intelligence, and the extracted text is provided to you along with the original image."
+GPT_DI_TEXT_SYSTEM_PROMPT = GPT_SYSTEM_PROMPT + "\n\nThe document has already been processed by Document Intelligence, and the extracted text is provided to you."
+
+# Phi has no structured output, so the schema is part of the (stable) system prompt
+PHI_SYSTEM_PROMPT = EXTRACTION_INSTRUCTIONS + f"""
+- Strictly use the following JSON schema (all fields optional): {INVOICE_SCHEMA}
+- ONLY return the JSON object. DO NOT return as a JSON markdown code block. DO NOT include any other detail in your response."""
+
+_CLAUDE_RULES = f"""Follow this exact schema structure for your JSON response (string dates as YYYY-MM-DD, tax_type e.g. CGST, SGST, IGST):
+
+{CLAUDE_INVOICE_SCHEMA}
+
+Important notes:
+1. All fields are optional. If a field is not found in the document, omit it from the JSON rather than including it with a null or empty value.
+2. Always include the tax_details array even if empty.
+3. CRITICAL: You MUST use the key 'line_items' (not 'items') for the array of invoice line items as shown in the schema. The UI expects this exact field name."""
+
+# A worked example makes the shared Claude prefix long enough to cache, and shows the
+# conventions (ISO dates, omitted fields, one tax_details entry per rate) in use
+_EXAMPLE_DOCUMENT = """TAX INVOICE
+Sunrise Stationers Pvt Ltd
+12 MG Road, Bengaluru, Karnataka 560001
+GSTIN: 29AABCS1429B1ZQ  PAN: AABCS1429B  Phone: +91 80 4123 4567
+
+Invoice No: SS/2024/0457            Invoice Date: 14-03-2024
+PO No: PO-88213                     Payment Terms: Net 30
+Place of Supply: 29-Karnataka       Reverse Charge: No
+
+Bill To: Northwind Traders LLP
+4th Floor, Prestige Tower, Residency Road, Bengaluru 560025
+GSTIN: 29AAGFN5521K1Z0
+
+| # | Description | HSN | Qty | Unit | Rate | Taxable Value | GST % | GST Amount | Total |
+| 1 | A4 Copier Paper 75 GSM | 4802 | 20 | Ream | 245.00 | 4,900.00 | 12% | 588.00 | 5,488.00 |
+| 2 | Ball Pen Blue (Box of 50) | 9608 | 10 | Box | 180.00 | 1,800.00 | 18% | 324.00 | 2,124.00 |
+| 3 | Stapler No. 10 | 8472 | 5 | Nos | 95.00 | 475.00 | 18% | 85.50 | 560.50 |
+
+Taxable Value: 7,175.00
+CGST @ 6%: 294.00    SGST @ 6%: 294.00
+CGST @ 9%: 204.75    SGST @ 9%: 204.75
+Grand Total: Rs. 8,172.50
+Amount in words: INR Eight Thousand One Hundred Seventy-Two and Fifty Paise Only
+
+Bank: HDFC Bank, MG Road Branch  A/c No: 50200012345678  IFSC: HDFC0000123"""
+
+EXAMPLE_INVOICE = {
+    "invoice_number": "SS/2024/0457",
+    "invoice_date": "2024-03-14",
+    "payment_terms": "Net 30",
+    "currency": "INR",
+    "seller": {"name": "Sunrise Stationers Pvt Ltd", "address": "12 MG Road, Bengaluru, Karnataka 560001",
+               "gstin": "29AABCS1429B1ZQ", "pan": "AABCS1429B", "contact_details": "+91 80 4123 4567"},
+    "buyer": {"name": "Northwind Traders LLP",
+              "address": "4th Floor, Prestige Tower, Residency Road, Bengaluru 560025", "gstin": "29AAGFN5521K1Z0"},
+    "line_items": [
+        {"description": "A4 Copier Paper 75 GSM", "hsn_sac": "4802", "quantity": 20, "unit": "Ream",
+         "unit_price": 245.0, "tax_percentage": 12, "tax_amount": 588.0, "amount": 5488.0},
+        {"description": "Ball Pen Blue (Box of 50)", "hsn_sac": "9608", "quantity": 10, "unit": "Box",
+         "unit_price": 180.0, "tax_percentage": 18, "tax_amount": 324.0, "amount": 2124.0},
+        {"description": "Stapler No. 10", "hsn_sac": "8472", "quantity": 5, "unit": "Nos",
+         "unit_price": 95.0, "tax_percentage": 18, "tax_amount": 85.5, "amount": 560.5},
+    ],
+    "subtotal": 7175.0,
+    "tax_details": [
+        {"tax_type": "CGST", "rate": 6, "amount": 294.0}, {"tax_type": "SGST", "rate": 6, "amount": 294.0},
+        {"tax_type": "CGST", "rate": 9, "amount": 204.75}, {"tax_type": "SGST", "rate": 9, "amount": 204.75},
+    ],
+    "total_tax_amount": 997.5,
+    "total_amount": 8172.5,
+    "amount_in_words": "INR Eight Thousand One Hundred Seventy-Two and Fifty Paise Only",
+    "po_number": "PO-88213",
+    "bank_details": {"bank_name": "HDFC Bank", "account_number": "50200012345678", "ifsc_code": "HDFC0000123",
+                     "branch": "MG Road"},
+    "place_of_supply": "29-Karnataka",
+    "reverse_charge": False,
+}
+
+# Shared by every Claude invoice prompt and sent as its own cached block (see claude_system_blocks)
+CLAUDE_INVOICE_PREFIX = "You are an expert invoice parser. Extract all relevant invoice fields in structured JSON format. Respond ONLY with a JSON object matching the invoice schema, no extra text.\n\n" + EXTRACTION_INSTRUCTIONS + "\n\n" + _CLAUDE_RULES + f"""
+
+Example. For an invoice reading:
+
+{_EXAMPLE_DOCUMENT}
+
+the response is:
+
+{json.dumps(EXAMPLE_INVOICE)}
+
+It has no due_date, shipping_details, irn or notes because the invoice does not show them."""
+
+CLAUDE_IMAGE_SYSTEM_PROMPT = CLAUDE_INVOICE_PREFIX + "\n\nThe invoice to extract is given as an image."
+CLAUDE_DOCUMENT_SYSTEM_PROMPT = CLAUDE_INVOICE_PREFIX + "\n\nThe invoice to extract is given as its document content and an image."
+CLAUDE_TEXT_SYSTEM_PROMPT = CLAUDE_INVOICE_PREFIX + "\n\nThe invoice to extract is given as its document content."
+
+# Chunked extraction: prompts for a slice of the line-item table (see chunked_extraction.py)
+LINE_ITEM_SCHEMA = compact_schema(LineItem)
+
+_LINE_ITEMS_INSTRUCTIONS = """You are an AI assistant specialized in extracting invoice line items.
+You are given a slice of an invoice's line-item table, starting with its column headings.
+Extract every row of the slice as a line item, in order, and nothing else. Skip heading, subtotal and total rows.
+Format monetary values as numbers without currency symbols. Extract unit_price, tax_percentage and tax_amount when available, and make amount the total for the line item."""
+
+GPT_LINE_ITEMS_SYSTEM_PROMPT = _LINE_ITEMS_INSTRUCTIONS
+CLAUDE_LINE_ITEMS_SYSTEM_PROMPT = _LINE_ITEMS_INSTRUCTIONS + f"""
+Respond ONLY with a JSON object of the form {{"line_items": [{LINE_ITEM_SCHEMA}]}}, no extra text. Omit fields that are not present."""
+
+
+# Selective re-extraction: low-confidence fields are re-read from crops of the page (see provenance.py)
+CLAUDE_FIELD_SYSTEM_PROMPT = """You are an expert invoice parser. You are given small crops of an invoice page, each preceded by the name of one field and the value read for it so far, which may be wrong.
+Read the value of each field from its crop. Respond ONLY with a JSON object mapping each field name exactly as given to its value, no extra text.
+Format monetary values and quantities as numbers without currency symbols or thousands separators, and dates as YYYY-MM-DD. Use null when the crop does not show the field."""
+
+
+def estimated_tokens(text):
+    """Rough token count of prompt text, at about four characters per token"""
+    return len(text) // 4
+
+
+def claude_system_blocks(system_prompt):
+    """Return the Bedrock Messages API ``system`` value, with its shared prefix marked cacheable.
+
+    A prompt that starts with ``CLAUDE_INVOICE_PREFIX`` is split in two blocks so
+    that the prefix is cached once for every prompt built on it. Other prompts are
+    marked as a whole when long enough, and sent as a plain string otherwise.
+    """
+    if not BEDROCK_PROMPT_CACHING:
+        return system_prompt
+    if system_prompt.startswith(CLAUDE_INVOICE_PREFIX) and estimated_tokens(CLAUDE_INVOICE_PREFIX) >= BEDROCK_CACHE_MIN_TOKENS:
+        blocks = [{"type": "text", "text": CLAUDE_INVOICE_PREFIX, "cache_control": {"type": "ephemeral"}}]
+        rest = system_prompt[len(CLAUDE_INVOICE_PREFIX):].strip()
+        return blocks + [{"type": "text", "text": rest}] if rest else blocks
+    if estimated_tokens(system_prompt) < BEDROCK_CACHE_MIN_TOKENS:
+        return system_prompt
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
@@ -0,0 +1,308 @@
+"""Per-field confidence and page provenance of extracted invoices.
+
+Textract and Document Intelligence return a confidence and a bounding box for
+every word, but the LLM only sees their text. ``field_provenance`` matches each
+extracted value back to the words it was read from and records, per field path
+(the ``line_items[0].amount`` notation of the validation report, whichever of
+``items`` and ``line_items`` the result stores them under)::
+
+    {"confidence": 0.83, "page": 1, "bbox": [left, top, width, height], "source": "textract"}
+
+Boxes are fractions of the page size. A value's confidence is that of its least
+confident word. Values that cannot be found in the OCR text (e.g. fields the
+model inferred) get ``"confidence": None, "match": "none"``.
+
+Fields below ``FIELD_CONFIDENCE_THRESHOLD`` can then be read again on their own:
+``reextract_fields`` crops the page around each of them and sends the crops in
+one small request, instead of re-running the whole document through a more
+expensive method.
+"""
+import io
+import os
+import re
+import json
+import base64
+
+from models import Invoice
+from result_store import parse_invoice_date
+
+FIELD_CONFIDENCE_THRESHOLD = float(os.getenv("FIELD_CONFIDENCE_THRESHOLD", "0.9"))
+# Most fields re-read per document, lowest confidence first
+REEXTRACT_MAX_FIELDS = int(os.getenv("REEXTRACT_MAX_FIELDS", "8"))
+REEXTRACT_DPI = int(os.getenv("REEXTRACT_DPI", "200"))
+
+# Result keys holding extracted fields (Claude names the line items 'line_items')
+_FIELD_KEYS = set(Invoice.model_fields) | {"line_items"}
+# Fields located first in each line item / tax row, so the others prefer words on the same row
+_ROW_ANCHORS = (".description", ".tax_type")
+# Page fractions added around a field's box; labels are usually to its left or above it
+_CROP_MARGIN = (0.2, 0.03, 0.03, 0.015)  # left, top, right, bottom
+# Longest span tried for a multi-word value, beyond its own number of words
+_SPAN_SLACK = 2
+# A partial match must cover this share of the value's characters
+_PARTIAL_MATCH = 0.6
+_NUMBER_NOISE = re.compile(r"^(?:rs\.?|inr|[₹$€£])|[,\s]|/-$", re.I)
+_PATH_PART = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+
+def _box(left, top, width, height):
+    return [round(left, 4), round(top, 4), round(width, 4), round(height, 4)]
+
+
+def textract_words(pages):
+    """Words of Textract blocks (one list of blocks per page), in reading order"""
+    words = []
+    for number, blocks in enumerate(pages, 1):
+        blocks_by_id = {block["Id"]: block for block in blocks}
+        for block in blocks:
+            if block["BlockType"] != "LINE":
+                continue
+            for relation in block.get("Relationships", []):
+                if relation["Type"] != "CHILD":
+                    continue
+                for child_id in relation["Ids"]:
+                    word = blocks_by_id.get(child_id)
+                    if not word or word.get("BlockType") != "WORD":
+                        continue
+                    box = word["Geometry"]["BoundingBox"]
+                    words.append({"text": word["Text"], "confidence": word.get("Confidence", 0.0) / 100,
+                                  "page": number, "bbox": _box(box["Left"], box["Top"], box["Width"], box["Height"])})
+    return words
+
+
+def document_intelligence_words(result):
+    """Words of a Document Intelligence AnalyzeResult, in reading order"""
+    words = []
+    for page in result.pages or []:
+        width, height = page.width or 1, page.height or 1
+        for word in page.words or []:
+            xs, ys = word.polygon[0::2], word.polygon[1::2]
+            words.append({"text": word.content, "confidence": word.confidence, "page": page.page_number,
+                          "bbox": _box(min(xs) / width, min(ys) / height,
+                                       (max(xs) - min(xs)) / width, (max(ys) - min(ys)) / height)})
+    return words
+
+
+def field_values(data):
+    """Yield (path, value) for every scalar field of a result that has a value"""
+    def scalar(value):
+        return isinstance(value, (str, int, float)) and not isinstance(value, bool) and value != ""
+
+    for key, value in data.items():
+        # Results cached before line items were stored once carry them under both names
+        if key not in _FIELD_KEYS or (key == "items" and "line_items" in data):
+            continue
+        key = "line_items" if key == "items" else key
+        if isinstance(value, dict):
+            yield from ((f"{key}.{name}", item) for name, item in value.items() if scalar(item))
+        elif isinstance(value, list):
+            for index, row in enumerate(value):
+                if isinstance(row, dict):
+                    yield from ((f"{key}[{index}].{name}", item) for name, item in row.items() if scalar(item))
+        elif scalar(value):
+            yield key, value
+
+
+def compact_text(text):
+    """Lower-case letters and digits of a text, for comparisons that ignore spacing and punctuation"""
+    return re.sub(r"[^0-9a-z]", "", str(text).lower())
+
+
+def parse_number(text):
+    """Number of an amount as printed (thousands separators, currency prefixes), or None"""
+    if isinstance(text, (int, float)):
+        return float(text)
+    try:
+        return float(_NUMBER_NOISE.sub("", text))
+    except ValueError:
+        return None
+
+
+class _Words:
+    """OCR words with the normalised forms every value is compared against"""
+
+    def __init__(self, words):
+        self.words = words
+        self.compacts = [compact_text(word["text"]) for word in words]
+        self.numbers = [parse_number(word["text"]) for word in words]
+        self.has_digit = [any(char.isdigit() for char in text) for text in self.compacts]
+
+    def spans(self, value):
+        """Yield (start, end, exact) spans of consecutive words on one page that read as ``value``"""
+        words, compacts = self.words, self.compacts
+        if isinstance(value, (int, float)):
+            for index, number in enumerate(self.numbers):
+                if number is not None and abs(number - value) < 0.005:
+                    yield index, index + 1, True
+            return
+        date = parse_invoice_date(value)
+        target = compact_text(value)
+        if not target:
+            return
+        max_span = len(str(value).split()) + _SPAN_SLACK
+        for start in range(len(words)):
+            if not compacts[start]:
+                continue
+            if date and self.has_digit[start]:
+                for end in range(start + 1, min(start + 4, len(words) + 1)):
+                    if words[end - 1]["page"] != words[start]["page"]:
+                        break
+                    if parse_invoice_date(" ".join(word["text"] for word in words[start:end])) == date:
+                        yield start, end, True
+                        break
+            joined = ""
+            for end in range(start + 1, min(start + max_span, len(words)) + 1):
+                if words[end - 1]["page"] != words[start]["page"]:
+                    break
+                joined += compacts[end - 1]
+                if joined == target:
+                    yield start, end, True
+                    break
+                if not target.startswith(joined):
+                    if len(joined) - len(compacts[end - 1]) >= _PARTIAL_MATCH * len(target) and end - 1 > start:
+                        yield start, end - 1, False
+                    break
+
+
+def _on_row(page, bbox, anchor):
+    """Whether a box sits on the row of an anchor (same page, vertical centre within its band)"""
+    if anchor is None or anchor["page"] != page:
+        return False
+    centre = bbox[1] + bbox[3] / 2
+    top, height = anchor["bbox"][1], anchor["bbox"][3]
+    return top - height / 2 <= centre <= top + height * 1.5
+
+
+def _locate(value, words, source, anchor=None):
+    best = None
+    for start, end, exact in words.spans(value):
+        span = words.words[start:end]
+        left = min(word["bbox"][0] for word in span)
+        top = min(word["bbox"][1] for word in span)
+        right = max(word["bbox"][0] + word["bbox"][2] for word in span)
+        bottom = max(word["bbox"][1] + word["bbox"][3] for word in span)
+        bbox = _box(left, top, right - left, bottom - top)
+        confidence = min(word["confidence"] for word in span)
+        page = span[0]["page"]
+        key = (exact, _on_row(page, bbox, anchor), confidence)
+        if best is None or key > best[0]:
+            best = (key, {"confidence": round(confidence, 3), "page": page, "bbox": bbox, "source": source})
+            if not exact:
+                best[1]["match"] = "partial"
+    if best is None:
+        return {"confidence": None, "source": source, "match": "none"}
+    return best[1]
+
+
+def field_provenance(data, words, source):
+    """{path: provenance} of every field of a result dict, matched against OCR ``words``"""
+    words = _Words(words)
+    values = list(field_values(data))
+    found = {}
+    anchors = {}
+    # Row anchors first, so the other fields of a line item prefer words on its row
+    for path, value in sorted(values, key=lambda pair: not pair[0].endswith(_ROW_ANCHORS)):
+        row = path.rsplit(".", 1)[0] if "[" in path else None
+        found[path] = _locate(value, words, source, anchors.get(row))
+        if row and path.endswith(_ROW_ANCHORS) and found[path].get("bbox"):
+            anchors[row] = found[path]
+    return {path: found[path] for path, _ in values}
+
+
+def low_confidence_fields(provenance, threshold=FIELD_CONFIDENCE_THRESHOLD):
+    """Paths of located fields below ``threshold`` that were not re-read yet, lowest first"""
+    paths = [path for path, entry in provenance.items()
+             if entry.get("confidence") is not None and entry["confidence"] < threshold
+             and entry.get("bbox") and not entry.get("reextracted")]
+    return sorted(paths, key=lambda path: provenance[path]["confidence"])
+
+
+def _parts(data, path):
+    parts = [int(index) if index else name for name, index in _PATH_PART.findall(path)]
+    if parts and parts[0] == "line_items" and "line_items" not in data:
+        parts[0] = "items"
+    return parts
+
+
+def get_field(data, path):
+    value = data
+    for part in _parts(data, path):
+        value = value[part]
+    return value
+
+
+def set_field(data, path, value):
+    parts = _parts(data, path)
+    target = data
+    for part in parts[:-1]:
+        target = target[part]
+    target[parts[-1]] = value
+
+
+def page_image(file_path, page, dpi=REEXTRACT_DPI):
+    """One page of a PDF or image as a PIL image"""
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+        return convert_from_path(file_path, dpi=dpi, first_page=page, last_page=page)[0]
+    from PIL import Image
+    image = Image.open(file_path)
+    if page > 1:
+        image.seek(page - 1)
+    image.load()
+    return image
+
+
+def crop_field(image, bbox):
+    """Crop of a page image around a field's box, with room for its label"""
+    left, top, width, height = bbox
+    margin_left, margin_top, margin_right, margin_bottom = _CROP_MARGIN
+    box = (max(0.0, left - margin_left) * image.width, max(0.0, top - margin_top) * image.height,
+           min(1.0, left + width + margin_right) * image.width, min(1.0, top + height + margin_bottom) * image.height)
+    return image.crop(tuple(round(edge) for edge in box))
+
+
+def _image_block(image):
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=90)
+    return {"type": "image",
+            "source": {"type": "base64", "media_type": "image/jpeg",
+                       "data": base64.b64encode(buffer.getvalue()).decode("utf-8")}}
+
+
+def reextract_fields(data, provenance, paths, file_path, ask):
+    """Re-read ``paths`` of a result from crops of the document's pages; updates both dicts in place.
+
+    ``ask(message_content)`` sends Claude Messages API content blocks with the
+    ``CLAUDE_FIELD_SYSTEM_PROMPT`` and returns the response text. Returns the
+    paths whose value changed.
+    """
+    content = []
+    pages = {}
+    for path in paths:
+        entry = provenance[path]
+        if entry["page"] not in pages:
+            pages[entry["page"]] = page_image(file_path, entry["page"])
+        content.append({"type": "text", "text": f"Field: {path}\nRead so far: {json.dumps(get_field(data, path))}"})
+        content.append(_image_block(crop_field(pages[entry["page"]], entry["bbox"])))
+    for image in pages.values():
+        image.close()
+
+    values = json.loads(ask(content))
+    changed = []
+    for path in paths:
+        value = values.get(path) if isinstance(values, dict) else None
+        provenance[path]["reextracted"] = True
+        if value is None:
+            continue
+        previous = get_field(data, path)
+        if isinstance(previous, (int, float)):
+            value = parse_number(value) if isinstance(value, str) else value
+            if not isinstance(value, (int, float)):
+                continue
+        elif not isinstance(value, str):
+            value = str(value)
+        if value != previous:
+            set_field(data, path, value)
+            provenance[path]["previous"] = previous
+            changed.append(path)
+    return changed
@@ -0,0 +1,327 @@
+"""Load balancing across several Azure OpenAI deployments and Bedrock regions.
+
+A pool holds interchangeable endpoints serving the same model: Azure OpenAI
+deployments in different resources, or Bedrock regions or inference profiles.
+Each call goes to the healthy endpoint with the best score, where the score is
+the endpoint's smoothed latency scaled by its in-flight calls and by how much of
+its rate-limit quota is left (from the ``x-ratelimit-remaining-*`` headers Azure
+returns). Throttled endpoints cool down for the time the service asks for;
+endpoints that keep failing are drained for a growing cooldown and then get one
+trial call before taking traffic again. Throttling and availability errors are
+retried on the next endpoint.
+
+Endpoints come from the JSON file named by ``PROVIDER_POOL_FILE``::
+
+    {
+      "azure_openai": [
+        {"name": "eastus", "endpoint": "https://a.openai.azure.com", "key": "...", "deployment": "gpt-4o"},
+        {"name": "swedencentral", "endpoint": "https://b.openai.azure.com", "key": "...", "deployment": "gpt-4o"}
+      ],
+      "bedrock_claude": [
+        {"name": "us-east-1", "region": "us-east-1", "model_id": "us.anthropic.claude-3-5-sonnet-20240620-v1:0"},
+        {"name": "us-west-2", "region": "us-west-2", "model_id": "us.anthropic.claude-3-5-sonnet-20240620-v1:0"}
+      ]
+    }
+
+Without the file, each pool has the single endpoint from the existing settings.
+"""
+import os
+import json
+import time
+import functools
+import threading
+
+from progress import note, stage
+from usage import openai_usage, record_usage
+
+PROVIDER_POOL_FILE = os.getenv("PROVIDER_POOL_FILE", "providers.json")
+# Consecutive failures after which an endpoint is drained
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "3"))
+# First drain period; doubles on each further failed trial, up to the maximum
+PROVIDER_COOLDOWN_SECONDS = float(os.getenv("PROVIDER_COOLDOWN_SECONDS", "30"))
+PROVIDER_MAX_COOLDOWN_SECONDS = float(os.getenv("PROVIDER_MAX_COOLDOWN_SECONDS", "600"))
+# Cooldown after a throttled call that did not say when to retry
+PROVIDER_THROTTLE_SECONDS = float(os.getenv("PROVIDER_THROTTLE_SECONDS", "10"))
+
+AZURE_OPENAI_API_VERSION = "2024-08-01-preview"
+
+# Weight of the newest sample in the smoothed latency
+_LATENCY_ALPHA = 0.3
+# Floor on the quota factor, so an almost exhausted endpoint is avoided but not divided by zero
+_MIN_QUOTA_FACTOR = 0.05
+
+THROTTLED = "throttled"
+UNAVAILABLE = "unavailable"
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Every endpoint of a pool is draining or failed the call"""
+
+
+class Endpoint:
+    """One deployment or region, with its client and health statistics"""
+
+    def __init__(self, name, client, target):
+        self.name = name
+        self.client = client
+        self.target = target  # deployment name or model id to call on this endpoint
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown = 0.0
+        self.available_at = 0.0
+        self.remaining_tokens = None
+        self.max_remaining_tokens = None
+        self.calls = 0
+        self.errors = 0
+
+    def healthy(self, now):
+        return now >= self.available_at
+
+    def score(self):
+        # Endpoints without a latency sample yet are tried first
+        latency = self.latency if self.latency is not None else 0.0
+        quota = 1.0
+        if self.remaining_tokens is not None and self.max_remaining_tokens:
+            quota = max(_MIN_QUOTA_FACTOR, self.remaining_tokens / self.max_remaining_tokens)
+        return latency * (self.in_flight + 1) / quota
+
+    def status(self, now):
+        return {
+            "name": self.name,
+            "target": self.target,
+            "healthy": self.healthy(now),
+            "available_in": round(max(0.0, self.available_at - now), 1),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "in_flight": self.in_flight,
+            "remaining_tokens": self.remaining_tokens,
+            "calls": self.calls,
+            "errors": self.errors,
+        }
+
+
+class ProviderPool:
+    """Route calls across endpoints by latency, quota and health.
+
+    ``classify(exception)`` returns THROTTLED, UNAVAILABLE or None (a request
+    error that would fail on any endpoint and is raised straight away), and
+    ``retry_after(exception)`` the seconds the service asked to wait, if any.
+    """
+
+    def __init__(self, name, endpoints, classify, retry_after=lambda e: None):
+        if not endpoints:
+            raise ValueError(f"Provider pool {name} has no endpoints")
+        self.name = name
+        self.endpoints = endpoints
+        self.classify = classify
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in tried and e.healthy(now)]
+            if candidates:
+                endpoint = min(candidates, key=Endpoint.score)
+            elif not tried:
+                # Everything is draining: try the endpoint that recovers first rather than failing outright
+                endpoint = min(self.endpoints, key=lambda e: e.available_at)
+            else:
+                return None
+            endpoint.in_flight += 1
+            endpoint.calls += 1
+            return endpoint
+
+    def _record_success(self, endpoint, elapsed, remaining_tokens):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.latency = elapsed if endpoint.latency is None else (
+                _LATENCY_ALPHA * elapsed + (1 - _LATENCY_ALPHA) * endpoint.latency)
+            endpoint.failures = 0
+            endpoint.cooldown = 0.0
+            if remaining_tokens is not None:
+                endpoint.remaining_tokens = remaining_tokens
+                endpoint.max_remaining_tokens = max(endpoint.max_remaining_tokens or 0, remaining_tokens)
+
+    def _record_failure(self, endpoint, kind, retry_after):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.errors += 1
+            now = time.monotonic()
+            if kind == THROTTLED:
+                endpoint.available_at = now + (retry_after or PROVIDER_THROTTLE_SECONDS)
+                endpoint.remaining_tokens = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= PROVIDER_FAILURE_THRESHOLD:
+                endpoint.cooldown = min(PROVIDER_MAX_COOLDOWN_SECONDS, endpoint.cooldown * 2 or PROVIDER_COOLDOWN_SECONDS)
+                endpoint.available_at = now + endpoint.cooldown
+                # The first call after the cooldown is a trial: one more failure drains it again
+                endpoint.failures = PROVIDER_FAILURE_THRESHOLD - 1
+                print(f"Draining {self.name} endpoint {endpoint.name} for {endpoint.cooldown:.0f}s")
+
+    def call(self, fn):
+        """Run ``fn(endpoint)`` on the best endpoint, failing over on throttling or outages.
+
+        ``fn`` returns ``(result, remaining_tokens)``; remaining_tokens may be None.
+        """
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise ProviderUnavailableError(
+                    f"No healthy {self.name} endpoint available") from last_error
+            tried.append(endpoint)
+            started = time.monotonic()
+            try:
+                with stage("llm", provider=self.name, endpoint=endpoint.name):
+                    result, remaining_tokens = fn(endpoint)
+            except Exception as e:
+                kind = self.classify(e)
+                if kind is None:
+                    # Bad request: not the endpoint's fault
+                    self._record_success(endpoint, time.monotonic() - started, None)
+                    raise
+                self._record_failure(endpoint, kind, self.retry_after(e))
+                print(f"{self.name} endpoint {endpoint.name} {kind}: {e}")
+                note(f"{self.name} endpoint {endpoint.name} {kind}, failing over")
+                last_error = e
+                continue
+            self._record_success(endpoint, time.monotonic() - started, remaining_tokens)
+            return result
+
+    def status(self):
+        with self._lock:
+            now = time.monotonic()
+            return [endpoint.status(now) for endpoint in self.endpoints]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_config():
+    if PROVIDER_POOL_FILE and os.path.exists(PROVIDER_POOL_FILE):
+        with open(PROVIDER_POOL_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+
+# --- Azure OpenAI -----------------------------------------------------------
+
+def _classify_openai(e):
+    import openai
+    if isinstance(e, openai.RateLimitError):
+        return THROTTLED
+    if isinstance(e, (openai.APIConnectionError, openai.InternalServerError)):
+        return UNAVAILABLE
+    return None
+
+
+def _openai_retry_after(e):
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AzureOpenAIPool(ProviderPool):
+    """Pool of Azure OpenAI deployments of the same model"""
+
+    def parse(self, **kwargs):
+        """``beta.chat.completions.parse`` on the best deployment; ``model`` is set per endpoint"""
+        def call(endpoint):
+            raw = endpoint.client.beta.chat.completions.with_raw_response.parse(model=endpoint.target, **kwargs)
+            remaining = raw.headers.get("x-ratelimit-remaining-tokens")
+            response = raw.parse()
+            record_usage("azure_openai", endpoint.target, **openai_usage(response.usage))
+            return response, int(remaining) if remaining and remaining.isdigit() else None
+        return self.call(call)
+
+
+def _azure_openai_endpoint(name, endpoint, key, deployment, api_version=AZURE_OPENAI_API_VERSION, failover=False):
+    from openai import AzureOpenAI
+    # With other deployments to fail over to, the SDK's own retries are limited to one;
+    # a lone deployment keeps the SDK's default retries with backoff
+    retries = {"max_retries": 1} if failover else {}
+    client = AzureOpenAI(azure_endpoint=endpoint, api_key=key, api_version=api_version, **retries)
+    return Endpoint(name, client, deployment)
+
+
+# --- Bedrock ----------------------------------------------------------------
+
+_BEDROCK_THROTTLED = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+_BEDROCK_UNAVAILABLE = {"ServiceUnavailableException", "InternalServerException", "ModelNotReadyException",
+                        "ModelTimeoutException"}
+
+
+def _classify_bedrock(e):
+    from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code")
+        if code in _BEDROCK_THROTTLED:
+            return THROTTLED
+        if code in _BEDROCK_UNAVAILABLE:
+            return UNAVAILABLE
+        return None
+    if isinstance(e, (ConnectionError, ReadTimeoutError)):
+        return UNAVAILABLE
+    return None
+
+
+def _bedrock_endpoint(name, region, model_id, failover=False):
+    import boto3
+    from botocore.config import Config
+    # With other regions to fail over to, standard mode with one retry: throttling is spread
+    # over regions by the pool instead; a lone region keeps botocore's default retries
+    config = Config(retries={"mode": "standard", "max_attempts": 2}) if failover else None
+    client = boto3.client("bedrock-runtime", region_name=region, config=config)
+    return Endpoint(name, client, model_id)
+
+
+# --- Pool registry ----------------------------------------------------------
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def azure_openai_pool(endpoint, key, deployment):
+    """The configured Azure OpenAI pool, or a single-endpoint pool for the given settings"""
+    config = _load_config().get("azure_openai")
+    cache_key = ("azure_openai",) if config else ("azure_openai", endpoint, key, deployment)
+    with _pools_lock:
+        if cache_key not in _pools:
+            if config:
+                endpoints = [_azure_openai_endpoint(entry.get("name", entry["endpoint"]), entry["endpoint"], entry["key"],
+                                                    entry["deployment"], entry.get("api_version", AZURE_OPENAI_API_VERSION),
+                                                    failover=len(config) > 1)
+                             for entry in config]
+            else:
+                endpoints = [_azure_openai_endpoint(deployment, endpoint, key, deployment)]
+            _pools[cache_key] = AzureOpenAIPool("azure_openai", endpoints, _classify_openai, _openai_retry_after)
+        return _pools[cache_key]
+
+
+def bedrock_claude_pool(region, model_id):
+    """The configured Bedrock Claude pool, or a single-region pool for the given settings"""
+    config = _load_config().get("bedrock_claude")
+    cache_key = ("bedrock_claude",) if config else ("bedrock_claude", region, model_id)
+    with _pools_lock:
+        if cache_key not in _pools:
+            if config:
+                endpoints = [_bedrock_endpoint(entry.get("name", entry["region"]), entry["region"], entry["model_id"],
+                                               failover=len(config) > 1)
+                             for entry in config]
+            else:
+                endpoints = [_bedrock_endpoint(region, region, model_id)]
+            _pools[cache_key] = ProviderPool("bedrock_claude", endpoints, _classify_bedrock)
+        return _pools[cache_key]
+
+
+def pool_status():
+    """Health and load of every pool created so far"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    status = {}
+    for pool in pools:
+        status.setdefault(pool.name, []).extend(pool.status())
+    return status
@@ -0,0 +1,393 @@
+"""Columnar store of extracted invoices for analytics.
+
+``save_to_cache`` appends every result to Parquet files, using the same three
+tables that export.py writes (``invoices``, ``line_items``, ``tax_details``):
+
+    <directory>/<table>/extracted_month=YYYY-MM/part-<uuid>.parquet
+
+Each result becomes one small file, written under a temporary name and renamed
+into place, so any number of worker processes can append without a shared
+writer. Once a partition holds ``RESULT_STORE_COMPACT_FILES`` files, they are
+merged into one, under a file lock so only one process compacts a partition at
+a time. Swapping the merged file in waits for running queries, and queries wait
+for a swap, so no query sees a partition's rows twice or misses a removed file.
+
+Line item and tax rows also carry their invoice's ``invoice_month``, seller,
+buyer and currency. Questions like "spend per seller GSTIN per month" are then
+a single scan-and-group over one table, which DuckDB runs vectorised straight
+from the Parquet files. When a document was extracted more than once, only its
+latest result counts.
+
+Needs ``pyarrow`` to write and ``duckdb`` to query. Rebuild the store from the
+result cache with::
+
+    python result_store.py --rebuild
+"""
+import os
+import sys
+import time
+import uuid
+import fcntl
+import argparse
+import threading
+import importlib.util
+from contextlib import contextmanager
+from datetime import datetime
+
+from export import KEY_COLUMNS, TABLES as EXPORT_TABLES, arrow_schema, flatten_result
+from usage import COUNTS as USAGE_COUNTS
+
+RESULT_STORE_COMPACT_FILES = int(os.getenv("RESULT_STORE_COMPACT_FILES", "64"))
+AGGREGATE_MAX_ROWS = int(os.getenv("AGGREGATE_MAX_ROWS", "10000"))
+
+# Invoice columns repeated on line item and tax rows so they group without a join
+INVOICE_CONTEXT = ("invoice_month", "seller_gstin", "seller_name", "buyer_gstin", "currency")
+
+TABLES = {
+    "invoices": EXPORT_TABLES["invoices"] + [("invoice_month", str, None)],
+    "line_items": EXPORT_TABLES["line_items"] + [(name, str, None) for name in INVOICE_CONTEXT],
+    "tax_details": EXPORT_TABLES["tax_details"] + [(name, str, None) for name in INVOICE_CONTEXT],
+    # One row per provider and model of every extraction, failed ones included (see usage.py)
+    "usage": KEY_COLUMNS + [("extracted_day", str, None), ("status", str, None)]
+             + [(name, str, None) for name in INVOICE_CONTEXT]
+             + [("provider", str, None), ("model", str, None), ("calls", int, None)]
+             + [(name, int, None) for name in USAGE_COUNTS] + [("cost_usd", float, None)],
+}
+METRICS = ("sum", "avg", "min", "max", "count")
+
+DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%y",
+                 "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d %B %Y", "%B %d, %Y", "%b %d, %Y")
+
+
+def parse_invoice_date(text):
+    """date of an invoice date in the formats invoices use (day first), or None"""
+    if not text:
+        return None
+    text = str(text).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def invoice_month(invoice_date):
+    """'YYYY-MM' of an invoice date, or None"""
+    parsed = parse_invoice_date(invoice_date)
+    return parsed.strftime("%Y-%m") if parsed else None
+
+
+def store_rows(data, document_sha256, file, processing_method, extracted_at):
+    """{table: rows} of one result, with the invoice context added to child rows"""
+    rows = {table: [] for table in TABLES}
+    context = {}
+    for table, row in flatten_result(data, document_sha256, file, processing_method, extracted_at):
+        if table == "invoices":
+            row["invoice_month"] = invoice_month(row.get("invoice_date"))
+            context = {name: row.get(name) for name in INVOICE_CONTEXT}
+        else:
+            row.update(context)
+        rows[table].append(row)
+    usage = data.get("usage") if isinstance(data, dict) else None
+    if isinstance(usage, dict):
+        keys = {"document_sha256": document_sha256, "file": file, "processing_method": processing_method,
+                "extracted_at": extracted_at, "extracted_day": extracted_at[:10],
+                "status": "error" if "error" in data else "ok"}
+        for call in usage.get("calls") or []:
+            row = dict(keys, **{name: context.get(name) for name in INVOICE_CONTEXT})
+            row.update({name: call.get(name) for name in ("provider", "model", "calls", "cost_usd")})
+            row.update({name: call.get(name, 0) for name in USAGE_COUNTS})
+            rows["usage"].append(row)
+    return rows
+
+
+class ResultStore:
+    """Append-only Parquet tables of extracted invoices, queried with DuckDB"""
+
+    def __init__(self, directory, compact_files=RESULT_STORE_COMPACT_FILES):
+        # Fail early when the store cannot be written, without importing pyarrow until first use
+        if importlib.util.find_spec("pyarrow") is None:
+            raise ImportError("pyarrow is not installed")
+        self.directory = directory
+        self.compact_files = compact_files
+        self._schemas = {}
+        self._local = threading.local()
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        for table in TABLES:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+    # --- writing ---
+
+    def _schema(self, table):
+        if table not in self._schemas:
+            self._schemas[table] = arrow_schema(TABLES[table])
+        return self._schemas[table]
+
+    @contextmanager
+    def _swap_lock(self, exclusive):
+        """Store-wide lock between compaction swaps (exclusive) and queries (shared).
+
+        A query globs the Parquet files and then opens them, so it must not run
+        while a compaction replaces a partition's files with the merged one:
+        it would count rows twice or fail on a removed file.
+        """
+        with open(os.path.join(self.directory, ".swap.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def add(self, data, document_sha256, file, processing_method, extracted_at):
+        """Append one result; results with an error only add their usage rows"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = store_rows(data, document_sha256, file, processing_method, extracted_at)
+        if not any(rows.values()):
+            return
+        partition = f"extracted_month={extracted_at[:7]}"
+        for table, table_rows in rows.items():
+            if not table_rows:
+                continue
+            directory = os.path.join(self.directory, table, partition)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+            pq.write_table(pa.Table.from_pylist(table_rows, schema=self._schema(table)), path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self._maybe_compact(directory, table)
+
+    def _maybe_compact(self, directory, table):
+        parts = [name for name in os.listdir(directory) if name.startswith("part-") and name.endswith(".parquet")]
+        if len(parts) < self.compact_files:
+            return
+        with open(os.path.join(directory, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # another process is compacting this partition
+            self.compact(directory, table)
+
+    def compact(self, directory, table):
+        """Merge a partition's files into one; call with the partition's lock held"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+        if len(names) < 2:
+            return
+        paths = [os.path.join(directory, name) for name in names]
+        # Promotion fills columns added to the models since older files were written
+        merged = pa.concat_tables([pq.read_table(path) for path in paths], promote_options="default")
+        target = os.path.join(directory, f"compact-{uuid.uuid4().hex}.parquet")
+        pq.write_table(merged, target + ".tmp", row_group_size=256 * 1024)
+        with self._swap_lock(exclusive=True):
+            os.replace(target + ".tmp", target)
+            for path in paths:
+                os.remove(path)
+
+    def rebuild(self, results):
+        """Replace the store's contents with ``results`` (as from the app's iter_cached_results)"""
+        import shutil
+        for table in TABLES:
+            shutil.rmtree(os.path.join(self.directory, table), ignore_errors=True)
+            os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+        count = 0
+        for result in results:
+            self.add(**result)
+            count += 1
+        for table in TABLES:
+            table_dir = os.path.join(self.directory, table)
+            for partition in os.listdir(table_dir):
+                self.compact(os.path.join(table_dir, partition), table)
+        return count
+
+    # --- querying ---
+
+    def _cursor(self):
+        """A DuckDB cursor for this thread (connections are not shared between threads)"""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            import duckdb
+            with self._connection_lock:
+                if self._connection is None:
+                    self._connection = duckdb.connect()
+                cursor = self._connection.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    def _query(self, sql, params):
+        """Rows of a query, under the shared swap lock; unreadable files raise OSError"""
+        import duckdb
+        with self._swap_lock(exclusive=False):
+            try:
+                return self._cursor().execute(sql, params).fetchall()
+            except duckdb.IOException as e:
+                raise OSError(f"Could not read the columnar store: {e}") from e
+
+    def _source(self, table):
+        glob = os.path.join(self.directory, table, "*", "*.parquet").replace("'", "''")
+        return f"read_parquet('{glob}', hive_partitioning = true, union_by_name = true)"
+
+    def _has_files(self, table):
+        table_dir = os.path.join(self.directory, table)
+        return any(name.endswith(".parquet") for partition in os.listdir(table_dir)
+                   if os.path.isdir(os.path.join(table_dir, partition))
+                   for name in os.listdir(os.path.join(table_dir, partition)))
+
+    def aggregate(self, table="line_items", group_by=("seller_gstin", "invoice_month"),
+                  metrics=(("sum", "amount"), ("count", None)), filters=None, processing_method=None,
+                  month_from=None, month_to=None, limit=AGGREGATE_MAX_ROWS):
+        """Group the latest result of every document and compute ``metrics`` per group.
+
+        ``metrics`` are (function, column) pairs; ``filters`` maps columns to the
+        values they must equal. Column names are checked against the table, and
+        values are passed as query parameters. The ``usage`` table counts every
+        extraction, not just the latest, and its months are those of ``extracted_day``.
+        """
+        if table not in TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        kinds = {name: kind for name, kind, _ in TABLES[table]}
+        for column in list(group_by) + list(filters or {}):
+            if column not in kinds:
+                raise ValueError(f"Unknown column for {table}: {column}")
+        selects = []
+        names = []
+        for function, column in metrics:
+            if function not in METRICS:
+                raise ValueError(f"Unknown metric: {function}")
+            if column and column not in kinds:
+                raise ValueError(f"Unknown column for {table}: {column}")
+            if function == "count":
+                name = f"count_{column}" if column else "count"
+                target = f'"{column}"' if column else "*"
+                selects.append(f'count({target}) AS "{name}"')
+            elif kinds.get(column) not in (float, int):
+                raise ValueError(f"{function} needs a numeric column of {table}, not {column}")
+            else:
+                name = f"{function}_{column}"
+                selects.append(f'{function}("{column}") AS "{name}"')
+            names.append(name)
+        if not selects:
+            raise ValueError("At least one metric is required")
+
+        group_columns = [f'"{column}"' for column in group_by]
+        columns = list(group_by) + names
+        every_extraction = table == "usage"
+        if not self._has_files(table) or not (every_extraction or self._has_files("invoices")):
+            return {"columns": columns, "rows": [], "elapsed_ms": 0.0}
+
+        params = [processing_method] if processing_method and not every_extraction else []
+        conditions = []
+        if processing_method and every_extraction:
+            conditions.append("processing_method = ?")
+            params.append(processing_method)
+        for column, value in (filters or {}).items():
+            conditions.append(f'"{column}" = ?')
+            params.append(value)
+        month = "left(extracted_day, 7)" if every_extraction else "invoice_month"
+        if month_from:
+            conditions.append(f"{month} >= ?")
+            params.append(month_from)
+        if month_to:
+            conditions.append(f"{month} <= ?")
+            params.append(month_to)
+        params.append(int(limit))
+
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        group = "GROUP BY " + ", ".join(group_columns) if group_columns else ""
+        if every_extraction:
+            sql = f"""
+                SELECT {", ".join(group_columns + selects)}
+                FROM {self._source(table)}
+                {where}
+                {group}
+                ORDER BY {len(group_columns) + 1} DESC
+                LIMIT ?
+            """
+        else:
+            sql = f"""
+            WITH latest AS (
+                SELECT document_sha256,
+                       arg_max(processing_method, extracted_at) AS processing_method,
+                       max(extracted_at) AS extracted_at
+                FROM {self._source("invoices")}
+                {"WHERE processing_method = ?" if processing_method else ""}
+                GROUP BY document_sha256
+            )
+            SELECT {", ".join(group_columns + selects)}
+            FROM {self._source(table)} JOIN latest USING (document_sha256, processing_method, extracted_at)
+            {where}
+            {group}
+            ORDER BY {len(group_columns) + 1} DESC
+            LIMIT ?
+        """
+        started = time.perf_counter()
+        rows = self._query(sql, params)
+        return {"columns": columns, "rows": [list(row) for row in rows],
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    def search(self, query, columns, field=None, processing_method=None, limit=50):
+        """Invoice rows of ``columns`` whose ``field`` (or any of ``columns``) contains ``query``.
+
+        Only each document's latest result (of ``processing_method``, if given) is
+        searched, so a document whose earlier result matched but whose latest does
+        not is left out. Rows come newest first, from one scan of the invoices table
+        rather than a read of every cached result. Matching is case-insensitive on
+        the values as text.
+        """
+        kinds = {name for name, _, _ in TABLES["invoices"]}
+        for column in list(columns) + ([field] if field else []):
+            if column not in kinds:
+                raise ValueError(f"Unknown column for invoices: {column}")
+        selected = ["document_sha256", "file", "processing_method"] + list(columns)
+        if not self._has_files("invoices"):
+            return {"columns": selected, "rows": []}
+
+        params = [processing_method] if processing_method else []
+        conditions = []
+        if query:
+            searched = [field] if field else columns
+            conditions.append("(" + " OR ".join(f'contains(lower(CAST("{column}" AS VARCHAR)), ?)'
+                                                for column in searched) + ")")
+            params.extend([query.lower()] * len(searched))
+        params.append(int(limit))
+        sql = f"""
+            WITH latest AS (
+                SELECT * FROM {self._source("invoices")}
+                {"WHERE processing_method = ?" if processing_method else ""}
+                QUALIFY row_number() OVER (PARTITION BY document_sha256 ORDER BY extracted_at DESC) = 1
+            )
+            SELECT {", ".join(f'"{column}"' for column in selected)}
+            FROM latest
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY extracted_at DESC
+            LIMIT ?
+        """
+        rows = self._query(sql, params)
+        return {"columns": selected, "rows": [list(row) for row in rows]}
+
+
+def open_store(directory):
+    """A ResultStore, or None (with a message) when pyarrow is not installed"""
+    try:
+        return ResultStore(directory)
+    except ImportError:
+        print("pyarrow is not installed; extracted results are not added to the columnar store")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the columnar store of extracted invoices")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the store from every cached result")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+    # The app owns the result cache and the store's location
+    from app import RESULT_STORE, iter_cached_results
+    if RESULT_STORE is None:
+        return 1
+    print(f"Stored {RESULT_STORE.rebuild(iter_cached_results())} results in {RESULT_STORE.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py creates its stores under UPLOAD_FOLDER when imported; keep them out of the checkout
+_STATE = tempfile.mkdtemp(prefix="invoice-tests-")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_STATE, "uploads"))
+os.environ.setdefault("LOCAL_OCR_EXTRACTOR", "none")
+os.environ.setdefault("VENDOR_MASTER_CSV", os.path.join(_STATE, "vendors.csv"))
+os.environ.setdefault("IFSC_MASTER_CSV", os.path.join(_STATE, "ifsc.csv"))
+
+SELLER_GSTIN = "29ABCDE1234F1ZW"
+BUYER_GSTIN = "27AAPFU0939F1ZV"
+
+
+def word(text, left, top, width=None, height=0.02, confidence=0.98):
+    """An OCR word in the local_ocr.py page format, boxes as page fractions"""
+    return {"text": text, "confidence": confidence, "bbox": [left, top, width or 0.012 * len(text), height]}
+
+
+def invoice_page(invoice_number="INV-1", seller_gstin=SELLER_GSTIN, buyer_gstin=BUYER_GSTIN):
+    """One page of a small invoice: header lines, a three-column item table and a total"""
+    return {"width": 2480, "height": 3508, "words": [
+        # Out of reading order, as Tesseract returns table columns as separate blocks
+        word("Amount", 0.8, 0.25), word("100.00", 0.8, 0.28), word("50.00", 0.8, 0.31),
+        word("ACME", 0.05, 0.05), word("TRADERS", 0.11, 0.05),
+        word("GSTIN:", 0.05, 0.08), word(seller_gstin, 0.13, 0.08),
+        word("Invoice", 0.05, 0.12), word("No:", 0.14, 0.12), word(invoice_number, 0.185, 0.12),
+        word("Date:", 0.05, 0.15), word("01/02/2026", 0.12, 0.15),
+        word("Buyer", 0.05, 0.18), word("GSTIN:", 0.115, 0.18), word(buyer_gstin, 0.195, 0.18),
+        word("Description", 0.05, 0.25), word("Qty", 0.5, 0.25),
+        word("Widget", 0.05, 0.28), word("2", 0.5, 0.28),
+        word("Gadget", 0.05, 0.31), word("1", 0.5, 0.31),
+        word("Total:", 0.6, 0.40), word("150.00", 0.7, 0.40),
+    ]}
+
+
+def invoice_data(invoice_number="INV-1"):
+    """The extraction of ``invoice_page`` an LLM would return"""
+    return {
+        "invoice_number": invoice_number,
+        "invoice_date": "01/02/2026",
+        "seller": {"name": "ACME TRADERS", "gstin": SELLER_GSTIN},
+        "buyer": {"gstin": BUYER_GSTIN},
+        "line_items": [{"description": "Widget", "quantity": 2, "amount": 100.0},
+                       {"description": "Gadget", "quantity": 1, "amount": 50.0}],
+        "subtotal": 150.0,
+        "total_amount": 150.0,
+    }
+
+
+@pytest.fixture
+def page():
+    return invoice_page()
+
+
+def text_pdf(path, texts, width=595, height=842, size=10):
+    """Write a born-digital PDF with Helvetica ``texts``, (left, top, text) in points from the top left"""
+    stream = "".join(f"BT /F1 {size} Tf {left} {height - top - size} Td ({text}) Tj ET\n"
+                     for left, top, text in texts).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] /Contents 4 0 R "
+        f"/Resources << /Font << /F1 5 0 R >> >> >>".encode("ascii"),
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"endstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def invoice_pdf(path, invoice_number="INV-1"):
+    """``invoice_page`` as a born-digital PDF"""
+    return text_pdf(path, [
+        (30, 40, "ACME TRADERS"), (30, 60, f"GSTIN: {SELLER_GSTIN}"),
+        (30, 90, f"Invoice No: {invoice_number}"), (30, 110, "Date: 01/02/2026"),
+        (30, 130, f"Buyer GSTIN: {BUYER_GSTIN}"),
+        (30, 200, "Description"), (300, 200, "Qty"), (480, 200, "Amount"),
+        (30, 220, "Widget"), (300, 220, "2"), (480, 220, "100.00"),
+        (30, 240, "Gadget"), (300, 240, "1"), (480, 240, "50.00"),
+        (380, 300, "Total:"), (430, 300, "150.00"),
+    ])
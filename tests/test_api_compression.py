@@ -0,0 +1,51 @@
+import pytest
+from flask import Response
+
+import app
+
+BODY = b'{"result": "' + b"x" * 5000 + b'"}'
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(app, "_compressed", type(app._compressed)())
+    monkeypatch.setattr(app, "_compressed_bytes", 0)
+
+
+def finish(headers=None, etag=None, body=BODY):
+    with app.app.test_request_context("/api/v1/results/abc", headers=headers or {}):
+        response = Response(body, mimetype="application/json")
+        if etag:
+            response.set_etag(etag)
+        return app.finish_api_response(response)
+
+
+def test_each_encoding_has_its_own_etag():
+    identity = finish()
+    gzipped = finish({"Accept-Encoding": "gzip"})
+    assert identity.headers.get("Content-Encoding") is None and gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.get_etag() == (identity.get_etag()[0] + "-gzip", False)
+    assert "Accept-Encoding" in gzipped.vary
+
+
+def test_conditional_requests_match_the_encoded_etag():
+    etag = finish({"Accept-Encoding": "gzip"}, etag="v1").get_etag()[0]
+    assert etag == "v1-gzip"
+    assert finish({"Accept-Encoding": "gzip", "If-None-Match": f'"{etag}"'}, etag="v1").status_code == 304
+    # The identity body is a different representation
+    assert finish({"If-None-Match": f'"{etag}"'}, etag="v1").status_code == 200
+
+
+def test_only_versioned_bodies_are_kept_compressed(monkeypatch):
+    finish({"Accept-Encoding": "gzip"})
+    assert list(app._compressed) == []
+    monkeypatch.setattr(app, "API_COMPRESS_CACHE_BYTES", 100)
+    first = finish({"Accept-Encoding": "gzip"}, etag="v1").get_data()
+    finish({"Accept-Encoding": "gzip"}, etag="v2", body=BODY.replace(b"x", b"y"))
+    assert list(app._compressed) == [("v2", "gzip")]
+    assert app._compressed_bytes == len(first)
+
+
+def test_small_bodies_are_sent_as_they_are():
+    response = finish({"Accept-Encoding": "gzip"}, body=b"{}")
+    assert response.headers.get("Content-Encoding") is None and not response.get_etag()[0].endswith("-gzip")
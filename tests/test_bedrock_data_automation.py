@@ -0,0 +1,112 @@
+"""The BDA client against moto's S3 and STS, with the BDA runtime stubbed by botocore"""
+import json
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+from bedrock_data_automation import (BedrockDataAutomationClient, BedrockDataAutomationError, output_page_count,
+                                     split_s3_uri, standard_output_text)
+
+REGION = "us-east-1"
+BUCKET = "bda-test"
+INVOCATION_ARN = "arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/job-1"
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name=REGION)
+        s3.create_bucket(Bucket=BUCKET)
+        yield s3
+
+
+@pytest.fixture
+def client(aws):
+    bda = boto3.client("bedrock-data-automation-runtime", region_name=REGION)
+    client = BedrockDataAutomationClient(REGION, bucket=BUCKET, project_id="project-1", max_workers=2,
+                                         poll_interval=0, timeout=5, s3_client=aws, bda_client=bda,
+                                         sts_client=boto3.client("sts", region_name=REGION))
+    with Stubber(bda) as stubber:
+        client.stubber = stubber
+        yield client
+
+
+def put_json(s3, key, data):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=json.dumps(data).encode("utf-8"))
+    return f"s3://{BUCKET}/{key}"
+
+
+def segment(markdown, pages):
+    return {"metadata": {"number_of_pages": pages}, "output": [{"representation": {"markdown": markdown}}]}
+
+
+def stub_invocation(client, statuses, output_uri=None):
+    client.stubber.add_response("invoke_data_automation_async", {"invocationArn": INVOCATION_ARN}, {
+        "inputConfiguration": {"s3Uri": ANY},
+        "outputConfiguration": {"s3Uri": f"s3://{BUCKET}/{client.output_prefix}"},
+        "dataAutomationConfiguration": {
+            "dataAutomationProjectArn": "arn:aws:bedrock:us-east-1:123456789012:data-automation-project/project-1"},
+        "dataAutomationProfileArn": ANY,
+    })
+    for status in statuses:
+        response = {"status": status}
+        if status == "Success":
+            response["outputConfiguration"] = {"s3Uri": output_uri}
+        client.stubber.add_response("get_data_automation_status", response, {"invocationArn": INVOCATION_ARN})
+
+
+def test_process_uploads_polls_and_reads_segments_in_order(client, aws, tmp_path):
+    document = tmp_path / "invoice.pdf"
+    document.write_bytes(b"%PDF-1.4 test")
+    first = put_json(aws, "out/0/standard_output.json", segment("# Page 1", 1))
+    second = put_json(aws, "out/1/standard_output.json", segment("# Pages 2-3", 2))
+    metadata = put_json(aws, "out/job_metadata.json", {"output_metadata": [
+        {"segment_metadata": [{"standard_output_path": first}, {"standard_output_path": second}]}]})
+    stub_invocation(client, ["Created", "InProgress", "Success"], metadata)
+
+    outputs = client.process(str(document))
+
+    assert standard_output_text(outputs) == "# Page 1\n# Pages 2-3"
+    assert output_page_count(outputs) == 3
+    client.stubber.assert_no_pending_responses()
+    (uploaded,) = aws.list_objects_v2(Bucket=BUCKET, Prefix=client.input_prefix)["Contents"]
+    assert uploaded["Key"].endswith("/invoice.pdf")
+    assert aws.get_object(Bucket=BUCKET, Key=uploaded["Key"])["Body"].read() == b"%PDF-1.4 test"
+
+
+def test_failed_invocation_raises_with_the_status(client, tmp_path):
+    document = tmp_path / "invoice.pdf"
+    document.write_bytes(b"%PDF-1.4 test")
+    stub_invocation(client, ["InProgress", "ServiceError"])
+
+    with pytest.raises(BedrockDataAutomationError, match="ServiceError") as error:
+        client.process(str(document))
+    assert error.value.status_response["status"] == "ServiceError"
+
+
+def test_job_without_standard_output_raises(client, aws):
+    metadata = put_json(aws, "out/job_metadata.json", {"output_metadata": [{"segment_metadata": []}]})
+    with pytest.raises(BedrockDataAutomationError, match="no standard output"):
+        client.fetch_outputs(metadata)
+
+
+def test_process_many_reports_each_document(client, aws, tmp_path):
+    document = tmp_path / "invoice.pdf"
+    document.write_bytes(b"%PDF-1.4 test")
+    stub_invocation(client, ["Failed"])
+
+    results = client.process_many([str(document)])
+
+    assert isinstance(results[str(document)], BedrockDataAutomationError)
+
+
+def test_helpers():
+    assert split_s3_uri("s3://bucket/a/b.json") == ("bucket", "a/b.json")
+    assert standard_output_text([{"output": []}]) == json.dumps({"output": []})
+    assert output_page_count([{}, {"metadata": {"number_of_pages": 4}}]) == 5
@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from chunked_extraction import (extract_chunked, find_line_item_table, reconcile_line_items, should_chunk,
+                                split_layout)
+
+
+def markdown_invoice(rows):
+    lines = ["Invoice No: INV-1", "", "| Item | Amount |", "| --- | --- |"]
+    lines += [f"| Item {number} | {number}.00 |" for number in range(1, rows + 1)]
+    lines += ["", "| Tax | Amount |", "| --- | --- |", "| IGST | 9.00 |", "", "Total: 100.00"]
+    return "\n".join(lines)
+
+
+def html_invoice(rows):
+    body = "".join(f"<tr><td>Item {number}</td><td>{number}</td></tr>" for number in range(1, rows + 1))
+    return f"Header text<table><tr><th>Item</th><th>Amount</th></tr>{body}</table>Footer text"
+
+
+def test_the_longest_table_is_the_line_item_table():
+    table = find_line_item_table(markdown_invoice(5))
+    assert table.kind == "markdown"
+    assert table.header_rows == ["| Item | Amount |", "| --- | --- |"]
+    assert len(table.body_rows) == 5
+    assert find_line_item_table("No tables here") is None
+    assert find_line_item_table(None) is None
+
+
+def test_html_tables_split_heading_rows():
+    table = find_line_item_table(html_invoice(3))
+    assert table.kind == "html"
+    assert table.header_rows == ["<tr><th>Item</th><th>Amount</th></tr>"]
+    assert table.render(table.body_rows[:1]) == (
+        "<table><tr><th>Item</th><th>Amount</th></tr><tr><td>Item 1</td><td>1</td></tr></table>")
+
+
+def test_should_chunk_follows_the_threshold_and_setting(monkeypatch):
+    monkeypatch.delenv("CHUNKED_EXTRACTION", raising=False)
+    assert not should_chunk(markdown_invoice(59))
+    assert should_chunk(markdown_invoice(60))
+    monkeypatch.setenv("CHUNKED_EXTRACTION", "off")
+    assert not should_chunk(markdown_invoice(100))
+    monkeypatch.setenv("CHUNKED_EXTRACTION", "always")
+    assert should_chunk(markdown_invoice(41))
+    assert not should_chunk(markdown_invoice(40))
+
+
+def test_split_layout_keeps_headings_on_every_chunk():
+    header_text, chunks = split_layout(markdown_invoice(25), chunk_rows=10)
+    assert len(chunks) == 3
+    assert all(chunk.startswith("| Item | Amount |\n| --- | --- |\n") for chunk in chunks)
+    assert chunks[2].count("\n") == 2 + 5 - 1
+    # The header keeps two sample rows and the rest of the document
+    assert "| Item 2 | 2.00 |" in header_text and "| Item 3 | 3.00 |" not in header_text
+    assert "[23 more line item rows omitted]" in header_text
+    assert "Total: 100.00" in header_text and "| IGST | 9.00 |" in header_text
+
+
+def test_split_layout_without_a_table():
+    assert split_layout("Just text") == ("Just text", [])
+
+
+def test_reconcile_line_items():
+    result = reconcile_line_items([{"amount": 10.25}, {"amount": None}, "junk", {"amount": 5}], 15.5)
+    assert result == {"line_items_count": 4, "line_items_total": 15.25, "subtotal": 15.5, "delta": -0.25,
+                      "reconciled": True}
+    assert reconcile_line_items([{"amount": 10}], 20, tolerance=1.0)["reconciled"] is False
+    assert reconcile_line_items([{"amount": 10}], None)["reconciled"] is None
+
+
+def test_extract_chunked_merges_items_in_row_order():
+    seen = []
+    lock = threading.Lock()
+
+    def extract_header(text):
+        assert "[15 more line item rows omitted]" in text
+        return {"invoice_number": "INV-1", "subtotal": sum(range(1, 18)), "items": ["dropped"]}
+
+    def extract_items(chunk):
+        rows = chunk.split("\n")[2:]
+        with lock:
+            seen.append(len(rows))
+        return [{"description": row.split("|")[1].strip(), "amount": float(row.split("|")[2])} for row in rows]
+
+    invoice = extract_chunked(markdown_invoice(17), extract_header, extract_items, chunk_rows=5, workers=4)
+
+    assert sorted(seen) == [2, 5, 5, 5]
+    assert [item["description"] for item in invoice["line_items"]] == [f"Item {n}" for n in range(1, 18)]
+    assert "items" not in invoice
+    assert invoice["reconciliation"]["reconciled"] is True
+    assert invoice["reconciliation"]["chunks"] == 4
+
+
+def test_extract_chunked_can_name_the_items_key():
+    invoice = extract_chunked(markdown_invoice(3), lambda text: None, lambda chunk: [{"amount": 1}],
+                              items_key="items", chunk_rows=2)
+    assert invoice["items"] == [{"amount": 1}, {"amount": 1}]
+    assert invoice["reconciliation"]["subtotal"] is None
+
+
+def test_extract_chunked_raises_chunk_errors():
+    def extract_items(chunk):
+        raise ValueError("chunk failed")
+
+    with pytest.raises(ValueError, match="chunk failed"):
+        extract_chunked(markdown_invoice(3), lambda text: {}, extract_items, chunk_rows=2)
@@ -0,0 +1,77 @@
+from PIL import Image, ImageDraw
+
+from duplicates import DuplicateIndex, document_hash, field_fingerprint, image_hash, informative
+
+
+def invoice_image(path, shift=0):
+    image = Image.new("RGB", (400, 560), "white")
+    draw = ImageDraw.Draw(image)
+    for index, top in enumerate(range(40, 520, 60)):
+        draw.rectangle((40 + shift, top, 160 + 25 * (index % 4), top + 20), fill="black")
+    image.save(path)
+    return str(path)
+
+
+def test_document_hash_matches_near_copies(tmp_path):
+    original = document_hash(invoice_image(tmp_path / "a.png"))
+    rescan = document_hash(invoice_image(tmp_path / "b.png", shift=1))
+    assert informative(original)
+    assert bin(original ^ rescan).count("1") <= 3
+
+
+def test_blank_pages_are_not_informative():
+    assert image_hash(Image.new("RGB", (100, 100), "white")) == 0
+    assert not informative(0)
+    assert not informative((1 << 64) - 1)
+
+
+def test_field_fingerprint_normalizes_and_needs_every_field():
+    first = field_fingerprint({"seller": {"gstin": "27 aapfu0939f1zv"}, "invoice_number": "INV/1-2",
+                               "total_amount": 100})
+    second = field_fingerprint({"seller": {"gstin": "27AAPFU0939F1ZV"}, "invoice_number": "inv12",
+                                "total_amount": 100.0})
+    assert first == second
+    assert field_fingerprint({"seller": {"gstin": "27AAPFU0939F1ZV"}, "invoice_number": "INV12"}) is None
+    assert field_fingerprint("not a result") is None
+
+
+def test_find_similar_within_distance(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"), max_distance=3)
+    phash = 0x0F0F_3C3C_A5A5_F00F
+    index.add("a", "a.pdf", phash=phash)
+    index.add("b", "b.pdf", phash=phash ^ 0b111)
+    index.add("c", "c.pdf", phash=phash ^ 0b11110)
+    assert index.find_similar(phash ^ 0b1, exclude="x") == [
+        {"id": "a", "path": "a.pdf", "distance": 1}, {"id": "b", "path": "b.pdf", "distance": 2}]
+    assert [match["id"] for match in index.find_similar(phash, exclude="a")] == ["b"]
+
+
+def test_uninformative_hashes_never_match(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    index.add("blank1", "blank1.pdf", phash=0)
+    index.add("blank2", "blank2.pdf", phash=1)
+    assert index.find_similar(0) == []
+    assert index.find_similar(1) == []
+
+
+def test_updates_merge_and_reindex(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    phash = 0x0F0F_3C3C_A5A5_F00F
+    index.add("a", "a.pdf", phash=phash, mtime=1.0)
+    index.add("a", "a.pdf", fingerprint="f1")
+    assert index.get("a") == {"path": "a.pdf", "phash": f"{phash:016x}", "mtime": 1.0, "fingerprint": "f1"}
+    index.add("a", "a.pdf", fingerprint="f2")
+    assert index.find_by_fingerprint("f1") == []
+    assert index.find_by_fingerprint("f2") == [{"id": "a", "path": "a.pdf"}]
+    assert [match["id"] for match in index.find_similar(phash)] == ["a"]
+
+
+def test_index_is_shared_through_its_journal(tmp_path):
+    path = str(tmp_path / "duplicates.jsonl")
+    writer = DuplicateIndex(path)
+    reader = DuplicateIndex(path)
+    writer.add("a", "a.pdf", fingerprint="f")
+    assert reader.find_by_fingerprint("f") == [{"id": "a", "path": "a.pdf"}]
+    # Another process's entries are replayed from the journal on start
+    assert DuplicateIndex(path).get("a") == {"path": "a.pdf", "fingerprint": "f"}
+
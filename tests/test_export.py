@@ -0,0 +1,73 @@
+import csv
+import json
+
+import pytest
+
+from export import TABLES, export_results, flatten_result, format_timestamp, parse_timestamp, stream_table
+
+from conftest import SELLER_GSTIN, invoice_data
+
+
+def cached(number, extracted_at, method="textract_claude", **fields):
+    data = dict(invoice_data(number), **fields)
+    data["seller"] = {"name": "Acme Supplies", "gstin": SELLER_GSTIN}
+    data["line_items"] = [{"description": "Widget", "quantity": "2", "amount": "1,200.50"},
+                          {"description": "Gadget", "amount": None}]
+    data["tax_details"] = [{"tax_type": "IGST", "rate": 18, "amount": 216.09}]
+    return {"data": data, "document_sha256": number.lower() * 4, "file": f"{number}.pdf",
+            "processing_method": method, "extracted_at": extracted_at}
+
+
+def test_results_flatten_into_three_tables():
+    rows = list(flatten_result(**cached("INV-1", "2024-03-01T10:00:00.000000Z", reverse_charge="No")))
+    assert [table for table, _ in rows] == ["invoices", "line_items", "line_items", "tax_details"]
+    invoice = rows[0][1]
+    assert list(invoice) == [name for name, _, _ in TABLES["invoices"]]
+    assert invoice["seller_gstin"] == SELLER_GSTIN and invoice["reverse_charge"] is False
+    first_item = rows[1][1]
+    assert (first_item["invoice_number"], first_item["line_number"]) == ("INV-1", 1)
+    assert (first_item["quantity"], first_item["amount"]) == (2.0, 1200.5)
+    assert rows[2][1]["amount"] is None
+    assert list(flatten_result({"error": "failed"}, "x", "x.pdf", "m", "t")) == []
+
+
+def test_csv_export_writes_a_file_per_table_and_a_watermark(tmp_path):
+    results = [cached("INV-1", "2024-03-01T10:00:00.000000Z"), cached("INV-2", "2024-03-02T10:00:00.000000Z")]
+    summary = export_results(iter(results), str(tmp_path), "csv", chunk_rows=1)
+
+    assert summary["documents"] == 2
+    assert summary["rows"] == {"invoices": 2, "line_items": 4, "tax_details": 2}
+    assert summary["watermark"] == "2024-03-02T10:00:00.000000Z"
+    with open(summary["files"]["line_items"], newline="") as f:
+        items = list(csv.DictReader(f))
+    assert [(item["invoice_number"], item["line_number"]) for item in items] == [
+        ("INV-1", "1"), ("INV-1", "2"), ("INV-2", "1"), ("INV-2", "2")]
+
+    # A later run keeps the newest watermark, even when it exports older results
+    export_results(iter([cached("INV-0", "2024-01-01T10:00:00.000000Z")]), str(tmp_path), "jsonl")
+    state = json.loads((tmp_path / "export_state.json").read_text())
+    assert state["watermark"] == "2024-03-02T10:00:00.000000Z"
+    assert [run["format"] for run in state["runs"]] == ["csv", "jsonl"]
+
+
+def test_parquet_export(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    summary = export_results(iter([cached("INV-1", "2024-03-01T10:00:00.000000Z")]), str(tmp_path), "parquet")
+    table = pq.read_table(summary["files"]["invoices"])
+    assert table.num_rows == 1
+    assert table.column("invoice_number").to_pylist() == ["INV-1"]
+
+
+def test_streamed_tables_match_the_rows():
+    text = "".join(stream_table(iter([cached("INV-1", "t1"), cached("INV-2", "t2")]), "tax_details", "jsonl"))
+    rows = [json.loads(line) for line in text.splitlines()]
+    assert [(row["invoice_number"], row["tax_type"], row["amount"]) for row in rows] == [
+        ("INV-1", "IGST", 216.09), ("INV-2", "IGST", 216.09)]
+    with pytest.raises(ValueError):
+        list(stream_table(iter([]), "invoices", "parquet"))
+
+
+def test_timestamps_sort_as_text():
+    assert format_timestamp(0) == "1970-01-01T00:00:00.000000Z"
+    assert parse_timestamp("1970-01-01T00:01:00") == 60.0
+    assert parse_timestamp(format_timestamp(1700000000.25)) == 1700000000.25
@@ -0,0 +1,74 @@
+"""The offline local_ocr path: vendor templates without any LLM (LOCAL_OCR_EXTRACTOR=none)"""
+import pytest
+from PIL import Image, ImageDraw
+
+import app
+from local_ocr import layout_tables, layout_words
+from provenance import field_provenance
+from vendor_templates import VendorTemplates
+
+from conftest import SELLER_GSTIN, invoice_data, invoice_page
+
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    templates = VendorTemplates(str(tmp_path / "vendor_templates"))
+    monkeypatch.setattr(app, "VENDOR_TEMPLATES", templates)
+    return templates
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "invoice.png"
+    image = Image.new("RGB", (248, 350), "white")
+    ImageDraw.Draw(image).rectangle((20, 80, 220, 120), fill="black")
+    image.save(path)
+    return str(path)
+
+
+def learn(templates, invoice_number):
+    pages = [invoice_page(invoice_number)]
+    words = layout_words(pages)
+    data = invoice_data(invoice_number)
+    return templates.learn(data, field_provenance(data, words, "local_ocr"), words, layout_tables(pages))
+
+
+def test_offline_extractor_is_none():
+    assert app.LOCAL_OCR_EXTRACTOR == "none"
+
+
+def test_without_a_template_nothing_is_extracted(templates, document):
+    result = app.extract_from_layout(document, "local_ocr", [invoice_page()], "local_ocr", "none")
+    assert result is None
+    assert app.get_rendered_result(document, "local_ocr") is None
+
+
+def test_one_sample_does_not_make_a_template_ready(templates, document):
+    assert learn(templates, "INV-1") == SELLER_GSTIN
+    assert app.extract_from_layout(document, "local_ocr", [invoice_page("INV-3")], "local_ocr", "none") is None
+
+
+def test_ready_template_extracts_and_caches(templates, document):
+    learn(templates, "INV-1")
+    learn(templates, "INV-2")
+
+    result = app.extract_from_layout(document, "local_ocr", [invoice_page("INV-3")], "local_ocr", "none")
+
+    assert result["template"]["seller_gstin"] == SELLER_GSTIN
+    assert result["invoice_number"] == "INV-3"
+    assert result["invoice_date"] == "2026-02-01"
+    assert result["total_amount"] == 150.0
+    assert result["seller"]["gstin"] == SELLER_GSTIN
+    assert [(item["description"], item["amount"]) for item in result["line_items"]] == [
+        ("Widget", 100.0), ("Gadget", 50.0)]
+    assert result["provenance"]["invoice_number"]["source"] == "local_ocr_template"
+    cached = app.get_rendered_result(document, "local_ocr")
+    assert cached is not None and cached.data["invoice_number"] == "INV-3"
+
+
+def test_template_is_not_applied_to_the_buyer(templates, document):
+    learn(templates, "INV-1")
+    learn(templates, "INV-2")
+    # An invoice the templated seller received: its GSTIN is printed in the buyer's place
+    page = invoice_page("X-9", seller_gstin="27AAPFU0939F1ZV", buyer_gstin=SELLER_GSTIN)
+    assert app.extract_from_layout(document, "local_ocr", [page], "local_ocr", "none") is None
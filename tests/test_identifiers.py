@@ -0,0 +1,113 @@
+import csv
+import os
+
+import pytest
+
+import identifiers
+from identifiers import (MasterDataIndex, check_identifiers, gstin_check_digit, is_valid_gstin, is_valid_ifsc,
+                         is_valid_pan, state_code_for_place, suggest_gstins)
+
+GSTIN = "27AAPFU0939F1ZV"
+
+
+@pytest.fixture
+def no_master_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(identifiers, "_indexes", {})
+    monkeypatch.setattr(identifiers, "VENDOR_MASTER_CSV", str(tmp_path / "vendors.csv"))
+    monkeypatch.setattr(identifiers, "IFSC_MASTER_CSV", str(tmp_path / "ifsc.csv"))
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def master_data(no_master_data):
+    write_csv(identifiers.VENDOR_MASTER_CSV, [{"gstin": GSTIN, "name": "Known Vendor"}])
+    write_csv(identifiers.IFSC_MASTER_CSV, [{"ifsc": "HDFC0001234", "bank": "HDFC Bank"}])
+
+
+def test_gstin_checksum():
+    assert gstin_check_digit(GSTIN[:14]) == "V"
+    assert is_valid_gstin(GSTIN)
+    assert is_valid_gstin("27 aapfu0939f1zv")
+    assert not is_valid_gstin("27AAPFU0939F1ZA")  # wrong check character
+    assert not is_valid_gstin("99AAPFU0939F1Z" + gstin_check_digit("99AAPFU0939F1Z"))  # no such state
+    assert not is_valid_gstin(None)
+
+
+def test_pan_and_ifsc_formats():
+    assert is_valid_pan("AAPFU0939F")
+    assert not is_valid_pan("AAPXU0939F")
+    assert is_valid_ifsc("HDFC0001234")
+    assert not is_valid_ifsc("HDFC1001234")
+
+
+def test_state_code_for_place():
+    assert state_code_for_place("27-Maharashtra") == "27"
+    assert state_code_for_place("Maharashtra") == "27"
+    assert state_code_for_place("Maharashtra (27)") == "27"
+    assert state_code_for_place("Atlantis") is None
+    assert state_code_for_place(None) is None
+
+
+def test_ocr_confusions_are_suggested_without_master_data():
+    # O read for 0
+    assert GSTIN in suggest_gstins("27AAPFU0939F1ZV".replace("0939", "O939"))
+    assert suggest_gstins("short") == []
+
+
+def test_master_data_index_lookup(master_data):
+    vendors = identifiers.vendor_index()
+    assert vendors.get(GSTIN) == {"gstin": GSTIN, "name": "Known Vendor"}
+    assert vendors.get("29AAPFU0939F1ZV") is None
+    assert vendors.get("too short") is None
+
+
+def test_indexes_follow_changes_to_the_csv(master_data):
+    assert identifiers.vendor_index().get("29AAPFU0939F1ZV") is None
+    write_csv(identifiers.VENDOR_MASTER_CSV, [{"gstin": "29AAPFU0939F1ZV", "name": "New Vendor"}])
+    os.utime(identifiers.VENDOR_MASTER_CSV, ns=(0, os.stat(identifiers.VENDOR_MASTER_CSV).st_mtime_ns + 10**9))
+    assert identifiers.vendor_index().get("29AAPFU0939F1ZV")["name"] == "New Vendor"
+    assert identifiers.vendor_index().get(GSTIN) is None
+    assert not [name for name in os.listdir(os.path.dirname(identifiers.VENDOR_MASTER_CSV)) if name.endswith(".tmp")]
+
+
+def test_missing_master_data_is_picked_up_once_written(no_master_data):
+    assert identifiers.ifsc_index() is None
+    write_csv(identifiers.IFSC_MASTER_CSV, [{"ifsc": "HDFC0001234", "bank": "HDFC Bank"}])
+    assert identifiers.ifsc_index().get("HDFC0001234")["bank"] == "HDFC Bank"
+
+
+def test_check_identifiers_flags_invalid_values(no_master_data):
+    report = check_identifiers({
+        "seller": {"gstin": "27AAPFU0939F1ZA", "pan": "AAPFU0939F"},
+        "buyer": {"gstin": GSTIN, "pan": "BBPFU0939F"},
+        "bank_details": {"ifsc_code": "HDFC1001234"},
+    })
+    problems = {(issue["field"], issue["problem"]) for issue in report["issues"]}
+    assert problems == {("seller.gstin", "invalid GSTIN"), ("buyer.pan", "PAN does not match GSTIN"),
+                        ("bank_details.ifsc_code", "invalid IFSC")}
+    assert not report["valid"]
+
+
+def test_place_of_supply_must_match_buyer_state(no_master_data):
+    report = check_identifiers({"buyer": {"gstin": GSTIN}, "place_of_supply": "29-Karnataka"})
+    (issue,) = report["issues"]
+    assert issue["field"] == "place_of_supply"
+    assert issue["suggestions"] == ["27-Maharashtra"]
+
+
+def test_check_identifiers_looks_up_master_data(master_data):
+    report = check_identifiers({"seller": {"gstin": GSTIN}, "bank_details": {"ifsc_code": "HDFC0001234"}})
+    assert report["valid"]
+    assert report["lookups"]["seller.gstin"]["name"] == "Known Vendor"
+    assert report["lookups"]["bank_details.ifsc_code"]["bank"] == "HDFC Bank"
+
+    report = check_identifiers({"bank_details": {"ifsc_code": "HDFC0001235"}})
+    (issue,) = report["issues"]
+    assert issue["problem"] == "unknown IFSC"
+    assert issue["suggestions"] == ["HDFC0001234"]
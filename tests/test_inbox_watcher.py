@@ -0,0 +1,69 @@
+import threading
+import time
+
+import app
+import inbox_watcher
+from inbox_watcher import InboxState, InboxWatcher
+from ingestion import ContentHashIndex
+
+
+class Rendered:
+    data = {"invoice_number": "INV-1"}
+
+
+def test_shutdown_drains_queued_extractions(tmp_path, monkeypatch):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (inbox / name).write_bytes(name.encode())
+    state_file = str(tmp_path / "inbox_state.jsonl")
+    extracted = []
+
+    def extract(path, processing_method):
+        time.sleep(0.2)
+        extracted.append(path)
+        return Rendered()
+
+    def run(watcher):
+        # Take in both files, then stop as on SIGTERM while they are still queued
+        for name in ("a.pdf", "b.pdf"):
+            stat = (inbox / name).stat()
+            watcher._ingest(str(inbox / name), stat.st_size, stat.st_mtime)
+        watcher.stop()
+
+    monkeypatch.setattr(app, "analyze_to_rendered_result", extract)
+    monkeypatch.setattr(app, "CONTENT_HASH_INDEX", ContentHashIndex(str(tmp_path / "content_hashes.jsonl")))
+    monkeypatch.setattr(InboxWatcher, "run", run)
+
+    assert inbox_watcher.main([str(inbox), "--workers", "1", "--state-file", state_file]) == 0
+
+    assert sorted(extracted) == [str(inbox / "a.pdf"), str(inbox / "b.pdf")]
+    assert InboxState(state_file).in_flight() == []
+
+
+def test_drain_gives_up_after_its_timeout(tmp_path, monkeypatch):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    (inbox / "slow.pdf").write_bytes(b"slow")
+    release = threading.Event()
+
+    def extract(path, processing_method):
+        release.wait(5)
+        return Rendered()
+
+    def run(watcher):
+        stat = (inbox / "slow.pdf").stat()
+        watcher._ingest(str(inbox / "slow.pdf"), stat.st_size, stat.st_mtime)
+        watcher.stop()
+
+    monkeypatch.setattr(app, "analyze_to_rendered_result", extract)
+    monkeypatch.setattr(app, "CONTENT_HASH_INDEX", ContentHashIndex(str(tmp_path / "content_hashes.jsonl")))
+    monkeypatch.setattr(InboxWatcher, "run", run)
+    state_file = str(tmp_path / "inbox_state.jsonl")
+
+    started = time.monotonic()
+    assert inbox_watcher.main([str(inbox), "--state-file", state_file, "--drain-timeout", "0.2"]) == 0
+    assert time.monotonic() - started < 2
+    # Still queued, so the next start resumes it
+    assert InboxState(state_file).in_flight() == [str(inbox / "slow.pdf")]
+    release.set()
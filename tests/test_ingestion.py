@@ -0,0 +1,94 @@
+import hashlib
+import io
+import queue
+import threading
+import zipfile
+
+import pytest
+
+from ingestion import (ArchiveTooLargeError, ContentHashIndex, ExtractionQueue, file_sha256, iter_zip_spools,
+                       spool_stream, store_spool)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ContentHashIndex(str(tmp_path / "content_hashes.jsonl"))
+
+
+def spool(tmp_path, data):
+    return spool_stream(io.BytesIO(data), str(tmp_path), chunk_size=4)
+
+
+def test_spool_hashes_while_writing(tmp_path):
+    spooled = spool(tmp_path, b"%PDF-1.4 invoice")
+    assert spooled.hexdigest() == hashlib.sha256(b"%PDF-1.4 invoice").hexdigest()
+    assert spooled.size == 16
+    spooled.commit(str(tmp_path / "a.pdf"))
+    assert file_sha256(str(tmp_path / "a.pdf")) == spooled.hexdigest()
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_store_spool_keeps_new_content_and_drops_duplicates(tmp_path, index):
+    first, duplicate_of = store_spool(spool(tmp_path, b"one"), "invoice.pdf", str(tmp_path), index)
+    assert (first, duplicate_of) == (str(tmp_path / "invoice.pdf"), None)
+
+    path, duplicate_of = store_spool(spool(tmp_path, b"one"), "again.pdf", str(tmp_path), index)
+    assert (path, duplicate_of) == (None, first)
+    assert not (tmp_path / "again.pdf").exists()
+
+    # Same name, different content: both are kept
+    second, _ = store_spool(spool(tmp_path, b"two"), "invoice.pdf", str(tmp_path), index)
+    assert second == str(tmp_path / f"invoice_{hashlib.sha256(b'two').hexdigest()[:8]}.pdf")
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_hash_index_forgets_deleted_and_overwritten_documents(tmp_path, index):
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"one")
+    assert index.claim("1" * 64, str(path)) is None
+    assert index.claim("2" * 64, str(path)) is None
+    assert index.get("1" * 64) is None and index.get("2" * 64) == str(path)
+    assert index.digest_of(str(path)) == "2" * 64
+    path.unlink()
+    assert index.get("2" * 64) is None and index.entries() == []
+    # A deleted document's content can be stored again
+    assert index.claim("2" * 64, str(tmp_path / "b.pdf")) is None
+
+
+def test_zip_members_are_spooled_within_the_limits(tmp_path):
+    archive = tmp_path / "batch.zip"
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("invoices/a.pdf", b"a" * 10)
+        f.writestr("notes.txt", b"skipped")
+        f.writestr("b.PDF", b"b" * 10)
+    members = [(name, spooled.size) for name, spooled in iter_zip_spools(str(archive), str(tmp_path))]
+    assert members == [("a.pdf", 10), ("b.PDF", 10)]
+
+    with pytest.raises(ArchiveTooLargeError, match="a.pdf"):
+        list(iter_zip_spools(str(archive), str(tmp_path), max_member_bytes=5))
+    with pytest.raises(ArchiveTooLargeError, match="b.PDF"):
+        list(iter_zip_spools(str(archive), str(tmp_path), max_total_bytes=15))
+
+
+def test_extraction_queue_applies_backpressure_and_drains():
+    release = threading.Event()
+    handled = []
+
+    def handler(path, method):
+        release.wait(5)
+        if path == "bad.pdf":
+            raise RuntimeError("extraction failed")
+        handled.append(path)
+
+    extraction_queue = ExtractionQueue(handler, workers=1, maxsize=1)
+    extraction_queue.submit("bad.pdf", "m")
+    extraction_queue.submit("a.pdf", "m", timeout=1)
+    with pytest.raises(queue.Full):
+        extraction_queue.submit("b.pdf", "m", block=False)
+    assert not extraction_queue.drain(timeout=0.05)
+    with pytest.raises(RuntimeError):
+        extraction_queue.submit("c.pdf", "m")
+
+    release.set()
+    assert extraction_queue.drain(timeout=5)
+    assert handled == ["a.pdf"]
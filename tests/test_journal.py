@@ -0,0 +1,92 @@
+import os
+
+from inbox_watcher import InboxState
+from ingestion import ContentHashIndex
+from journal import Journal
+
+
+class Settings:
+    """A key-value map journaled as {"key", "value"} records, the way the indexes use journals"""
+
+    def __init__(self, path, compact_bytes=1 << 20):
+        self.values = {}
+        self.journal = Journal(path, self.apply, self.snapshot, compact_bytes=compact_bytes)
+
+    def apply(self, record):
+        self.values[record["key"]] = record["value"]
+
+    def snapshot(self):
+        return [{"key": key, "value": value} for key, value in self.values.items()]
+
+    def set(self, key, value):
+        self.journal.append({"key": key, "value": value})
+
+    def read(self):
+        with self.journal.mutex:
+            self.journal.refresh()
+            return dict(self.values)
+
+
+def test_appends_are_replayed_by_other_readers(tmp_path):
+    path = str(tmp_path / "settings.jsonl")
+    writer, reader = Settings(path), Settings(path)
+    writer.set("a", 1)
+    writer.set("a", 2)
+    assert reader.read() == {"a": 2}
+    reader.set("b", 1)
+    assert writer.read() == {"a": 2, "b": 1}
+
+
+def test_unfinished_and_unreadable_lines_are_skipped(tmp_path):
+    path = tmp_path / "settings.jsonl"
+    path.write_bytes(b'{"key": "a", "value": 1}\nnot json\n{"key": "a", "val')
+    settings = Settings(str(path))
+    assert settings.read() == {"a": 1}
+    # The next append ends the crashed writer's line first
+    settings.set("b", 2)
+    assert Settings(str(path)).read() == {"a": 1, "b": 2}
+
+
+def test_journal_is_compacted_to_the_live_set(tmp_path):
+    path = str(tmp_path / "settings.jsonl")
+    writer, reader = Settings(path, compact_bytes=300), Settings(path)
+    reader.set("b", 1)
+    for value in range(30):
+        writer.set("a", value)
+
+    assert os.path.getsize(path) < 300
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    # Readers of the old file replay the compacted one
+    assert reader.read() == {"a": 29, "b": 1}
+    reader.set("a", 30)
+    assert writer.read() == Settings(path).read() == {"a": 30, "b": 1}
+
+
+def test_compaction_waits_until_the_journal_doubles_past_its_live_size(tmp_path):
+    path = str(tmp_path / "settings.jsonl")
+    settings = Settings(path, compact_bytes=100)
+    for key in range(10):
+        settings.set(f"key-{key}", 0)
+    live = os.path.getsize(path)
+    assert live > 100
+    settings.set("key-0", 1)
+    assert os.path.getsize(path) > live
+
+
+def test_indexes_compact_to_their_current_entries(tmp_path):
+    document = tmp_path / "a.pdf"
+    document.write_bytes(b"%PDF")
+    hashes = ContentHashIndex(str(tmp_path / "content_hashes.jsonl"))
+    hashes._journal.compact_bytes = hashes._journal._compact_at = 1
+    hashes.claim("1" * 64, str(tmp_path / "deleted.pdf"))
+    hashes.claim("2" * 64, str(document))
+    assert sum(line.count('"digest"') for line in open(hashes.index_path)) == 1
+    assert ContentHashIndex(hashes.index_path).entries() == [("2" * 64, str(document))]
+
+    state = InboxState(str(tmp_path / "inbox_state.jsonl"))
+    state.update("a.pdf", size=4, mtime=1.0, status="queued")
+    state._journal._compact_at = 1
+    state.update("a.pdf", status="done")
+    assert len(open(state.state_path).readlines()) == 2
+    assert InboxState(state.state_path).is_current("a.pdf", 4, 1.0)
+    assert InboxState(state.state_path).in_flight() == []
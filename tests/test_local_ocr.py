@@ -0,0 +1,65 @@
+from local_ocr import PAGE_BREAK, layout_markdown, layout_tables, layout_words
+
+from conftest import invoice_page, word
+
+
+def test_layout_markdown_reads_lines_and_table_in_order(page):
+    assert layout_markdown([page]) == "\n".join([
+        "ACME TRADERS",
+        "GSTIN: 29ABCDE1234F1ZW",
+        "Invoice No: INV-1",
+        "Date: 01/02/2026",
+        "Buyer GSTIN: 27AAPFU0939F1ZV",
+        "| Description | Qty | Amount |",
+        "| --- | --- | --- |",
+        "| Widget | 2 | 100.00 |",
+        "| Gadget | 1 | 50.00 |",
+        "Total: 150.00",
+    ])
+
+
+def test_layout_markdown_separates_pages():
+    text = layout_markdown([invoice_page("INV-1"), invoice_page("INV-2")])
+    first, second = text.split(PAGE_BREAK)
+    assert "Invoice No: INV-1" in first
+    assert "Invoice No: INV-2" in second
+
+
+def test_layout_markdown_escapes_pipes_in_cells():
+    page = {"words": [word("Item", 0.05, 0.1), word("Qty", 0.4, 0.1), word("Amount", 0.7, 0.1),
+                      word("A|B", 0.05, 0.13), word("1", 0.4, 0.13), word("10", 0.7, 0.13),
+                      word("C", 0.05, 0.16), word("2", 0.4, 0.16), word("20", 0.7, 0.16)]}
+    assert "| A/B | 1 | 10 |" in layout_markdown([page])
+
+
+def test_short_runs_of_columns_stay_lines():
+    # A heading and one row are not enough rows for a table
+    page = {"words": [word("Item", 0.05, 0.1), word("Qty", 0.4, 0.1), word("Amount", 0.7, 0.1),
+                      word("A", 0.05, 0.13), word("1", 0.4, 0.13), word("10", 0.7, 0.13)]}
+    assert layout_markdown([page]) == "Item Qty Amount\nA 1 10"
+    assert layout_tables([page]) == []
+
+
+def test_layout_tables_keep_cell_boxes(page):
+    (table,) = layout_tables([page])
+    assert table["page"] == 1
+    assert [[cell["text"] for cell in row] for row in table["rows"]] == [
+        ["Description", "Qty", "Amount"], ["Widget", "2", "100.00"], ["Gadget", "1", "50.00"]]
+    assert table["rows"][1][2]["bbox"] == [0.8, 0.28, 0.072, 0.02]
+
+
+def test_layout_tables_put_split_cells_under_one_heading():
+    page = {"words": [word("Description", 0.05, 0.1), word("Qty", 0.5, 0.1), word("Amount", 0.8, 0.1),
+                      # "Blue widget" is read as two cells by the gap between its words
+                      word("Blue", 0.05, 0.13), word("widget", 0.12, 0.13), word("1", 0.5, 0.13),
+                      word("10", 0.8, 0.13),
+                      word("Red", 0.05, 0.16), word("2", 0.5, 0.16), word("20", 0.8, 0.16)]}
+    (table,) = layout_tables([page])
+    assert [cell["text"] for cell in table["rows"][1]] == ["Blue widget", "1", "10"]
+
+
+def test_layout_words_are_in_reading_order_with_page_numbers():
+    words = layout_words([invoice_page(), invoice_page("INV-2")])
+    assert [w["text"] for w in words[:4]] == ["ACME", "TRADERS", "GSTIN:", "29ABCDE1234F1ZW"]
+    assert {w["page"] for w in words} == {1, 2}
+    assert words[0]["confidence"] == 0.98
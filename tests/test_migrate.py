@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+
+import pytest
+
+from migrate import MigrationLog, migrate
+
+
+class Rendered:
+    def __init__(self, data):
+        self.data = data
+
+
+def entries(log):
+    with open(log.path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_outcomes_are_counted_and_logged(tmp_path):
+    log = MigrationLog(str(tmp_path / "migrations" / "s-p.jsonl"))
+    results = {"ok.pdf": Rendered({"versions": "new"}), "old.pdf": Rendered({"versions": "old"}),
+               "failed.pdf": Rendered({"error": "provider down"}), "missing.pdf": None}
+
+    counts = migrate([(path, "textract_claude") for path in results], lambda path, method: results[path], log,
+                     workers=2, is_current=lambda data: data["versions"] == "new")
+
+    assert counts == {"ok": 1, "error": 3}
+    errors = {entry["file"]: entry["error"] for entry in entries(log) if entry["status"] == "error"}
+    assert errors == {"old.pdf": "the cached result is still from an older schema or prompt version",
+                      "failed.pdf": "provider down", "missing.pdf": "no result was cached"}
+    assert log.failed() == {("old.pdf", "textract_claude"), ("failed.pdf", "textract_claude"),
+                            ("missing.pdf", "textract_claude")}
+
+
+def test_a_later_success_clears_a_failure(tmp_path):
+    log = MigrationLog(str(tmp_path / "migrations" / "s-p.jsonl"))
+    log.record(file="a.pdf", processing_method="local_ocr", status="error", error="timeout")
+    migrate([("a.pdf", "local_ocr")], lambda path, method: Rendered({}), log)
+    assert log.failed() == set()
+
+
+def test_interrupt_logs_running_extractions_and_leaves_the_rest(tmp_path):
+    log = MigrationLog(str(tmp_path / "migrations" / "s-p.jsonl"))
+    started = []
+    running = threading.Event()
+
+    def reextract(path, method):
+        started.append(path)
+        if path == "interrupt.pdf":
+            running.wait(5)
+            raise KeyboardInterrupt
+        running.set()
+        time.sleep(0.2)
+        return Rendered({})
+
+    with pytest.raises(KeyboardInterrupt):
+        migrate([("interrupt.pdf", "m"), ("running.pdf", "m"), ("later.pdf", "m")], reextract, log, workers=2)
+
+    assert "later.pdf" not in started
+    assert [(entry["file"], entry["status"]) for entry in entries(log)] == [("running.pdf", "ok")]
@@ -0,0 +1,33 @@
+import prompts
+from models import Invoice
+from prompts import (CLAUDE_DOCUMENT_SYSTEM_PROMPT, CLAUDE_FIELD_SYSTEM_PROMPT, CLAUDE_IMAGE_SYSTEM_PROMPT,
+                     CLAUDE_INVOICE_PREFIX, CLAUDE_TEXT_SYSTEM_PROMPT, EXAMPLE_INVOICE, claude_system_blocks,
+                     estimated_tokens)
+
+
+def test_claude_invoice_prompts_share_a_cacheable_prefix():
+    assert estimated_tokens(CLAUDE_INVOICE_PREFIX) >= 1024
+    prefixes = set()
+    for prompt in (CLAUDE_IMAGE_SYSTEM_PROMPT, CLAUDE_DOCUMENT_SYSTEM_PROMPT, CLAUDE_TEXT_SYSTEM_PROMPT):
+        cached, rest = claude_system_blocks(prompt)
+        assert cached["cache_control"] == {"type": "ephemeral"} and "cache_control" not in rest
+        assert cached["text"] + "\n\n" + rest["text"] == prompt
+        prefixes.add(cached["text"])
+    assert prefixes == {CLAUDE_INVOICE_PREFIX}
+
+
+def test_short_prompts_are_sent_uncached(monkeypatch):
+    assert claude_system_blocks(CLAUDE_FIELD_SYSTEM_PROMPT) == CLAUDE_FIELD_SYSTEM_PROMPT
+    monkeypatch.setattr(prompts, "BEDROCK_PROMPT_CACHING", False)
+    assert claude_system_blocks(CLAUDE_TEXT_SYSTEM_PROMPT) == CLAUDE_TEXT_SYSTEM_PROMPT
+    monkeypatch.setattr(prompts, "BEDROCK_PROMPT_CACHING", True)
+    monkeypatch.setattr(prompts, "BEDROCK_CACHE_MIN_TOKENS", 2048)
+    assert claude_system_blocks(CLAUDE_TEXT_SYSTEM_PROMPT) == CLAUDE_TEXT_SYSTEM_PROMPT
+
+
+def test_the_worked_example_follows_the_schema():
+    example = dict(EXAMPLE_INVOICE, items=EXAMPLE_INVOICE["line_items"])
+    del example["line_items"]
+    invoice = Invoice.model_validate(example)
+    assert invoice.total_amount == invoice.subtotal + invoice.total_tax_amount
+    assert sum(item.amount for item in invoice.items) == invoice.total_amount
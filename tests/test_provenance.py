@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from PIL import Image
+
+from local_ocr import layout_words
+from provenance import (field_provenance, field_values, low_confidence_fields, parse_number, reextract_fields,
+                        textract_words)
+
+from conftest import invoice_data, invoice_page, word
+
+
+def test_field_values_cover_every_scalar():
+    values = dict(field_values(dict(invoice_data(), items=[{"amount": 1.0}], reverse_charge=True, notes="")))
+    assert values["seller.gstin"] == invoice_data()["seller"]["gstin"]
+    assert values["line_items[1].amount"] == 50.0
+    # line_items wins over a stale "items" copy, and booleans and empty strings are skipped
+    assert "line_items[0].amount" in values and values["line_items[0].amount"] == 100.0
+    assert "reverse_charge" not in values and "notes" not in values
+
+
+def test_values_are_traced_to_their_words(page):
+    provenance = field_provenance(invoice_data(), layout_words([page]), "tesseract")
+    number = provenance["invoice_number"]
+    assert (number["confidence"], number["page"], number["source"]) == (0.98, 1, "tesseract")
+    assert number["bbox"][:2] == [0.185, 0.12]
+    assert provenance["invoice_date"]["bbox"][:2] == [0.12, 0.15]
+    assert provenance["seller.name"]["bbox"][:2] == [0.05, 0.05]
+    assert provenance["total_amount"]["bbox"][1] == 0.4
+
+
+def test_line_item_fields_prefer_words_on_their_row(page):
+    # Both rows have a quantity of 2
+    page["words"] = [dict(word, text="2") if word["text"] == "1" else word for word in page["words"]]
+    data = invoice_data()
+    data["line_items"][1]["quantity"] = 2
+    provenance = field_provenance(data, layout_words([page]), "tesseract")
+    assert provenance["line_items[0].quantity"]["bbox"][1] == 0.28
+    assert provenance["line_items[1].quantity"]["bbox"][1] == 0.31
+
+
+def test_values_missing_from_the_page_have_no_confidence(page):
+    data = dict(invoice_data(), po_number="PO-99")
+    assert field_provenance(data, layout_words([page]), "tesseract")["po_number"] == {
+        "confidence": None, "source": "tesseract", "match": "none"}
+
+
+def test_low_confidence_fields_lowest_first():
+    provenance = {"a": {"confidence": 0.5, "bbox": [0, 0, 1, 1]}, "b": {"confidence": 0.2, "bbox": [0, 0, 1, 1]},
+                  "c": {"confidence": 0.95, "bbox": [0, 0, 1, 1]}, "d": {"confidence": None},
+                  "e": {"confidence": 0.1, "bbox": [0, 0, 1, 1], "reextracted": True}}
+    assert low_confidence_fields(provenance, threshold=0.9) == ["b", "a"]
+
+
+def test_parse_number():
+    assert parse_number("Rs. 1,20,000.50") == 120000.5
+    assert parse_number("₹ 99/-") == 99.0
+    assert parse_number("N/A") is None
+
+
+def test_textract_words():
+    blocks = [
+        {"Id": "line", "BlockType": "LINE", "Relationships": [{"Type": "CHILD", "Ids": ["w1", "w2"]}]},
+        {"Id": "w1", "BlockType": "WORD", "Text": "Total", "Confidence": 99.0,
+         "Geometry": {"BoundingBox": {"Left": 0.1, "Top": 0.2, "Width": 0.05, "Height": 0.01}}},
+        {"Id": "w2", "BlockType": "WORD", "Text": "150.00", "Confidence": 80.0,
+         "Geometry": {"BoundingBox": {"Left": 0.2, "Top": 0.2, "Width": 0.06, "Height": 0.01}}},
+    ]
+    words = textract_words([[], blocks])
+    assert words[1] == {"text": "150.00", "confidence": 0.8, "page": 2, "bbox": [0.2, 0.2, 0.06, 0.01]}
+
+
+def test_low_confidence_fields_are_reread_from_crops(tmp_path):
+    image_path = str(tmp_path / "invoice.png")
+    Image.new("RGB", (200, 300), "white").save(image_path)
+    words = layout_words([{"width": 200, "height": 300, "words": [
+        word("INV-7", 0.1, 0.1, confidence=0.4), word("150.00", 0.6, 0.5, confidence=0.5)]}])
+    data = {"invoice_number": "INV-7", "total_amount": 150.0}
+    provenance = field_provenance(data, words, "tesseract")
+    asked = []
+
+    def ask(content):
+        asked.append(content)
+        return json.dumps({"invoice_number": "INV-1", "total_amount": "1,150.00"})
+
+    changed = reextract_fields(data, provenance, low_confidence_fields(provenance), image_path, ask)
+
+    assert changed == ["invoice_number", "total_amount"]
+    assert data == {"invoice_number": "INV-1", "total_amount": 1150.0}
+    assert provenance["total_amount"]["previous"] == 150.0 and provenance["invoice_number"]["reextracted"]
+    (content,) = asked
+    assert [block["type"] for block in content] == ["text", "image", "text", "image"]
+    assert content[0]["text"] == 'Field: invoice_number\nRead so far: "INV-7"'
+    assert low_confidence_fields(provenance) == []
+
+
+def test_unreadable_answers_leave_values_alone(tmp_path):
+    image_path = str(tmp_path / "invoice.png")
+    Image.new("RGB", (200, 300), "white").save(image_path)
+    data = {"total_amount": 150.0}
+    provenance = {"total_amount": {"confidence": 0.3, "page": 1, "bbox": [0.5, 0.5, 0.1, 0.02]}}
+    assert reextract_fields(data, provenance, ["total_amount"], image_path,
+                            lambda content: '{"total_amount": "illegible"}') == []
+    assert data == {"total_amount": 150.0}
+    with pytest.raises(ValueError):
+        reextract_fields(data, provenance, ["total_amount"], image_path, lambda content: "not json")
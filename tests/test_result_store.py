@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("duckdb")
+
+from result_store import ResultStore, invoice_month
+
+from conftest import SELLER_GSTIN, invoice_data
+
+
+def result(number, total, seller="Acme Supplies", gstin=SELLER_GSTIN, invoice_date="05/03/2024", **extra):
+    data = dict(invoice_data(number), total_amount=total, invoice_date=invoice_date, **extra)
+    data["seller"] = {"name": seller, "gstin": gstin}
+    data["line_items"] = [{"description": "Widget", "amount": total}]
+    return data
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "store"), compact_files=3)
+
+
+def test_invoice_month_reads_day_first_dates():
+    assert invoice_month("05/03/2024") == "2024-03"
+    assert invoice_month("2024-03-05") == "2024-03"
+    assert invoice_month("5 March 2024") == "2024-03"
+    assert invoice_month("sometime") is None
+
+
+def test_search_only_matches_each_documents_latest_result(store):
+    store.add(result("INV-1", 100.0, seller="Old Name Traders"), "a" * 64, "a.pdf", "textract_claude",
+              "2024-03-01T10:00:00")
+    store.add(result("INV-1", 100.0, seller="Acme Supplies"), "a" * 64, "a.pdf", "local_ocr", "2024-03-02T10:00:00")
+    store.add(result("INV-2", 50.0, seller="Old Name Traders"), "b" * 64, "b.pdf", "textract_claude",
+              "2024-03-03T10:00:00")
+
+    found = store.search("old name", ["invoice_number", "seller_name"])
+    assert found["columns"] == ["document_sha256", "file", "processing_method", "invoice_number", "seller_name"]
+    assert found["rows"] == [["b" * 64, "b.pdf", "textract_claude", "INV-2", "Old Name Traders"]]
+    # Within one method, that method's latest result is searched
+    found = store.search("old name", ["invoice_number"], field="seller_name", processing_method="textract_claude")
+    assert [row[3] for row in found["rows"]] == ["INV-2", "INV-1"]
+    assert store.search("inv", ["invoice_number"], field="invoice_number", limit=1)["rows"][0][3] == "INV-2"
+    with pytest.raises(ValueError):
+        store.search("x", ["no_such_column"])
+
+
+def test_aggregate_counts_the_latest_result_of_each_document(store):
+    store.add(result("INV-1", 100.0), "a" * 64, "a.pdf", "textract_claude", "2024-03-01T10:00:00")
+    store.add(result("INV-1", 120.0), "a" * 64, "a.pdf", "textract_claude", "2024-03-02T10:00:00")
+    store.add(result("INV-2", 30.0, invoice_date="2024-04-10"), "b" * 64, "b.pdf", "textract_claude",
+              "2024-04-11T10:00:00")
+
+    totals = store.aggregate("line_items", group_by=("seller_gstin", "invoice_month"))
+    assert totals["columns"] == ["seller_gstin", "invoice_month", "sum_amount", "count"]
+    assert sorted(totals["rows"]) == [[SELLER_GSTIN, "2024-03", 120.0, 1], [SELLER_GSTIN, "2024-04", 30.0, 1]]
+    march = store.aggregate("invoices", group_by=(), metrics=(("sum", "total_amount"),), month_from="2024-03",
+                            month_to="2024-03")
+    assert march["rows"] == [[120.0]]
+    with pytest.raises(ValueError):
+        store.aggregate("invoices", metrics=(("sum", "seller_name"),))
+
+
+def test_usage_counts_every_extraction_including_failures(store):
+    usage = {"calls": [{"provider": "bedrock_claude", "model": "sonnet", "calls": 1, "input_tokens": 1000,
+                        "output_tokens": 200, "cost_usd": 0.006}]}
+    store.add(result("INV-1", 100.0, usage=usage), "a" * 64, "a.pdf", "textract_claude", "2024-03-01T10:00:00")
+    store.add({"error": "timeout", "usage": usage}, "b" * 64, "b.pdf", "textract_claude", "2024-03-01T11:00:00")
+
+    spend = store.aggregate("usage", group_by=("status",), metrics=(("sum", "input_tokens"), ("count", None)))
+    assert sorted(spend["rows"]) == [["error", 1000, 1], ["ok", 1000, 1]]
+
+
+def test_partitions_are_compacted_without_changing_results(store):
+    for number in range(3):
+        store.add(result(f"INV-{number}", 10.0), f"{number}" * 64, f"{number}.pdf", "local_ocr",
+                  f"2024-03-0{number + 1}T10:00:00")
+    partition = os.path.join(store.directory, "invoices", "extracted_month=2024-03")
+    assert len([name for name in os.listdir(partition) if name.endswith(".parquet")]) == 1
+    assert store.aggregate("invoices", group_by=(), metrics=(("count", None),))["rows"] == [[3]]
+
+
+def test_an_empty_store_answers_with_no_rows(store):
+    assert store.search("x", ["invoice_number"])["rows"] == []
+    assert store.aggregate()["rows"] == []
@@ -0,0 +1,82 @@
+import shutil
+
+import pytest
+
+import app
+from local_ocr import layout_markdown, layout_tables, layout_words
+from provenance import field_provenance
+from text_layer import read_text_layer, usable
+from vendor_templates import VendorTemplates
+
+from conftest import SELLER_GSTIN, invoice_data, invoice_pdf, text_pdf
+
+
+def test_words_come_with_page_fraction_boxes(tmp_path):
+    (page,) = read_text_layer(invoice_pdf(tmp_path / "invoice.pdf"))
+    assert (page["width"], page["height"]) == (595, 842)
+    first = page["words"][0]
+    assert first["text"] == "ACME" and first["confidence"] == 1.0
+    left, top, width, height = first["bbox"]
+    assert left == pytest.approx(30 / 595, abs=0.002)
+    assert top == pytest.approx(40 / 842, abs=0.01)
+    assert 0 < width < 0.1 and 0 < height < 0.03
+
+
+def test_text_layer_renders_like_ocr(tmp_path):
+    pages = read_text_layer(invoice_pdf(tmp_path / "invoice.pdf"))
+    assert "| Widget | 2 | 100.00 |" in layout_markdown(pages)
+    assert "Invoice No: INV-1" in layout_markdown(pages)
+
+
+def test_pages_without_enough_text_are_not_used(tmp_path):
+    assert read_text_layer(text_pdf(tmp_path / "scan.pdf", [(30, 40, "Page 1")])) is None
+    assert not usable("" * 60)
+    assert usable("x" * 60)
+
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    templates = VendorTemplates(str(tmp_path / "vendor_templates"))
+    monkeypatch.setattr(app, "VENDOR_TEMPLATES", templates)
+    for number in ("INV-1", "INV-2"):
+        pages = read_text_layer(invoice_pdf(tmp_path / f"{number}.pdf", number))
+        words = layout_words(pages)
+        data = invoice_data(number)
+        templates.learn(data, field_provenance(data, words, "text_layer"), words, layout_tables(pages))
+    return templates
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Paths whose first page was rendered for a page hash"""
+    paths = []
+    monkeypatch.setattr(app, "document_hash", lambda file_path: paths.append(file_path))
+    return paths
+
+
+def extract(file_path):
+    return app.analyze_and_parse_invoice(app.DOC_INTELLIGENCE_ENDPOINT, app.DOC_INTELLIGENCE_KEY, app.OPENAI_ENDPOINT,
+                                         app.OPENAI_KEY, app.DEPLOYMENT_NAME, file_path, "textract_claude")
+
+
+def test_born_digital_pdfs_are_never_rendered(tmp_path, templates, rendered):
+    result = extract(invoice_pdf(tmp_path / "new.pdf", "INV-3"))
+    assert rendered == []
+    assert result["invoice_number"] == "INV-3"
+    assert result["template"]["seller_gstin"] == SELLER_GSTIN
+    assert result["provenance"]["invoice_number"]["source"] == "text_layer_template"
+
+
+def test_identical_content_reuses_the_result_without_rendering(tmp_path, templates, rendered, monkeypatch):
+    monkeypatch.setattr(app, "DUPLICATE_POLICY", "reuse")
+    original = invoice_pdf(tmp_path / "original.pdf", "INV-4")
+    app.CONTENT_HASH_INDEX.claim(app.content_digest(original), original)
+    extract(original)
+    copy = str(tmp_path / "copy.pdf")
+    shutil.copy(original, copy)
+
+    result = extract(copy)
+
+    assert result["duplicate_of"] == original
+    assert result["invoice_number"] == "INV-4"
+    assert rendered == []
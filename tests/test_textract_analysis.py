@@ -0,0 +1,56 @@
+import pdf2image
+import pytest
+
+from ingestion import file_sha256
+from textract_analysis import TextractAnalyzer, render_document, render_page
+
+
+def line(block_id, text, top):
+    return {"Id": block_id, "BlockType": "LINE", "Text": text, "Geometry": {"BoundingBox": {"Top": top}}}
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    """An analyser whose page calls and pdfinfo runs are counted instead of made"""
+    analyzer = TextractAnalyzer("us-east-1", str(tmp_path / "textract"), textract_client=object())
+    analyzer.calls = {"pages": [], "pdfinfo": 0}
+
+    def analyze_pdf_page(file_path, page):
+        analyzer.calls["pages"].append(page)
+        return [line(f"l{page}", f"Page {page} text", 0.1)]
+
+    def pdfinfo_from_path(file_path):
+        analyzer.calls["pdfinfo"] += 1
+        return {"Pages": 3}
+
+    monkeypatch.setattr(analyzer, "_analyze_pdf_page", analyze_pdf_page)
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", pdfinfo_from_path)
+    return analyzer
+
+
+def test_pages_and_page_count_are_read_once_per_document(analyzer, tmp_path):
+    document = tmp_path / "invoice.pdf"
+    document.write_bytes(b"%PDF-1.4 three pages")
+
+    first = analyzer.analyze(str(document), "a" * 64)
+    again = analyzer.analyze(str(document), "a" * 64)
+
+    assert first == again and len(first) == 3
+    assert sorted(analyzer.calls["pages"]) == [1, 2, 3]
+    assert analyzer.calls["pdfinfo"] == 1
+
+
+def test_the_digest_is_computed_when_not_given(analyzer, tmp_path):
+    document = tmp_path / "invoice.pdf"
+    document.write_bytes(b"%PDF-1.4 three pages")
+    analyzer.analyze(str(document))
+    assert (tmp_path / "textract" / f"{file_sha256(str(document))}_pages.json").exists()
+    assert analyzer.document_text(str(document)).startswith("--- Page 1 ---\nPage 1 text")
+    assert len(analyzer.calls["pages"]) == 3
+
+
+def test_render_document():
+    page = [line("b", "second", 0.5), line("a", "first", 0.1)]
+    assert render_page(page) == "first\nsecond"
+    assert render_document([page]) == "first\nsecond"
+    assert render_document([page, []]) == "--- Page 1 ---\nfirst\nsecond\n\n--- Page 2 ---\n"
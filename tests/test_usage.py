@@ -0,0 +1,75 @@
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import usage
+from usage import claude_usage, cost, metered, openai_usage, record_usage, unit_prices, usage_summary
+
+
+def test_the_most_specific_model_entry_applies():
+    assert unit_prices("azure_openai", "gpt-4o-mini-2024-07-18")["input_tokens"] == 0.15
+    assert unit_prices("azure_openai", "gpt-4o")["input_tokens"] == 2.5
+    assert unit_prices("azure_openai", None)["input_tokens"] == 2.5
+    assert unit_prices("unknown", "model") == {}
+
+
+def test_cost_prices_tokens_per_million_and_pages_each():
+    assert cost("bedrock_claude", "sonnet", {"input_tokens": 1_000_000, "output_tokens": 100_000,
+                                             "cache_read_tokens": 1_000_000}) == pytest.approx(3.0 + 1.5 + 0.3)
+    assert cost("textract", None, {"pages": 10}) == pytest.approx(0.65)
+    assert cost("tesseract", None, {"pages": 10}) == 0.0
+
+
+def test_price_file_is_merged_over_the_defaults(tmp_path, monkeypatch):
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"textract": {"*": {"pages": 0.05}}, "mistral": {"*": {"input_tokens": 1.0}}}))
+    monkeypatch.setattr(usage, "USAGE_PRICES_FILE", str(path))
+    usage.load_prices.cache_clear()
+    try:
+        prices = usage.load_prices()
+    finally:
+        usage.load_prices.cache_clear()
+    assert prices["textract"]["*"] == {"pages": 0.05}
+    assert prices["mistral"]["*"] == {"input_tokens": 1.0}
+    assert prices["bedrock_claude"] == usage.DEFAULT_PRICES["bedrock_claude"]
+
+
+def test_metered_collects_calls_from_worker_threads():
+    with metered():
+        record_usage("bedrock_claude", "sonnet", input_tokens=1000, output_tokens=200, cache_read_tokens=0)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for _ in range(2):
+                pool.submit(contextvars.copy_context().run, record_usage, "textract", pages=3).result()
+        summary = usage_summary()
+
+    assert summary["input_tokens"] == 1000 and summary["output_tokens"] == 200 and summary["pages"] == 6
+    assert summary["cost_usd"] == pytest.approx(0.003 + 0.003 + 6 * 0.065)
+    claude, textract = summary["calls"]
+    assert claude == {"provider": "bedrock_claude", "model": "sonnet", "calls": 1, "input_tokens": 1000,
+                      "output_tokens": 200, "cost_usd": 0.006}
+    assert (textract["calls"], textract["pages"]) == (2, 6)
+
+
+def test_usage_outside_an_extraction_is_ignored():
+    record_usage("textract", pages=1)
+    assert usage_summary() is None
+    with metered():
+        assert usage_summary()["calls"] == []
+
+
+def test_openai_cached_tokens_are_not_counted_as_input():
+    response = SimpleNamespace(prompt_tokens=3000, completion_tokens=400,
+                               prompt_tokens_details=SimpleNamespace(cached_tokens=2048))
+    assert openai_usage(response) == {"input_tokens": 952, "output_tokens": 400, "cache_read_tokens": 2048}
+    assert openai_usage(SimpleNamespace(prompt_tokens=10, completion_tokens=2))["cache_read_tokens"] == 0
+    assert openai_usage(None) == {}
+
+
+def test_claude_usage_maps_cache_counts():
+    assert claude_usage({"input_tokens": 50, "output_tokens": 300, "cache_read_input_tokens": 1400,
+                         "cache_creation_input_tokens": 0}) == {
+        "input_tokens": 50, "output_tokens": 300, "cache_read_tokens": 1400, "cache_write_tokens": 0}
+    assert claude_usage(None)["input_tokens"] == 0
@@ -0,0 +1,70 @@
+import json
+
+from validation import decide_action, validate_batch, validate_cached_results, validate_invoice
+
+
+def fields(report):
+    return [issue["field"] for issue in report["issues"]]
+
+
+def test_consistent_invoice_is_valid():
+    report = validate_invoice({
+        "line_items": [{"quantity": 2, "unit_price": 50, "amount": 100, "tax_percentage": 18, "tax_amount": 18}],
+        "tax_details": [{"amount": 18}],
+        "subtotal": 100, "total_tax_amount": 18, "total_amount": 118,
+    })
+    assert report == {"valid": True, "issues": []}
+
+
+def test_line_and_total_mismatches_are_reported():
+    report = validate_invoice({
+        "items": [{"quantity": 2, "unit_price": 50, "amount": 120}, {"quantity": 1, "unit_price": 10, "amount": 10}],
+        "subtotal": 110, "total_tax_amount": 0, "total_amount": 200,
+    })
+    assert fields(report) == ["line_items[0].amount", "subtotal", "total_amount"]
+    assert report["issues"][0] == {"field": "line_items[0].amount", "expected": 100.0, "actual": 120.0, "delta": 20.0}
+
+
+def test_differences_within_tolerance_pass():
+    # Rounding on the printed invoice stays within the absolute tolerance of 1.0
+    assert validate_invoice({"line_items": [{"quantity": 3, "unit_price": 33.33, "amount": 100}],
+                             "subtotal": 100})["valid"]
+
+
+def test_missing_and_unreadable_values_are_not_checked():
+    report = validate_invoice({"line_items": [{"quantity": "two", "unit_price": 50, "amount": 75},
+                                              {"quantity": True, "unit_price": 5, "amount": 1}],
+                               "total_amount": None})
+    assert report["valid"]
+
+
+def test_batch_reports_each_invoice_in_order():
+    reports = validate_batch([
+        {"line_items": [{"amount": 10}], "subtotal": 10},
+        "not a result",
+        {"line_items": [{"amount": 10}], "subtotal": 30},
+        {},
+    ])
+    assert [report["valid"] for report in reports] == [True, True, False, True]
+    assert fields(reports[2]) == ["subtotal"]
+    assert validate_batch([]) == []
+
+
+def test_tax_details_must_add_up_to_total_tax():
+    report = validate_invoice({"tax_details": [{"amount": 9}, {"amount": 9}], "total_tax_amount": 20})
+    assert fields(report) == ["total_tax_amount"]
+
+
+def test_decide_action():
+    assert decide_action({"valid": True}) == "accept"
+    assert decide_action({"valid": False}, attempt=0, max_retries=1) == "retry"
+    assert decide_action({"valid": False}, attempt=1, max_retries=1) == "escalate"
+
+
+def test_validate_cached_results(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps({"line_items": [{"amount": 5}], "subtotal": 5}))
+    (tmp_path / "b.json").write_text(json.dumps({"line_items": [{"amount": 5}], "subtotal": 50}))
+    (tmp_path / "broken.json").write_text("{")
+    (tmp_path / "notes.txt").write_text("ignored")
+    reports = validate_cached_results(str(tmp_path))
+    assert {name: report["valid"] for name, report in reports.items()} == {"a.json": True, "b.json": False}
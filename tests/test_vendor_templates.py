@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from local_ocr import layout_tables, layout_words
+from provenance import field_provenance
+from vendor_templates import VendorTemplates, textract_tables
+
+from conftest import BUYER_GSTIN, SELLER_GSTIN, invoice_data, invoice_page
+
+
+@pytest.fixture
+def templates(tmp_path):
+    return VendorTemplates(str(tmp_path / "vendor_templates"))
+
+
+def learn(templates, invoice_number, data=None):
+    pages = [invoice_page(invoice_number)]
+    words = layout_words(pages)
+    data = data or invoice_data(invoice_number)
+    return templates.learn(data, field_provenance(data, words, "local_ocr"), words, layout_tables(pages))
+
+
+def extract(templates, page):
+    pages = [page]
+    return templates.extract(layout_words(pages), layout_tables(pages), "local_ocr")
+
+
+@pytest.fixture
+def ready(templates):
+    learn(templates, "INV-1")
+    learn(templates, "INV-2")
+    return templates
+
+
+def test_a_template_is_ready_after_min_samples(templates):
+    assert learn(templates, "INV-1") == SELLER_GSTIN
+    assert templates.get(SELLER_GSTIN)["samples"] == 1
+    assert extract(templates, invoice_page("INV-3")) is None
+    learn(templates, "INV-2")
+    assert extract(templates, invoice_page("INV-3")) is not None
+
+
+def test_invalid_extractions_are_not_learned(templates):
+    data = invoice_data()
+    data["subtotal"] = 120.0  # line items add up to 150.00
+    assert learn(templates, "INV-1", data) is None
+    data = invoice_data()
+    data["seller"]["gstin"] = "29ABCDE1234F1ZA"
+    assert learn(templates, "INV-1", data) is None
+    assert templates.get(SELLER_GSTIN) is None
+
+
+def test_extract_reads_fields_items_and_vendor_values(ready):
+    data, provenance, confidence, gstin = extract(ready, invoice_page("INV-3"))
+    assert gstin == SELLER_GSTIN
+    assert data["invoice_number"] == "INV-3"
+    assert data["invoice_date"] == "2026-02-01"
+    assert data["total_amount"] == 150.0
+    assert data["seller"] == {"name": "ACME TRADERS", "gstin": SELLER_GSTIN}
+    assert [(item["description"], item["quantity"], item["amount"]) for item in data["line_items"]] == [
+        ("Widget", 2.0, 100.0), ("Gadget", 1.0, 50.0)]
+    assert confidence == pytest.approx(0.98)
+    assert provenance["invoice_number"]["source"] == "local_ocr_template"
+    assert provenance["seller.gstin"]["match"] == "vendor"
+
+
+def test_confidence_is_the_lowest_required_field(ready):
+    page = invoice_page("INV-3")
+    for word in page["words"]:
+        if word["text"] == "INV-3":
+            word["confidence"] = 0.4
+    assert extract(ready, page)[2] == pytest.approx(0.4)
+
+
+def test_results_failing_validation_have_no_confidence(ready):
+    page = invoice_page("INV-3")
+    for word in page["words"]:
+        if word["text"] == "150.00":
+            word["text"] = "170.00"
+    data, _, confidence, _ = extract(ready, page)
+    assert data["total_amount"] == 170.0
+    assert confidence == 0.0
+
+
+def test_the_buyer_gstin_does_not_select_a_template(ready):
+    page = invoice_page("X-9", seller_gstin=BUYER_GSTIN, buyer_gstin=SELLER_GSTIN)
+    assert ready.find(layout_words([page])) is None
+    assert extract(ready, page) is None
+
+
+def test_templates_written_by_another_process_are_reread(ready):
+    other = VendorTemplates(ready.directory)
+    assert other.get(SELLER_GSTIN)["samples"] == 2
+    learn(other, "INV-3")
+    path = os.path.join(ready.directory, f"{SELLER_GSTIN}.json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert ready.get(SELLER_GSTIN)["samples"] == 3
+
+
+def test_textract_tables():
+    def block(id, kind, children=(), **fields):
+        block = dict(Id=id, BlockType=kind, **fields)
+        if children:
+            block["Relationships"] = [{"Type": "CHILD", "Ids": list(children)}]
+        return block
+
+    def cell(id, row, column, words):
+        box = {"Left": 0.1 * column, "Top": 0.1 * row, "Width": 0.1, "Height": 0.05}
+        return block(id, "CELL", words, RowIndex=row, ColumnIndex=column, Geometry={"BoundingBox": box})
+
+    page = [block("t", "TABLE", ["c1", "c2", "c3"]),
+            cell("c1", 1, 1, ["w1"]), cell("c2", 1, 2, ["w2", "w3"]), cell("c3", 2, 2, []),
+            block("w1", "WORD", Text="Item"), block("w2", "WORD", Text="Unit"), block("w3", "WORD", Text="Price")]
+
+    (table,) = textract_tables([[], page])
+
+    assert table["page"] == 2
+    assert [[cell and cell["text"] for cell in row] for row in table["rows"]] == [["Item", "Unit Price"], [None, ""]]
+    assert table["rows"][0][1]["bbox"] == [0.2, 0.1, 0.1, 0.05]
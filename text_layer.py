@@ -0,0 +1,91 @@
+"""Native text layer of born-digital PDFs, read instead of rasterizing and OCR.
+
+Most invoices are generated by billing software and embed their text. pypdfium2
+reads it with the box of every character in milliseconds, so such documents can
+skip page rendering, OCR and image tokens. Words come back as pages in the
+format of local_ocr.py (confidence 1.0, boxes as page fractions), so its layout
+markdown, table and word rendering apply unchanged.
+
+A text layer is only used when every page has one: at least
+``TEXT_LAYER_MIN_CHARS`` characters, nearly all of them readable. Scanned pages,
+and fonts without a Unicode mapping (which extract as replacement or
+private-use characters), send the document down the OCR path.
+"""
+import os
+
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Fewest non-space characters a page needs for its text layer to be used
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+# Largest share of unreadable characters a usable text layer may have
+TEXT_LAYER_MAX_BAD_CHARS = float(os.getenv("TEXT_LAYER_MAX_BAD_CHARS", "0.05"))
+
+# Gap between two characters, in character heights, that separates words printed without a space
+_WORD_GAP = 0.3
+
+
+def _unreadable(char):
+    code = ord(char)
+    return char == "�" or 0xE000 <= code <= 0xF8FF or (code < 32 and not char.isspace())
+
+
+def _page_words(textpage, width, height):
+    text = textpage.get_text_range()
+    words = []
+    current = []
+
+    def flush():
+        if current:
+            left = min(box[0] for _, box in current)
+            bottom = min(box[1] for _, box in current)
+            right = max(box[2] for _, box in current)
+            top = max(box[3] for _, box in current)
+            words.append({"text": "".join(char for char, _ in current), "confidence": 1.0,
+                          "bbox": [round(left / width, 4), round((height - top) / height, 4),
+                                   round((right - left) / width, 4), round((top - bottom) / height, 4)]})
+            current.clear()
+
+    for index, char in enumerate(text[:textpage.count_chars()]):
+        if char.isspace():
+            flush()
+            continue
+        box = textpage.get_charbox(index, loose=True)
+        if current:
+            last = current[-1][1]
+            char_height = max(last[3] - last[1], box[3] - box[1], 1e-6)
+            centre = (box[1] + box[3]) / 2
+            if box[0] - last[2] > _WORD_GAP * char_height or not last[1] <= centre <= last[3]:
+                flush()
+        current.append((char, box))
+    flush()
+    return words
+
+
+def usable(text):
+    """Whether the text of one page is a text layer worth extracting from"""
+    chars = [char for char in text if not char.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return False
+    return sum(_unreadable(char) for char in chars) <= TEXT_LAYER_MAX_BAD_CHARS * len(chars)
+
+
+def read_text_layer(file_path):
+    """Words of every page of a PDF from its text layer, or None when a page has no usable one"""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(file_path)
+    try:
+        pages = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                if not usable(textpage.get_text_range()):
+                    return None
+                width, height = page.get_size()
+                pages.append({"width": width, "height": height, "words": _page_words(textpage, width, height)})
+            finally:
+                textpage.close()
+                page.close()
+        return pages
+    finally:
+        pdf.close()
@@ -0,0 +1,262 @@
+"""Multi-page Amazon Textract analysis for the textract_claude method.
+
+Whole documents are analysed with the TABLES and FORMS features. Documents of up
+to ``TEXTRACT_SYNC_MAX_PAGES`` pages are rendered page by page and sent to the
+synchronous ``analyze_document`` API in parallel; longer ones are uploaded to S3
+and run through asynchronous ``StartDocumentAnalysis``.
+
+The blocks of each page are cached under the document's content hash, so
+re-running a document (or one whose pages were partly analysed before) only calls
+Textract for the pages that are missing. Page text is rendered from the blocks in
+reading order with tables as markdown, which is what chunked extraction splits on.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestion import file_sha256
+from progress import note
+from usage import record_usage
+
+# Longest document analysed with parallel synchronous page calls
+TEXTRACT_SYNC_MAX_PAGES = int(os.getenv("TEXTRACT_SYNC_MAX_PAGES", "10"))
+TEXTRACT_WORKERS = int(os.getenv("TEXTRACT_WORKERS", "4"))
+# Bucket for documents sent to asynchronous analysis
+TEXTRACT_BUCKET_NAME = os.getenv("TEXTRACT_BUCKET_NAME", os.getenv("BDA_BUCKET_NAME", "doc-ocr-poc"))
+TEXTRACT_INPUT_PREFIX = os.getenv("TEXTRACT_INPUT_PREFIX", "textract-temp/input")
+TEXTRACT_POLL_INTERVAL = float(os.getenv("TEXTRACT_POLL_INTERVAL", "2"))
+TEXTRACT_TIMEOUT = float(os.getenv("TEXTRACT_TIMEOUT", "900"))
+
+FEATURE_TYPES = ["TABLES", "FORMS"]
+# Resolution pages are rendered at for synchronous calls
+_PAGE_DPI = 200
+
+
+def _child_ids(block, relationship="CHILD"):
+    return [child_id for relation in block.get("Relationships", []) if relation["Type"] == relationship
+            for child_id in relation["Ids"]]
+
+
+def _text_of(block, blocks_by_id):
+    words = []
+    for child_id in _child_ids(block):
+        child = blocks_by_id.get(child_id, {})
+        if child.get("BlockType") == "WORD":
+            words.append(child["Text"])
+        elif child.get("BlockType") == "SELECTION_ELEMENT" and child.get("SelectionStatus") == "SELECTED":
+            words.append("[X]")
+    return " ".join(words)
+
+
+def _table_markdown(table, blocks_by_id):
+    cells = [blocks_by_id[cell_id] for cell_id in _child_ids(table) if blocks_by_id.get(cell_id, {}).get("BlockType") == "CELL"]
+    if not cells:
+        return ""
+    rows = max(cell["RowIndex"] for cell in cells)
+    columns = max(cell["ColumnIndex"] for cell in cells)
+    grid = [[""] * columns for _ in range(rows)]
+    for cell in cells:
+        grid[cell["RowIndex"] - 1][cell["ColumnIndex"] - 1] = _text_of(cell, blocks_by_id).replace("|", "/")
+    lines = ["| " + " | ".join(grid[0]) + " |", "|" + " --- |" * columns]
+    lines.extend("| " + " | ".join(row) + " |" for row in grid[1:])
+    return "\n".join(lines)
+
+
+def render_page(blocks):
+    """Render one page's blocks as text: lines and markdown tables in reading order, then form fields"""
+    blocks_by_id = {block["Id"]: block for block in blocks}
+    table_words = set()
+    items = []
+    for block in blocks:
+        if block["BlockType"] == "TABLE":
+            for cell_id in _child_ids(block):
+                table_words.update(_child_ids(blocks_by_id.get(cell_id, {})))
+            items.append((block["Geometry"]["BoundingBox"]["Top"], _table_markdown(block, blocks_by_id)))
+    for block in blocks:
+        if block["BlockType"] == "LINE":
+            words = _child_ids(block)
+            # Lines inside a table are already part of its markdown
+            if words and all(word in table_words for word in words):
+                continue
+            items.append((block["Geometry"]["BoundingBox"]["Top"], block["Text"]))
+    items.sort(key=lambda item: item[0])
+    parts = [text for _, text in items if text]
+
+    fields = []
+    for block in blocks:
+        if block["BlockType"] == "KEY_VALUE_SET" and "KEY" in block.get("EntityTypes", []):
+            values = [blocks_by_id[value_id] for value_id in _child_ids(block, "VALUE") if value_id in blocks_by_id]
+            value = " ".join(_text_of(value_block, blocks_by_id) for value_block in values).strip()
+            key = _text_of(block, blocks_by_id).strip()
+            if key and value:
+                fields.append(f"{key} {value}" if key.endswith(":") else f"{key}: {value}")
+    if fields:
+        parts.append("Form fields:\n" + "\n".join(fields))
+    return "\n".join(parts)
+
+
+def render_document(pages):
+    """Text of a whole document from the blocks of its pages, one rendered section per page"""
+    if len(pages) == 1:
+        return render_page(pages[0])
+    return "\n\n".join(f"--- Page {number} ---\n{render_page(blocks)}" for number, blocks in enumerate(pages, 1))
+
+
+class TextractAnalyzer:
+    """Analyse whole documents with Textract, caching the blocks of each page"""
+
+    def __init__(self, region, cache_dir, bucket=TEXTRACT_BUCKET_NAME, input_prefix=TEXTRACT_INPUT_PREFIX,
+                 sync_max_pages=TEXTRACT_SYNC_MAX_PAGES, workers=TEXTRACT_WORKERS,
+                 poll_interval=TEXTRACT_POLL_INTERVAL, timeout=TEXTRACT_TIMEOUT,
+                 textract_client=None, s3_client=None):
+        self.region = region
+        self.cache_dir = cache_dir
+        self.bucket = bucket
+        self.input_prefix = input_prefix
+        self.sync_max_pages = sync_max_pages
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        if textract_client is None:
+            import boto3
+            textract_client = boto3.client("textract", region_name=region)
+        self.textract = textract_client
+        self._s3 = s3_client
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, digest, page):
+        return os.path.join(self.cache_dir, f"{digest}_{'-'.join(FEATURE_TYPES).lower()}_p{page}.json")
+
+    def _load_page(self, digest, page):
+        path = self._cache_path(digest, page)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _page_count(self, digest, file_path):
+        """Number of pages of a PDF, read with pdfinfo once per document and kept with its pages"""
+        path = os.path.join(self.cache_dir, f"{digest}_pages.json")
+        try:
+            with open(path, "r") as f:
+                return json.load(f)["pages"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        from pdf2image import pdfinfo_from_path
+        page_count = int(pdfinfo_from_path(file_path)["Pages"])
+        with open(path + ".tmp", "w") as f:
+            json.dump({"pages": page_count}, f)
+        os.replace(path + ".tmp", path)
+        return page_count
+
+    def _save_page(self, digest, page, blocks):
+        path = self._cache_path(digest, page)
+        with open(path + ".tmp", "w") as f:
+            json.dump(blocks, f)
+        os.replace(path + ".tmp", path)
+
+    def _analyze_bytes(self, document_bytes):
+        response = self.textract.analyze_document(Document={"Bytes": document_bytes}, FeatureTypes=FEATURE_TYPES)
+        return response.get("Blocks", [])
+
+    def _analyze_pdf_page(self, file_path, page):
+        from pdf2image import convert_from_path
+        image = convert_from_path(file_path, dpi=_PAGE_DPI, first_page=page, last_page=page)[0]
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, "JPEG", quality=90)
+        return self._analyze_bytes(buffer.getvalue())
+
+    def _analyze_async(self, file_path):
+        """Run StartDocumentAnalysis on the whole PDF; returns {page: blocks}"""
+        import boto3
+        s3 = self._s3 or boto3.client("s3", region_name=self.region)
+        key = f"{self.input_prefix}/{uuid.uuid4().hex}/{os.path.basename(file_path)}"
+        s3.upload_file(file_path, self.bucket, key)
+        try:
+            job_id = self.textract.start_document_analysis(
+                DocumentLocation={"S3Object": {"Bucket": self.bucket, "Name": key}},
+                FeatureTypes=FEATURE_TYPES,
+            )["JobId"]
+            deadline = time.monotonic() + self.timeout
+            while True:
+                response = self.textract.get_document_analysis(JobId=job_id)
+                if response["JobStatus"] != "IN_PROGRESS":
+                    break
+                note("Textract analysis IN_PROGRESS")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Textract analysis timed out after {self.timeout}s")
+                time.sleep(self.poll_interval)
+            if response["JobStatus"] not in ("SUCCEEDED", "PARTIAL_SUCCESS"):
+                raise RuntimeError(f"Textract analysis failed: {response.get('StatusMessage', response['JobStatus'])}")
+
+            pages = {}
+            while True:
+                for block in response.get("Blocks", []):
+                    pages.setdefault(block.get("Page", 1), []).append(block)
+                if not response.get("NextToken"):
+                    break
+                response = self.textract.get_document_analysis(JobId=job_id, NextToken=response["NextToken"])
+            return pages
+        finally:
+            s3.delete_object(Bucket=self.bucket, Key=key)
+
+    def analyze(self, file_path, digest=None):
+        """Return the blocks of every page of a PDF or image, in page order.
+
+        ``digest`` is the SHA-256 of the file when the caller already knows it.
+        """
+        digest = digest or file_sha256(file_path)
+        if not file_path.lower().endswith(".pdf"):
+            blocks = self._load_page(digest, 1)
+            if blocks is None:
+                with open(file_path, "rb") as f:
+                    blocks = self._analyze_bytes(f.read())
+                record_usage("textract", "-".join(FEATURE_TYPES), pages=1)
+                self._save_page(digest, 1, blocks)
+            return [blocks]
+
+        page_count = self._page_count(digest, file_path)
+        pages = {page: self._load_page(digest, page) for page in range(1, page_count + 1)}
+        missing = [page for page, blocks in pages.items() if blocks is None]
+        if missing:
+            print(f"Textract: {page_count - len(missing)} of {page_count} pages cached, analysing {len(missing)}")
+            note(f"Textract: analysing {len(missing)} of {page_count} pages")
+        if len(missing) > self.sync_max_pages:
+            analysed = self._analyze_async(file_path)
+            for page in missing:
+                pages[page] = analysed.get(page, [])
+                self._save_page(digest, page, pages[page])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                # Each call runs in a copy of the caller's context so progress notes reach its job
+                futures = [executor.submit(contextvars.copy_context().run, self._analyze_pdf_page, file_path, page)
+                           for page in missing]
+                for page, blocks in zip(missing, (future.result() for future in futures)):
+                    pages[page] = blocks
+                    self._save_page(digest, page, blocks)
+        if missing:
+            # Asynchronous analysis covers the whole document, so every page is billed
+            billed = page_count if len(missing) > self.sync_max_pages else len(missing)
+            record_usage("textract", "-".join(FEATURE_TYPES), pages=billed)
+        return [pages[page] for page in range(1, page_count + 1)]
+
+    def document_text(self, file_path, digest=None):
+        """Text of the whole document, one rendered section per page"""
+        return render_document(self.analyze(file_path, digest))
+
+
+_analyzers = {}
+_analyzers_lock = threading.Lock()
+
+
+def get_analyzer(region, cache_dir):
+    """Shared analyser per region and cache directory"""
+    with _analyzers_lock:
+        if (region, cache_dir) not in _analyzers:
+            _analyzers[(region, cache_dir)] = TextractAnalyzer(region, cache_dir)
+        return _analyzers[(region, cache_dir)]
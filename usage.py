@@ -0,0 +1,154 @@
+"""Token, page and cost accounting of the provider calls behind each result.
+
+An extraction runs under ``metered``; every provider call beneath it, in any
+thread that copied its context, reports what it consumed with
+``record_usage(provider, model, **counts)``:
+
+* Azure OpenAI, Bedrock Claude and Phi report tokens: ``input_tokens`` (not
+  counting cached prompt tokens), ``output_tokens`` and, where the provider
+  caches prompts, ``cache_read_tokens`` / ``cache_write_tokens``;
+* Textract, Document Intelligence and Bedrock Data Automation report the
+  ``pages`` they analysed (pages served from a cache are free and not reported);
+* local OCR reports its pages at no cost.
+
+``usage_summary()`` prices the calls with the price table and is stored with the
+result (``save_to_cache``), as ``{"cost_usd", "input_tokens", "output_tokens",
+"pages", "calls": [per provider and model]}``. The columnar store keeps one
+row per provider and model of every extraction in its ``usage`` table, for
+reports by method, vendor and day.
+
+Prices are USD per million tokens and USD per page, per provider and model::
+
+    {"bedrock_claude": {"*": {"input_tokens": 3.0, "output_tokens": 15.0}},
+     "azure_openai": {"gpt-4o-mini": {"input_tokens": 0.15, "output_tokens": 0.6}}}
+
+A model entry applies when its name occurs in the model id, else ``"*"``. The
+JSON file named by ``USAGE_PRICES_FILE`` is merged over the defaults below,
+which are list prices and only a starting point.
+"""
+import os
+import json
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+USAGE_PRICES_FILE = os.getenv("USAGE_PRICES_FILE", "prices.json")
+
+COUNTS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens", "pages")
+_TOKEN_COUNTS = COUNTS[:4]
+
+DEFAULT_PRICES = {
+    "bedrock_claude": {"*": {"input_tokens": 3.0, "output_tokens": 15.0,
+                             "cache_read_tokens": 0.3, "cache_write_tokens": 3.75}},
+    "azure_openai": {"*": {"input_tokens": 2.5, "output_tokens": 10.0, "cache_read_tokens": 1.25},
+                     "gpt-4o-mini": {"input_tokens": 0.15, "output_tokens": 0.6, "cache_read_tokens": 0.075}},
+    "phi": {"*": {"input_tokens": 0.13, "output_tokens": 0.52}},
+    # AnalyzeDocument with the TABLES and FORMS features
+    "textract": {"*": {"pages": 0.065}},
+    "document_intelligence": {"*": {"pages": 0.01}},
+    "bedrock_data_automation": {"*": {"pages": 0.01}},
+    "tesseract": {"*": {"pages": 0.0}},
+}
+
+_ledger = contextvars.ContextVar("usage_ledger", default=None)
+
+
+@functools.lru_cache(maxsize=None)
+def load_prices():
+    """The default price table with ``USAGE_PRICES_FILE`` merged over it"""
+    prices = {provider: dict(models) for provider, models in DEFAULT_PRICES.items()}
+    if USAGE_PRICES_FILE and os.path.exists(USAGE_PRICES_FILE):
+        with open(USAGE_PRICES_FILE, "r") as f:
+            for provider, models in json.load(f).items():
+                prices.setdefault(provider, {}).update(models)
+    return prices
+
+
+def unit_prices(provider, model, prices=None):
+    """Prices of the most specific entry of a provider's table matching ``model``"""
+    models = (prices or load_prices()).get(provider, {})
+    matches = [name for name in models if name != "*" and model and name in model]
+    return models[max(matches, key=len)] if matches else models.get("*", {})
+
+
+def cost(provider, model, counts, prices=None):
+    """USD cost of one provider's ``counts``"""
+    rates = unit_prices(provider, model, prices)
+    total = 0.0
+    for name, count in counts.items():
+        total += count * rates.get(name, 0.0) / (1_000_000 if name in _TOKEN_COUNTS else 1)
+    return total
+
+
+class UsageLedger:
+    """Counts of one extraction per (provider, model); shared by the threads of the extraction"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, provider, model, counts):
+        with self._lock:
+            entry = self._entries.setdefault((provider, model), {"calls": 0})
+            entry["calls"] += 1
+            for name, count in counts.items():
+                if count:
+                    entry[name] = entry.get(name, 0) + int(count)
+
+    def summary(self, prices=None):
+        with self._lock:
+            entries = [(provider, model, dict(entry)) for (provider, model), entry in self._entries.items()]
+        calls = []
+        totals = {name: 0 for name in ("input_tokens", "output_tokens", "pages")}
+        total_cost = 0.0
+        for provider, model, entry in entries:
+            entry_cost = cost(provider, model, {name: entry.get(name, 0) for name in COUNTS}, prices)
+            calls.append(dict(entry, provider=provider, model=model, cost_usd=round(entry_cost, 6)))
+            for name in totals:
+                totals[name] += entry.get(name, 0)
+            total_cost += entry_cost
+        return dict(totals, cost_usd=round(total_cost, 6), calls=calls)
+
+
+@contextmanager
+def metered():
+    """Collect the usage of everything run beneath (a context manager or decorator)"""
+    ledger = UsageLedger()
+    token = _ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _ledger.reset(token)
+
+
+def record_usage(provider, model=None, **counts):
+    """Add a provider call's counts (see ``COUNTS``) to the current extraction; no-op outside one"""
+    ledger = _ledger.get()
+    if ledger is not None:
+        ledger.add(provider, model, counts)
+
+
+def usage_summary():
+    """Priced usage of the current extraction, or None outside one"""
+    ledger = _ledger.get()
+    return ledger.summary() if ledger is not None else None
+
+
+def openai_usage(usage):
+    """Counts of an OpenAI-style ``usage`` object (Azure OpenAI, Azure AI Inference)"""
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return {"input_tokens": (getattr(usage, "prompt_tokens", 0) or 0) - cached,
+            "output_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cache_read_tokens": cached}
+
+
+def claude_usage(usage):
+    """Counts of a Claude Messages API ``usage`` dict"""
+    usage = usage or {}
+    return {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0),
+            "cache_read_tokens": usage.get("cache_read_input_tokens", 0),
+            "cache_write_tokens": usage.get("cache_creation_input_tokens", 0)}
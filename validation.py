@@ -0,0 +1,150 @@
+"""Arithmetic validation and reconciliation of extracted invoices.
+
+All line items of a batch of invoices are flattened into NumPy arrays so the
+line checks run as single vector operations, and per-invoice sums come from
+``np.bincount`` over the owning invoice index instead of Python loops.
+"""
+import os
+import json
+import math
+
+# An amount matches when it is within the absolute or the relative tolerance
+VALIDATION_ABS_TOLERANCE = float(os.getenv("VALIDATION_ABS_TOLERANCE", "1.0"))
+VALIDATION_REL_TOLERANCE = float(os.getenv("VALIDATION_REL_TOLERANCE", "0.005"))
+# Re-extraction attempts before a failing invoice is escalated for review
+VALIDATION_MAX_RETRIES = int(os.getenv("VALIDATION_MAX_RETRIES", "1"))
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _line_items(result):
+    items = result.get("line_items")
+    if items is None:
+        items = result.get("items")
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+
+def _tax_details(result):
+    details = result.get("tax_details")
+    return [detail for detail in details if isinstance(detail, dict)] if isinstance(details, list) else []
+
+
+def _mismatch(expected, actual):
+    """Boolean mask of pairs that are both present and differ beyond tolerance"""
+    import numpy as np
+    tolerance = np.maximum(VALIDATION_ABS_TOLERANCE, VALIDATION_REL_TOLERANCE * np.abs(expected))
+    with np.errstate(invalid="ignore"):
+        return ~np.isnan(expected) & ~np.isnan(actual) & (np.abs(actual - expected) > tolerance)
+
+
+def _issue(field, expected, actual):
+    return {
+        "field": field,
+        "expected": round(float(expected), 2),
+        "actual": round(float(actual), 2),
+        "delta": round(float(actual - expected), 2),
+    }
+
+
+def validate_batch(results):
+    """Validate line and tax arithmetic for a list of result dicts.
+
+    Returns one report per result, in order, each with ``valid`` and a list of
+    ``issues`` naming the affected field with its expected and actual values.
+    """
+    count = len(results)
+    if not count:
+        return []
+    # Imported on first use, so starting the app does not pay for NumPy
+    import numpy as np
+    dicts = [result if isinstance(result, dict) else {} for result in results]
+
+    # Flatten every line item of every invoice into columns
+    items = [_line_items(result) for result in dicts]
+    owner = np.repeat(np.arange(count), [len(i) for i in items])
+    position = np.concatenate([np.arange(len(i)) for i in items])
+    flat_items = [item for invoice_items in items for item in invoice_items]
+    quantity = np.array([_number(item.get("quantity")) for item in flat_items], dtype=float)
+    unit_price = np.array([_number(item.get("unit_price")) for item in flat_items], dtype=float)
+    amount = np.array([_number(item.get("amount")) for item in flat_items], dtype=float)
+    tax_percentage = np.array([_number(item.get("tax_percentage")) for item in flat_items], dtype=float)
+    tax_amount = np.array([_number(item.get("tax_amount")) for item in flat_items], dtype=float)
+
+    taxes = [_tax_details(result) for result in dicts]
+    tax_owner = np.repeat(np.arange(count), [len(t) for t in taxes])
+    detail_amount = np.array([_number(detail.get("amount")) for invoice_taxes in taxes for detail in invoice_taxes], dtype=float)
+
+    subtotal = np.array([_number(result.get("subtotal")) for result in dicts], dtype=float)
+    total_tax = np.array([_number(result.get("total_tax_amount", result.get("tax_amount"))) for result in dicts], dtype=float)
+    total = np.array([_number(result.get("total_amount")) for result in dicts], dtype=float)
+
+    # Line checks over all line items at once
+    line_amount_bad = _mismatch(quantity * unit_price, amount)
+    line_tax_bad = _mismatch(amount * tax_percentage / 100, tax_amount)
+
+    # Per-invoice sums; an invoice only gets a sum when it has values to add up
+    amount_known = ~np.isnan(amount)
+    items_total = np.bincount(owner, weights=np.where(amount_known, amount, 0), minlength=count).astype(float)
+    items_total[np.bincount(owner, weights=amount_known, minlength=count) == 0] = np.nan
+    detail_known = ~np.isnan(detail_amount)
+    taxes_total = np.bincount(tax_owner, weights=np.where(detail_known, detail_amount, 0), minlength=count).astype(float)
+    taxes_total[np.bincount(tax_owner, weights=detail_known, minlength=count) == 0] = np.nan
+
+    subtotal_bad = _mismatch(subtotal, items_total)
+    tax_total_bad = _mismatch(total_tax, taxes_total)
+    grand_total_bad = _mismatch(total, subtotal + total_tax)
+
+    reports = [{"valid": True, "issues": []} for _ in range(count)]
+    for index in np.flatnonzero(line_amount_bad):
+        reports[owner[index]]["issues"].append(
+            _issue(f"line_items[{position[index]}].amount", quantity[index] * unit_price[index], amount[index]))
+    for index in np.flatnonzero(line_tax_bad):
+        reports[owner[index]]["issues"].append(
+            _issue(f"line_items[{position[index]}].tax_amount", amount[index] * tax_percentage[index] / 100, tax_amount[index]))
+    for index in np.flatnonzero(subtotal_bad):
+        reports[index]["issues"].append(_issue("subtotal", items_total[index], subtotal[index]))
+    for index in np.flatnonzero(tax_total_bad):
+        reports[index]["issues"].append(_issue("total_tax_amount", taxes_total[index], total_tax[index]))
+    for index in np.flatnonzero(grand_total_bad):
+        reports[index]["issues"].append(_issue("total_amount", subtotal[index] + total_tax[index], total[index]))
+
+    for report in reports:
+        report["valid"] = not report["issues"]
+    return reports
+
+
+def validate_invoice(result):
+    """Validate a single result dict"""
+    return validate_batch([result])[0]
+
+
+def decide_action(report, attempt=0, max_retries=VALIDATION_MAX_RETRIES):
+    """Map a validation report to 'accept', 'retry' or 'escalate'"""
+    if report.get("valid"):
+        return "accept"
+    if attempt < max_retries:
+        return "retry"
+    return "escalate"
+
+
+def validate_cached_results(cache_dir):
+    """Validate every cached result in one batch, keyed by cache file name"""
+    names = []
+    results = []
+    for filename in sorted(os.listdir(cache_dir)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(cache_dir, filename), "r") as f:
+                results.append(json.load(f))
+            names.append(filename)
+        except Exception as e:
+            print(f"Error reading cache file {filename}: {e}")
+    return dict(zip(names, validate_batch(results)))
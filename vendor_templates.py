@@ -0,0 +1,475 @@
+"""Vendor templates: deterministic extraction for recurring suppliers.
+
+Most invoices come from a few hundred repeat sellers, each of whom prints every
+invoice from the same layout. A template is learned per seller GSTIN from
+earlier LLM extractions that passed arithmetic validation, using the OCR words
+and provenance (see provenance.py) of each one:
+
+* header fields (invoice number, dates, totals, buyer, ...) are anchored on the
+  label printed to their left or above them, e.g. ``Invoice No:``;
+* seller and bank details, which belong to the vendor, are kept as values;
+* tax rows keep their type and rate and anchor their amount;
+* line-item table columns are mapped to ``LineItem`` fields by their heading.
+
+An anchor, value or column mapping is only used once ``TEMPLATE_MIN_SAMPLES``
+extractions agreed on it. A new invoice whose words contain the GSTIN of a
+ready template, printed where that seller prints its own GSTIN (a buyer's GSTIN
+sits elsewhere on the page), is then read from its OCR layout in milliseconds. The result is
+only accepted when every required field was found with at least
+``TEMPLATE_MIN_CONFIDENCE`` OCR confidence and its arithmetic validates;
+otherwise the LLM extraction runs, and its result refreshes the template.
+
+Templates are JSON files, ``<directory>/<gstin>.json``.
+"""
+import os
+import re
+import json
+import threading
+
+from export import TABLES as EXPORT_TABLES
+from identifiers import GSTIN_PATTERN, is_valid_gstin
+from provenance import FIELD_CONFIDENCE_THRESHOLD, compact_text, get_field, parse_number
+from result_store import parse_invoice_date
+from validation import validate_invoice
+
+VENDOR_TEMPLATES_ENABLED = os.getenv("VENDOR_TEMPLATES_ENABLED", "true").lower() in ("1", "true", "yes")
+# Extractions that must agree on an anchor before it is used
+TEMPLATE_MIN_SAMPLES = int(os.getenv("TEMPLATE_MIN_SAMPLES", "2"))
+# Lowest OCR confidence of a required field for a templated result to be accepted
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "0.9"))
+
+# A templated result needs all of these
+REQUIRED_FIELDS = ("invoice_number", "invoice_date", "total_amount")
+# Fields that belong to the vendor and are the same on all of its invoices
+_VENDOR_FIELDS = ("seller.", "bank_details.", "currency")
+_MAX_LABEL_WORDS = 3
+# Horizontal gap (page fraction) that ends a value: the next column starts after it
+_COLUMN_GAP = 0.04
+_MAX_VALUE_WORDS = 12
+# Furthest (page fractions, across plus down) a seller's GSTIN may be from where it was learned
+_SELLER_ANCHOR_DISTANCE = 0.15
+_GSTIN_IN_TEXT = re.compile(GSTIN_PATTERN.pattern.strip("^$"))
+
+_FIELD_KINDS = {".".join(path): kind for _, kind, path in EXPORT_TABLES["invoices"] if path}
+_ITEM_KINDS = {path[0]: kind for _, kind, path in EXPORT_TABLES["line_items"] if path}
+
+
+def _kind(field, kinds):
+    if field.endswith("date"):
+        return "date"
+    return "number" if kinds.get(field) in (float, int) else "text"
+
+
+def textract_tables(pages):
+    """Tables of Textract blocks (one list of blocks per page) as rows of {"text", "bbox"} cells"""
+    tables = []
+    for number, blocks in enumerate(pages, 1):
+        blocks_by_id = {block["Id"]: block for block in blocks}
+        for block in blocks:
+            if block["BlockType"] != "TABLE":
+                continue
+            cells = [blocks_by_id[cell_id] for relation in block.get("Relationships", []) if relation["Type"] == "CHILD"
+                     for cell_id in relation["Ids"] if blocks_by_id.get(cell_id, {}).get("BlockType") == "CELL"]
+            if not cells:
+                continue
+            rows = [[None] * max(cell["ColumnIndex"] for cell in cells)
+                    for _ in range(max(cell["RowIndex"] for cell in cells))]
+            for cell in cells:
+                words = [blocks_by_id[word_id]["Text"] for relation in cell.get("Relationships", [])
+                         if relation["Type"] == "CHILD" for word_id in relation["Ids"]
+                         if blocks_by_id.get(word_id, {}).get("BlockType") == "WORD"]
+                box = cell["Geometry"]["BoundingBox"]
+                rows[cell["RowIndex"] - 1][cell["ColumnIndex"] - 1] = {
+                    "text": " ".join(words), "bbox": [box["Left"], box["Top"], box["Width"], box["Height"]]}
+            tables.append({"page": number, "rows": rows})
+    return tables
+
+
+def document_intelligence_tables(result):
+    """Tables of a Document Intelligence AnalyzeResult as rows of {"text", "bbox"} cells"""
+    sizes = {page.page_number: (page.width or 1, page.height or 1) for page in result.pages or []}
+    tables = []
+    for table in result.tables or []:
+        if not table.bounding_regions:
+            continue
+        page = table.bounding_regions[0].page_number
+        width, height = sizes.get(page, (1, 1))
+        rows = [[None] * table.column_count for _ in range(table.row_count)]
+        for cell in table.cells:
+            bbox = None
+            if cell.bounding_regions:
+                xs, ys = cell.bounding_regions[0].polygon[0::2], cell.bounding_regions[0].polygon[1::2]
+                bbox = [min(xs) / width, min(ys) / height, (max(xs) - min(xs)) / width, (max(ys) - min(ys)) / height]
+            rows[cell.row_index][cell.column_index] = {"text": cell.content, "bbox": bbox}
+        tables.append({"page": page, "rows": rows})
+    return tables
+
+
+def _centre(bbox):
+    return bbox[0] + bbox[2] / 2, bbox[1] + bbox[3] / 2
+
+
+def _inside(bbox, box, margin=0.0):
+    x, y = _centre(bbox)
+    return box[0] - margin <= x <= box[0] + box[2] + margin and box[1] - margin <= y <= box[1] + box[3] + margin
+
+
+def _same_line(a, b):
+    """Whether two words are on one line: each one's vertical centre is within the other's height"""
+    return (a["page"] == b["page"] and a["bbox"][1] <= _centre(b["bbox"])[1] <= a["bbox"][1] + a["bbox"][3]
+            and b["bbox"][1] <= _centre(a["bbox"])[1] <= b["bbox"][1] + b["bbox"][3])
+
+
+def _is_label(word):
+    text = compact_text(word["text"])
+    return bool(text) and not any(char.isdigit() for char in text)
+
+
+def _near(word, anchor):
+    """Whether a word is on the anchor's page, within _SELLER_ANCHOR_DISTANCE of it"""
+    x, y = _centre(word["bbox"])
+    anchor_x, anchor_y = _centre(anchor["bbox"])
+    return word["page"] == anchor["page"] and abs(x - anchor_x) + abs(y - anchor_y) <= _SELLER_ANCHOR_DISTANCE
+
+
+def _cell_confidence(cell, page, words):
+    if not cell or not cell.get("bbox"):
+        return None
+    confidences = [word["confidence"] for word in words if word["page"] == page and _inside(word["bbox"], cell["bbox"])]
+    return min(confidences) if confidences else None
+
+
+class VendorTemplates:
+    """Learn and apply per-seller layout templates"""
+
+    def __init__(self, directory, min_samples=TEMPLATE_MIN_SAMPLES):
+        self.directory = directory
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._cache = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, gstin):
+        return os.path.join(self.directory, f"{gstin}.json")
+
+    def get(self, gstin):
+        """The template of a seller GSTIN, or None (re-read when another process updated it)"""
+        path = self._path(gstin)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._cache.get(gstin)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r") as f:
+                template = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading vendor template {gstin}: {e}")
+            return None
+        self._cache[gstin] = (mtime, template)
+        return template
+
+    def _save(self, template):
+        path = self._path(template["seller_gstin"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(template, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    # --- learning ---
+
+    def learn(self, data, provenance, words, tables):
+        """Update the seller's template from a validated extraction; returns its GSTIN or None"""
+        seller = data.get("seller") if isinstance(data.get("seller"), dict) else {}
+        gstin = str(seller.get("gstin") or "").replace(" ", "").upper()
+        if not is_valid_gstin(gstin) or not validate_invoice(data)["valid"]:
+            return None
+        with self._lock:
+            template = self.get(gstin) or {"seller_gstin": gstin, "samples": 0, "fields": {}, "values": {},
+                                           "taxes": {}, "columns": {}}
+            template["samples"] += 1
+            for path, entry in provenance.items():
+                if "[" in path:
+                    continue
+                value = get_field(data, path)
+                if path.startswith(_VENDOR_FIELDS):
+                    self._agree(template["values"], path, {"value": value})
+                    continue
+                anchor = self._anchor(entry, words)
+                if anchor is not None:
+                    self._agree(template["fields"], path, anchor, keys=("label", "relation"))
+            self._learn_seller_anchor(template, provenance, words)
+            self._learn_taxes(template, data, provenance, words)
+            self._learn_columns(template, data, provenance, tables)
+            self._save(template)
+        return gstin
+
+    @staticmethod
+    def _agree(learned, key, entry, keys=None):
+        """Store ``entry`` under ``key``, counting how many samples in a row agreed on it"""
+        previous = learned.get(key)
+        same = previous is not None and all(previous.get(name) == entry.get(name) for name in (keys or entry))
+        entry["hits"] = previous["hits"] + 1 if same else 1
+        learned[key] = entry
+
+    def _anchor(self, entry, words):
+        """Label words and relation of a value found with high confidence on one line"""
+        if entry.get("match") or entry.get("confidence") is None or entry["confidence"] < FIELD_CONFIDENCE_THRESHOLD:
+            return None
+        span = [index for index, word in enumerate(words)
+                if word["page"] == entry["page"] and _inside(word["bbox"], entry["bbox"])]
+        if not span or not all(_same_line(words[span[0]], words[index]) for index in span):
+            return None
+        first = words[span[0]]
+        label = []
+        index = span[0] - 1
+        while index >= 0 and len(label) < _MAX_LABEL_WORDS and _same_line(words[index], first) and _is_label(words[index]):
+            label.insert(0, compact_text(words[index]["text"]))
+            index -= 1
+        relation = "left"
+        if not label:
+            # Otherwise the label is the nearest line above, over the value
+            above = [word for word in words if word["page"] == first["page"] and _is_label(word)
+                     and word["bbox"][1] + word["bbox"][3] <= first["bbox"][1]
+                     and first["bbox"][1] - word["bbox"][1] < 3 * first["bbox"][3]
+                     and word["bbox"][0] < entry["bbox"][0] + entry["bbox"][2] + _COLUMN_GAP
+                     and word["bbox"][0] + word["bbox"][2] > entry["bbox"][0] - _COLUMN_GAP]
+            if not above:
+                return None
+            nearest = max(word["bbox"][1] for word in above)
+            label = [compact_text(word["text"]) for word in above
+                     if abs(word["bbox"][1] - nearest) < word["bbox"][3] / 2][:_MAX_LABEL_WORDS]
+            relation = "above"
+        return {"label": label, "relation": relation, "page": entry["page"], "bbox": entry["bbox"], "words": len(span)}
+
+    def _learn_seller_anchor(self, template, provenance, words):
+        """Where the seller prints its GSTIN: the extracted field's box, else its first occurrence"""
+        gstin = template["seller_gstin"]
+        entry = provenance.get("seller.gstin") or {}
+        anchor = {"page": entry["page"], "bbox": entry["bbox"]} if entry.get("bbox") else None
+        if anchor is None:
+            found = next((word for word in words if gstin in word["text"].upper().replace(" ", "")), None)
+            if found is None:
+                return
+            anchor = {"page": found["page"], "bbox": found["bbox"]}
+        previous = template.get("seller_anchor")
+        same = previous is not None and _near(anchor, previous)
+        anchor["hits"] = previous["hits"] + 1 if same else 1
+        template["seller_anchor"] = anchor
+
+    def _learn_taxes(self, template, data, provenance, words):
+        for index, tax in enumerate(data.get("tax_details") or []):
+            entry = provenance.get(f"tax_details[{index}].amount")
+            anchor = self._anchor(entry, words) if isinstance(tax, dict) and entry else None
+            if anchor is not None:
+                anchor.update(tax_type=tax.get("tax_type"), rate=tax.get("rate"))
+                self._agree(template["taxes"], f"{tax.get('tax_type')}@{tax.get('rate')}", anchor,
+                            keys=("label", "relation"))
+
+    def _learn_columns(self, template, data, provenance, tables):
+        items = data.get("line_items") or data.get("items") or []
+        template["has_items"] = bool(items)
+        votes = {}
+        for path, entry in provenance.items():
+            match = re.match(r"line_items\[\d+\]\.(\w+)$", path)
+            if not match or entry.get("match") or not entry.get("bbox"):
+                continue
+            for table in tables or []:
+                if table["page"] != entry["page"] or not table["rows"]:
+                    continue
+                for row in table["rows"][1:]:
+                    for column, cell in enumerate(row):
+                        if cell and cell.get("bbox") and _inside(entry["bbox"], cell["bbox"]):
+                            heading = compact_text((table["rows"][0][column] or {}).get("text", ""))
+                            if heading:
+                                field_votes = votes.setdefault(heading, {})
+                                field_votes[match.group(1)] = field_votes.get(match.group(1), 0) + 1
+        columns = {heading: max(fields, key=fields.get) for heading, fields in votes.items()}
+        if columns:
+            self._agree(template, "columns", {"map": columns}, keys=("map",))
+
+    # --- extraction ---
+
+    def find(self, words):
+        """The ready template of a GSTIN printed in ``words`` where its seller prints it, or None.
+
+        Invoices also carry the buyer's GSTIN, which may be a seller with a
+        template of its own; that one is printed away from its seller anchor.
+        """
+        for word in words:
+            for gstin in _GSTIN_IN_TEXT.findall(word["text"].upper()):
+                template = self.get(gstin)
+                if template is not None and self._ready(template) and _near(word, template["seller_anchor"]):
+                    return template
+        return None
+
+    def _ready(self, template):
+        if template.get("seller_anchor", {}).get("hits", 0) < self.min_samples:
+            return False  # learned before seller anchors, or the seller's GSTIN moves around
+        fields = template["fields"]
+        if any(fields.get(name, {}).get("hits", 0) < self.min_samples for name in REQUIRED_FIELDS):
+            return False
+        return not template.get("has_items") or template.get("columns", {}).get("hits", 0) >= self.min_samples
+
+    def extract(self, words, tables, source):
+        """Read an invoice with the template of its seller.
+
+        Returns (data, provenance, confidence, gstin), or None when no template
+        applies or a required field was not found. ``confidence`` is the lowest
+        OCR confidence of the required fields and line items, or 0 when the
+        result fails arithmetic validation.
+        """
+        template = self.find(words)
+        if template is None:
+            return None
+        compacts = [compact_text(word["text"]) for word in words]
+        source = f"{source}_template"
+        data = {}
+        provenance = {}
+        confidences = []
+
+        for path, learned in template["values"].items():
+            if learned["hits"] >= self.min_samples:
+                _assign(data, path, learned["value"])
+                provenance[path] = {"confidence": None, "source": source, "match": "vendor"}
+        for path, anchor in template["fields"].items():
+            if anchor["hits"] < self.min_samples:
+                continue
+            found = self._read(anchor, words, compacts, _kind(path, _FIELD_KINDS))
+            if found is None:
+                continue
+            value, confidence, entry = found
+            _assign(data, path, value)
+            provenance[path] = dict(entry, source=source)
+            if path in REQUIRED_FIELDS:
+                confidences.append(confidence)
+        if any(name not in data for name in REQUIRED_FIELDS):
+            return None
+
+        data["tax_details"] = []
+        for anchor in template["taxes"].values():
+            if anchor["hits"] < self.min_samples:
+                continue
+            found = self._read(anchor, words, compacts, "number")
+            if found is not None:
+                index = len(data["tax_details"])
+                data["tax_details"].append({"tax_type": anchor["tax_type"], "rate": anchor["rate"], "amount": found[0]})
+                provenance[f"tax_details[{index}].amount"] = dict(found[2], source=source)
+
+        columns = template.get("columns", {})
+        if columns.get("hits", 0) >= self.min_samples:
+            items = self._read_items(columns["map"], tables, words, provenance, source, confidences)
+            if template.get("has_items") and not items:
+                return None
+            data["line_items"] = items
+
+        confidence = min(confidences) if confidences else 0.0
+        if not validate_invoice(data)["valid"]:
+            confidence = 0.0
+        return data, provenance, confidence, template["seller_gstin"]
+
+    def _read(self, anchor, words, compacts, kind):
+        """(value, confidence, provenance) of an anchored field, or None"""
+        label = anchor["label"]
+        starts = [index for index in range(len(words) - len(label) + 1)
+                  if compacts[index:index + len(label)] == label]
+        if not starts:
+            return None
+        # The occurrence nearest to where the label was learned
+        learned_x, learned_y = _centre(anchor["bbox"])
+
+        def distance(index):
+            word = words[index + len(label) - 1]
+            x, y = _centre(word["bbox"])
+            return (word["page"] != anchor["page"], abs(x - learned_x) + abs(y - learned_y))
+
+        start = min(starts, key=distance)
+        last = words[start + len(label) - 1]
+        if anchor["relation"] == "left":
+            candidates = [word for word in words[start + len(label):start + len(label) + _MAX_VALUE_WORDS]
+                          if _same_line(word, last)]
+        else:
+            left = min(word["bbox"][0] for word in words[start:start + len(label)])
+            below = [word for word in words if word["page"] == last["page"] and word["bbox"][1] > last["bbox"][1] + last["bbox"][3] / 2
+                     and word["bbox"][1] - last["bbox"][1] < 3 * last["bbox"][3] and word["bbox"][0] >= left - _COLUMN_GAP]
+            candidates = [word for word in below if _same_line(word, below[0])] if below else []
+        run = []
+        for word in candidates:
+            if run and word["bbox"][0] - (run[-1]["bbox"][0] + run[-1]["bbox"][2]) > _COLUMN_GAP:
+                break
+            run.append(word)
+        if not run:
+            return None
+
+        if kind == "number":
+            parsed = [(parse_number(" ".join(word["text"] for word in run[:size])), size) for size in (1, 2)]
+            parsed = [(value, size) for value, size in parsed if value is not None and size <= len(run)]
+            if not parsed:
+                return None
+            value, size = parsed[0]
+        elif kind == "date":
+            for size in (1, 2, 3):
+                date = parse_invoice_date(" ".join(word["text"] for word in run[:size])) if size <= len(run) else None
+                if date:
+                    value = date.isoformat()
+                    break
+            else:
+                return None
+        else:
+            size = min(len(run), anchor["words"]) if anchor["words"] <= 2 else len(run)
+            value = " ".join(word["text"] for word in run[:size])
+        used = run[:size]
+        confidence = min(word["confidence"] for word in used)
+        left = min(word["bbox"][0] for word in used)
+        top = min(word["bbox"][1] for word in used)
+        right = max(word["bbox"][0] + word["bbox"][2] for word in used)
+        bottom = max(word["bbox"][1] + word["bbox"][3] for word in used)
+        entry = {"confidence": round(confidence, 3), "page": used[0]["page"],
+                 "bbox": [round(left, 4), round(top, 4), round(right - left, 4), round(bottom - top, 4)]}
+        return value, confidence, entry
+
+    def _read_items(self, columns, tables, words, provenance, source, confidences):
+        """Line items of the tables whose headings include every learned column"""
+        items = []
+        width = None
+        for table in tables or []:
+            rows = table["rows"]
+            headings = [compact_text((cell or {}).get("text", "")) for cell in rows[0]] if rows else []
+            if all(heading in headings for heading in columns):
+                fields = {headings.index(heading): field for heading, field in columns.items()}
+                width = len(headings)
+                body = rows[1:]
+            elif width is not None and len(headings) == width:
+                body = rows  # the table continues on a later page without its headings
+            else:
+                continue
+            for row in body:
+                item = {}
+                cells = {}
+                for column, field in fields.items():
+                    cell = row[column] if column < len(row) else None
+                    text = (cell or {}).get("text", "").strip()
+                    value = (parse_number(text) if _kind(field, _ITEM_KINDS) == "number" else text) if text else None
+                    if value is not None:
+                        item[field] = value
+                        cells[field] = cell
+                if item.get("amount") is None or compact_text(item.get("description", "")).startswith(("total", "subtotal")):
+                    continue  # heading, blank or total rows
+                for field, cell in cells.items():
+                    confidence = _cell_confidence(cell, table["page"], words)
+                    provenance[f"line_items[{len(items)}].{field}"] = {
+                        "confidence": round(confidence, 3) if confidence is not None else None,
+                        "page": table["page"], "bbox": cell["bbox"], "source": source}
+                    if confidence is not None:
+                        confidences.append(confidence)
+                items.append(item)
+        return items
+
+
+def _assign(data, path, value):
+    """Set a dotted path, creating the nested dicts on the way"""
+    *parents, name = path.split(".")
+    for parent in parents:
+        data = data.setdefault(parent, {})
+    data[name] = value